@@ -0,0 +1,246 @@
+"""Benchmarks de las funciones CRUD y de los comandos del CLI sobre historiales sintéticos.
+
+Uso:
+    python -m benchmarks.bench_crud --transacciones 100000 --activos 50 --salida resultados.json
+
+Cada ejecución crea una base temporal, la llena con un historial reproducible
+(ver `benchmarks/sintetico.py`) y mide latencias (percentiles), throughput y
+memoria pico. El JSON resultante permite comparar ejecuciones en el tiempo.
+"""
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from gestor_inversiones import db
+from gestor_inversiones.crud import (registrar_transaccion, consultar_registros, consultar_pagina, actualizar_transaccion,
+                                     borrar_transaccion, calcular_saldos, recalcular_saldos, validar_inventario,
+                                     _codificar_cursor)
+from gestor_inversiones.exportacion import exportar_registros
+from gestor_inversiones.rendimiento import calcular_rendimiento
+
+from .sintetico import generar_historial
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rss_pico_mb():
+    """Memoria residente máxima del proceso hasta el momento, en MB."""
+    maximo = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reporta KB; macOS, bytes
+    return maximo / (1024 * 1024) if sys.platform == 'darwin' else maximo / 1024
+
+
+def _percentil(ordenados, p):
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * (len(ordenados) - 1))))
+    return ordenados[indice]
+
+
+def resumir(duraciones):
+    """Resume una lista de duraciones (segundos) en percentiles (ms) y operaciones por segundo."""
+    ordenados = sorted(duraciones)
+    total = sum(ordenados)
+    return {
+        'n': len(ordenados),
+        'media_ms': total / len(ordenados) * 1000,
+        'p50_ms': _percentil(ordenados, 50) * 1000,
+        'p90_ms': _percentil(ordenados, 90) * 1000,
+        'p99_ms': _percentil(ordenados, 99) * 1000,
+        'max_ms': ordenados[-1] * 1000,
+        'operaciones_por_segundo': len(ordenados) / total if total > 0 else None,
+        'rss_pico_mb': rss_pico_mb(),
+    }
+
+
+def medir(funcion, argumentos):
+    """Ejecuta `funcion(*args)` para cada elemento de `argumentos` y resume las duraciones."""
+    duraciones = []
+    for args in argumentos:
+        inicio = time.perf_counter()
+        funcion(*args)
+        duraciones.append(time.perf_counter() - inicio)
+    return resumir(duraciones)
+
+
+def _combinaciones_filtros(activo, desde, hasta):
+    opciones = {
+        'activo': activo,
+        'operacion': 'VENTA',
+        'rango': {'fecha_desde': desde, 'fecha_hasta': hasta},
+    }
+    for cantidad in range(len(opciones) + 1):
+        for nombres in itertools.combinations(opciones, cantidad):
+            filtros = {}
+            for nombre in nombres:
+                valor = opciones[nombre]
+                filtros.update(valor if isinstance(valor, dict) else {nombre: valor})
+            yield '+'.join(nombres) or 'sin_filtros', filtros
+
+
+def _medir_cli(argumentos, repeticiones):
+    comando = [sys.executable, '-m', 'gestor_inversiones', '--db', db.ruta_db(), *argumentos]
+    return medir(lambda: subprocess.run(comando, cwd=RAIZ, stdout=subprocess.DEVNULL, check=True),
+                 [()] * repeticiones)
+
+
+def ejecutar_benchmarks(transacciones=10000, activos=20, semilla=42, muestras=200, repeticiones=5,
+                        incluir_cli=True, directorio=None):
+    """Genera un historial sintético en una base temporal y mide cada operación.
+
+    Parámetros:
+    - transacciones, activos, semilla: forma del historial sintético
+    - muestras: llamadas medidas para las operaciones puntuales (registro, actualizar, borrar)
+    - repeticiones: llamadas medidas para las operaciones sobre todo el historial
+    - incluir_cli: medir también los comandos del CLI como procesos nuevos (arranque en frío)
+    - directorio: dónde crear la base temporal (por defecto, un directorio temporal del sistema)
+
+    Retorna:
+    - dict serializable a JSON con parámetros, entorno y resultados por operación
+    """
+    directorio_temporal = tempfile.mkdtemp(dir=directorio)
+    ruta_anterior = db.ruta_db()
+    db.configurar(os.path.join(directorio_temporal, 'bench.db'))
+    azar = random.Random(semilla)
+    resultados = {}
+
+    try:
+        carga = generar_historial(transacciones, activos=activos, semilla=semilla)
+        resultados['importar_transacciones'] = {
+            'n': carga['filas'],
+            'segundos': carga['segundos'],
+            'filas_por_segundo': carga['filas_por_segundo'],
+            'rss_pico_mb': rss_pico_mb(),
+        }
+
+        conn = db.obtener_conexion()
+        id_maximo = conn.execute("SELECT MAX(id) FROM transacciones").fetchone()[0]
+        fecha_min, fecha_max = conn.execute("SELECT MIN(fecha), MAX(fecha) FROM transacciones").fetchone()
+        activo_frecuente = conn.execute(
+            "SELECT activo FROM saldos ORDER BY transacciones DESC LIMIT 1").fetchone()[0]
+        # Un rango de un mes en la mitad del historial
+        medio = datetime.fromisoformat(fecha_min) + (datetime.fromisoformat(fecha_max) - datetime.fromisoformat(fecha_min)) / 2
+        desde, hasta = medio.date().isoformat(), (medio.date() + timedelta(days=30)).isoformat()
+
+        # Operaciones idénticas: cada una lleva su id externo para que no se descarten como duplicadas
+        resultados['registrar_transaccion'] = medir(registrar_transaccion, [
+            (activo_frecuente, 'COMPRA', 0.1, 100, 10, 1000, fecha_max, False, f"bench-{indice}")
+            for indice in range(muestras)
+        ])
+        resultados['actualizar_transaccion'] = medir(
+            lambda id_transaccion: actualizar_transaccion(id_transaccion, dolar_cambio=1234.5),
+            [(azar.randint(1, id_maximo),) for _ in range(muestras)]
+        )
+
+        # La primera consulta carga pandas; no debe contarse como latencia de la consulta
+        consultar_registros(activo='__calentamiento__')
+        for nombre, filtros in _combinaciones_filtros(activo_frecuente, desde, hasta):
+            resultados[f'consultar_registros[{nombre}]'] = medir(
+                lambda: consultar_registros(**filtros), [()] * repeticiones)
+
+        # Primera página y una página cercana al final del historial: deben costar lo mismo
+        fecha_profunda, id_profundo = conn.execute(
+            "SELECT fecha, id FROM transacciones ORDER BY fecha, id LIMIT 1 OFFSET ?",
+            (min(100, transacciones - 1),)).fetchone()
+        cursor_profundo = _codificar_cursor('desc', fecha_profunda, id_profundo)
+        resultados['consultar_pagina[primera]'] = medir(
+            lambda: consultar_pagina(limite=50), [()] * max(muestras, repeticiones))
+        resultados['consultar_pagina[profunda]'] = medir(
+            lambda: consultar_pagina(limite=50, cursor=cursor_profundo), [()] * max(muestras, repeticiones))
+
+        resultados['calcular_saldos'] = medir(calcular_saldos, [()] * max(muestras, repeticiones))
+        # Saldos a fechas al azar: la primera llamada calcula los cortes mensuales, el resto los reutiliza
+        resultados['calcular_saldos[al]'] = medir(lambda fecha: calcular_saldos(al=fecha), [
+            ((datetime.fromisoformat(fecha_min) + timedelta(days=azar.randint(0, 3650))).date().isoformat(),)
+            for _ in range(max(muestras, repeticiones))
+        ])
+        resultados['validar_inventario'] = medir(validar_inventario, [()] * repeticiones)
+        resultados['recalcular_saldos'] = medir(recalcular_saldos, [()] * repeticiones)
+        resultados['exportar_registros[csv]'] = medir(
+            lambda: exportar_registros(os.devnull, formato='csv'), [()] * repeticiones)
+
+        df = consultar_registros()
+        for metodo in ('FIFO', 'PROMEDIO'):
+            resultados[f'calcular_rendimiento[{metodo}]'] = medir(
+                lambda: calcular_rendimiento(df, metodo=metodo), [()] * repeticiones)
+        del df
+
+        if incluir_cli:
+            resultados['cli[registro]'] = _medir_cli(
+                ['registro', '--activo', activo_frecuente, '--operacion', 'COMPRA', '--cantidad', '1',
+                 '--precio', '1', '--costo', '1', '--dolar', '1'], repeticiones)
+            resultados['cli[resumen]'] = _medir_cli(['resumen'], repeticiones)
+            resultados['cli[consulta --activo]'] = _medir_cli(['consulta', '--activo', activo_frecuente], repeticiones)
+
+        # Se mide al final porque modifica el historial
+        resultados['borrar_transaccion'] = medir(borrar_transaccion, [
+            (id_transaccion,) for id_transaccion in azar.sample(range(1, id_maximo + 1), min(muestras, id_maximo))
+        ])
+
+        tamano_db = os.path.getsize(db.ruta_db())
+    finally:
+        db.cerrar_conexiones()
+        db.configurar(ruta_anterior)
+        shutil.rmtree(directorio_temporal, ignore_errors=True)
+
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'parametros': {
+            'transacciones': transacciones,
+            'activos': activos,
+            'semilla': semilla,
+            'muestras': muestras,
+            'repeticiones': repeticiones,
+        },
+        'entorno': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plataforma': platform.platform(),
+        },
+        'tamano_db_mb': tamano_db / (1024 * 1024),
+        'rss_pico_mb': rss_pico_mb(),
+        'resultados': resultados,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks del gestor de inversiones sobre historiales sintéticos.")
+    parser.add_argument('--transacciones', type=int, default=10000, help='Transacciones del historial (por defecto 10000).')
+    parser.add_argument('--activos', type=int, default=20, help='Cantidad de activos distintos (por defecto 20).')
+    parser.add_argument('--semilla', type=int, default=42, help='Semilla para reproducir el mismo historial.')
+    parser.add_argument('--muestras', type=int, default=200, help='Llamadas medidas en operaciones puntuales.')
+    parser.add_argument('--repeticiones', type=int, default=5, help='Llamadas medidas en operaciones sobre todo el historial.')
+    parser.add_argument('--sin-cli', dest='incluir_cli', action='store_false', help='No medir los comandos del CLI.')
+    parser.add_argument('--directorio', help='Directorio donde crear la base temporal.')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, salida estándar).')
+    args = parser.parse_args()
+
+    resultado = ejecutar_benchmarks(
+        transacciones=args.transacciones,
+        activos=args.activos,
+        semilla=args.semilla,
+        muestras=args.muestras,
+        repeticiones=args.repeticiones,
+        incluir_cli=args.incluir_cli,
+        directorio=args.directorio,
+    )
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto + '\n')
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
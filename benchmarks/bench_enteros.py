@@ -0,0 +1,182 @@
+"""Compara el almacenamiento de importes en REAL (esquema v4) con enteros escalados (v5).
+
+Uso:
+    python -m benchmarks.bench_enteros --transacciones 200000 --activos 50 --salida enteros.json
+
+Genera el mismo historial sintético en una base con el esquema anterior (importes
+REAL), la copia y la migra a punto fijo (`db._migracion_5_enteros`). En ambas
+mide el tamaño del archivo (después de VACUUM), las consultas del resumen y de
+las agregaciones sobre todo el historial. Además compara los saldos acumulados
+en REAL con la suma exacta (`math.fsum`) de las mismas cantidades.
+"""
+import argparse
+import json
+import math
+import os
+import platform
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+
+from gestor_inversiones import db
+from gestor_inversiones.utils import validar_transaccion
+
+from .bench_crud import medir
+from .sintetico import generar_filas
+
+# Consultas medidas en cada esquema: las mismas operaciones, adaptadas a cómo se guardan los importes
+_SALDOS_REALES = "SELECT activo, compras - ventas FROM saldos ORDER BY activo"
+_SALDOS_ENTEROS = f"""
+    SELECT s.activo, (s.compras - s.ventas) * 1.0 / COALESCE(e.factor, {db.FACTOR_POR_DEFECTO})
+    FROM saldos AS s LEFT JOIN escalas AS e ON e.activo = s.activo
+    ORDER BY s.activo
+"""
+_AGREGADO = """
+    SELECT activo, SUM(CASE operacion WHEN 'COMPRA' THEN cantidad WHEN 'VENTA' THEN -cantidad ELSE 0 END),
+           SUM(costo_total), COUNT(*)
+    FROM transacciones
+    GROUP BY activo
+"""
+_VENTANA = """
+    SELECT COUNT(*) FROM (
+        SELECT SUM(CASE operacion WHEN 'COMPRA' THEN cantidad WHEN 'VENTA' THEN -cantidad ELSE 0 END)
+               OVER (PARTITION BY activo ORDER BY fecha, id) AS saldo
+        FROM transacciones
+    )
+    WHERE saldo < 0
+"""
+
+
+def _crear_base_reales(ruta, transacciones, activos, semilla):
+    """Crea una base con el esquema v4 (importes REAL) y el historial sintético."""
+    conn = sqlite3.connect(ruta, isolation_level=None)
+    try:
+        conn.execute("BEGIN")
+        for migracion in db.MIGRACIONES[:4]:
+            migracion(conn)
+        conn.execute("PRAGMA user_version = 4")
+        conn.executemany("""
+            INSERT INTO transacciones
+            (fecha, activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (validar_transaccion(fila) for _, fila in generar_filas(transacciones, activos=activos, semilla=semilla)))
+        conn.execute("COMMIT")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def _error_redondeo(ruta):
+    """Diferencia entre los saldos REAL de la tabla `saldos` y la suma exacta de cada activo."""
+    conn = sqlite3.connect(ruta)
+    try:
+        deltas = {}
+        for activo, delta in conn.execute(
+                "SELECT activo, CASE operacion WHEN 'VENTA' THEN -cantidad ELSE cantidad END FROM transacciones"):
+            deltas.setdefault(activo, []).append(delta)
+        errores = [abs(saldo - math.fsum(deltas[activo]))
+                   for activo, saldo in conn.execute("SELECT activo, compras - ventas FROM saldos")]
+    finally:
+        conn.close()
+    return {
+        'activos_con_error': sum(1 for error in errores if error),
+        'error_maximo': max(errores, default=0.0),
+    }
+
+
+def _medir_base(ruta, consulta_saldos, repeticiones):
+    conn = sqlite3.connect(ruta, isolation_level=None)
+    try:
+        # Primera lectura fuera de la medición: carga el esquema y calienta la caché de páginas
+        conn.execute(_AGREGADO).fetchall()
+        return {
+            'tamano_mb': os.path.getsize(ruta) / (1024 * 1024),
+            'resumen': medir(lambda: conn.execute(consulta_saldos).fetchall(), [()] * repeticiones * 20),
+            'agregado_por_activo': medir(lambda: conn.execute(_AGREGADO).fetchall(), [()] * repeticiones),
+            'validar_historial': medir(lambda: conn.execute(_VENTANA).fetchall(), [()] * repeticiones),
+        }
+    finally:
+        conn.close()
+
+
+def comparar_almacenamiento(transacciones=100000, activos=20, semilla=42, repeticiones=5, directorio=None):
+    """Mide tamaño y velocidad de las agregaciones con importes REAL y con enteros escalados.
+
+    Parámetros:
+    - transacciones, activos, semilla: forma del historial sintético
+    - repeticiones: ejecuciones medidas de cada consulta sobre todo el historial
+      (el resumen, que lee una fila por activo, se repite 20 veces más)
+    - directorio: dónde crear las bases temporales
+
+    Retorna:
+    - dict serializable a JSON con los resultados de cada esquema (en 'reales',
+      también el error de redondeo de los saldos) y la reducción de tamaño
+    """
+    directorio_temporal = tempfile.mkdtemp(dir=directorio)
+    try:
+        ruta_reales = os.path.join(directorio_temporal, 'reales.db')
+        ruta_enteros = os.path.join(directorio_temporal, 'enteros.db')
+        _crear_base_reales(ruta_reales, transacciones, activos, semilla)
+
+        shutil.copyfile(ruta_reales, ruta_enteros)
+        conn = sqlite3.connect(ruta_enteros, isolation_level=None)
+        try:
+            db.migrar(conn)
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+        reales = _medir_base(ruta_reales, _SALDOS_REALES, repeticiones)
+        reales['error_redondeo_saldos'] = _error_redondeo(ruta_reales)
+        enteros = _medir_base(ruta_enteros, _SALDOS_ENTEROS, repeticiones)
+    finally:
+        shutil.rmtree(directorio_temporal, ignore_errors=True)
+
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'parametros': {
+            'transacciones': transacciones,
+            'activos': activos,
+            'semilla': semilla,
+            'repeticiones': repeticiones,
+        },
+        'entorno': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plataforma': platform.platform(),
+        },
+        'reales': reales,
+        'enteros': enteros,
+        'reduccion_tamano': 1 - enteros['tamano_mb'] / reales['tamano_mb'],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara importes REAL contra enteros escalados (punto fijo).")
+    parser.add_argument('--transacciones', type=int, default=100000, help='Transacciones del historial (por defecto 100000).')
+    parser.add_argument('--activos', type=int, default=20, help='Cantidad de activos distintos (por defecto 20).')
+    parser.add_argument('--semilla', type=int, default=42, help='Semilla para reproducir el mismo historial.')
+    parser.add_argument('--repeticiones', type=int, default=5, help='Ejecuciones medidas de cada consulta.')
+    parser.add_argument('--directorio', help='Directorio donde crear las bases temporales.')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, salida estándar).')
+    args = parser.parse_args()
+
+    resultado = comparar_almacenamiento(
+        transacciones=args.transacciones,
+        activos=args.activos,
+        semilla=args.semilla,
+        repeticiones=args.repeticiones,
+        directorio=args.directorio,
+    )
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto + '\n')
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+"""Mide la consolidación de varios portafolios en un proceso y en paralelo.
+
+Uso:
+    python -m benchmarks.bench_portafolios --portafolios 8 --transacciones 50000 --salida portafolios.json
+
+Genera un historial sintético distinto (otra semilla) en cada portafolio de un
+directorio temporal y mide `consolidado.consolidar_rendimiento` y
+`consolidado.consolidar_saldos` con un solo proceso y con un proceso por núcleo.
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import tempfile
+from datetime import datetime
+
+from gestor_inversiones import db
+from gestor_inversiones.consolidado import consolidar_rendimiento, consolidar_saldos
+
+from .bench_crud import medir
+from .sintetico import generar_historial
+
+
+def medir_portafolios(portafolios=8, transacciones=50000, activos=20, semilla=42, repeticiones=3, procesos=None,
+                      directorio=None):
+    """Crea `portafolios` bases sintéticas y mide la consolidación secuencial y en paralelo.
+
+    Parámetros:
+    - portafolios: cantidad de portafolios (una base cada uno)
+    - transacciones, activos, semilla: forma del historial de cada portafolio
+    - repeticiones: ejecuciones medidas de cada variante
+    - procesos: procesos de la variante en paralelo (por defecto, uno por núcleo)
+    - directorio: dónde crear las bases temporales
+
+    Retorna:
+    - dict serializable a JSON con las latencias por variante y la aceleración
+    """
+    ruta_anterior = db.ruta_db()
+    procesos = procesos or os.cpu_count() or 1
+    directorio_temporal = tempfile.mkdtemp(dir=directorio)
+    try:
+        for indice in range(portafolios):
+            db.configurar(db.ruta_portafolio(f"cuenta{indice:02d}", directorio_temporal))
+            generar_historial(transacciones, activos=activos, semilla=semilla + indice)
+            db.cerrar_conexiones()
+        db.configurar(os.path.join(directorio_temporal, 'cuenta00.db'))
+
+        resultados = {}
+        for nombre, funcion in (('rendimiento', consolidar_rendimiento), ('saldos', consolidar_saldos)):
+            for variante, cantidad in (('secuencial', 1), ('paralelo', procesos)):
+                resultados[f"{nombre}[{variante}]"] = medir(lambda: funcion(procesos=cantidad), [()] * repeticiones)
+            resultados[f"{nombre}[aceleracion]"] = round(
+                resultados[f"{nombre}[secuencial]"]['p50_ms'] / resultados[f"{nombre}[paralelo]"]['p50_ms'], 2)
+    finally:
+        db.cerrar_conexiones()
+        db.configurar(ruta_anterior)
+        shutil.rmtree(directorio_temporal, ignore_errors=True)
+
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'parametros': {
+            'portafolios': portafolios,
+            'transacciones': transacciones,
+            'activos': activos,
+            'semilla': semilla,
+            'repeticiones': repeticiones,
+            'procesos': procesos,
+        },
+        'entorno': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'nucleos': os.cpu_count(),
+            'plataforma': platform.platform(),
+        },
+        'resultados': resultados,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide la consolidación de varios portafolios.")
+    parser.add_argument('--portafolios', type=int, default=8, help='Cantidad de portafolios (por defecto 8).')
+    parser.add_argument('--transacciones', type=int, default=50000, help='Transacciones por portafolio (por defecto 50000).')
+    parser.add_argument('--activos', type=int, default=20, help='Cantidad de activos distintos (por defecto 20).')
+    parser.add_argument('--semilla', type=int, default=42, help='Semilla del primer portafolio.')
+    parser.add_argument('--repeticiones', type=int, default=3, help='Ejecuciones medidas de cada variante.')
+    parser.add_argument('--procesos', type=int, help='Procesos de la variante en paralelo (por defecto, uno por núcleo).')
+    parser.add_argument('--directorio', help='Directorio donde crear las bases temporales.')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, salida estándar).')
+    args = parser.parse_args()
+
+    resultado = medir_portafolios(
+        portafolios=args.portafolios,
+        transacciones=args.transacciones,
+        activos=args.activos,
+        semilla=args.semilla,
+        repeticiones=args.repeticiones,
+        procesos=args.procesos,
+        directorio=args.directorio,
+    )
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto + '\n')
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
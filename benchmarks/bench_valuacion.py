@@ -0,0 +1,130 @@
+"""Mide la carga del historial de precios y la serie diaria de valuación de la cartera.
+
+Uso:
+    python -m benchmarks.bench_valuacion --transacciones 100000 --activos 50 --dias 3650 --salida valuacion.json
+
+Genera un historial sintético de transacciones y un CSV de cierres diarios
+(paseo aleatorio por activo) para el mismo período, los carga en una base
+temporal y mide `precios.valuar_cartera` sobre todo el rango: leyendo las
+transacciones de SQLite y desde la caché columnar.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import tempfile
+from datetime import date, datetime, timedelta
+
+from gestor_inversiones import columnar, db
+from gestor_inversiones.precios import importar_precios, valuar_cartera
+
+from .bench_crud import medir
+from .sintetico import generar_historial
+
+DESDE = '2015-01-01'
+
+
+def escribir_precios_sinteticos(ruta, activos, dias, semilla=42, desde=DESDE):
+    """Escribe un CSV fecha,activo,cierre con un paseo aleatorio diario por activo (mismos símbolos que `sintetico`)."""
+    azar = random.Random(semilla)
+    inicio = date.fromisoformat(desde)
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        archivo.write('fecha,activo,cierre\n')
+        for indice in range(activos):
+            simbolo = f"A{indice:03d}"
+            precio = azar.uniform(1, 50000)
+            for dia in range(dias):
+                precio = max(0.0001, precio * azar.gauss(1, 0.02))
+                archivo.write(f"{(inicio + timedelta(days=dia)).isoformat()},{simbolo},{precio:.6f}\n")
+
+
+def medir_valuacion(transacciones=100000, activos=50, dias=3650, semilla=42, repeticiones=5, directorio=None):
+    """Carga precios y transacciones sintéticos y mide la serie diaria de valuación.
+
+    Parámetros:
+    - transacciones, activos, semilla: forma del historial sintético
+    - dias: días del período (de transacciones y de precios)
+    - repeticiones: ejecuciones medidas de cada variante
+    - directorio: dónde crear la base temporal
+
+    Retorna:
+    - dict serializable a JSON con la carga de precios y las latencias de
+      `valuar_cartera` desde SQLite y desde la caché columnar
+    """
+    ruta_anterior = db.ruta_db()
+    habilitada_previa = columnar._configuracion['habilitada']
+    directorio_temporal = tempfile.mkdtemp(dir=directorio)
+    hasta = (date.fromisoformat(DESDE) + timedelta(days=dias - 1)).isoformat()
+    try:
+        db.configurar(os.path.join(directorio_temporal, 'valuacion.db'))
+        generar_historial(transacciones, activos=activos, semilla=semilla, desde=DESDE, dias=dias)
+        ruta_precios = os.path.join(directorio_temporal, 'precios.csv')
+        escribir_precios_sinteticos(ruta_precios, activos, dias, semilla=semilla)
+        carga = importar_precios(ruta_precios)
+
+        resultados = {}
+        for nombre, habilitada in (('sqlite', False), ('columnar', True)):
+            columnar.habilitar(habilitada)
+            # Primera ejecución fuera de la medición: construye la caché y calienta las páginas
+            ultimo = valuar_cartera(hasta=hasta)
+            resultados[nombre] = medir(lambda: valuar_cartera(hasta=hasta), [()] * repeticiones)
+        resultados['dias'] = len(ultimo['fechas'])
+        resultados['activos'] = len(ultimo['activos'])
+    finally:
+        columnar.habilitar(habilitada_previa)
+        db.cerrar_conexiones()
+        db.configurar(ruta_anterior)
+        shutil.rmtree(directorio_temporal, ignore_errors=True)
+
+    return {
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+        'parametros': {
+            'transacciones': transacciones,
+            'activos': activos,
+            'dias': dias,
+            'semilla': semilla,
+            'repeticiones': repeticiones,
+        },
+        'entorno': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plataforma': platform.platform(),
+        },
+        'carga_precios': carga,
+        'valuacion': resultados,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mide la serie diaria de valuación de la cartera.")
+    parser.add_argument('--transacciones', type=int, default=100000, help='Transacciones del historial (por defecto 100000).')
+    parser.add_argument('--activos', type=int, default=50, help='Cantidad de activos distintos (por defecto 50).')
+    parser.add_argument('--dias', type=int, default=3650, help='Días del período (por defecto 3650, diez años).')
+    parser.add_argument('--semilla', type=int, default=42, help='Semilla para reproducir los mismos datos.')
+    parser.add_argument('--repeticiones', type=int, default=5, help='Ejecuciones medidas de cada variante.')
+    parser.add_argument('--directorio', help='Directorio donde crear la base temporal.')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, salida estándar).')
+    args = parser.parse_args()
+
+    resultado = medir_valuacion(
+        transacciones=args.transacciones,
+        activos=args.activos,
+        dias=args.dias,
+        semilla=args.semilla,
+        repeticiones=args.repeticiones,
+        directorio=args.directorio,
+    )
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto + '\n')
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
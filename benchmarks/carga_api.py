@@ -0,0 +1,228 @@
+"""Prueba de carga de la API HTTP (`python -m gestor_inversiones servir`).
+
+Uso:
+    python -m benchmarks.carga_api --conexiones 32 --peticiones 20000 --salida carga.json
+    python -m benchmarks.carga_api --url http://127.0.0.1:8765 --escrituras 0.5
+
+Sin --url, crea una base temporal con un historial sintético y levanta una
+instancia local del servidor en un puerto libre. Cada conexión es persistente
+(keep-alive) y envía una mezcla de lecturas (saldos y consultas filtradas) y
+escrituras (registros). Reporta peticiones por segundo y latencias (p50, p90,
+p99) en total y por tipo de petición.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+
+from gestor_inversiones import db
+
+from .bench_crud import resumir, RAIZ
+from .sintetico import generar_historial
+
+
+async def _peticion(lector, escritor, metodo, ruta, datos=None):
+    """Envía una petición HTTP/1.1 por una conexión abierta y retorna (estado, cuerpo)."""
+    cuerpo = json.dumps(datos).encode('utf-8') if datos is not None else b''
+    escritor.write(
+        f"{metodo} {ruta} HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(cuerpo)}\r\n\r\n".encode('latin-1') + cuerpo
+    )
+    await escritor.drain()
+
+    estado = int((await lector.readline()).split()[1])
+    largo = 0
+    while True:
+        linea = await lector.readline()
+        if linea in (b'\r\n', b'\n', b''):
+            break
+        nombre, _, valor = linea.decode('latin-1').partition(':')
+        if nombre.strip().lower() == 'content-length':
+            largo = int(valor)
+    return estado, await lector.readexactly(largo)
+
+
+def _generar_peticion(azar, activos, proporcion_escrituras):
+    """Elige una petición de la mezcla: (tipo, metodo, ruta, cuerpo)."""
+    activo = azar.choice(activos)
+    if azar.random() < proporcion_escrituras:
+        return 'registrar', 'POST', '/transacciones', {
+            'activo': activo, 'operacion': 'COMPRA', 'cantidad': 0.01,
+            'precio': 100.0, 'costo': 1.0, 'dolar': 1000.0,
+        }
+    if azar.random() < 0.5:
+        return 'saldos', 'GET', '/saldos', None
+    # Un mes al azar del historial sintético (2015-2024)
+    anio, mes = azar.randint(2015, 2024), azar.randint(1, 12)
+    fin = f"{anio + 1}-01-01" if mes == 12 else f"{anio}-{mes + 1:02d}-01"
+    return 'consultar', 'GET', f"/transacciones?activo={activo}&desde={anio}-{mes:02d}-01&hasta={fin}", None
+
+
+async def _cargar(host, puerto, conexiones, peticiones, proporcion_escrituras, activos, semilla):
+    latencias = {}
+    errores = {'total': 0}
+    restantes = [peticiones]
+
+    async def cliente(numero):
+        azar = random.Random(semilla * 1000 + numero)
+        lector, escritor = await asyncio.open_connection(host, puerto)
+        try:
+            while restantes[0] > 0:
+                restantes[0] -= 1
+                tipo, metodo, ruta, datos = _generar_peticion(azar, activos, proporcion_escrituras)
+                inicio = time.perf_counter()
+                estado, _ = await _peticion(lector, escritor, metodo, ruta, datos)
+                latencias.setdefault(tipo, []).append(time.perf_counter() - inicio)
+                if estado >= 400:
+                    errores['total'] += 1
+                    errores[estado] = errores.get(estado, 0) + 1
+        finally:
+            escritor.close()
+
+    inicio = time.perf_counter()
+    await asyncio.gather(*(cliente(numero) for numero in range(conexiones)))
+    segundos = time.perf_counter() - inicio
+
+    lector, escritor = await asyncio.open_connection(host, puerto)
+    _, estado_servidor = await _peticion(lector, escritor, 'GET', '/estado')
+    escritor.close()
+    return latencias, errores, segundos, json.loads(estado_servidor)
+
+
+def _iniciar_servidor(ruta_db, hilos, lote):
+    """Levanta el servidor en un puerto libre y retorna (proceso, url)."""
+    proceso = subprocess.Popen(
+        [sys.executable, '-m', 'gestor_inversiones', '--db', ruta_db, 'servir', '--puerto', '0',
+         '--hilos', str(hilos), '--lote', str(lote)],
+        cwd=RAIZ, stdout=subprocess.PIPE, text=True,
+    )
+    linea = proceso.stdout.readline()
+    if 'http://' not in linea:
+        proceso.kill()
+        raise RuntimeError(f"El servidor no arrancó: {linea!r}")
+    return proceso, linea.split('http://', 1)[1].split()[0]
+
+
+def ejecutar_carga(url=None, conexiones=16, peticiones=5000, proporcion_escrituras=0.2, transacciones=10000,
+                   activos=20, semilla=42, hilos=4, lote=256, directorio=None):
+    """Mide la API bajo carga concurrente.
+
+    Parámetros:
+    - url: servidor ya en marcha (ej: http://127.0.0.1:8765). Si se omite se crea
+      una base temporal con un historial sintético y se levanta una instancia local.
+    - conexiones: clientes concurrentes, cada uno con una conexión persistente
+    - peticiones: total de peticiones repartidas entre los clientes
+    - proporcion_escrituras: fracción de peticiones que registran transacciones
+    - transacciones, activos, semilla: forma del historial sintético (instancia local)
+    - hilos, lote: opciones `--hilos` y `--lote` de la instancia local
+    - directorio: dónde crear la base temporal
+
+    Retorna:
+    - dict serializable a JSON con peticiones por segundo, errores, latencias
+      totales y por tipo, y el estado reportado por el servidor (escrituras y commits)
+    """
+    proceso = None
+    directorio_temporal = None
+    simbolos = [f"A{indice:03d}" for indice in range(activos)]
+
+    try:
+        if url is None:
+            directorio_temporal = tempfile.mkdtemp(dir=directorio)
+            ruta_anterior = db.ruta_db()
+            db.configurar(os.path.join(directorio_temporal, 'carga.db'))
+            try:
+                generar_historial(transacciones, activos=activos, semilla=semilla)
+                ruta = db.ruta_db()
+            finally:
+                db.cerrar_conexiones()
+                db.configurar(ruta_anterior)
+            proceso, direccion = _iniciar_servidor(ruta, hilos, lote)
+            url = f"http://{direccion}"
+
+        partes = urlsplit(url)
+        latencias, errores, segundos, estado_servidor = asyncio.run(_cargar(
+            partes.hostname, partes.port, conexiones, peticiones, proporcion_escrituras, simbolos, semilla))
+    finally:
+        if proceso is not None:
+            proceso.terminate()
+            proceso.wait()
+        if directorio_temporal:
+            shutil.rmtree(directorio_temporal, ignore_errors=True)
+
+    todas = [duracion for duraciones in latencias.values() for duracion in duraciones]
+    commits = estado_servidor.get('commits') or 0
+    return {
+        'parametros': {
+            'url': url,
+            'conexiones': conexiones,
+            'peticiones': peticiones,
+            'proporcion_escrituras': proporcion_escrituras,
+            'transacciones': transacciones if proceso is not None else None,
+            'hilos': hilos if proceso is not None else None,
+            'lote': lote if proceso is not None else None,
+        },
+        'entorno': {
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'plataforma': platform.platform(),
+        },
+        'segundos': segundos,
+        'peticiones_por_segundo': len(todas) / segundos if segundos > 0 else None,
+        'errores': errores,
+        'latencias': resumir(todas),
+        'por_tipo': {tipo: resumir(duraciones) for tipo, duraciones in sorted(latencias.items())},
+        'servidor': {
+            **estado_servidor,
+            'escrituras_por_commit': estado_servidor.get('escrituras', 0) / commits if commits else None,
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga de la API HTTP del gestor de inversiones.")
+    parser.add_argument('--url', help='Servidor ya en marcha. Si se omite, se levanta una instancia local temporal.')
+    parser.add_argument('--conexiones', type=int, default=16, help='Clientes concurrentes (por defecto 16).')
+    parser.add_argument('--peticiones', type=int, default=5000, help='Total de peticiones (por defecto 5000).')
+    parser.add_argument('--escrituras', dest='proporcion_escrituras', type=float, default=0.2,
+                        help='Fracción de peticiones que son escrituras (por defecto 0.2).')
+    parser.add_argument('--transacciones', type=int, default=10000, help='Historial sintético de la instancia local.')
+    parser.add_argument('--activos', type=int, default=20, help='Cantidad de activos distintos (por defecto 20).')
+    parser.add_argument('--semilla', type=int, default=42, help='Semilla para reproducir la misma carga.')
+    parser.add_argument('--hilos', type=int, default=4, help='Hilos lectores de la instancia local (por defecto 4).')
+    parser.add_argument('--lote', type=int, default=256, help='Escrituras por COMMIT de la instancia local (por defecto 256).')
+    parser.add_argument('--directorio', help='Directorio donde crear la base temporal.')
+    parser.add_argument('--salida', help='Archivo JSON de resultados (por defecto, salida estándar).')
+    args = parser.parse_args()
+
+    resultado = ejecutar_carga(
+        url=args.url,
+        conexiones=args.conexiones,
+        peticiones=args.peticiones,
+        proporcion_escrituras=args.proporcion_escrituras,
+        transacciones=args.transacciones,
+        activos=args.activos,
+        semilla=args.semilla,
+        hilos=args.hilos,
+        lote=args.lote,
+        directorio=args.directorio,
+    )
+
+    texto = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as archivo:
+            archivo.write(texto + '\n')
+    else:
+        print(texto)
+
+
+if __name__ == '__main__':
+    main()
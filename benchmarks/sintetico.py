@@ -0,0 +1,58 @@
+# Generación de historiales sintéticos reproducibles para benchmarks
+import random
+from datetime import datetime, timedelta
+
+from gestor_inversiones.crud import importar_transacciones
+
+
+def generar_filas(transacciones, activos=20, semilla=42, desde='2015-01-01', dias=3650, proporcion_ventas=0.35):
+    """Genera transacciones sintéticas en orden cronológico, sin materializarlas.
+
+    - Las fechas avanzan con saltos aleatorios repartidos en `dias` días.
+    - Cada activo sigue un paseo aleatorio de precios.
+    - Las ventas nunca superan el inventario acumulado, como en un historial real.
+
+    Genera tuplas (numero_fila, dict) listas para `importar_transacciones`.
+    """
+    azar = random.Random(semilla)
+    simbolos = [f"A{indice:03d}" for indice in range(activos)]
+    precios = {simbolo: azar.uniform(1, 50000) for simbolo in simbolos}
+    inventario = dict.fromkeys(simbolos, 0.0)
+
+    fecha = datetime.fromisoformat(desde)
+    salto_medio = dias * 86400 / max(transacciones, 1)
+
+    for numero in range(1, transacciones + 1):
+        fecha += timedelta(seconds=azar.expovariate(1 / salto_medio))
+        simbolo = simbolos[(int(azar.paretovariate(1.2)) - 1) % activos]
+        precio = precios[simbolo] = max(0.0001, precios[simbolo] * azar.gauss(1, 0.01))
+
+        if inventario[simbolo] > 0 and azar.random() < proporcion_ventas:
+            operacion = 'VENTA'
+            cantidad = inventario[simbolo] * azar.uniform(0.05, 0.5)
+            inventario[simbolo] -= cantidad
+        else:
+            operacion = 'COMPRA'
+            cantidad = azar.uniform(10, 5000) / precio
+            inventario[simbolo] += cantidad
+
+        yield numero, {
+            'fecha': fecha.isoformat(sep=' ', timespec='seconds'),
+            'activo': simbolo,
+            'operacion': operacion,
+            'cantidad': cantidad,
+            'precio_unitario': precio,
+            'costo_total': cantidad * precio,
+            'dolar_cambio': 1000 + (fecha.year - 2015) * 150 + azar.uniform(-20, 20),
+        }
+
+
+def generar_historial(transacciones, activos=20, semilla=42, tamano_lote=10000, **opciones):
+    """Carga un historial sintético en la base configurada (ver `gestor_inversiones.db.configurar`).
+
+    Retorna el resultado de `importar_transacciones` (filas, segundos, filas_por_segundo).
+    """
+    return importar_transacciones(
+        generar_filas(transacciones, activos=activos, semilla=semilla, **opciones),
+        tamano_lote=tamano_lote,
+    )
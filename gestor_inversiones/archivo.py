@@ -0,0 +1,389 @@
+# Archivo por años: transacciones de ejercicios cerrados en bases adjuntas y saldos de apertura
+import os
+import sqlite3
+from datetime import date, datetime
+
+from .db import obtener_conexion, transaccion, ruta_db, FACTOR_MONTOS, FACTOR_POR_DEFECTO
+from .perfilado import fase
+from .utils import normalizar_fecha, a_unidades, OPERACION_APERTURA
+
+# Variación del inventario de una fila, en enteros escalados (como `crud._DELTA_SQL`)
+_DELTA_SQL = "CASE WHEN operacion IN ('COMPRA', 'APERTURA') THEN cantidad WHEN operacion = 'VENTA' THEN -cantidad ELSE 0 END"
+
+# Columnas de la tabla de un archivo: las de `transacciones` más el factor de escala
+# de la cantidad al archivarla (un cambio de escala posterior no reescala lo archivado)
+_COLUMNAS_ARCHIVO = ('id', 'fecha', 'activo', 'operacion', 'cantidad', 'factor',
+                     'precio_unitario', 'costo_total', 'dolar_cambio', 'id_externo', 'huella', 'ocurrencia')
+
+# Columnas de la deduplicación (ver db._migracion_9_huellas) que faltan en los archivos anteriores a ella
+_COLUMNAS_HUELLA = (('id_externo', 'TEXT'), ('huella', 'BLOB'), ('ocurrencia', 'INTEGER NOT NULL DEFAULT 1'))
+
+
+def ruta_archivo(anio, ruta=None):
+    """Archivo SQLite de un año archivado: junto a la base, con el año antes de la extensión."""
+    base, extension = os.path.splitext(ruta or ruta_db())
+    return f"{base}.{int(anio)}{extension or '.db'}"
+
+
+def _alias(anio):
+    return f"archivo_{int(anio)}"
+
+
+def listar_archivos():
+    """Retorna [{'anio', 'archivo', 'transacciones', 'archivado'}] de los años archivados, en orden."""
+    filas = obtener_conexion().execute(
+        "SELECT anio, archivo, transacciones, archivado FROM archivos ORDER BY anio").fetchall()
+    return [{'anio': anio, 'archivo': archivo, 'transacciones': transacciones, 'archivado': archivado}
+            for anio, archivo, transacciones, archivado in filas]
+
+
+def cierre_archivado(conn=None):
+    """Fecha del último día archivado ('YYYY-12-31'), o None si no hay nada archivado."""
+    anio, = (conn or obtener_conexion()).execute("SELECT MAX(anio) FROM archivos").fetchone()
+    return f"{anio:04d}-12-31" if anio is not None else None
+
+
+def _adjuntados(conn):
+    return {nombre for _, nombre, _ in conn.execute("PRAGMA database_list")}
+
+
+def _adjuntar(conn, anios):
+    """Adjunta (ATTACH) los archivos de `anios` que aún no lo estén en la conexión.
+
+    SQLite limita cuántas bases se adjuntan a la vez (10 por defecto): si hace
+    falta lugar se separan antes los archivos adjuntados que no se piden.
+    """
+    adjuntados = _adjuntados(conn)
+    faltan = [anio for anio in anios if _alias(anio) not in adjuntados]
+    if not faltan:
+        return
+    if conn.in_transaction:
+        raise ValueError("No se pueden abrir los archivos de años anteriores dentro de una transacción")
+
+    limite = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(anios) > limite:
+        raise ValueError(f"El rango abarca {len(anios)} años archivados; se pueden consultar hasta {limite} a la vez")
+    pedidos = {_alias(anio) for anio in anios}
+    sobrantes = sorted(nombre for nombre in adjuntados if nombre.startswith('archivo_') and nombre not in pedidos)
+    while sobrantes and len(adjuntados) - 2 + len(faltan) > limite:  # main y temp no cuentan
+        nombre = sobrantes.pop()
+        conn.execute(f"DETACH DATABASE {nombre}")
+        adjuntados.discard(nombre)
+
+    for anio in faltan:
+        conn.execute(f"ATTACH DATABASE ? AS {_alias(anio)}", (ruta_archivo(anio),))
+
+
+def anios_en_rango(fecha_desde=None, fecha_hasta=None, conn=None):
+    """Años archivados que alcanza un rango de fechas (ninguno si no se indica rango)."""
+    if not fecha_desde and not fecha_hasta:
+        return []
+    condiciones, params = [], []
+    if fecha_desde:
+        condiciones.append("anio >= ?")
+        params.append(int(normalizar_fecha(fecha_desde)[:4]))
+    if fecha_hasta:
+        condiciones.append("anio <= ?")
+        params.append(int(normalizar_fecha(fecha_hasta)[:4]))
+    filas = (conn or obtener_conexion()).execute(
+        f"SELECT anio FROM archivos WHERE {' AND '.join(condiciones)} ORDER BY anio", params).fetchall()
+    return [anio for anio, in filas]
+
+
+def origen_consulta(fecha_desde=None, fecha_hasta=None):
+    """Tabla o vista sobre la que consultar transacciones en un rango de fechas.
+
+    Si el rango no alcanza años archivados es `v_transacciones`. Si los alcanza,
+    adjunta esos archivos a la conexión del hilo y retorna una vista temporal
+    que une (UNION ALL) sus transacciones con las de la base. En esa vista no
+    figuran las filas de saldo de apertura: las reemplazan las transacciones
+    originales que resumen.
+    """
+    conn = obtener_conexion()
+    anios = anios_en_rango(fecha_desde, fecha_hasta, conn)
+    if not anios:
+        return 'v_transacciones'
+
+    _adjuntar(conn, anios)
+    vista = "v_historial_" + "_".join(str(anio) for anio in anios)
+    partes = [f"""
+        SELECT id, fecha, activo, operacion,
+               cantidad * 1.0 / factor AS cantidad,
+               precio_unitario * 1.0 / {FACTOR_MONTOS} AS precio_unitario,
+               costo_total * 1.0 / {FACTOR_MONTOS} AS costo_total,
+               dolar_cambio * 1.0 / {FACTOR_MONTOS} AS dolar_cambio
+        FROM {_alias(anio)}.transacciones
+    """ for anio in anios]
+    partes.append(f"SELECT * FROM main.v_transacciones WHERE operacion <> '{OPERACION_APERTURA}'")
+    conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS {vista} AS {' UNION ALL '.join(partes)}")
+    return vista
+
+
+def _crear_esquema_archivo(conn, alias):
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {alias}.transacciones (
+            id INTEGER PRIMARY KEY,
+            fecha TEXT NOT NULL,
+            activo TEXT NOT NULL,
+            operacion TEXT,
+            cantidad INTEGER NOT NULL,
+            factor INTEGER NOT NULL,
+            precio_unitario INTEGER NOT NULL,
+            costo_total INTEGER NOT NULL,
+            dolar_cambio INTEGER NOT NULL,
+            id_externo TEXT,
+            huella BLOB,
+            ocurrencia INTEGER NOT NULL DEFAULT 1
+        )
+    """)
+    # Un archivo de antes de las huellas las obtiene al volver a archivar (sin id externo: no se guardaba)
+    existentes = {fila[1] for fila in conn.execute(f"PRAGMA {alias}.table_info(transacciones)")}
+    faltantes = [(columna, tipo) for columna, tipo in _COLUMNAS_HUELLA if columna not in existentes]
+    for columna, tipo in faltantes:
+        conn.execute(f"ALTER TABLE {alias}.transacciones ADD COLUMN {columna} {tipo}")
+    if faltantes:
+        conn.execute(f"""
+            UPDATE {alias}.transacciones
+            SET huella = huella_transaccion(fecha, activo, operacion, cantidad, factor, precio_unitario, costo_total, NULL)
+        """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_transacciones_activo_fecha ON transacciones (activo, fecha)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_transacciones_fecha ON transacciones (fecha)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_transacciones_huella ON transacciones (huella)")
+
+
+def _tiene_huellas(conn, esquema='main'):
+    return any(fila[1] == 'huella' for fila in conn.execute(f"PRAGMA {esquema}.table_info(transacciones)"))
+
+
+def huellas_archivadas(huellas_por_anio):
+    """Busca huellas de contenido (ver `db.huella_transaccion`) en los archivos de cada año.
+
+    Abre cada archivo con una conexión propia de sólo lectura, así que se puede
+    llamar dentro de una transacción de la conexión del hilo.
+
+    Parámetros:
+    - huellas_por_anio: dict {anio: [huella, ...]}
+
+    Retorna:
+    - dict {huella: id en el archivo} de las huellas que ya están archivadas
+    """
+    encontradas = {}
+    for anio, huellas in huellas_por_anio.items():
+        ruta = ruta_archivo(anio)
+        if not huellas or not os.path.exists(ruta):
+            continue
+        conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+        try:
+            if not _tiene_huellas(conn):
+                continue
+            # De a tramos, por el límite de parámetros de SQLite
+            for inicio in range(0, len(huellas), 500):
+                tramo = huellas[inicio:inicio + 500]
+                encontradas.update(conn.execute(
+                    f"SELECT huella, id FROM transacciones WHERE huella IN ({', '.join('?' * len(tramo))})", tramo))
+        finally:
+            conn.close()
+    return encontradas
+
+
+def duplicados_archivados(anio):
+    """Filas con huella repetida entre el archivo de `anio` y las de ese año que sigan en la base.
+
+    Una huella incluye la fecha, así que una transacción sólo puede repetirse
+    dentro de su año. Adjunta el archivo a la conexión del hilo.
+
+    Retorna:
+    - lista de tuplas (huella, id, archivada, fecha, activo, operacion, cantidad,
+      precio_unitario, costo_total), ordenada por huella e id
+    """
+    conn = obtener_conexion()
+    _adjuntar(conn, [anio])
+    alias = _alias(anio)
+    if not _tiene_huellas(conn, alias):
+        return []
+    return conn.execute(f"""
+        WITH filas AS (
+            SELECT huella, id, 1 AS archivada, fecha, activo, operacion, cantidad * 1.0 / factor AS cantidad,
+                   precio_unitario * 1.0 / {FACTOR_MONTOS} AS precio_unitario,
+                   costo_total * 1.0 / {FACTOR_MONTOS} AS costo_total
+            FROM {alias}.transacciones WHERE huella IS NOT NULL
+            UNION ALL
+            SELECT t.huella, v.id, 0, v.fecha, v.activo, v.operacion, v.cantidad, v.precio_unitario, v.costo_total
+            FROM main.transacciones AS t JOIN main.v_transacciones AS v ON v.id = t.id
+            WHERE t.huella IS NOT NULL AND t.fecha >= ? AND t.fecha < ?
+        )
+        SELECT * FROM filas WHERE huella IN (SELECT huella FROM filas GROUP BY huella HAVING COUNT(*) > 1)
+        ORDER BY huella, id
+    """, (f"{anio:04d}-01-01", f"{anio + 1:04d}-01-01")).fetchall()
+
+
+def _lotes_al_cierre(conn, limite, metodo):
+    """Lotes que quedan por activo con las transacciones anteriores a `limite`.
+
+    Cada lote es [cantidad, costo_unitario_usd, costo_unitario_local], en el orden
+    en que `rendimiento` los consume (con PROMEDIO, a lo sumo uno por activo).
+    """
+    import pandas as pd
+    from .rendimiento import calcular_rendimiento
+
+    with fase('sql'):
+        cursor = conn.execute("SELECT * FROM v_transacciones WHERE fecha < ? ORDER BY fecha, id", (limite,))
+        columnas = [descripcion[0] for descripcion in cursor.description]
+        df = pd.DataFrame.from_records(cursor.fetchall(), columns=columnas)
+    estado = calcular_rendimiento(df, metodo=metodo)['estado']
+    return {activo: datos['lotes'] for activo, datos in estado['activos'].items()}
+
+
+def _filas_apertura(cierre, activo, cantidad, factor, lotes, dolar_previo):
+    """Filas 'APERTURA' de un activo: una por lote, con cantidades enteras que suman exactamente `cantidad`.
+
+    Los cortes entre lotes se redondean sobre la cantidad acumulada, así el
+    redondeo no se acumula; lo que no respalda ningún lote entra sin costo.
+    """
+    if not lotes:
+        lotes = [[cantidad / factor, 0.0, 0.0]]
+    filas = []
+    acumulado = 0.0
+    anterior = 0
+    for indice, (unidades, costo_usd, costo_local) in enumerate(lotes):
+        acumulado += unidades
+        corte = cantidad if indice == len(lotes) - 1 else min(cantidad, a_unidades(acumulado, factor))
+        if corte <= anterior:
+            continue
+        enteras, anterior = corte - anterior, corte
+        dolar = costo_local / costo_usd if costo_usd > 0 else dolar_previo
+        filas.append((cierre, activo, OPERACION_APERTURA, enteras, a_unidades(costo_usd, FACTOR_MONTOS),
+                      a_unidades(enteras / factor * costo_usd, FACTOR_MONTOS), a_unidades(dolar, FACTOR_MONTOS)))
+    return filas
+
+
+def _saldos(conn, tabla='saldos'):
+    if tabla == 'saldos':
+        filas = conn.execute("SELECT activo, compras - ventas FROM saldos")
+    else:
+        filas = conn.execute(f"SELECT activo, SUM({_DELTA_SQL}) FROM {tabla} GROUP BY activo")
+    return {activo: saldo for activo, saldo in filas if saldo}
+
+
+def _archivar_anio(conn, anio, metodo):
+    """Mueve las transacciones de `anio` a su archivo y deja el saldo de apertura de cada activo.
+
+    Todo ocurre en una transacción que se deshace si la verificación falla.
+    """
+    alias = _alias(anio)
+    desde, limite = f"{anio:04d}-01-01", f"{anio + 1:04d}-01-01"
+    cierre = f"{anio:04d}-12-31 23:59:59"
+
+    with transaccion():
+        _crear_esquema_archivo(conn, alias)
+        saldos_antes = _saldos(conn)
+
+        # Saldo al cierre en enteros (exacto) e importes del costo base restante
+        al_cierre = dict(conn.execute(f"""
+            SELECT activo, SUM({_DELTA_SQL}) FROM transacciones WHERE fecha < ? GROUP BY activo
+        """, (limite,)))
+        negativos = sorted(activo for activo, saldo in al_cierre.items() if saldo < 0)
+        if negativos:
+            raise ValueError(f"No se puede archivar {anio}: {', '.join(negativos)} cierra el año con saldo negativo "
+                             f"(ver resumen --validar)")
+        lotes = _lotes_al_cierre(conn, limite, metodo)
+        aperturas_previas = dict(conn.execute("""
+            SELECT activo, SUM(cantidad) FROM transacciones WHERE operacion = ? AND fecha < ? GROUP BY activo
+        """, (OPERACION_APERTURA, limite)))
+        ultimos_dolares = dict(conn.execute("""
+            SELECT activo, dolar_cambio FROM transacciones AS t
+            WHERE fecha < ? AND id = (SELECT MAX(id) FROM transacciones AS u WHERE u.activo = t.activo AND u.fecha < ?)
+        """, (limite, limite)))
+
+        # Las filas que ya estaban archivadas (un reintento tras una interrupción) se reemplazan
+        movidas = conn.execute(f"""
+            INSERT OR REPLACE INTO {alias}.transacciones ({', '.join(_COLUMNAS_ARCHIVO)})
+            SELECT t.id, t.fecha, t.activo, t.operacion, t.cantidad, COALESCE(e.factor, {FACTOR_POR_DEFECTO}),
+                   t.precio_unitario, t.costo_total, t.dolar_cambio, t.id_externo, t.huella, t.ocurrencia
+            FROM main.transacciones AS t LEFT JOIN escalas AS e ON e.activo = t.activo
+            WHERE t.fecha >= ? AND t.fecha < ? AND t.operacion <> ?
+        """, (desde, limite, OPERACION_APERTURA)).rowcount
+        # Lo que suma el año según el archivo, para las filas recién copiadas
+        del_anio = _saldos(conn, f"""(
+            SELECT * FROM {alias}.transacciones WHERE id IN (
+                SELECT id FROM main.transacciones WHERE fecha >= '{desde}' AND fecha < '{limite}'
+            )
+        )""")
+        conn.execute("DELETE FROM main.transacciones WHERE fecha < ?", (limite,))
+
+        factores = dict(conn.execute("SELECT activo, factor FROM escalas"))
+        aperturas = []
+        for activo, cantidad in sorted(al_cierre.items()):
+            if cantidad:
+                aperturas += _filas_apertura(cierre, activo, cantidad, factores.get(activo, FACTOR_POR_DEFECTO),
+                                             lotes.get(activo), ultimos_dolares[activo] / FACTOR_MONTOS)
+        conn.executemany("""
+            INSERT INTO transacciones (fecha, activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, aperturas)
+
+        # Verificación: el saldo de cada activo es el mismo antes y después, tanto en
+        # `saldos` (triggers) como recalculado desde las transacciones, y el archivo
+        # explica la diferencia entre el saldo de apertura anterior y el nuevo
+        saldos_despues = _saldos(conn)
+        recalculados = _saldos(conn, 'main.transacciones')
+        nuevas = {}
+        for _, activo, _, cantidad, *_ in aperturas:
+            nuevas[activo] = nuevas.get(activo, 0) + cantidad
+        explicadas = {activo: aperturas_previas.get(activo, 0) + del_anio.get(activo, 0)
+                      for activo in set(aperturas_previas) | set(del_anio)}
+        explicadas = {activo: saldo for activo, saldo in explicadas.items() if saldo}
+        if not (saldos_antes == saldos_despues == recalculados and nuevas == explicadas):
+            raise ValueError(f"La verificación de saldos de {anio} falló; no se archivó nada")
+
+        conn.execute("""
+            INSERT INTO archivos (anio, archivo, transacciones, archivado) VALUES (?, ?, ?, ?)
+            ON CONFLICT (anio) DO UPDATE SET transacciones = transacciones + excluded.transacciones,
+                                             archivado = excluded.archivado
+        """, (anio, os.path.basename(ruta_archivo(anio)), movidas, datetime.now().isoformat(sep=' ', timespec='seconds')))
+
+    return {'anio': anio, 'transacciones': movidas, 'aperturas': len(aperturas),
+            'saldos_verificados': len(saldos_antes), 'archivo': ruta_archivo(anio)}
+
+
+def archivar(hasta_anio, metodo='FIFO'):
+    """Archiva los ejercicios cerrados hasta `hasta_anio` inclusive.
+
+    Cada año se procesa en su propia transacción, del más antiguo al más
+    reciente: sus transacciones pasan a un archivo SQLite propio (ver
+    `ruta_archivo`) y en la base quedan, fechadas al 31/12, filas 'APERTURA'
+    con el saldo al cierre de cada activo: una por lote que queda según
+    `metodo`, con su costo unitario, de modo que `rendimiento` sigue consumiendo
+    los mismos lotes en las ventas posteriores. Antes
+    de confirmar cada año se verifica que los saldos de todos los activos sean
+    idénticos antes y después; si no, se deshace.
+
+    Parámetros:
+    - hasta_anio: último año a archivar (debe estar cerrado: anterior al actual)
+    - metodo: método de costo base de los saldos de apertura (FIFO, LIFO o PROMEDIO)
+
+    Retorna:
+    - lista de dicts {'anio', 'transacciones', 'aperturas', 'saldos_verificados', 'archivo'}
+      por año archivado (vacía si no había nada que archivar)
+    """
+    hasta_anio = int(hasta_anio)
+    if hasta_anio >= date.today().year:
+        raise ValueError(f"Sólo se pueden archivar años cerrados (anteriores a {date.today().year})")
+
+    conn = obtener_conexion()
+    if conn.in_transaction:
+        raise ValueError("No se puede archivar dentro de una transacción")
+    pendientes = [anio for anio, in conn.execute("""
+        SELECT DISTINCT CAST(substr(fecha, 1, 4) AS INTEGER) FROM transacciones
+        WHERE fecha < ? AND operacion <> ?
+        ORDER BY 1
+    """, (f"{hasta_anio + 1:04d}-01-01", OPERACION_APERTURA))]
+
+    resultados = []
+    for anio in pendientes:
+        _adjuntar(conn, [anio])
+        try:
+            resultados.append(_archivar_anio(conn, anio, metodo))
+        finally:
+            conn.execute(f"DETACH DATABASE {_alias(anio)}")
+    return resultados
@@ -0,0 +1,145 @@
+# Serie de tipos de cambio (moneda local por dólar) y búsqueda del tipo vigente a cada fecha
+import csv
+import time
+
+from .db import obtener_conexion, transaccion, FACTOR_MONTOS
+from .perfilado import fase
+from .utils import normalizar_fecha, a_unidades, dia_siguiente
+
+# Nombres aceptados para la columna del valor en los CSV de tipos de cambio
+COLUMNAS_VALOR = ('valor', 'dolar', 'dolar_cambio', 'tipo_cambio')
+
+TAMANO_LOTE_IMPORTACION = 1000
+
+
+def _fecha_serie(fecha):
+    fecha = normalizar_fecha(fecha)
+    if fecha is None:
+        raise ValueError("Falta la fecha del tipo de cambio")
+    # Un tipo de cambio por día: la hora, si viene, se descarta
+    return fecha[:10]
+
+
+def registrar_tipo_cambio(fecha, valor):
+    """Guarda (o reemplaza) el tipo de cambio de una fecha."""
+    valor = a_unidades(valor, FACTOR_MONTOS)
+    if valor <= 0:
+        raise ValueError(f"El tipo de cambio debe ser mayor que cero: {valor / FACTOR_MONTOS}")
+    with transaccion() as conn:
+        conn.execute("INSERT OR REPLACE INTO tipos_cambio (fecha, valor) VALUES (?, ?)", (_fecha_serie(fecha), valor))
+
+
+def _leer_csv(ruta):
+    with open(ruta, newline='', encoding='utf-8') as archivo:
+        lector = csv.DictReader(archivo)
+        columna = next((nombre for nombre in COLUMNAS_VALOR if nombre in (lector.fieldnames or ())), None)
+        if 'fecha' not in (lector.fieldnames or ()) or columna is None:
+            raise ValueError(f"El CSV debe tener las columnas 'fecha' y una de: {', '.join(COLUMNAS_VALOR)}")
+        for fila in lector:
+            yield lector.line_num, fila['fecha'], fila[columna]
+
+
+def importar_tipos_cambio(ruta, tamano_lote=TAMANO_LOTE_IMPORTACION):
+    """Carga en bloque un CSV de tipos de cambio (cabecera: fecha,valor) en una sola transacción.
+
+    Las fechas ya cargadas se reemplazan con el valor del archivo. Si una fila
+    no es válida no se guarda nada y se lanza ValueError con el número de línea.
+
+    Retorna:
+    - dict con estructura: {'filas': total_cargadas, 'segundos': duracion, 'filas_por_segundo': ritmo}
+    """
+    inicio = time.perf_counter()
+    total = 0
+    with transaccion() as conn:
+        lote = []
+        for numero, fecha, valor in _leer_csv(ruta):
+            try:
+                unidades = a_unidades(valor, FACTOR_MONTOS)
+                if unidades <= 0:
+                    raise ValueError(f"El tipo de cambio debe ser mayor que cero: {valor!r}")
+                lote.append((_fecha_serie(fecha), unidades))
+            except ValueError as e:
+                raise ValueError(f"Fila {numero}: {e}") from None
+            if len(lote) >= tamano_lote:
+                conn.executemany("INSERT OR REPLACE INTO tipos_cambio (fecha, valor) VALUES (?, ?)", lote)
+                total += len(lote)
+                lote = []
+        conn.executemany("INSERT OR REPLACE INTO tipos_cambio (fecha, valor) VALUES (?, ?)", lote)
+        total += len(lote)
+
+    segundos = time.perf_counter() - inicio
+    return {
+        'filas': total,
+        'segundos': segundos,
+        'filas_por_segundo': total / segundos if segundos > 0 else 0.0
+    }
+
+
+def tipo_cambio_al(fecha):
+    """Retorna el tipo de cambio vigente al final de `fecha` (el último cargado hasta ese día), o None."""
+    fila = obtener_conexion().execute(
+        "SELECT valor FROM tipos_cambio WHERE fecha < ? ORDER BY fecha DESC LIMIT 1", (dia_siguiente(fecha),)
+    ).fetchone()
+    return fila[0] / FACTOR_MONTOS if fila else None
+
+
+def resumen_tipos_cambio():
+    """Retorna {'filas', 'desde', 'hasta', 'ultimo'} de la serie cargada."""
+    conn = obtener_conexion()
+    filas, desde, hasta = conn.execute("SELECT COUNT(*), MIN(fecha), MAX(fecha) FROM tipos_cambio").fetchone()
+    ultimo = conn.execute("SELECT valor FROM tipos_cambio WHERE fecha = ?", (hasta,)).fetchone()
+    return {'filas': filas, 'desde': desde, 'hasta': hasta, 'ultimo': ultimo[0] / FACTOR_MONTOS if ultimo else None}
+
+
+def tipos_cambio_para(fechas):
+    """Tipo de cambio vigente a cada una de `fechas`, en una sola pasada vectorizada.
+
+    Es un "as-of join" como `pandas.merge_asof(direction='backward')`: lee la
+    serie una vez y ubica cada fecha con una búsqueda binaria (`searchsorted`)
+    sobre ella, sin una consulta por fila. Las fechas pueden venir en cualquier
+    orden y con hora (un tipo cargado para un día vale desde su inicio).
+
+    Retorna:
+    - array de float con el tipo de cambio de cada fecha (NaN si no hay ninguno anterior)
+    """
+    import numpy as np
+
+    with fase('sql'):
+        serie = obtener_conexion().execute("SELECT fecha, valor FROM tipos_cambio ORDER BY fecha").fetchall()
+    fechas = np.asarray(fechas, dtype=str)
+    if not serie:
+        return np.full(len(fechas), np.nan)
+
+    fechas_serie = np.array([fecha for fecha, _ in serie], dtype=str)
+    valores = np.array([valor for _, valor in serie], dtype=np.int64) / FACTOR_MONTOS
+    posiciones = np.searchsorted(fechas_serie, fechas, side='right') - 1
+    return np.where(posiciones >= 0, valores[np.maximum(posiciones, 0)], np.nan)
+
+
+def asignar_tipos_cambio(df, todos=False, columna='dolar_cambio'):
+    """Completa la columna de tipo de cambio de un DataFrame de transacciones con la serie.
+
+    Parámetros:
+    - df: DataFrame con columna 'fecha' (como el de `consultar_registros`)
+    - todos: si es True reemplaza el tipo de cambio de todas las filas por el de
+      la serie a su fecha; si es False sólo completa los faltantes (0 o vacíos)
+    - columna: columna a completar
+
+    Retorna:
+    - una copia del DataFrame con la columna completada. Lanza ValueError si a
+      alguna fila que lo necesita no le corresponde ningún tipo de cambio.
+    """
+    import numpy as np
+
+    df = df.copy()
+    actuales = df[columna].to_numpy(dtype=float) if columna in df else np.zeros(len(df))
+    reemplazar = np.ones(len(df), dtype=bool) if todos else ~(actuales > 0)
+    if reemplazar.any():
+        serie = tipos_cambio_para(df['fecha'].to_numpy()[reemplazar])
+        if np.isnan(serie).any():
+            primera = df['fecha'].to_numpy()[reemplazar][np.isnan(serie)].min()
+            raise ValueError(f"No hay tipo de cambio cargado para {primera} ni para fechas anteriores")
+        actuales = actuales.copy()
+        actuales[reemplazar] = serie
+    df[columna] = actuales
+    return df
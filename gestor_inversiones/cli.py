@@ -1,11 +1,160 @@
 import argparse
-from .crud import registrar_compra, consultar_registros, borrar_transaccion, actualizar_transaccion, calcular_saldos
+import math
+import os
+import sqlite3
+import sys
+from datetime import date
+from .db import configurar, ruta_portafolio, obtener_conexion, contador_modificaciones, VARIABLE_ENTORNO_DB
+from . import columnar, memoria
+from .perfilado import perfilar, fase
+from .utils import normalizar_fecha, normalizar_activo, OPERACION_APERTURA
+from .rendimiento import calcular_rendimiento, cargar_estado, guardar_estado, EstadoDesactualizado, METODOS
+from .crud import registrar_compra, consultar_registros, consultar_pagina, iterar_paginas, ORDENES, borrar_transaccion, actualizar_transaccion, calcular_saldos, recalcular_saldos, validar_inventario, ErrorInventario, importar_archivo, TAMANO_LOTE_IMPORTACION, definir_escala, listar_escalas, TransaccionDuplicada, buscar_duplicados, listar_marcas_agua, actualizar_transacciones, borrar_transacciones, listar_cambios, deshacer_cambio
+from .exportacion import exportar_registros, FORMATOS_EXPORTACION, TAMANO_BLOQUE_EXPORTACION
+from .shell import ejecutar_shell, TAMANO_GRUPO
 
-def main():
+def _fecha(valor):
+    """Tipo de argparse: valida una fecha ISO y la retorna normalizada."""
+    try:
+        return normalizar_fecha(valor)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+
+def _precio(valor):
+    """Tipo de argparse: interpreta 'ACTIVO=PRECIO'."""
+    activo, separador, precio = valor.partition('=')
+    try:
+        if not separador or not activo.strip():
+            raise ValueError
+        return normalizar_activo(activo), float(precio)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"Precio no válido: {valor!r} (se espera ACTIVO=PRECIO, ej: BTC=45000)")
+
+def _lista_portafolios(valor):
+    """Tipo de argparse: nombres de portafolio separados por comas."""
+    nombres = [nombre.strip() for nombre in valor.split(',') if nombre.strip()]
+    if not nombres:
+        raise argparse.ArgumentTypeError("Indica al menos un portafolio")
+    return nombres
+
+# Ancho de cada columna en la salida de `consulta`; es fijo para poder imprimir
+# las páginas a medida que llegan, sin esperar a ver todas las filas
+_ANCHOS_COLUMNAS = {'portafolio': 12, 'id': 7, 'fecha': 19, 'activo': 8, 'operacion': 9}
+_ANCHO_NUMERO = 16
+
+def _formatear_fila(columnas, valores, encabezado=False):
+    """Formatea una fila (o el encabezado) de `consulta` en columnas de ancho fijo."""
+    partes = []
+    for columna, valor in zip(columnas, valores):
+        ancho = _ANCHOS_COLUMNAS.get(columna, _ANCHO_NUMERO)
+        if columna in ('portafolio', 'fecha', 'activo', 'operacion'):
+            partes.append(f"{valor if valor is not None else '':<{ancho}}")
+        elif encabezado or valor is None:
+            partes.append(f"{valor if valor is not None else '':>{ancho}}")
+        elif columna == 'id':
+            partes.append(f"{valor:>{ancho}d}")
+        else:
+            partes.append(f"{valor:>{ancho}.10g}")
+    return "  ".join(partes).rstrip()
+
+def _imprimir_saldos(resultado, titulo):
+    saldos = resultado['saldos']
+    alertas = resultado['alertas']
+    
+    print("\n" + "="*60)
+    print(titulo)
+    print("="*60)
+    
+    if not saldos:
+        print("No hay transacciones registradas.")
+    else:
+        for activo, saldo in sorted(saldos.items()):
+            # Mostrar saldo con formato apropiado
+            print(f"{activo:8} | Saldo: {saldo:12.8f}")
+    
+    print("="*60)
+    
+    # Mostrar alertas si las hay
+    if alertas:
+        print("\n🚨 ALERTAS DE INVENTARIO:")
+        for alerta in alertas:
+            print(alerta)
+    else:
+        print("\n✅ Todos los saldos son válidos (sin inventarios negativos).")
+
+def _imprimir_rendimientos(rendimientos, titulo):
+    print("\n" + "="*60)
+    print(titulo)
+    print("="*60)
+
+    if len(rendimientos) == 0:
+        print("No hay transacciones registradas.")
+    else:
+        for fila in rendimientos.to_dict('records'):
+            print(f"{fila['activo']:8} | Cantidad: {fila['cantidad']:14.8f} | Costo USD: {fila['costo_usd']:14.2f} "
+                  f"| Realizado USD: {fila['realizado_usd']:12.2f} | Realizado local: {fila['realizado_local']:14.2f}")
+            if not math.isnan(fila.get('no_realizado_usd', math.nan)):
+                linea = f"{'':8} | No realizado USD: {fila['no_realizado_usd']:12.2f}"
+                if not math.isnan(fila.get('no_realizado_local', math.nan)):
+                    linea += f" | No realizado local: {fila['no_realizado_local']:14.2f}"
+                print(linea)
+            if fila['vendido_sin_costo'] > 0:
+                print(f"{'':8} | ⚠️ Vendido sin lotes de compra: {fila['vendido_sin_costo']:.8f}")
+
+    print("="*60)
+
+def _mostrar_progreso():
+    """Función de progreso de `respaldar`/`restaurar` que actualiza una línea en stderr (sólo en una terminal)."""
+    if not sys.stderr.isatty():
+        return None
+
+    def mostrar(avance):
+        print(f"\r⏳ {avance['copiadas']}/{avance['total']} páginas "
+              f"({avance['paginas_por_segundo']:.0f} páginas/s)", end='' if avance['copiadas'] < avance['total'] else '\n',
+              file=sys.stderr, flush=True)
+    return mostrar
+
+def _informar_cambio_masivo(resultado, simular, condicional, participio):
+    """Imprime el resultado de un actualizar/borrar por filtros y retorna el código de salida."""
+    if not resultado['filas']:
+        print("❌ No hay transacciones que coincidan con los filtros especificados.")
+        return 1
+    detalle = ", ".join(f"{activo}: {filas}" for activo, filas in resultado['por_activo'].items())
+    if simular:
+        print(f"🔎 Se {condicional} {resultado['filas']} transacciones ({detalle}). No se cambió nada.")
+    else:
+        print(f"✅ {resultado['filas']} transacciones {participio} ({detalle}). "
+              f"Cambio #{resultado['cambio']}: se puede revertir con el comando deshacer")
+    return 0
+
+
+def construir_parser():
+    """Arma el parser de argumentos con todos los subcomandos."""
     parser = argparse.ArgumentParser(
         description="Gestor de inversiones en criptoactivos con SQLite.",
         epilog="Ejecuta 'python -m gestor_inversiones <comando> -h' para ayuda específica."
     )
+    parser.add_argument('--db', required=False,
+                        help=f'Ruta del archivo SQLite (por defecto ${VARIABLE_ENTORNO_DB} o data/inversiones.db).')
+    parser.add_argument('--portafolio', required=False, metavar='NOMBRE',
+                        help='Trabajar sobre el portafolio NOMBRE: el archivo NOMBRE.db en el directorio de la base '
+                             '(data/ por defecto). Cada portafolio es una base independiente.')
+    parser.add_argument('--cache', action='store_true',
+                        help='Resolver consulta (sin --limit ni --cursor), resumen --al, rendimiento y valuacion sobre la caché '
+                             f'columnar (también con ${columnar.VARIABLE_ENTORNO_CACHE}=1).')
+    parser.add_argument('--memoria', action='store_true',
+                        help='Reutilizar en memoria los resultados de consultas y saldos mientras los datos no cambien; '
+                             f'útil con shell y servir (también con ${memoria.VARIABLE_ENTORNO_MEMORIA}=1).')
+    parser.add_argument('--profile', nargs='?', const='texto', choices=['texto', 'json'], required=False,
+                        help='Al terminar, mostrar en stderr los tiempos por fase (conexión, SQL, pandas, formato) '
+                             'como texto (por defecto) o JSON.')
+    parser.add_argument('--trace-sql', dest='trace_sql', action='store_true',
+                        help='Incluir en el perfil cada sentencia SQL ejecutada con su duración y filas (implica --profile).')
+    parser.add_argument('--cprofile', required=False, metavar='ARCHIVO',
+                        help='Guardar un perfil de cProfile del comando en ARCHIVO (se lee con pstats).')
+    parser.add_argument('--respaldo-cada', dest='respaldo_cada', required=False, type=int, metavar='N',
+                        help='Respaldar la base automáticamente cada N escrituras (también con '
+                             '$GESTOR_INVERSIONES_RESPALDO_CADA=N; 0 lo desactiva).')
     subparsers = parser.add_subparsers(dest='comando', required=True)
 
     # Subcomando: registro
@@ -19,14 +168,19 @@ def main():
                                  help='Precio por unidad.')
     parser_registro.add_argument('--costo', dest='costo_total', required=True, type=float, 
                                  help='Monto total de la transacción.')
-    parser_registro.add_argument('--dolar', dest='dolar_cambio', required=True, type=float, 
-                                 help='Tipo de cambio del dólar.')
-    parser_registro.add_argument('--fecha', dest='fecha', required=False,
+    parser_registro.add_argument('--dolar', dest='dolar_cambio', required=False, type=float,
+                                 help='Tipo de cambio del dólar. Si se omite, se usa el de la serie de tipos de cambio a la fecha.')
+    parser_registro.add_argument('--fecha', dest='fecha', required=False, type=_fecha,
                                  help="Fecha de la transacción (YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS). Si se omite, se usa la fecha actual.")
+    parser_registro.add_argument('--estricto', action='store_true',
+                                 help='Rechazar la operación si deja el inventario del activo en negativo.')
+    parser_registro.add_argument('--id-externo', dest='id_externo', required=False,
+                                 help='Id de la operación en el exchange o banco. Permite registrar dos operaciones idénticas.')
 
     # Subcomando: actualizar
-    parser_actualizar = subparsers.add_parser('actualizar', help='Actualizar una transacción existente.')
-    parser_actualizar.add_argument('--id', required=True, type=int, help='ID de la transacción a actualizar.')
+    parser_actualizar = subparsers.add_parser('actualizar', help='Actualizar una transacción o todas las que cumplan filtros.')
+    parser_actualizar.add_argument('--id', required=False, type=int,
+                                   help='ID de la transacción a actualizar. Sin él, se actualizan todas las que cumplan los filtros.')
     parser_actualizar.add_argument('--activo', required=False, help='Nuevo nombre del activo.')
     parser_actualizar.add_argument('--operacion', required=False, choices=['COMPRA', 'VENTA'], 
                                    help='Nueva operación.')
@@ -37,38 +191,261 @@ def main():
                                    help='Nuevo costo total.')
     parser_actualizar.add_argument('--dolar', dest='dolar_cambio', required=False, type=float, 
                                    help='Nuevo tipo de cambio del dólar.')
-    parser_actualizar.add_argument('--fecha', dest='fecha', required=False, 
+    parser_actualizar.add_argument('--fecha', dest='fecha', required=False, type=_fecha, 
                                    help='Nueva fecha (formato ISO: YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS).')
+    parser_actualizar.add_argument('--estricto', action='store_true',
+                                   help='Rechazar el cambio si deja el inventario de algún activo en negativo.')
+    # Filtros del cambio masivo (--activo y --operacion son aquí los valores nuevos)
+    parser_actualizar.add_argument('--filtro-activo', dest='filtro_activo', required=False,
+                                   help='Actualizar las transacciones de este activo.')
+    parser_actualizar.add_argument('--filtro-operacion', dest='filtro_operacion', required=False, choices=['COMPRA', 'VENTA'],
+                                   help='Actualizar las transacciones de esta operación.')
+    parser_actualizar.add_argument('--desde', dest='fecha_desde', required=False, type=_fecha,
+                                   help='Actualizar las transacciones desde esta fecha (formato: YYYY-MM-DD).')
+    parser_actualizar.add_argument('--hasta', dest='fecha_hasta', required=False, type=_fecha,
+                                   help='Actualizar las transacciones hasta esta fecha (formato: YYYY-MM-DD).')
+    parser_actualizar.add_argument('--dry-run', dest='simular', action='store_true',
+                                   help='Mostrar cuántas transacciones cambiarían, sin cambiar nada.')
 
     # Subcomando: consulta
     parser_consulta = subparsers.add_parser('consulta', help='Consultar transacciones con filtros opcionales.')
     parser_consulta.add_argument('--activo', required=False, help='Filtrar por nombre de activo (ej: BTC, ETH).')
-    parser_consulta.add_argument('--operacion', required=False, choices=['COMPRA', 'VENTA'], 
-                                 help='Filtrar por tipo de operación.')
-    parser_consulta.add_argument('--desde', dest='fecha_desde', required=False, 
+    parser_consulta.add_argument('--operacion', required=False, choices=['COMPRA', 'VENTA', OPERACION_APERTURA],
+                                 help='Filtrar por tipo de operación (APERTURA: saldos de apertura de lo archivado).')
+    parser_consulta.add_argument('--desde', dest='fecha_desde', required=False, type=_fecha, 
                                  help='Filtrar desde una fecha (formato: YYYY-MM-DD).')
-    parser_consulta.add_argument('--hasta', dest='fecha_hasta', required=False, 
-                                 help='Filtrar hasta una fecha (formato: YYYY-MM-DD).')
+    parser_consulta.add_argument('--hasta', dest='fecha_hasta', required=False, type=_fecha, 
+                                 help='Filtrar hasta una fecha (formato: YYYY-MM-DD). Si el rango alcanza años archivados, '
+                                      'también se buscan en sus archivos.')
+    parser_consulta.add_argument('--limit', dest='limite', required=False, type=int,
+                                 help='Mostrar sólo una página de N registros e indicar el cursor de la siguiente.')
+    parser_consulta.add_argument('--cursor', required=False,
+                                 help='Continuar desde el cursor que mostró la página anterior.')
+    parser_consulta.add_argument('--columnas', required=False,
+                                 help='Columnas a mostrar separadas por comas (ej: fecha,activo,cantidad).')
+    parser_consulta.add_argument('--orden', required=False, choices=ORDENES, default='desc',
+                                 help='Orden por fecha: desc (más recientes primero, por defecto) o asc.')
 
     # Subcomando: borrar
-    parser_borrar = subparsers.add_parser('borrar', help='Borrar una transacción.')
-    parser_borrar.add_argument('--id', required=True, type=int, help='ID de la transacción a borrar.')
+    parser_borrar = subparsers.add_parser('borrar', help='Borrar una transacción o todas las que cumplan filtros.')
+    parser_borrar.add_argument('--id', required=False, type=int,
+                               help='ID de la transacción a borrar. Sin él, se borran todas las que cumplan los filtros.')
+    parser_borrar.add_argument('--activo', required=False, help='Borrar las transacciones de este activo.')
+    parser_borrar.add_argument('--operacion', required=False, choices=['COMPRA', 'VENTA'],
+                               help='Borrar las transacciones de esta operación.')
+    parser_borrar.add_argument('--desde', dest='fecha_desde', required=False, type=_fecha,
+                               help='Borrar las transacciones desde esta fecha (formato: YYYY-MM-DD).')
+    parser_borrar.add_argument('--hasta', dest='fecha_hasta', required=False, type=_fecha,
+                               help='Borrar las transacciones hasta esta fecha (formato: YYYY-MM-DD).')
+    parser_borrar.add_argument('--dry-run', dest='simular', action='store_true',
+                               help='Mostrar cuántas transacciones se borrarían, sin borrar nada.')
+
+    # Subcomando: deshacer
+    parser_deshacer = subparsers.add_parser('deshacer', help='Deshacer el último cambio masivo (actualizar o borrar con filtros).')
+    parser_deshacer.add_argument('--listar', action='store_true', help='Listar los cambios masivos guardados en el diario.')
+    parser_deshacer.add_argument('--forzar', action='store_true',
+                                 help='Deshacer aunque haya habido otras escrituras después del cambio.')
 
     # Subcomando: resumen
     parser_resumen = subparsers.add_parser('resumen', help='Mostrar saldo de cada activo y alertas.')
+    parser_resumen.add_argument('--al', dest='fechas', required=False, action='append', type=_fecha, default=[],
+                                help='Mostrar los saldos al final de esa fecha (formato: YYYY-MM-DD). Repetible.')
+    parser_resumen.add_argument('--validar', action='store_true',
+                                help='Revisar el historial en orden cronológico y señalar la primera venta que dejó cada activo en negativo.')
+
+    # Subcomando: recalcular
+    parser_recalcular = subparsers.add_parser('recalcular', help='Reconstruir la tabla de saldos y verificar desvíos.')
+
+    # Subcomando: rendimiento
+    parser_rendimiento = subparsers.add_parser('rendimiento', help='Calcular costo base y ganancias/pérdidas por activo.')
+    parser_rendimiento.add_argument('--metodo', required=False, choices=METODOS, default='FIFO',
+                                    help='Método de asignación de costos (por defecto FIFO).')
+    parser_rendimiento.add_argument('--activo', required=False, help='Calcular sólo para un activo.')
+    parser_rendimiento.add_argument('--precio', dest='precios', required=False, action='append', type=_precio, default=[],
+                                    help='Precio actual en USD para el resultado no realizado (ej: BTC=45000). Repetible.')
+    parser_rendimiento.add_argument('--dolar', dest='dolar_actual', required=False, type=float,
+                                    help='Tipo de cambio actual para el no realizado en moneda local. '
+                                         'Si se omite, se usa el de la serie a la fecha de --al (o de hoy).')
+    parser_rendimiento.add_argument('--cambio', required=False, choices=['registro', 'serie'], default='registro',
+                                    help='Tipo de cambio de cada transacción: el registrado con ella (por defecto) o el de la serie a su fecha. '
+                                         'Con "registro", las transacciones sin tipo de cambio (0) se completan con la serie.')
+    parser_rendimiento.add_argument('--al', required=False, type=_fecha,
+                                    help='Fecha de valuación para el tipo de cambio actual (formato: YYYY-MM-DD).')
+    parser_rendimiento.add_argument('--estado', required=False,
+                                    help='Archivo JSON con el estado de lotes. Si existe, sólo se procesan las transacciones nuevas '
+                                         '(se recalcula todo si cambiaron las anteriores); al terminar se actualiza.')
+
+    # Subcomando: importar
+    parser_importar = subparsers.add_parser('importar', help='Importar transacciones en bloque desde un archivo CSV o JSONL.')
+    parser_importar.add_argument('--archivo', required=True, help='Ruta del archivo a importar.')
+    parser_importar.add_argument('--formato', required=False, choices=['csv', 'jsonl'],
+                                 help='Formato del archivo. Si se omite, se deduce de la extensión.')
+    parser_importar.add_argument('--lote', dest='tamano_lote', required=False, type=int, default=TAMANO_LOTE_IMPORTACION,
+                                 help=f'Filas por lote de inserción (por defecto {TAMANO_LOTE_IMPORTACION}).')
+    parser_importar.add_argument('--origen', required=False,
+                                 help='Nombre de la fuente (ej: binance). Las filas anteriores a la última fecha importada '
+                                      'de esa fuente se descartan sin procesarlas.')
+
+    # Subcomando: duplicados
+    subparsers.add_parser('duplicados', help='Buscar transacciones repetidas (misma fecha, activo, operación e importes).')
+
+    # Subcomando: exportar
+    parser_exportar = subparsers.add_parser('exportar', help='Exportar transacciones a CSV, JSONL o Parquet.')
+    parser_exportar.add_argument('--formato', required=False, choices=FORMATOS_EXPORTACION, default='csv',
+                                 help='Formato de salida (por defecto csv).')
+    parser_exportar.add_argument('--archivo', required=False,
+                                 help='Archivo de destino. Si se omite, se escribe en la salida estándar (csv/jsonl).')
+    parser_exportar.add_argument('--activo', required=False, help='Filtrar por nombre de activo (ej: BTC, ETH).')
+    parser_exportar.add_argument('--operacion', required=False, choices=['COMPRA', 'VENTA'],
+                                 help='Filtrar por tipo de operación.')
+    parser_exportar.add_argument('--desde', dest='fecha_desde', required=False, type=_fecha,
+                                 help='Filtrar desde una fecha (formato: YYYY-MM-DD).')
+    parser_exportar.add_argument('--hasta', dest='fecha_hasta', required=False, type=_fecha,
+                                 help='Filtrar hasta una fecha (formato: YYYY-MM-DD).')
+    parser_exportar.add_argument('--bloque', dest='tamano_bloque', required=False, type=int, default=TAMANO_BLOQUE_EXPORTACION,
+                                 help=f'Filas leídas y escritas por bloque (por defecto {TAMANO_BLOQUE_EXPORTACION}).')
+
+    # Subcomando: shell
+    parser_shell = subparsers.add_parser('shell', help='Ejecutar muchos comandos en un solo proceso (interactivo o por lotes).')
+    parser_shell.add_argument('--archivo', required=False,
+                              help='Script con un comando por línea. Si se omite, se leen de la entrada estándar.')
+    parser_shell.add_argument('--grupo', dest='tamano_grupo', required=False, type=int, default=TAMANO_GRUPO,
+                              help=f'Máximo de escrituras consecutivas confirmadas juntas en modo por lotes (por defecto {TAMANO_GRUPO}).')
+
+    # Subcomando: cache
+    parser_cache = subparsers.add_parser('cache', help='Construir o poner al día la caché columnar.')
+    parser_cache.add_argument('--borrar', action='store_true', help='Eliminar la caché en lugar de actualizarla.')
+
+    # Subcomando: escala
+    parser_escala = subparsers.add_parser('escala', help='Ver o definir los decimales con que se guarda la cantidad de cada activo.')
+    parser_escala.add_argument('--activo', required=False, help='Activo cuya escala se define (ej: ETH).')
+    parser_escala.add_argument('--decimales', required=False, type=int,
+                               help='Decimales de la cantidad (por defecto 8, como el satoshi). Reescala las transacciones existentes.')
+
+    # Subcomando: cambio
+    parser_cambio = subparsers.add_parser('cambio', help='Cargar o consultar la serie de tipos de cambio (moneda local por dólar).')
+    parser_cambio.add_argument('--importar', dest='archivo', required=False,
+                               help='CSV con columnas fecha,valor a cargar en bloque (reemplaza las fechas ya cargadas).')
+    parser_cambio.add_argument('--fecha', required=False, type=_fecha, help='Fecha del tipo de cambio a registrar o consultar.')
+    parser_cambio.add_argument('--valor', required=False, type=float, help='Tipo de cambio a registrar para --fecha.')
+
+    # Subcomando: precios
+    parser_precios = subparsers.add_parser('precios', help='Cargar o consultar el historial local de precios diarios.')
+    parser_precios.add_argument('--importar', dest='archivos', required=False, action='append', default=[],
+                                help='CSV con columnas fecha,activo,cierre (y opcionalmente apertura,maximo,minimo). Repetible.')
+    parser_precios.add_argument('--activo', required=False,
+                                help='Activo de los archivos que no tienen columna activo (un archivo por activo).')
+
+    # Subcomando: valuacion
+    parser_valuacion = subparsers.add_parser('valuacion', help='Valor de mercado diario de la cartera y distribución por activo.')
+    parser_valuacion.add_argument('--desde', required=False, type=_fecha,
+                                  help='Primer día de la serie (por defecto, el de la primera transacción).')
+    parser_valuacion.add_argument('--hasta', required=False, type=_fecha, help='Último día de la serie (por defecto, hoy).')
+    parser_valuacion.add_argument('--moneda', required=False, choices=['USD', 'local'], default='USD',
+                                  help='Moneda de los valores: USD (por defecto) o local, con la serie de tipos de cambio.')
+    parser_valuacion.add_argument('--salida', required=False,
+                                  help='CSV donde escribir la serie diaria completa (fecha, total y valor de cada activo).')
+
+    # Subcomando: archivar
+    parser_archivar = subparsers.add_parser('archivar', help='Archivar años cerrados en bases aparte y dejar saldos de apertura.')
+    parser_archivar.add_argument('--hasta', dest='hasta_anio', required=False, type=int, metavar='AAAA',
+                                 help='Último año a archivar. Si se omite, se listan los años archivados.')
+    parser_archivar.add_argument('--metodo', required=False, choices=METODOS, default='FIFO',
+                                 help='Método del costo base que conservan los saldos de apertura (por defecto FIFO).')
+
+    # Subcomando: portafolios
+    subparsers.add_parser('portafolios', help='Listar los portafolios (una base por cuenta o cliente).')
+
+    # Subcomando: consolidado
+    parser_consolidado = subparsers.add_parser(
+        'consolidado', help='Resumen, consulta o rendimiento sumando varios portafolios, procesados en paralelo.')
+    parser_consolidado.add_argument('vista', choices=['resumen', 'consulta', 'rendimiento'],
+                                    help='Qué consolidar: saldos, transacciones o costo base y resultados.')
+    parser_consolidado.add_argument('--portafolios', required=False, type=_lista_portafolios,
+                                    help='Portafolios separados por comas (por defecto, todos).')
+    parser_consolidado.add_argument('--procesos', required=False, type=int,
+                                    help='Máximo de procesos en paralelo (por defecto, uno por núcleo).')
+    parser_consolidado.add_argument('--detalle', action='store_true',
+                                    help='En resumen y rendimiento, mostrar también cada portafolio por separado.')
+    parser_consolidado.add_argument('--al', required=False, type=_fecha, help='resumen: saldos al final de esa fecha.')
+    parser_consolidado.add_argument('--activo', required=False, help='consulta: filtrar por activo.')
+    parser_consolidado.add_argument('--operacion', required=False, choices=['COMPRA', 'VENTA', OPERACION_APERTURA],
+                                    help='consulta: filtrar por tipo de operación.')
+    parser_consolidado.add_argument('--desde', dest='fecha_desde', required=False, type=_fecha, help='consulta: desde una fecha.')
+    parser_consolidado.add_argument('--hasta', dest='fecha_hasta', required=False, type=_fecha, help='consulta: hasta una fecha.')
+    parser_consolidado.add_argument('--orden', required=False, choices=ORDENES, default='desc',
+                                    help='consulta: orden por fecha, desc (por defecto) o asc.')
+    parser_consolidado.add_argument('--metodo', required=False, choices=METODOS, default='FIFO',
+                                    help='rendimiento: método de costo base (por defecto FIFO).')
+    parser_consolidado.add_argument('--precio', dest='precios', action='append', type=_precio, default=[],
+                                    help='rendimiento: precio actual en USD como ACTIVO=PRECIO (repetible).')
+    parser_consolidado.add_argument('--dolar', dest='dolar_actual', required=False, type=float,
+                                    help='rendimiento: tipo de cambio actual para el no realizado en moneda local.')
+
+    # Subcomando: respaldar
+    parser_respaldar = subparsers.add_parser('respaldar', help='Respaldar la base en uso sin detener las escrituras.')
+    parser_respaldar.add_argument('--directorio', required=False,
+                                  help='Directorio de los respaldos (por defecto, junto a la base con sufijo .respaldos).')
+    parser_respaldar.add_argument('--comprimir', action='store_true', help='Guardar el respaldo comprimido con gzip.')
+    parser_respaldar.add_argument('--conservar', required=False, type=int, metavar='N',
+                                  help='Conservar sólo los N respaldos más recientes.')
+    parser_respaldar.add_argument('--paginas', dest='paginas_por_paso', required=False, type=int, default=256,
+                                  help='Páginas copiadas por paso; entre pasos pueden escribir otros (por defecto 256).')
+    parser_respaldar.add_argument('--listar', action='store_true', help='Listar los respaldos existentes.')
 
-    args = parser.parse_args()
+    # Subcomando: restaurar
+    parser_restaurar = subparsers.add_parser('restaurar', help='Verificar un respaldo y reemplazar con él la base.')
+    parser_restaurar.add_argument('--archivo', required=False,
+                                  help='Respaldo a restaurar (.db o .db.gz; por defecto, el más reciente).')
+    parser_restaurar.add_argument('--sin-respaldo-previo', dest='respaldo_previo', action='store_false',
+                                  help='No respaldar la base actual antes de reemplazarla.')
 
+    # Subcomando: servir
+    parser_servir = subparsers.add_parser('servir', help='Exponer las operaciones como API HTTP/JSON local.')
+    parser_servir.add_argument('--host', required=False, default='127.0.0.1',
+                               help='Dirección en la que escuchar (por defecto 127.0.0.1).')
+    parser_servir.add_argument('--puerto', required=False, type=int, default=8765,
+                               help='Puerto TCP (por defecto 8765; 0 elige uno libre).')
+    parser_servir.add_argument('--hilos', required=False, type=int, default=4,
+                               help='Hilos que atienden lecturas en paralelo (por defecto 4).')
+    parser_servir.add_argument('--lote', dest='tamano_lote', required=False, type=int, default=256,
+                               help='Máximo de escrituras confirmadas con un mismo COMMIT (por defecto 256).')
+
+    return parser
+
+def ejecutar(args):
+    """Ejecuta el subcomando indicado en `args` (resultado de `construir_parser().parse_args`).
+
+    Retorna el código de salida: 0 si el comando terminó bien, 1 si falló.
+    """
     if args.comando == 'registro':
-        registrar_compra(
-            args.activo,
-            args.operacion,
-            args.cantidad,
-            args.precio_unitario,
-            args.costo_total,
-            args.dolar_cambio,
-            fecha=args.fecha
-        )
+        if args.dolar_cambio is None:
+            from .cambio import tipo_cambio_al
+            args.dolar_cambio = tipo_cambio_al(args.fecha or date.today().isoformat())
+            if args.dolar_cambio is None:
+                print("❌ Falta --dolar y no hay tipo de cambio cargado para esa fecha (ver el comando cambio).")
+                return 1
+        try:
+            registrar_compra(
+                args.activo,
+                args.operacion,
+                args.cantidad,
+                args.precio_unitario,
+                args.costo_total,
+                args.dolar_cambio,
+                fecha=args.fecha,
+                estricto=args.estricto,
+                id_externo=args.id_externo
+            )
+        except ErrorInventario as e:
+            print(f"❌ Operación rechazada. {e}")
+            return 1
+        except TransaccionDuplicada as e:
+            print(f"⚠️ No se registró: {e}")
+            return 1
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
         print(f"✅ {args.operacion.capitalize()} de {args.activo} registrada exitosamente")
 
     elif args.comando == 'actualizar':
@@ -90,58 +467,554 @@ def main():
 
         if not campos_a_actualizar:
             print("❌ Debes especificar al menos un campo a actualizar.")
-            return
+            return 1
+
+        filtros = {'activo': args.filtro_activo, 'operacion': args.filtro_operacion,
+                   'fecha_desde': args.fecha_desde, 'fecha_hasta': args.fecha_hasta}
+        if args.id is None:
+            try:
+                resultado = actualizar_transacciones(filtros, simular=args.simular, estricto=args.estricto,
+                                                     **campos_a_actualizar)
+            except ErrorInventario as e:
+                print(f"❌ Cambio rechazado, no se actualizó ninguna transacción. {e}")
+                return 1
+            except ValueError as e:
+                print(f"❌ {e}")
+                return 1
+            return _informar_cambio_masivo(resultado, args.simular, 'actualizarían', 'actualizadas')
+        if any(filtros.values()) or args.simular:
+            print("❌ Indica --id o los filtros de un cambio masivo, no ambos.")
+            return 1
+
+        try:
+            actualizado = actualizar_transaccion(args.id, estricto=args.estricto, **campos_a_actualizar)
+        except ErrorInventario as e:
+            print(f"❌ Cambio rechazado. {e}")
+            return 1
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
 
-        if actualizar_transaccion(args.id, **campos_a_actualizar):
+        if actualizado:
             print(f"✅ Transacción {args.id} actualizada exitosamente")
         else:
             print(f"❌ No se encontró la transacción {args.id}")
+            return 1
 
     elif args.comando == 'consulta':
-        df = consultar_registros(
+        filtros = dict(
             activo=args.activo,
             operacion=args.operacion,
             fecha_desde=args.fecha_desde,
-            fecha_hasta=args.fecha_hasta
+            fecha_hasta=args.fecha_hasta,
+            columnas=args.columnas,
+            orden=args.orden,
+            cursor=args.cursor
         )
         
-        if len(df) > 0:
-            print("\nRegistros encontrados:")
-            print(df.to_string(index=False))
-        else:
+        total = 0
+        siguiente = None
+        try:
+            # Sin --limit se recorren todas las páginas, mostrando cada una apenas se lee
+            if args.limite is not None:
+                paginas = [consultar_pagina(limite=args.limite, **filtros)]
+            elif args.cursor is None and columnar.habilitada():
+                # Con --cache el resultado completo sale de una vez de los arrays de la caché columnar
+                df = consultar_registros(**{clave: valor for clave, valor in filtros.items() if clave != 'cursor'})
+                paginas = [{'columnas': list(df.columns), 'filas': list(df.itertuples(index=False, name=None)),
+                            'cursor': None}]
+            else:
+                paginas = iterar_paginas(**filtros)
+            for pagina in paginas:
+                if not pagina['filas']:
+                    continue
+                with fase('formato'):
+                    texto = "\n".join(_formatear_fila(pagina['columnas'], fila) for fila in pagina['filas'])
+                if total == 0:
+                    print("\nRegistros encontrados:")
+                    print(_formatear_fila(pagina['columnas'], pagina['columnas'], encabezado=True))
+                print(texto, flush=True)
+                total += len(pagina['filas'])
+                siguiente = pagina['cursor']
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+        
+        if total == 0:
             print("No hay registros que coincidan con los filtros especificados.")
+        elif siguiente:
+            print(f"\n➡️ Se muestran {total} registros. Página siguiente: --cursor {siguiente}")
 
     elif args.comando == 'borrar':
+        filtros = {'activo': args.activo, 'operacion': args.operacion,
+                   'fecha_desde': args.fecha_desde, 'fecha_hasta': args.fecha_hasta}
+        if args.id is None:
+            try:
+                resultado = borrar_transacciones(simular=args.simular, **filtros)
+            except ValueError as e:
+                print(f"❌ {e}")
+                return 1
+            return _informar_cambio_masivo(resultado, args.simular, 'borrarían', 'borradas')
+        if any(filtros.values()) or args.simular:
+            print("❌ Indica --id o los filtros de un borrado masivo, no ambos.")
+            return 1
         if borrar_transaccion(args.id):
             print(f"✅ Transacción {args.id} eliminada exitosamente")
         else:
             print(f"❌ No se encontró la transacción {args.id}")
+            return 1
+
+    elif args.comando == 'deshacer':
+        if args.listar:
+            cambios = listar_cambios()
+            if not cambios:
+                print("No hay cambios masivos en el diario.")
+            for cambio in cambios:
+                estado = f"deshecho el {cambio['deshecho']}" if cambio['deshecho'] else "vigente"
+                print(f"#{cambio['id']:<4} | {cambio['fecha']} | {cambio['tipo']:<10} | {cambio['filas']:>6} filas | "
+                      f"{estado} | {cambio['descripcion']}")
+            return 0
+        try:
+            resultado = deshacer_cambio(forzar=args.forzar)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+        print(f"✅ Cambio #{resultado['cambio']} deshecho ({resultado['tipo'].lower()} {resultado['descripcion']}): "
+              f"{resultado['filas']} transacciones restauradas")
+        if resultado['filas'] < resultado['esperadas']:
+            print(f"⚠️ {resultado['esperadas'] - resultado['filas']} transacciones ya no existían y no se restauraron")
 
     elif args.comando == 'resumen':
-        resultado = calcular_saldos()
-        saldos = resultado['saldos']
-        alertas = resultado['alertas']
-        
+        if args.fechas:
+            for fecha in args.fechas:
+                try:
+                    saldos = calcular_saldos(al=fecha)
+                except ValueError as e:
+                    print(f"❌ {e}")
+                    return 1
+                _imprimir_saldos(saldos, f"📊 SALDOS POR ACTIVO AL {fecha[:10]}")
+        else:
+            _imprimir_saldos(calcular_saldos(), "📊 RESUMEN DE SALDOS POR ACTIVO")
+
+        if args.validar:
+            sobreventas = validar_inventario()
+            if sobreventas:
+                print("\n🚨 SOBREVENTAS EN EL HISTORIAL:")
+                for sobreventa in sobreventas:
+                    print(f"⚠️ {sobreventa['activo']}: la transacción {sobreventa['id']} ({sobreventa['fecha']}) "
+                          f"dejó el inventario en negativo, faltaban {sobreventa['faltante']:.8f}")
+            else:
+                print("✅ El historial nunca tuvo inventarios negativos.")
+
+    elif args.comando == 'recalcular':
+        resultado = recalcular_saldos()
+        diferencias = resultado['diferencias']
+
+        if not diferencias:
+            print(f"✅ Saldos recalculados para {resultado['activos']} activos, sin desvíos.")
+        else:
+            print(f"⚠️ Saldos recalculados para {resultado['activos']} activos. Se corrigieron {len(diferencias)} desvíos:")
+            for diferencia in diferencias:
+                guardado = diferencia['guardado'] if diferencia['guardado'] is not None else 0
+                recalculado = diferencia['recalculado'] if diferencia['recalculado'] is not None else 0
+                print(f"{diferencia['activo']:8} | Guardado: {guardado:12.8f} | Recalculado: {recalculado:12.8f}")
+
+    elif args.comando == 'rendimiento':
+        estado = None
+        if args.estado and os.path.exists(args.estado):
+            estado = cargar_estado(args.estado)
+
+        if args.cambio == 'serie' and args.estado:
+            print("❌ --cambio serie recalcula todo el historial; no se puede combinar con --estado.")
+            return 1
+        if args.activo and args.estado:
+            print("❌ --estado guarda los lotes de todos los activos; no se puede combinar con --activo.")
+            return 1
+
+        from .cambio import asignar_tipos_cambio, tipo_cambio_al
+        # Se lee antes que las transacciones: un cambio intermedio invalida el estado en la próxima ejecución
+        modificaciones = contador_modificaciones(obtener_conexion())
+        try:
+            if args.dolar_actual is None:
+                args.dolar_actual = tipo_cambio_al(args.al or date.today().isoformat())
+            while True:
+                df = consultar_registros(activo=args.activo, despues_de_id=estado['ultimo_id'] if estado else None)
+                if args.cambio == 'serie' or (df['dolar_cambio'] <= 0).any():
+                    df = asignar_tipos_cambio(df, todos=args.cambio == 'serie')
+                try:
+                    resultado = calcular_rendimiento(df, metodo=args.metodo, estado=estado, precios=dict(args.precios),
+                                                     dolar_actual=args.dolar_actual, activo=args.activo,
+                                                     modificaciones=modificaciones)
+                    break
+                except EstadoDesactualizado as e:
+                    print(f"⚠️ {e}; se recalcula desde el principio.")
+                    estado = None
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+
+        if args.estado:
+            guardar_estado(resultado['estado'], args.estado)
+
+        _imprimir_rendimientos(resultado['rendimientos'], f"💹 RENDIMIENTO POR ACTIVO ({args.metodo})")
+
+    elif args.comando == 'importar':
+        try:
+            resultado = importar_archivo(args.archivo, formato=args.formato, tamano_lote=args.tamano_lote,
+                                         origen=args.origen)
+        except (ValueError, OSError) as e:
+            print(f"❌ Importación cancelada, no se guardó ninguna fila. {e}")
+            return 1
+
+        print(f"✅ {resultado['filas']} transacciones importadas en {resultado['segundos']:.2f} s "
+              f"({resultado['filas_por_segundo']:.0f} filas/s)")
+        if resultado['duplicadas']:
+            print(f"   {resultado['duplicadas']} filas ya estaban registradas y se descartaron")
+        if resultado['omitidas']:
+            print(f"   {resultado['omitidas']} filas anteriores a la marca de agua de {args.origen} se omitieron")
+        for marca in listar_marcas_agua():
+            if marca['origen'] == args.origen:
+                print(f"   Marca de agua de {args.origen}: {marca['fecha']} ({marca['filas']} filas importadas en total)")
+
+    elif args.comando == 'duplicados':
+        duplicados = buscar_duplicados()
+        if not duplicados:
+            print("✅ No hay transacciones duplicadas.")
+            return 0
+        print(f"⚠️ {len(duplicados)} transacciones registradas más de una vez:")
+        for grupo in duplicados:
+            archivados = f" (archivados: {', '.join(map(str, grupo['archivados']))})" if grupo['archivados'] else ""
+            print(f"   {grupo['fecha']} | {grupo['activo']:<8} | {grupo['operacion']:<7} | "
+                  f"Cantidad: {grupo['cantidad']:.8f} | Costo: {grupo['costo_total']:.2f} | "
+                  f"ids: {', '.join(map(str, grupo['ids']))}{archivados}")
+        print("   Revisa cada grupo y borra las copias que sobren (comando borrar; las archivadas no se borran).")
+
+    elif args.comando == 'exportar':
+        try:
+            total = exportar_registros(
+                args.archivo,
+                formato=args.formato,
+                tamano_bloque=args.tamano_bloque,
+                activo=args.activo,
+                operacion=args.operacion,
+                fecha_desde=args.fecha_desde,
+                fecha_hasta=args.fecha_hasta
+            )
+        except (ValueError, ImportError, OSError) as e:
+            print(f"❌ {e}", file=sys.stderr)
+            return 1
+
+        # El aviso va a stderr para no mezclarse con los datos cuando se exporta a stdout
+        print(f"✅ {total} transacciones exportadas en formato {args.formato}", file=sys.stderr)
+
+    elif args.comando == 'shell':
+        if args.tamano_grupo < 1:
+            print("❌ --grupo debe ser mayor que cero")
+            return 1
+        parser = construir_parser()
+        if args.archivo:
+            try:
+                script = open(args.archivo, encoding='utf-8')
+            except OSError as e:
+                print(f"❌ {e}")
+                return 1
+            with script:
+                return ejecutar_shell(parser, ejecutar, script, interactivo=False, tamano_grupo=args.tamano_grupo)
+        return ejecutar_shell(parser, ejecutar, tamano_grupo=args.tamano_grupo)
+
+    elif args.comando == 'cache':
+        if args.borrar:
+            columnar.borrar_cache()
+            print(f"✅ Caché eliminada ({columnar.ruta_cache()})")
+            return 0
+        try:
+            resultado = columnar.actualizar_cache()
+        except (ValueError, OSError) as e:
+            print(f"❌ {e}")
+            return 1
+        acciones = {'vigente': 'ya estaba al día', 'extendida': 'extendida con las transacciones nuevas',
+                    'reconstruida': 'reconstruida'}
+        print(f"✅ Caché {acciones[resultado['accion']]}: {resultado['filas']} transacciones, "
+              f"{resultado['bytes'] / (1024 * 1024):.1f} MB en {columnar.ruta_cache()}")
+
+    elif args.comando == 'escala':
+        if (args.activo is None) != (args.decimales is None):
+            print("❌ Indica --activo y --decimales juntos (o ninguno para listar las escalas).")
+            return 1
+        if args.activo is not None:
+            try:
+                reescaladas = definir_escala(args.activo, args.decimales)
+            except ValueError as e:
+                print(f"❌ {e}")
+                return 1
+            print(f"✅ {normalizar_activo(args.activo)} se guarda con {args.decimales} decimales "
+                  f"({reescaladas} transacciones reescaladas)")
+        else:
+            escalas = listar_escalas()
+            if not escalas:
+                print("No hay activos registrados.")
+            for activo, decimales in escalas.items():
+                print(f"{activo:8} | Decimales: {decimales}")
+
+    elif args.comando == 'cambio':
+        from .cambio import importar_tipos_cambio, registrar_tipo_cambio, tipo_cambio_al, resumen_tipos_cambio
+        if args.valor is not None and args.fecha is None:
+            print("❌ Indica --fecha junto con --valor.")
+            return 1
+        try:
+            if args.archivo:
+                resultado = importar_tipos_cambio(args.archivo)
+                print(f"✅ {resultado['filas']} tipos de cambio cargados en {resultado['segundos']:.2f} s "
+                      f"({resultado['filas_por_segundo']:.0f} filas/s)")
+            if args.valor is not None:
+                registrar_tipo_cambio(args.fecha, args.valor)
+                print(f"✅ Tipo de cambio del {args.fecha[:10]}: {args.valor:.4f}")
+        except (ValueError, OSError) as e:
+            print(f"❌ {e}")
+            return 1
+        if args.archivo or args.valor is not None:
+            return 0
+
+        if args.fecha is not None:
+            valor = tipo_cambio_al(args.fecha)
+            if valor is None:
+                print(f"⚠️ No hay tipo de cambio cargado hasta el {args.fecha[:10]}.")
+                return 1
+            print(f"Tipo de cambio al {args.fecha[:10]}: {valor:.4f}")
+        else:
+            serie = resumen_tipos_cambio()
+            if not serie['filas']:
+                print("No hay tipos de cambio cargados.")
+            else:
+                print(f"{serie['filas']} tipos de cambio del {serie['desde']} al {serie['hasta']} "
+                      f"(último: {serie['ultimo']:.4f})")
+
+    elif args.comando == 'precios':
+        from .precios import importar_precios, obtener_historial
+        if args.archivos:
+            try:
+                resultado = importar_precios(args.archivos, activo=args.activo)
+            except (ValueError, OSError) as e:
+                print(f"❌ Carga cancelada, no se modificó el historial. {e}")
+                return 1
+            print(f"✅ {resultado['filas']} precios cargados en {resultado['segundos']:.2f} s: "
+                  f"{resultado['activos']} activos, {resultado['dias']} días "
+                  f"({resultado['bytes'] / (1024 * 1024):.1f} MB)")
+        else:
+            historial = obtener_historial()
+            if historial is None:
+                print("No hay precios cargados.")
+            else:
+                print(f"{len(historial.activos)} activos del {historial.inicio} al {historial.fin} "
+                      f"({historial.dias} días; campos: {', '.join(historial.meta['campos'])})")
+
+    elif args.comando == 'valuacion':
+        from .precios import valuar_cartera, exportar_valuacion, caida_maxima
+        try:
+            resultado = valuar_cartera(desde=args.desde, hasta=args.hasta, moneda=args.moneda)
+            if args.salida:
+                exportar_valuacion(resultado, args.salida)
+        except (ValueError, OSError) as e:
+            print(f"❌ {e}")
+            return 1
+
+        total = resultado['total']
         print("\n" + "="*60)
-        print("📊 RESUMEN DE SALDOS POR ACTIVO")
+        print(f"📈 VALUACIÓN DE LA CARTERA ({args.moneda})")
         print("="*60)
-        
-        if not saldos:
-            print("No hay transacciones registradas.")
+        if len(total) == 0:
+            print("No hay transacciones en el rango.")
         else:
-            for activo, saldo in sorted(saldos.items()):
-                # Mostrar saldo con formato apropiado
-                print(f"{activo:8} | Saldo: {saldo:12.8f}")
-        
+            final = total[-1]
+            print(f"Al {resultado['fechas'][-1]}: {final:,.2f}")
+            for activo, valor, cantidad in zip(resultado['activos'], resultado['valores'][-1], resultado['cantidades'][-1]):
+                if cantidad:
+                    participacion = valor / final * 100 if final else 0.0
+                    print(f"{activo:8} | Cantidad: {cantidad:14.8f} | Valor: {valor:16,.2f} | {participacion:6.2f} %")
+            maximo = total.argmax()
+            caida = caida_maxima(total)
+            print(f"Del {resultado['fechas'][0]} al {resultado['fechas'][-1]} ({len(total)} días): "
+                  f"inicial {total[0]:,.2f} | máximo {total[maximo]:,.2f} el {resultado['fechas'][maximo]} "
+                  f"| mayor caída {caida * 100:.2f} %")
+            if resultado['sin_precio']:
+                print(f"⚠️ Sin precio en algún día del rango (se valúan en 0): {', '.join(resultado['sin_precio'])}")
+            if args.salida:
+                print(f"✅ Serie diaria escrita en {args.salida}")
         print("="*60)
-        
-        # Mostrar alertas si las hay
-        if alertas:
-            print("\n🚨 ALERTAS DE INVENTARIO:")
-            for alerta in alertas:
-                print(alerta)
+
+    elif args.comando == 'archivar':
+        from .archivo import archivar, listar_archivos
+        if args.hasta_anio is None:
+            archivos = listar_archivos()
+            if not archivos:
+                print("No hay años archivados.")
+            for archivo in archivos:
+                print(f"{archivo['anio']} | Transacciones: {archivo['transacciones']:8} | {archivo['archivo']} "
+                      f"(archivado el {archivo['archivado']})")
+            return 0
+        try:
+            resultados = archivar(args.hasta_anio, metodo=args.metodo)
+        except (ValueError, OSError, sqlite3.Error) as e:
+            print(f"❌ {e}")
+            return 1
+        if not resultados:
+            print(f"No hay transacciones hasta {args.hasta_anio} para archivar.")
+        for resultado in resultados:
+            print(f"✅ {resultado['anio']}: {resultado['transacciones']} transacciones archivadas en {resultado['archivo']}, "
+                  f"{resultado['aperturas']} lotes de apertura")
+            print(f"   Verificación: saldos de {resultado['saldos_verificados']} activos idénticos antes y después")
+
+    elif args.comando == 'portafolios':
+        from .consolidado import listar_portafolios
+        from .db import ruta_db
+        portafolios = listar_portafolios()
+        if not portafolios:
+            print(f"No hay portafolios en {os.path.dirname(ruta_db())}.")
+        for nombre in portafolios:
+            ruta = ruta_portafolio(nombre)
+            actual = ' (en uso)' if ruta == ruta_db() else ''
+            print(f"{nombre:20} | {os.path.getsize(ruta) / (1024 * 1024):8.1f} MB | {ruta}{actual}")
+
+    elif args.comando == 'consolidado':
+        from .consolidado import consolidar_saldos, consolidar_registros, consolidar_rendimiento
+        try:
+            if args.vista == 'resumen':
+                resultado = consolidar_saldos(args.portafolios, al=args.al, procesos=args.procesos)
+            elif args.vista == 'consulta':
+                df = consolidar_registros(args.portafolios, procesos=args.procesos, orden=args.orden, activo=args.activo,
+                                          operacion=args.operacion, fecha_desde=args.fecha_desde,
+                                          fecha_hasta=args.fecha_hasta)
+            else:
+                resultado = consolidar_rendimiento(args.portafolios, metodo=args.metodo, precios=dict(args.precios),
+                                                   dolar_actual=args.dolar_actual, procesos=args.procesos)
+        except (ValueError, sqlite3.Error) as e:
+            print(f"❌ {e}")
+            return 1
+
+        if args.vista == 'resumen':
+            al = f" AL {args.al}" if args.al else ""
+            if args.detalle:
+                for nombre, saldos in resultado['por_portafolio'].items():
+                    _imprimir_saldos({'saldos': saldos, 'alertas': []}, f"📁 {nombre.upper()}{al}")
+            _imprimir_saldos(resultado, f"📊 SALDOS CONSOLIDADOS{al} ({len(resultado['por_portafolio'])} portafolios)")
+        elif args.vista == 'consulta':
+            if len(df) == 0:
+                print("No hay registros que coincidan con los filtros especificados.")
+                return 0
+            columnas = list(df.columns)
+            print("\nRegistros encontrados:")
+            print(_formatear_fila(columnas, columnas, encabezado=True))
+            with fase('formato'):
+                texto = "\n".join(_formatear_fila(columnas, fila) for fila in df.itertuples(index=False, name=None))
+            print(texto)
+            print(f"\n{len(df)} registros de {df['portafolio'].nunique()} portafolios")
         else:
-            print("\n✅ Todos los saldos son válidos (sin inventarios negativos).")
+            if args.detalle:
+                por_portafolio = resultado['por_portafolio']
+                for nombre in (por_portafolio['portafolio'].unique() if len(por_portafolio) else []):
+                    _imprimir_rendimientos(por_portafolio[por_portafolio['portafolio'] == nombre],
+                                           f"📁 {nombre.upper()} ({args.metodo})")
+            _imprimir_rendimientos(resultado['rendimientos'], f"💹 RENDIMIENTO CONSOLIDADO ({args.metodo})")
+
+    elif args.comando == 'respaldar':
+        from .respaldo import respaldar, listar_respaldos, ruta_respaldos
+        if args.listar:
+            respaldos = listar_respaldos(args.directorio)
+            if not respaldos:
+                print(f"No hay respaldos en {args.directorio or ruta_respaldos()}.")
+            for respaldo in respaldos:
+                anios = f" (+ {len(respaldo['archivos'])} años archivados)" if respaldo['archivos'] else ""
+                print(f"{respaldo['fecha']} | {respaldo['bytes'] / (1024 * 1024):8.1f} MB | {respaldo['archivo']}{anios}")
+            return 0
+        try:
+            resultado = respaldar(args.directorio, comprimir=args.comprimir, conservar=args.conservar,
+                                  paginas_por_paso=args.paginas_por_paso, progreso=_mostrar_progreso())
+        except (ValueError, OSError, sqlite3.Error) as e:
+            print(f"❌ {e}")
+            return 1
+        print(f"✅ Respaldo creado: {resultado['archivo']} ({resultado['paginas']} páginas, "
+              f"{resultado['bytes'] / (1024 * 1024):.1f} MB, {resultado['paginas'] / max(resultado['segundos'], 1e-9):.0f} páginas/s)")
+        for archivo_anio in resultado['archivos']:
+            print(f"   Año archivado: {archivo_anio}")
+        for eliminado in resultado['eliminados']:
+            print(f"   Eliminado por rotación: {eliminado}")
+
+    elif args.comando == 'restaurar':
+        from .respaldo import restaurar
+        try:
+            resultado = restaurar(args.archivo, respaldo_previo=args.respaldo_previo, progreso=_mostrar_progreso())
+        except (ValueError, OSError, sqlite3.Error) as e:
+            print(f"❌ {e}")
+            return 1
+        print(f"✅ Base restaurada desde {resultado['origen']} ({resultado['paginas']} páginas, "
+              f"esquema versión {resultado['version']})")
+        if resultado['anios']:
+            print(f"   Años archivados restaurados: {', '.join(map(str, resultado['anios']))}")
+        for eliminado in resultado['eliminados']:
+            print(f"   Eliminado (el respaldo es de antes de archivar ese año): {eliminado}")
+        if resultado['respaldo_previo']:
+            print(f"   La base anterior quedó respaldada en {resultado['respaldo_previo']}")
+
+    elif args.comando == 'servir':
+        # asyncio y el servidor sólo se cargan para este comando (ver "Tiempo de arranque")
+        from .servidor import servir
+        try:
+            servir(args.host, args.puerto, hilos=args.hilos, tamano_lote=args.tamano_lote)
+        except KeyboardInterrupt:
+            print("\n👋 Servidor detenido")
+        except (ValueError, OSError) as e:
+            print(f"❌ {e}")
+            return 1
+
+    return 0
+
+def main(argv=None):
+    args = construir_parser().parse_args(argv)
+
+    if args.db:
+        configurar(args.db)
+    if args.portafolio:
+        try:
+            configurar(ruta_portafolio(args.portafolio))
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+    if args.cache:
+        columnar.habilitar(True)
+    if args.memoria:
+        memoria.habilitar(True)
+    if args.respaldo_cada is not None or os.environ.get('GESTOR_INVERSIONES_RESPALDO_CADA'):
+        from .respaldo import programar
+        try:
+            programar(args.respaldo_cada)
+        except ValueError as e:
+            print(f"❌ {e}")
+            return 1
+
+    formato_perfil = args.profile or ('texto' if args.trace_sql else None)
+    if not formato_perfil and not args.cprofile:
+        return ejecutar(args)
+
+    perfilador = None
+    if args.cprofile:
+        import cProfile
+        perfilador = cProfile.Profile()
+
+    with perfilar(trazar_sql=args.trace_sql) as perfil:
+        if perfilador:
+            perfilador.enable()
+        try:
+            codigo = ejecutar(args)
+        finally:
+            if perfilador:
+                perfilador.disable()
+                perfilador.dump_stats(args.cprofile)
+
+    if formato_perfil == 'json':
+        print(perfil.json(), file=sys.stderr)
+    elif formato_perfil:
+        print(perfil.texto(), file=sys.stderr)
+    return codigo
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
@@ -0,0 +1,452 @@
+# Caché columnar de las transacciones: un archivo binario por columna, mapeado en memoria
+import json
+import os
+import shutil
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos
+    fcntl = None
+
+from .db import obtener_conexion, ruta_db, contador_modificaciones, FACTOR_MONTOS, FACTOR_POR_DEFECTO
+from .perfilado import fase
+from .utils import normalizar_activo, normalizar_fecha, dia_siguiente, OPERACION_APERTURA
+
+VARIABLE_ENTORNO_CACHE = "GESTOR_INVERSIONES_CACHE"
+
+# Cambia si se modifica la forma de los archivos; una caché de otra versión se reconstruye
+VERSION_FORMATO = 2
+
+# Filas leídas de SQLite por bloque al construir o extender la caché
+TAMANO_BLOQUE = 50000
+
+# Las fechas se guardan como bytes de ancho fijo ('YYYY-MM-DD HH:MM:SS.ffffff' = 26)
+ANCHO_FECHA_MINIMO = 26
+
+# Columnas en el orden en que se leen de SQLite y su tipo en disco (little endian).
+# `activo` y `operacion` se guardan como códigos de diccionario; `fecha` como S<ancho>.
+# Los importes son los mismos enteros escalados de la base (ver db._migracion_5_enteros).
+COLUMNAS = ('id', 'fecha', 'activo', 'operacion', 'cantidad', 'precio_unitario', 'costo_total', 'dolar_cambio')
+_TIPOS = {
+    'id': '<i8',
+    'activo': '<i4',
+    'operacion': '<i2',
+    'cantidad': '<i8',
+    'precio_unitario': '<i8',
+    'costo_total': '<i8',
+    'dolar_cambio': '<i8',
+}
+_MONTOS = ('precio_unitario', 'costo_total', 'dolar_cambio')
+
+_configuracion = {'habilitada': None}
+
+# Instantáneas cargadas en este proceso, por ruta de base de datos
+_instantaneas = {}
+_lock = threading.Lock()
+
+
+def habilitar(habilitada=True):
+    """Activa o desactiva el uso de la caché en `consultar_registros`.
+
+    Con None se vuelve al valor de la variable de entorno GESTOR_INVERSIONES_CACHE
+    (desactivada si no está definida).
+    """
+    _configuracion['habilitada'] = habilitada
+
+
+def habilitada():
+    if _configuracion['habilitada'] is not None:
+        return _configuracion['habilitada']
+    return os.environ.get(VARIABLE_ENTORNO_CACHE, '').lower() in ('1', 'si', 'sí', 'true')
+
+
+def ruta_cache(ruta=None):
+    """Directorio de la caché de una base: junto al archivo, con sufijo '.columnas'."""
+    return (ruta or ruta_db()) + '.columnas'
+
+
+class Instantanea:
+    """Columnas de todas las transacciones hasta `max_id`, mapeadas en memoria.
+
+    Las filas están en orden de id. `meta` describe el contenido: filas, id máximo,
+    contador de modificaciones de la base al construirla, diccionarios de activos
+    (con el factor de escala de cada uno) y operaciones, y el ancho de las fechas.
+    """
+
+    def __init__(self, directorio, meta):
+        import numpy as np
+
+        self.directorio = directorio
+        self.meta = meta
+        self.filas = meta['filas']
+        self.activos = meta['activos']
+        self.operaciones = meta['operaciones']
+        self._codigos_activo = {activo: codigo for codigo, activo in enumerate(self.activos)}
+        self._codigos_operacion = {operacion: codigo for codigo, operacion in enumerate(self.operaciones)}
+        self._factores = np.asarray(meta['factores'], dtype=np.int64)
+        self.testigo = None
+
+        generacion = _directorio_generacion(directorio, meta['generacion'])
+        self.columnas = {}
+        for nombre, tipo in _tipos(meta).items():
+            if self.filas:
+                self.columnas[nombre] = np.memmap(os.path.join(generacion, f"{nombre}.bin"),
+                                                  dtype=tipo, mode='r', shape=(self.filas,))
+            else:
+                self.columnas[nombre] = np.empty(0, dtype=tipo)
+
+    @property
+    def max_id(self):
+        return self.meta['max_id']
+
+    @property
+    def modificaciones(self):
+        return self.meta['modificaciones']
+
+    def mascara(self, activo=None, operacion=None, fecha_desde=None, fecha_hasta=None, despues_de_id=None):
+        """Máscara booleana de las filas que cumplen los filtros (mismos que `consultar_registros`)."""
+        import numpy as np
+
+        mascara = np.ones(self.filas, dtype=bool)
+        if activo:
+            codigo = self._codigos_activo.get(normalizar_activo(activo))
+            mascara &= self.columnas['activo'] == (-1 if codigo is None else codigo)
+        if operacion:
+            codigo = self._codigos_operacion.get(operacion.strip().upper())
+            mascara &= self.columnas['operacion'] == (-1 if codigo is None else codigo)
+        if fecha_desde:
+            mascara &= self.columnas['fecha'] >= normalizar_fecha(fecha_desde)[:10].encode('ascii')
+        if fecha_hasta:
+            mascara &= self.columnas['fecha'] < dia_siguiente(fecha_hasta).encode('ascii')
+        if despues_de_id is not None:
+            mascara &= self.columnas['id'] > int(despues_de_id)
+        return mascara
+
+    def registros(self, columnas=COLUMNAS, orden='desc', **filtros):
+        """Retorna {columna: array} con las filas filtradas, ordenadas por (fecha, id).
+
+        `orden` es 'desc' (más recientes primero) o 'asc', como en SQLite.
+        """
+        import numpy as np
+
+        indices = np.flatnonzero(self.mascara(**filtros))
+        fechas = self.columnas['fecha'][indices]
+        # Casi siempre las filas ya están en orden cronológico (se registran al
+        # ocurrir); ordenar strings es caro, así que sólo se hace si hace falta
+        if len(fechas) > 1 and not (fechas[1:] >= fechas[:-1]).all():
+            indices = indices[np.argsort(fechas, kind='stable')]
+        if orden.lower() == 'desc':
+            indices = indices[::-1]
+
+        resultado = {}
+        for columna in columnas:
+            valores = self.columnas[columna][indices]
+            if columna == 'activo':
+                valores = np.asarray(self.activos, dtype=object)[valores]
+            elif columna == 'operacion':
+                valores = np.asarray(self.operaciones, dtype=object)[valores]
+            elif columna == 'fecha':
+                valores = valores.astype(str).astype(object)
+            elif columna == 'cantidad':
+                # Misma división que hace la vista v_transacciones, así que el float es idéntico
+                valores = valores / self._factores[self.columnas['activo'][indices]]
+            elif columna in _MONTOS:
+                valores = valores / FACTOR_MONTOS
+            else:
+                valores = np.asarray(valores)
+            resultado[columna] = valores
+        return resultado
+
+    def _sumas(self, **filtros):
+        """Compras, ventas (enteros escalados) y cantidad de transacciones por código de activo."""
+        import numpy as np
+
+        mascara = self.mascara(**filtros)
+        codigos = self.columnas['activo'][mascara]
+        cantidades = self.columnas['cantidad'][mascara]
+        operaciones = self.columnas['operacion'][mascara]
+        total = len(self.activos)
+
+        def suma(operacion):
+            # bincount acumula en float; np.add.at suma los enteros sin redondeos
+            seleccion = operaciones == self._codigos_operacion.get(operacion, -1)
+            acumulado = np.zeros(total, dtype=np.int64)
+            np.add.at(acumulado, codigos[seleccion], cantidades[seleccion])
+            return acumulado
+
+        # El saldo de apertura de lo archivado (ver `archivo.archivar`) cuenta como compra
+        return suma('COMPRA') + suma(OPERACION_APERTURA), suma('VENTA'), np.bincount(codigos, minlength=total)
+
+    def totales_enteros(self, **filtros):
+        """Tuplas (activo, compras, ventas, factor) en enteros, como `crud.totales_saldos`.
+
+        Sólo incluye los activos con alguna transacción que cumple los filtros; con
+        `fecha_hasta` es el saldo a esa fecha que usa `resumen --al` con la caché.
+        """
+        compras, ventas, transacciones = self._sumas(**filtros)
+        return sorted((activo, int(compras[codigo]), int(ventas[codigo]), int(self._factores[codigo]))
+                      for codigo, activo in enumerate(self.activos) if transacciones[codigo])
+
+    def totales_por_activo(self, **filtros):
+        """Compras, ventas, saldo y cantidad de transacciones por activo, con filtros opcionales.
+
+        Se suma sobre las columnas de enteros (exacto, como la tabla `saldos`); sirve,
+        por ejemplo, para el saldo a una fecha (`fecha_hasta`) sin recorrer las
+        transacciones en SQLite.
+        """
+        compras, ventas, transacciones = self._sumas(**filtros)
+        return {
+            activo: {
+                'compras': int(compras[codigo]) / int(self._factores[codigo]),
+                'ventas': int(ventas[codigo]) / int(self._factores[codigo]),
+                'saldo': int(compras[codigo] - ventas[codigo]) / int(self._factores[codigo]),
+                'transacciones': int(transacciones[codigo]),
+            }
+            for codigo, activo in enumerate(self.activos)
+            if transacciones[codigo]
+        }
+
+    def movimientos(self):
+        """Día, código de activo y variación de la cantidad (en enteros escalados) de cada fila.
+
+        Las compras suman y las ventas restan; sirve para construir tenencias
+        diarias sin leer las transacciones de SQLite (ver `precios.valuar_cartera`).
+        """
+        import numpy as np
+
+        operaciones = self.columnas['operacion']
+        signos = np.zeros(len(self.operaciones) + 1, dtype=np.int64)
+        for operacion, signo in (('COMPRA', 1), (OPERACION_APERTURA, 1), ('VENTA', -1)):
+            if operacion in self._codigos_operacion:
+                signos[self._codigos_operacion[operacion]] = signo
+        dias = self.columnas['fecha'].astype('S10').astype('datetime64[D]')
+        return dias, np.asarray(self.columnas['activo'], dtype=np.int64), self.columnas['cantidad'] * signos[operaciones]
+
+
+def _tipos(meta):
+    tipos = dict(_TIPOS)
+    tipos['fecha'] = f"S{meta['ancho_fecha']}"
+    return {columna: tipos[columna] for columna in COLUMNAS}
+
+
+def _directorio_generacion(directorio, generacion):
+    return os.path.join(directorio, f"g{generacion}")
+
+
+def _leer_meta(directorio):
+    try:
+        with open(os.path.join(directorio, 'meta.json'), encoding='utf-8') as archivo:
+            meta = json.load(archivo)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == VERSION_FORMATO else None
+
+
+def _escribir_meta(directorio, meta):
+    # Se escribe aparte y se reemplaza: los lectores ven la versión anterior o la nueva, nunca una a medias
+    temporal = os.path.join(directorio, 'meta.json.tmp')
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump(meta, archivo)
+    os.replace(temporal, os.path.join(directorio, 'meta.json'))
+
+
+@contextmanager
+def _bloqueo(directorio):
+    """Impide que dos procesos actualicen la misma caché a la vez."""
+    os.makedirs(directorio, exist_ok=True)
+    with open(os.path.join(directorio, '.lock'), 'w') as archivo:
+        if fcntl is not None:
+            fcntl.flock(archivo, fcntl.LOCK_EX)
+        yield
+
+
+def _escribir_filas(conn, directorio, meta, desde_id, hasta_id):
+    """Agrega a los archivos de la generación actual las filas con id en (desde_id, hasta_id].
+
+    Actualiza en `meta` la cantidad de filas, los diccionarios y los factores de
+    escala de los activos. Retorna False
+    (sin escribir nada) si alguna fecha no entra en el ancho de la caché.
+    """
+    import numpy as np
+
+    ancho = conn.execute("SELECT MAX(LENGTH(fecha)) FROM transacciones WHERE id > ? AND id <= ?",
+                         (desde_id, hasta_id)).fetchone()[0] or 0
+    if ancho > meta['ancho_fecha']:
+        return False
+
+    tipos = _tipos(meta)
+    generacion = _directorio_generacion(directorio, meta['generacion'])
+    archivos = {}
+    try:
+        for columna, tipo in tipos.items():
+            archivo = open(os.path.join(generacion, f"{columna}.bin"), 'r+b' if meta['filas'] else 'wb')
+            # Descarta bytes de una extensión interrumpida que el meta.json no llegó a registrar
+            archivo.truncate(meta['filas'] * np.dtype(tipo).itemsize)
+            archivo.seek(0, os.SEEK_END)
+            archivos[columna] = archivo
+
+        codigos_activo = {activo: codigo for codigo, activo in enumerate(meta['activos'])}
+        codigos_operacion = {operacion: codigo for codigo, operacion in enumerate(meta['operaciones'])}
+        cursor = conn.execute(f"""
+            SELECT {', '.join(COLUMNAS)} FROM transacciones
+            WHERE id > ? AND id <= ? ORDER BY id
+        """, (desde_id, hasta_id))
+        while True:
+            bloque = cursor.fetchmany(TAMANO_BLOQUE)
+            if not bloque:
+                break
+            ids, fechas, activos, operaciones, *numeros = zip(*bloque)
+            valores = {
+                'id': ids,
+                'fecha': [fecha.encode('ascii') if fecha else b'' for fecha in fechas],
+                'activo': [codigos_activo.setdefault(activo, len(codigos_activo)) for activo in activos],
+                'operacion': [codigos_operacion.setdefault(operacion, len(codigos_operacion)) for operacion in operaciones],
+            }
+            valores.update(zip(COLUMNAS[4:], numeros))
+            for columna, tipo in tipos.items():
+                np.asarray(valores[columna], dtype=tipo).tofile(archivos[columna])
+            meta['filas'] += len(bloque)
+    finally:
+        for archivo in archivos.values():
+            archivo.close()
+
+    # Una escala que cambia reescala las filas del activo y eso fuerza una reconstrucción,
+    # así que los factores leídos ahora valen para todas las filas ya guardadas
+    factores = dict(conn.execute("SELECT activo, factor FROM escalas"))
+    meta['activos'] = list(codigos_activo)
+    meta['factores'] = [factores.get(activo, FACTOR_POR_DEFECTO) for activo in codigos_activo]
+    meta['operaciones'] = list(codigos_operacion)
+    return True
+
+
+def _reconstruir(conn, directorio, anterior, modificaciones, max_id):
+    """Escribe una generación nueva con todas las transacciones hasta `max_id`."""
+    ancho = conn.execute("SELECT MAX(LENGTH(fecha)) FROM transacciones").fetchone()[0] or 0
+    meta = {
+        'version': VERSION_FORMATO,
+        'generacion': (anterior['generacion'] + 1) if anterior else 1,
+        'filas': 0,
+        'max_id': max_id,
+        'modificaciones': modificaciones,
+        'ancho_fecha': max(ANCHO_FECHA_MINIMO, ancho),
+        'activos': [],
+        'factores': [],
+        'operaciones': [],
+    }
+    generacion = _directorio_generacion(directorio, meta['generacion'])
+    shutil.rmtree(generacion, ignore_errors=True)
+    os.makedirs(generacion)
+    _escribir_filas(conn, directorio, meta, 0, max_id)
+    _escribir_meta(directorio, meta)
+
+    # Las generaciones anteriores ya no se usan (un proceso que aún las tenga
+    # mapeadas conserva el acceso en sistemas POSIX)
+    for nombre in os.listdir(directorio):
+        if nombre.startswith('g') and nombre != f"g{meta['generacion']}":
+            shutil.rmtree(os.path.join(directorio, nombre), ignore_errors=True)
+    return meta
+
+
+def _actualizar(conn, directorio, instantanea):
+    """Deja la caché al día con la base: la extiende si sólo hubo altas, si no la reconstruye.
+
+    Retorna (instantanea, accion) con accion 'vigente', 'extendida' o 'reconstruida'.
+    """
+    with _bloqueo(directorio):
+        # Una lectura consistente: contador, id máximo y filas de la misma versión de la base
+        conn.execute("BEGIN")
+        try:
+            modificaciones = contador_modificaciones(conn)
+            max_id = conn.execute("SELECT COALESCE(MAX(id), 0) FROM transacciones").fetchone()[0]
+
+            # Otro proceso pudo haberla actualizado: se parte de lo que hay en disco
+            meta = _leer_meta(directorio)
+            if meta is not None and (meta['modificaciones'], meta['max_id']) == (modificaciones, max_id):
+                accion = 'vigente'
+            elif (meta is not None and meta['modificaciones'] == modificaciones and meta['max_id'] < max_id
+                  and _escribir_filas(conn, directorio, meta, meta['max_id'], max_id)):
+                meta['max_id'] = max_id
+                _escribir_meta(directorio, meta)
+                accion = 'extendida'
+            else:
+                meta = _reconstruir(conn, directorio, meta, modificaciones, max_id)
+                accion = 'reconstruida'
+        finally:
+            conn.execute("COMMIT")
+
+    if instantanea is not None and instantanea.meta == meta:
+        return instantanea, accion
+    return Instantanea(directorio, meta), accion
+
+
+def obtener_instantanea():
+    """Retorna la instantánea de la base configurada, actualizándola si hace falta.
+
+    La comprobación rápida usa `PRAGMA data_version` (cambia cuando otra conexión
+    confirma una escritura) y `total_changes` (escrituras de la propia conexión):
+    si ninguno cambió desde la última vez, la instantánea sigue vigente sin
+    consultar nada más. Si cambiaron, se compara el id máximo y el contador de
+    modificaciones: si sólo se agregaron transacciones se extienden los archivos
+    con las filas nuevas; si se modificó o borró alguna, se reconstruye.
+
+    Retorna None si la conexión del hilo está dentro de una transacción: las
+    filas aún no confirmadas no deben quedar guardadas en la caché.
+    """
+    conn = obtener_conexion()
+    if conn.in_transaction:
+        return None
+
+    ruta = ruta_db()
+    testigo = (id(conn), conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+    instantanea = _instantaneas.get(ruta)
+    if instantanea is not None and instantanea.testigo == testigo:
+        return instantanea
+
+    with _lock:
+        with fase('cache'):
+            instantanea, _ = _actualizar(conn, ruta_cache(ruta), _instantaneas.get(ruta))
+        instantanea.testigo = testigo
+        _instantaneas[ruta] = instantanea
+    return instantanea
+
+
+def actualizar_cache():
+    """Construye o pone al día la caché de la base configurada.
+
+    Retorna:
+    - dict con estructura: {'accion': 'vigente' | 'extendida' | 'reconstruida',
+      'filas', 'max_id', 'bytes'}
+    """
+    conn = obtener_conexion()
+    if conn.in_transaction:
+        raise ValueError("No se puede actualizar la caché dentro de una transacción")
+    ruta = ruta_db()
+    directorio = ruta_cache(ruta)
+    with _lock:
+        instantanea, accion = _actualizar(conn, directorio, _instantaneas.get(ruta))
+        _instantaneas[ruta] = instantanea
+
+    generacion = _directorio_generacion(directorio, instantanea.meta['generacion'])
+    tamano = sum(entrada.stat().st_size for entrada in os.scandir(generacion))
+    return {'accion': accion, 'filas': instantanea.filas, 'max_id': instantanea.max_id, 'bytes': tamano}
+
+
+def borrar_cache(ruta=None):
+    """Elimina la caché en disco de una base (por defecto, la configurada)."""
+    ruta = ruta or ruta_db()
+    with _lock:
+        _instantaneas.pop(ruta, None)
+        shutil.rmtree(ruta_cache(ruta), ignore_errors=True)
+
+
+def totales_por_activo(**filtros):
+    """Totales por activo calculados sobre la caché (ver `Instantanea.totales_por_activo`).
+
+    Acepta los filtros de `consultar_registros`. Actualiza la caché si hace falta.
+    """
+    instantanea = obtener_instantanea()
+    if instantanea is None:
+        raise ValueError("No se puede usar la caché dentro de una transacción")
+    return instantanea.totales_por_activo(**filtros)
@@ -0,0 +1,195 @@
+# Consolidación de varios portafolios (una base por portafolio) en paralelo
+import os
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor
+
+from . import db
+from .db import ruta_db, ruta_portafolio, PATRON_PORTAFOLIO
+
+# Columnas de `calcular_rendimiento` que se suman entre portafolios
+COLUMNAS_ADITIVAS = ('cantidad', 'costo_usd', 'costo_local', 'realizado_usd', 'realizado_local', 'vendido_sin_costo',
+                     'no_realizado_usd', 'no_realizado_local')
+
+
+def _es_base_del_gestor(ruta):
+    try:
+        conn = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+    except sqlite3.Error:
+        return False
+    try:
+        return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transacciones'").fetchone() is not None
+    except sqlite3.DatabaseError:
+        return False
+    finally:
+        conn.close()
+
+
+def listar_portafolios(directorio=None):
+    """Nombres de los portafolios del directorio de la base configurada, en orden alfabético.
+
+    Un portafolio es un archivo `<nombre>.db` con la tabla de transacciones; los
+    archivos por año (`archivar`) y los de otras aplicaciones no se cuentan.
+    """
+    directorio = directorio or os.path.dirname(ruta_db())
+    try:
+        nombres = sorted(os.listdir(directorio))
+    except FileNotFoundError:
+        return []
+    return [nombre[:-3] for nombre in nombres
+            if nombre.endswith('.db') and re.fullmatch(PATRON_PORTAFOLIO, nombre[:-3])
+            and _es_base_del_gestor(os.path.join(directorio, nombre))]
+
+
+def _resolver(portafolios):
+    """Retorna [(nombre, ruta)] de los portafolios pedidos (por defecto, todos); ValueError si falta alguno."""
+    disponibles = listar_portafolios()
+    if portafolios is None:
+        portafolios = disponibles
+    faltantes = [nombre for nombre in portafolios if nombre not in disponibles]
+    if faltantes:
+        raise ValueError(f"No existe el portafolio {', '.join(faltantes)} (disponibles: {', '.join(disponibles) or 'ninguno'})")
+    if not portafolios:
+        raise ValueError(f"No hay portafolios en {os.path.dirname(ruta_db())}")
+    return [(nombre, ruta_portafolio(nombre)) for nombre in portafolios]
+
+
+def _tarea_saldos(al):
+    from .crud import totales_saldos
+    return totales_saldos(al=al)
+
+
+def _tarea_registros(filtros):
+    from .crud import consultar_registros
+    return consultar_registros(**filtros)
+
+
+def _tarea_rendimiento(metodo, precios, dolar_actual):
+    from .cambio import asignar_tipos_cambio
+    from .crud import consultar_registros
+    from .rendimiento import calcular_rendimiento
+    df = consultar_registros()
+    # Las operaciones sin tipo de cambio toman el de la serie de su propio portafolio
+    if (df['dolar_cambio'] <= 0).any():
+        df = asignar_tipos_cambio(df)
+    return calcular_rendimiento(df, metodo=metodo, precios=precios, dolar_actual=dolar_actual)['rendimientos']
+
+
+def _en_portafolio(ruta, tarea, argumentos):
+    """Ejecuta `tarea(*argumentos)` sobre la base `ruta` (en un proceso del pool o en el actual)."""
+    anterior = ruta_db()
+    db.configurar(ruta)
+    try:
+        return tarea(*argumentos)
+    finally:
+        db.cerrar_conexiones()
+        db.configurar(anterior)
+
+
+def _repartir(portafolios, tarea, argumentos, procesos):
+    """Ejecuta la tarea en cada portafolio y retorna {nombre: resultado parcial}.
+
+    Cada portafolio se procesa en un proceso del pool (hasta `procesos`, por
+    defecto uno por núcleo), así que el tiempo total depende de los núcleos y no
+    de la cantidad de portafolios. Con un solo proceso no se crea el pool.
+    """
+    destinos = _resolver(portafolios)
+    procesos = min(len(destinos), (os.cpu_count() or 1) if procesos is None else procesos)
+    if procesos < 1:
+        raise ValueError("procesos debe ser mayor que cero")
+    if procesos == 1:
+        return {nombre: _en_portafolio(ruta, tarea, argumentos) for nombre, ruta in destinos}
+    with ProcessPoolExecutor(max_workers=procesos) as pool:
+        futuros = {nombre: pool.submit(_en_portafolio, ruta, tarea, argumentos) for nombre, ruta in destinos}
+        return {nombre: futuro.result() for nombre, futuro in futuros.items()}
+
+
+def consolidar_saldos(portafolios=None, al=None, procesos=None):
+    """Saldo de cada activo sumando todos los portafolios.
+
+    Cada portafolio aporta sus compras y ventas acumuladas en enteros
+    (`crud.totales_saldos`); se llevan a la escala más fina de cada activo y se
+    suman, así que el consolidado es exacto como el de una sola base.
+
+    Parámetros:
+    - portafolios: lista de nombres (por defecto, todos los de `listar_portafolios`)
+    - al: opcional, fecha (YYYY-MM-DD) como en `calcular_saldos`
+    - procesos: máximo de procesos en paralelo (por defecto, uno por núcleo)
+
+    Retorna:
+    - dict {'saldos', 'alertas'} como `calcular_saldos`, más
+      'por_portafolio': {nombre: {activo: saldo}}
+    """
+    from .crud import _resumir_saldos
+
+    parciales = _repartir(portafolios, _tarea_saldos, (al,), procesos)
+    acumulados = {}
+    for filas in parciales.values():
+        for activo, compras, ventas, factor in filas:
+            previo = acumulados.get(activo)
+            if previo is None:
+                acumulados[activo] = [compras, ventas, factor]
+                continue
+            # Los factores son potencias de 10: se reescala a la más fina sin perder precisión
+            comun = max(previo[2], factor)
+            previo[0] = previo[0] * (comun // previo[2]) + compras * (comun // factor)
+            previo[1] = previo[1] * (comun // previo[2]) + ventas * (comun // factor)
+            previo[2] = comun
+
+    resultado = _resumir_saldos([(activo, *acumulados[activo]) for activo in sorted(acumulados)])
+    resultado['por_portafolio'] = {nombre: _resumir_saldos(filas)['saldos'] for nombre, filas in parciales.items()}
+    return resultado
+
+
+def consolidar_registros(portafolios=None, procesos=None, orden='desc', **filtros):
+    """Transacciones de todos los portafolios, con una columna 'portafolio'.
+
+    Acepta los filtros de `consultar_registros` (activo, operacion, fechas,
+    columnas). Cada portafolio se consulta en paralelo y los resultados se
+    ordenan por fecha según `orden`.
+
+    Retorna:
+    - DataFrame con la columna 'portafolio' primero
+    """
+    import pandas as pd
+
+    filtros['orden'] = orden
+    parciales = _repartir(portafolios, _tarea_registros, (filtros,), procesos)
+    partes = [df.assign(portafolio=nombre) for nombre, df in parciales.items() if len(df)]
+    if not partes:
+        columnas = list(next(iter(parciales.values())).columns)
+        return pd.DataFrame(columns=['portafolio'] + columnas)
+    df = pd.concat(partes, ignore_index=True)
+    df = df[['portafolio'] + [columna for columna in df.columns if columna != 'portafolio']]
+    claves = [columna for columna in ('fecha', 'portafolio', 'id') if columna in df.columns]
+    return df.sort_values(claves, ascending=orden == 'asc', kind='stable', ignore_index=True)
+
+
+def consolidar_rendimiento(portafolios=None, metodo='FIFO', precios=None, dolar_actual=None, procesos=None):
+    """Costo base y resultados por activo sumando todos los portafolios.
+
+    Los lotes se consumen dentro de cada portafolio (una venta de una cuenta no
+    usa las compras de otra); el consolidado suma cantidades, costos y
+    resultados realizados y no realizados de cada activo.
+
+    Parámetros:
+    - portafolios, procesos: como en `consolidar_saldos`
+    - metodo, precios, dolar_actual: como en `calcular_rendimiento`
+
+    Retorna:
+    - dict {'rendimientos': DataFrame consolidado por activo,
+            'por_portafolio': DataFrame con una fila por portafolio y activo}
+    """
+    import pandas as pd
+
+    parciales = _repartir(portafolios, _tarea_rendimiento, (metodo.upper(), precios, dolar_actual), procesos)
+    partes = [df.assign(portafolio=nombre) for nombre, df in parciales.items() if len(df)]
+    if not partes:
+        return {'rendimientos': pd.DataFrame(), 'por_portafolio': pd.DataFrame()}
+    por_portafolio = pd.concat(partes, ignore_index=True)
+    sumas = [columna for columna in COLUMNAS_ADITIVAS if columna in por_portafolio.columns]
+    # min_count=1: un activo sin precio en ningún portafolio sigue sin no realizado (NaN), no en 0
+    rendimientos = por_portafolio.groupby('activo', sort=True)[sumas].sum(min_count=1).reset_index()
+    if 'precio' in por_portafolio.columns:
+        rendimientos.insert(1, 'precio', por_portafolio.groupby('activo', sort=True)['precio'].first().to_numpy())
+    return {'rendimientos': rendimientos, 'por_portafolio': por_portafolio}
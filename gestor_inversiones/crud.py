@@ -1,8 +1,167 @@
-from .db import get_db_connection
-import pandas as pd
-from datetime import datetime
+from . import columnar, memoria
+from .archivo import (origen_consulta, anios_en_rango, cierre_archivado, huellas_archivadas, duplicados_archivados,
+                      listar_archivos)
+from .db import (obtener_conexion, transaccion, huella_transaccion, contador_escrituras, SQL_RECALCULAR_SALDOS,
+                 FACTOR_MONTOS, FACTOR_POR_DEFECTO, MAX_DECIMALES)
+from .perfilado import fase
+from .utils import (validar_transaccion, leer_transacciones, normalizar_fecha, normalizar_activo, dia_siguiente,
+                    a_unidades, leer_id_externo, CAMPOS_TRANSACCION, ALIAS_CAMPOS, MAX_ENTERO, OPERACION_APERTURA)
+import base64
+import json
+import sqlite3
+import time
+from datetime import date, datetime
+from itertools import islice
 
-def registrar_transaccion(activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio, fecha=None):
+TAMANO_LOTE_IMPORTACION = 1000
+TAMANO_BLOQUE_EXPORTACION = 5000
+TAMANO_PAGINA = 1000
+
+# Órdenes admitidos por las consultas paginadas (por fecha e id)
+ORDENES = ('desc', 'asc')
+
+# Columnas (en orden) que devuelven las lecturas por bloques
+COLUMNAS_TRANSACCION = ('id',) + CAMPOS_TRANSACCION
+
+# Saldos por debajo de -TOLERANCIA_INVENTARIO se consideran sobreventa. Los importes
+# son enteros exactos (ver db._migracion_5_enteros), así que cualquier margen menor
+# que la unidad mínima del activo equivale a exigir saldo >= 0
+TOLERANCIA_INVENTARIO = 1e-9
+
+# Columnas guardadas en unidades de 1/FACTOR_MONTOS (la cantidad usa la escala de su activo)
+CAMPOS_MONTOS = ('precio_unitario', 'costo_total', 'dolar_cambio')
+
+# Campos que admite un cambio masivo: la cantidad y el id externo son propios de cada
+# operación y sólo se cambian por id (`actualizar_transaccion`)
+CAMPOS_MASIVOS = ('activo', 'operacion', 'precio_unitario', 'costo_total', 'dolar_cambio', 'fecha')
+
+# Cambios masivos que se conservan en el diario (los más viejos ya no se pueden deshacer)
+CAMBIOS_CONSERVADOS = 20
+
+# Columnas de una transacción que guarda el diario de cambios masivos, en orden
+_COLUMNAS_IMAGEN = ('id', 'fecha', 'activo', 'operacion', 'cantidad', 'precio_unitario', 'costo_total', 'dolar_cambio',
+                    'id_externo', 'huella', 'ocurrencia')
+
+# Variación que una transacción produce en el inventario de su activo (el saldo
+# de apertura que deja `archivo.archivar` suma como una compra)
+_DELTA_SQL = "CASE WHEN operacion IN ('COMPRA', 'APERTURA') THEN cantidad WHEN operacion = 'VENTA' THEN -cantidad ELSE 0 END"
+
+# Compras y ventas de un conjunto de transacciones, como las acumula la tabla `saldos`
+_TOTALES_SQL = ("SUM(CASE WHEN operacion IN ('COMPRA', 'APERTURA') THEN cantidad ELSE 0 END), "
+                "SUM(CASE WHEN operacion = 'VENTA' THEN cantidad ELSE 0 END)")
+
+class ErrorInventario(ValueError):
+    """Una escritura dejaría el inventario de un activo en negativo.
+
+    El atributo `sobreventa` tiene la misma estructura que los elementos
+    retornados por `validar_inventario`.
+    """
+    def __init__(self, sobreventa):
+        self.sobreventa = sobreventa
+        super().__init__(
+            f"La operación deja {sobreventa['activo']} en negativo desde la transacción "
+            f"{sobreventa['id']} ({sobreventa['fecha']}): faltan {sobreventa['faltante']:.8f}"
+        )
+
+class TransaccionDuplicada(ValueError):
+    """La transacción ya está registrada (misma huella de contenido; ver db._migracion_9_huellas).
+
+    El atributo `id_existente` es el id de la transacción ya guardada.
+    """
+    def __init__(self, id_existente):
+        self.id_existente = id_existente
+        super().__init__(
+            f"La transacción ya está registrada con el id {id_existente} "
+            f"(si es otra operación idéntica, indica su id externo)"
+        )
+
+# Alta que descarta en silencio las filas cuya huella ya existe (ocurrencia 1:
+# las altas nuevas nunca repiten una huella, ver db._migracion_9_huellas)
+_SQL_INSERTAR = """
+    INSERT INTO transacciones
+    (fecha, activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio, id_externo, huella)
+    VALUES (COALESCE(?, CURRENT_TIMESTAMP), ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT DO NOTHING
+"""
+
+def _huella(fecha, activo, operacion, factor, enteros, id_externo):
+    """Huella de una fila a insertar; None si no tiene fecha (la pone la base y no se deduplica)."""
+    if fecha is None:
+        return None
+    cantidad, precio_unitario, costo_total, _ = enteros
+    return huella_transaccion(fecha, activo, operacion, cantidad, factor, precio_unitario, costo_total, id_externo)
+
+def _factor_activo(conn, activo):
+    """Unidades por unidad del activo con que se guarda su cantidad (10^decimales)."""
+    fila = conn.execute("SELECT factor FROM escalas WHERE activo = ?", (activo,)).fetchone()
+    return fila[0] if fila else FACTOR_POR_DEFECTO
+
+def _a_enteros(factor, cantidad, precio_unitario, costo_total, dolar_cambio):
+    """Convierte los importes de una transacción a los enteros con que se guardan."""
+    return (a_unidades(cantidad, factor), a_unidades(precio_unitario, FACTOR_MONTOS),
+            a_unidades(costo_total, FACTOR_MONTOS), a_unidades(dolar_cambio, FACTOR_MONTOS))
+
+def _archivada(fecha, cierre):
+    return cierre is not None and fecha is not None and fecha[:10] <= cierre
+
+def _rechazar_archivada(fecha, cierre):
+    """Lanza ValueError si `fecha` cae en un año ya archivado (hasta `cierre` inclusive, ver `archivo.archivar`).
+
+    Una transacción nueva en ese año no figuraría en su archivo ni en el saldo
+    de apertura que lo resume, y los dos dejarían de coincidir con la base.
+    """
+    if _archivada(fecha, cierre):
+        raise ValueError(f"La fecha {fecha[:10]} está en un año archivado (hasta el {cierre}); "
+                         f"las transacciones de ese año ya no se pueden agregar ni modificar")
+
+def listar_escalas():
+    """Retorna {activo: decimales} con la escala de cantidad de cada activo conocido."""
+    return dict(obtener_conexion().execute("SELECT activo, decimales FROM escalas ORDER BY activo"))
+
+def definir_escala(activo, decimales):
+    """Define con cuántos decimales se guarda la cantidad de un activo.
+    
+    Las transacciones ya registradas del activo se reescalan en la misma
+    transacción (los triggers ajustan `saldos`). Lanza ValueError si reducir
+    los decimales perdería precisión en alguna cantidad existente, o si al
+    aumentarlos alguna no entraría en 64 bits.
+    
+    Parámetros:
+    - activo: símbolo del activo (ej: ETH)
+    - decimales: entre 0 y MAX_DECIMALES (8 equivale al satoshi de BTC)
+    
+    Retorna:
+    - cantidad de transacciones reescaladas
+    """
+    decimales = int(decimales)
+    if not 0 <= decimales <= MAX_DECIMALES:
+        raise ValueError(f"Los decimales deben estar entre 0 y {MAX_DECIMALES}: {decimales}")
+    activo = normalizar_activo(activo)
+    
+    with transaccion() as conn:
+        fila = conn.execute("SELECT decimales FROM escalas WHERE activo = ?", (activo,)).fetchone()
+        diferencia = decimales - (fila[0] if fila else decimales)
+        conn.execute("INSERT OR REPLACE INTO escalas (activo, decimales, factor) VALUES (?, ?, ?)",
+                     (activo, decimales, 10 ** decimales))
+        if diferencia == 0:
+            return 0
+        
+        escala = 10 ** abs(diferencia)
+        if diferencia > 0:
+            maximo, = conn.execute("SELECT MAX(cantidad) FROM transacciones WHERE activo = ?", (activo,)).fetchone()
+            if maximo is not None and maximo * escala > MAX_ENTERO:
+                raise ValueError(f"Con {decimales} decimales alguna cantidad de {activo} no entra en 64 bits")
+            cursor = conn.execute("UPDATE transacciones SET cantidad = cantidad * ? WHERE activo = ?", (escala, activo))
+        else:
+            perdidas, = conn.execute("SELECT COUNT(*) FROM transacciones WHERE activo = ? AND cantidad % ? <> 0",
+                                     (activo, escala)).fetchone()
+            if perdidas:
+                raise ValueError(f"Con {decimales} decimales se perdería precisión en {perdidas} transacciones de {activo}")
+            cursor = conn.execute("UPDATE transacciones SET cantidad = cantidad / ? WHERE activo = ?", (escala, activo))
+        return cursor.rowcount
+
+def registrar_transaccion(activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio, fecha=None, estricto=False,
+                          id_externo=None):
     """Registra una transacción (compra o venta) en la base de datos.
 
     Parámetros:
@@ -12,88 +171,482 @@ def registrar_transaccion(activo, operacion, cantidad, precio_unitario, costo_to
     - precio_unitario: precio por unidad en el momento de la transacción
     - costo_total: monto total de la transacción
     - dolar_cambio: tipo de cambio del dólar en ese momento
+      (los importes se guardan como enteros escalados; ver `definir_escala`)
     - fecha: opcional. Si se indica, puede ser:
         * un objeto `datetime`
         * un string en formato ISO (YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS)
       Si no se indica, la base de datos usará la fecha/hora actual.
+    - estricto: si es True, lanza ErrorInventario (y no guarda nada) cuando la
+      transacción dejaría el inventario del activo en negativo en algún momento.
+    - id_externo: opcional, id de la operación en el exchange o banco de origen.
+      Distingue dos operaciones con la misma fecha, activo, cantidad e importes.
+
+    Si ya hay una transacción con la misma fecha, activo, operación, cantidad,
+    precio, costo e id externo no se guarda nada y se lanza TransaccionDuplicada
+    (las transacciones sin fecha no se comparan). En un año archivado se busca
+    en su archivo: si ya está ahí se lanza TransaccionDuplicada con el id
+    archivado y, si no, ValueError (ese año no admite altas).
+
+    Retorna:
+    - el id de la transacción registrada
     """
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    activo = normalizar_activo(activo)
+    fecha = normalizar_fecha(fecha)
+    id_externo = leer_id_externo({'id_externo': id_externo})
 
-    if fecha is None:
-        cursor.execute("""
-            INSERT INTO transacciones 
-            (activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio))
-    else:
-        # Normalizar fecha a string
-        if hasattr(fecha, 'isoformat'):
-            fecha_str = fecha.isoformat(sep=' ')
-        else:
-            fecha_str = str(fecha)
+    with transaccion() as conn:
+        factor = _factor_activo(conn, activo)
+        enteros = _a_enteros(factor, cantidad, precio_unitario, costo_total, dolar_cambio)
+        huella = _huella(fecha, activo, operacion, factor, enteros, id_externo)
+        cierre = cierre_archivado(conn)
+        if _archivada(fecha, cierre):
+            id_archivado = huellas_archivadas({int(fecha[:4]): [huella]}).get(huella)
+            if id_archivado is not None:
+                raise TransaccionDuplicada(id_archivado)
+            _rechazar_archivada(fecha, cierre)
+        cursor = conn.execute(_SQL_INSERTAR, (fecha, activo, operacion, *enteros, id_externo, huella))
+        if cursor.rowcount == 0:
+            id_existente, = conn.execute("SELECT id FROM transacciones WHERE huella = ? AND ocurrencia = 1",
+                                         (huella,)).fetchone()
+            raise TransaccionDuplicada(id_existente)
 
-        cursor.execute("""
-            INSERT INTO transacciones 
-            (fecha, activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (fecha_str, activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio))
+        id_nuevo = cursor.lastrowid
+        if estricto:
+            fecha_guardada, = conn.execute("SELECT fecha FROM transacciones WHERE id = ?", (id_nuevo,)).fetchone()
+            _verificar_inventario(conn, activo, fecha_guardada, id_nuevo)
 
-    conn.commit()
-    conn.close()
-    return True
+    return id_nuevo
 
 # Mantener compatibilidad con nombre anterior
-def registrar_compra(activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio, fecha=None):
+def registrar_compra(activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio, fecha=None, estricto=False,
+                     id_externo=None):
     """Alias para registrar_transaccion (mantiene compatibilidad)."""
-    return registrar_transaccion(activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio, fecha)
+    return registrar_transaccion(activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio, fecha, estricto,
+                                 id_externo)
+
+def importar_transacciones(filas, tamano_lote=TAMANO_LOTE_IMPORTACION, origen=None):
+    """Inserta transacciones en bloque dentro de una única transacción SQLite.
+
+    La importación es idempotente: las filas cuya huella (fecha, activo,
+    operación, cantidad, precio, costo e id externo) ya está en la base se
+    descartan con `ON CONFLICT DO NOTHING`, así que reimportar el mismo archivo
+    no duplica nada. Las de años archivados se buscan en su archivo y también
+    se descartan si ya están ahí. Las filas sin fecha no se comparan.
 
-def consultar_registros(activo=None, operacion=None, fecha_desde=None, fecha_hasta=None):
-    """Consulta registros de transacciones con filtros opcionales.
-    
     Parámetros:
-    - activo: filtrar por nombre de activo (ej: "BTC", "ETH")
-    - operacion: filtrar por tipo de operación ("COMPRA", "VENTA")
-    - fecha_desde: filtrar transacciones desde una fecha (formato ISO: YYYY-MM-DD)
-    - fecha_hasta: filtrar transacciones hasta una fecha (formato ISO: YYYY-MM-DD)
-    
+    - filas: iterable de tuplas (numero_fila, dict) como las que genera
+      `utils.leer_transacciones`. Se consume de forma perezosa, por lotes.
+      Cada fila puede traer el id de la operación en el origen ('id_externo').
+    - tamano_lote: cantidad de filas que se validan e insertan con cada `executemany`
+    - origen: opcional, nombre de la fuente (ej: 'binance'). Se guarda la fecha
+      más reciente importada de ese origen (marca de agua) y en las
+      importaciones siguientes las filas anteriores a ella se descartan sin
+      validarlas ni calcular su huella. Las de la misma fecha se comparan.
+
+    Si una fila no es válida (o cae en un año archivado sin estar en su archivo)
+    se deshace toda la importación (no queda ningún lote a medias confirmado) y se lanza
+    ValueError indicando el número de fila.
+
     Retorna:
-    - DataFrame con los registros que coinciden con los filtros
+    - dict con estructura: {'filas': total_insertadas, 'duplicadas': ya_registradas,
+      'omitidas': anteriores_a_la_marca, 'segundos': duracion, 'filas_por_segundo': ritmo}
     """
-    conn = get_db_connection()
-    
-    query = "SELECT * FROM transacciones WHERE 1=1"
+    if tamano_lote < 1:
+        raise ValueError("El tamaño de lote debe ser mayor que cero")
+
+    inicio = time.perf_counter()
+    filas = iter(filas)
+    total = duplicadas = omitidas = 0
+
+    with transaccion() as conn:
+        cursor = conn.cursor()
+        factores = dict(conn.execute("SELECT activo, factor FROM escalas"))
+        cierre = cierre_archivado(conn)
+        marca = None
+        if origen is not None:
+            fila_marca = conn.execute("SELECT fecha FROM marcas_agua WHERE origen = ?", (origen,)).fetchone()
+            marca = fila_marca[0] if fila_marca else None
+        mas_reciente = marca
+        while True:
+            lote = list(islice(filas, tamano_lote))
+            if not lote:
+                break
+
+            valores = []
+            archivadas = []
+            for numero, fila in lote:
+                try:
+                    if marca is not None:
+                        fecha = normalizar_fecha(fila.get('fecha'))
+                        if fecha is not None and fecha < marca:
+                            omitidas += 1
+                            continue
+                    fecha, activo, operacion, *importes = validar_transaccion(fila)
+                    id_externo = leer_id_externo(fila)
+                    factor = factores.get(activo, FACTOR_POR_DEFECTO)
+                    enteros = _a_enteros(factor, *importes)
+                except ValueError as e:
+                    raise ValueError(f"Fila {numero}: {e}") from None
+                huella = _huella(fecha, activo, operacion, factor, enteros, id_externo)
+                if fecha is not None and (mas_reciente is None or fecha > mas_reciente):
+                    mas_reciente = fecha
+                if _archivada(fecha, cierre):
+                    archivadas.append((numero, fecha, huella))
+                    continue
+                valores.append((fecha, activo, operacion, *enteros, id_externo, huella))
+
+            if archivadas:
+                # Sólo se aceptan si ya están archivadas (reimportar un extracto viejo): se cuentan como duplicadas
+                por_anio = {}
+                for _, fecha, huella in archivadas:
+                    por_anio.setdefault(int(fecha[:4]), []).append(huella)
+                encontradas = huellas_archivadas(por_anio)
+                for numero, fecha, huella in archivadas:
+                    if huella not in encontradas:
+                        try:
+                            _rechazar_archivada(fecha, cierre)
+                        except ValueError as e:
+                            raise ValueError(f"Fila {numero}: {e}") from None
+                duplicadas += len(archivadas)
+
+            cursor.executemany(_SQL_INSERTAR, valores)
+            total += cursor.rowcount
+            duplicadas += len(valores) - cursor.rowcount
+
+        if origen is not None and mas_reciente is not None:
+            conn.execute("""
+                INSERT INTO marcas_agua (origen, fecha, filas, actualizado) VALUES (?, ?, ?, ?)
+                ON CONFLICT (origen) DO UPDATE SET
+                    fecha = excluded.fecha, filas = filas + excluded.filas, actualizado = excluded.actualizado
+            """, (origen, mas_reciente, total, datetime.now().isoformat(sep=' ', timespec='seconds')))
+
+    segundos = time.perf_counter() - inicio
+    return {
+        'filas': total,
+        'duplicadas': duplicadas,
+        'omitidas': omitidas,
+        'segundos': segundos,
+        'filas_por_segundo': total / segundos if segundos > 0 else 0.0
+    }
+
+def importar_archivo(ruta, formato=None, tamano_lote=TAMANO_LOTE_IMPORTACION, origen=None):
+    """Importa un archivo CSV o JSONL de transacciones (ver `importar_transacciones`)."""
+    return importar_transacciones(leer_transacciones(ruta, formato), tamano_lote=tamano_lote, origen=origen)
+
+def listar_marcas_agua():
+    """Retorna las marcas de agua de importación: [{'origen', 'fecha', 'filas', 'actualizado'}] por origen."""
+    cursor = obtener_conexion().execute("SELECT origen, fecha, filas, actualizado FROM marcas_agua ORDER BY origen")
+    return [dict(zip(('origen', 'fecha', 'filas', 'actualizado'), fila)) for fila in cursor]
+
+def buscar_duplicados():
+    """Busca transacciones repetidas (misma huella) registradas antes de la deduplicación.
+
+    Recorre una sola vez el índice único de huellas (`idx_transacciones_huella`,
+    que ya está ordenado por huella) sin leer la tabla: las huellas con más de
+    una ocurrencia son filas idénticas en fecha, activo, operación, cantidad,
+    precio, costo e id externo. Después se revisa cada año archivado junto con
+    las transacciones de ese año que sigan en la base (ver
+    `archivo.duplicados_archivados`); adjunta esos archivos, así que no se puede
+    llamar dentro de una transacción.
+
+    Retorna:
+    - lista de dicts {'ids': [id, ...], 'archivados': [ids que están en un archivo],
+      'fecha', 'activo', 'operacion', 'cantidad', 'precio_unitario', 'costo_total'}
+      ordenada por fecha; el primer id es el original
+    """
+    conn = obtener_conexion()
+    cursor = conn.execute("""
+        SELECT t.huella, v.id, v.fecha, v.activo, v.operacion, v.cantidad, v.precio_unitario, v.costo_total
+        FROM transacciones AS t JOIN v_transacciones AS v ON v.id = t.id
+        WHERE t.huella IN (
+            SELECT huella FROM transacciones WHERE huella IS NOT NULL GROUP BY huella HAVING COUNT(*) > 1
+        )
+        ORDER BY t.huella, t.id
+    """)
+    def agrupar(grupos, huella, id_transaccion, campos, archivada=False):
+        if huella not in grupos:
+            grupos[huella] = {'ids': [], 'archivados': [], **dict(zip(
+                ('fecha', 'activo', 'operacion', 'cantidad', 'precio_unitario', 'costo_total'), campos))}
+        grupos[huella]['ids'].append(id_transaccion)
+        if archivada:
+            grupos[huella]['archivados'].append(id_transaccion)
+
+    grupos = {}
+    for huella, id_transaccion, *campos in cursor:
+        agrupar(grupos, huella, id_transaccion, campos)
+
+    # Una huella de un año archivado agrupa de nuevo todas sus filas: las de la base y las del archivo
+    for anio in [archivo['anio'] for archivo in listar_archivos()]:
+        del_anio = {}
+        for huella, id_transaccion, archivada, *campos in duplicados_archivados(anio):
+            agrupar(del_anio, huella, id_transaccion, campos, archivada)
+        grupos.update(del_anio)
+    return sorted(grupos.values(), key=lambda grupo: (grupo['fecha'], grupo['ids'][0]))
+
+def _construir_filtros(activo=None, operacion=None, fecha_desde=None, fecha_hasta=None, despues_de_id=None):
+    """Arma la cláusula WHERE (y sus parámetros) compartida por consultas y exportaciones.
+
+    Los filtros son igualdades y rangos sobre las columnas tal como se guardan
+    (activo en mayúsculas, fecha ISO), para que SQLite pueda usar los índices
+    (activo, fecha), (operacion, fecha) y (fecha) en lugar de recorrer la tabla.
+    """
+    condiciones = ["1=1"]
     params = []
     
     # Agregar filtros dinámicamente
     if activo:
-        query += " AND LOWER(activo) = LOWER(?)"
-        params.append(activo)
+        condiciones.append("activo = ?")
+        params.append(normalizar_activo(activo))
     
     if operacion:
-        query += " AND operacion = ?"
-        params.append(operacion)
+        condiciones.append("operacion = ?")
+        params.append(operacion.strip().upper())
     
     if fecha_desde:
-        query += " AND DATE(fecha) >= ?"
-        params.append(fecha_desde)
+        condiciones.append("fecha >= ?")
+        params.append(normalizar_fecha(fecha_desde)[:10])
     
     if fecha_hasta:
-        query += " AND DATE(fecha) <= ?"
-        params.append(fecha_hasta)
+        # Hasta el final del día indicado: menor que el inicio del día siguiente
+        condiciones.append("fecha < ?")
+        params.append(dia_siguiente(fecha_hasta))
     
-    query += " ORDER BY fecha DESC"
+    if despues_de_id is not None:
+        condiciones.append("id > ?")
+        params.append(int(despues_de_id))
     
-    df = pd.read_sql_query(query, conn, params=params)
-    conn.close()
-    return df
+    return " AND ".join(condiciones), params
+
+def _direccion(orden):
+    orden = (orden or 'desc').lower()
+    if orden not in ORDENES:
+        raise ValueError(f"Orden no válido: {orden!r} (se espera asc o desc)")
+    return orden.upper()
 
-def actualizar_transaccion(id_transaccion, **kwargs):
+def _consulta_sql(columnas="*", orden='desc', posicion=None, limite=None, **filtros):
+    """Retorna (query, params) de la consulta filtrada, ordenada por (fecha, id).
+    
+    Por defecto va de la más reciente a la más antigua. `posicion` es la clave
+    (fecha, id) de la última fila ya entregada: la consulta empieza justo después
+    (paginación por clave), así que SQLite salta directamente a ese punto del
+    índice en lugar de recorrer y descartar las filas previas como con OFFSET.
+    
+    Si el rango de fechas alcanza años archivados, la consulta se hace sobre la
+    vista que une esos archivos con la base (ver `archivo.origen_consulta`).
+    """
+    where, params = _construir_filtros(**filtros)
+    direccion = _direccion(orden)
+    if posicion is not None:
+        where += f" AND (fecha, id) {'<' if direccion == 'DESC' else '>'} (?, ?)"
+        params.extend(posicion)
+    origen = origen_consulta(filtros.get('fecha_desde'), filtros.get('fecha_hasta'))
+    query = f"SELECT {columnas} FROM {origen} WHERE {where} ORDER BY fecha {direccion}, id {direccion}"
+    if limite is not None:
+        query += " LIMIT ?"
+        params.append(int(limite))
+    return query, params
+
+def _codificar_cursor(orden, fecha, id_transaccion):
+    """Token opaco que identifica la posición de la última fila de una página."""
+    texto = json.dumps([orden.lower(), fecha, id_transaccion], separators=(',', ':'))
+    return base64.urlsafe_b64encode(texto.encode('utf-8')).decode('ascii').rstrip('=')
+
+def _decodificar_cursor(cursor, orden):
+    """Retorna la posición (fecha, id) de un token de `_codificar_cursor`."""
+    try:
+        texto = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        orden_cursor, fecha, id_transaccion = json.loads(texto)
+        if not isinstance(fecha, str) or not isinstance(id_transaccion, int):
+            raise ValueError
+    except (ValueError, TypeError):
+        raise ValueError(f"Cursor no válido: {cursor!r}") from None
+    if orden_cursor != orden.lower():
+        raise ValueError(f"El cursor corresponde al orden {orden_cursor}, no a {orden.lower()}")
+    return fecha, id_transaccion
+
+def _proyeccion(columnas):
+    """Valida las columnas pedidas (acepta los alias de importación) y las retorna en una tupla."""
+    if not columnas:
+        return COLUMNAS_TRANSACCION
+    if isinstance(columnas, str):
+        columnas = columnas.split(',')
+    proyeccion = tuple(ALIAS_CAMPOS.get(columna.strip(), columna.strip()) for columna in columnas)
+    invalidas = [columna for columna in proyeccion if columna not in COLUMNAS_TRANSACCION]
+    if invalidas or not proyeccion:
+        raise ValueError(f"Columnas no válidas: {', '.join(invalidas) or '(ninguna)'} "
+                         f"(se espera alguna de: {', '.join(COLUMNAS_TRANSACCION)})")
+    return proyeccion
+
+def consultar_pagina(activo=None, operacion=None, fecha_desde=None, fecha_hasta=None, columnas=None,
+                     orden='desc', limite=TAMANO_PAGINA, cursor=None):
+    """Retorna una página de transacciones filtradas, sin pandas.
+    
+    Parámetros:
+    - activo, operacion, fecha_desde, fecha_hasta: filtros como en `consultar_registros`
+    - columnas: columnas a devolver (lista o texto separado por comas); por defecto todas
+    - orden: 'desc' (más recientes primero) o 'asc', siempre por fecha e id
+    - limite: filas por página
+    - cursor: token de la página anterior (`'cursor'` del resultado) para pedir la siguiente
+    
+    Pedir la página N cuesta lo mismo que pedir la primera: el cursor guarda la
+    clave (fecha, id) de la última fila y la consulta busca a partir de ella.
+    
+    Retorna:
+    - dict con estructura: {
+        'columnas': nombres de las columnas,
+        'filas': lista de tuplas,
+        'cursor': token para la página siguiente, o None si no hay más filas
+      }
+    """
+    if limite < 1:
+        raise ValueError("El límite debe ser mayor que cero")
+    proyeccion = _proyeccion(columnas)
+    # La clave (fecha, id) se lee siempre, aunque no se haya pedido, para armar el cursor
+    extra = tuple(columna for columna in ('fecha', 'id') if columna not in proyeccion)
+    seleccion = proyeccion + extra
+    posicion = _decodificar_cursor(cursor, orden) if cursor else None
+
+    query, params = _consulta_sql(", ".join(seleccion), orden=orden, posicion=posicion, limite=limite + 1,
+                                  activo=activo, operacion=operacion, fecha_desde=fecha_desde, fecha_hasta=fecha_hasta)
+    with fase('sql'):
+        filas = obtener_conexion().execute(query, params).fetchall()
+    
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        ultima = filas[-1]
+        siguiente = _codificar_cursor(orden, ultima[seleccion.index('fecha')], ultima[seleccion.index('id')])
+    if extra:
+        filas = [fila[:len(proyeccion)] for fila in filas]
+    return {'columnas': list(proyeccion), 'filas': filas, 'cursor': siguiente}
+
+def iterar_paginas(activo=None, operacion=None, fecha_desde=None, fecha_hasta=None, columnas=None,
+                   orden='desc', tamano_pagina=TAMANO_PAGINA, cursor=None):
+    """Genera las páginas de `consultar_pagina` una tras otra, siguiendo los cursores.
+    
+    Cada página se pide recién cuando se consume la anterior, por lo que el
+    llamador puede mostrar resultados mientras el resto aún no se leyó.
+    """
+    while True:
+        pagina = consultar_pagina(activo=activo, operacion=operacion, fecha_desde=fecha_desde,
+                                  fecha_hasta=fecha_hasta, columnas=columnas, orden=orden,
+                                  limite=tamano_pagina, cursor=cursor)
+        yield pagina
+        cursor = pagina['cursor']
+        if cursor is None:
+            break
+
+def consultar_registros(activo=None, operacion=None, fecha_desde=None, fecha_hasta=None, despues_de_id=None,
+                        columnas=None, orden='desc', limite=None, cursor=None):
+    """Consulta registros de transacciones con filtros opcionales.
+    
+    Parámetros:
+    - activo: filtrar por nombre de activo (ej: "BTC", "ETH")
+    - operacion: filtrar por tipo de operación ("COMPRA", "VENTA")
+    - fecha_desde: filtrar transacciones desde una fecha (formato ISO: YYYY-MM-DD)
+    - fecha_hasta: filtrar transacciones hasta una fecha (formato ISO: YYYY-MM-DD)
+    - despues_de_id: sólo transacciones con id mayor a este valor (para procesos incrementales)
+    - columnas: columnas a incluir (por defecto todas)
+    - orden: 'desc' (por defecto, más recientes primero) o 'asc'
+    - limite, cursor: si se indica alguno, retorna sólo una página (ver `consultar_pagina`)
+      y deja el cursor de la página siguiente en `df.attrs['cursor']`
+    
+    Si la caché columnar está habilitada (ver `columnar.habilitar`), las consultas
+    sin paginar se resuelven sobre sus arrays en lugar de leer las filas de SQLite.
+    Si la caché en memoria está habilitada (ver `memoria.habilitar`), una consulta
+    repetida con los mismos filtros retorna una copia del resultado anterior
+    mientras los datos no cambien.
+    
+    Retorna:
+    - DataFrame con los registros que coinciden con los filtros
+    """
+    if not memoria.habilitada():
+        return _consultar_registros(activo, operacion, fecha_desde, fecha_hasta, despues_de_id, columnas, orden,
+                                    limite, cursor)
+    # La clave usa los filtros como los recibe SQLite: 'btc' y 'BTC' son la misma consulta
+    clave = ('consultar_registros', normalizar_activo(activo) if activo else None,
+             operacion.strip().upper() if operacion else None,
+             normalizar_fecha(fecha_desde)[:10] if fecha_desde else None,
+             dia_siguiente(fecha_hasta) if fecha_hasta else None,
+             None if despues_de_id is None else int(despues_de_id),
+             _proyeccion(columnas) if columnas else None, _direccion(orden), limite, cursor, columnar.habilitada())
+    return memoria.resolver(clave, lambda: _consultar_registros(activo, operacion, fecha_desde, fecha_hasta,
+                                                                 despues_de_id, columnas, orden, limite, cursor))
+
+def _consultar_registros(activo, operacion, fecha_desde, fecha_hasta, despues_de_id, columnas, orden, limite, cursor):
+    instantanea = None
+    # La caché sólo cubre la base: un rango que alcanza años archivados se consulta en SQLite
+    if limite is None and cursor is None and columnar.habilitada() and not anios_en_rango(fecha_desde, fecha_hasta):
+        instantanea = columnar.obtener_instantanea()
+    
+    if instantanea is not None:
+        with fase('cache'):
+            datos = instantanea.registros(columnas=_proyeccion(columnas), orden=_direccion(orden).lower(),
+                                          activo=activo, operacion=operacion, fecha_desde=fecha_desde,
+                                          fecha_hasta=fecha_hasta, despues_de_id=despues_de_id)
+    elif limite is not None or cursor is not None:
+        if despues_de_id is not None:
+            raise ValueError("despues_de_id no se puede combinar con la paginación")
+        pagina = consultar_pagina(activo=activo, operacion=operacion, fecha_desde=fecha_desde,
+                                  fecha_hasta=fecha_hasta, columnas=columnas, orden=orden,
+                                  limite=TAMANO_PAGINA if limite is None else limite, cursor=cursor)
+        columnas, filas = pagina['columnas'], pagina['filas']
+    else:
+        query, params = _consulta_sql("*" if columnas is None else ", ".join(_proyeccion(columnas)), orden=orden,
+                                      activo=activo, operacion=operacion, fecha_desde=fecha_desde,
+                                      fecha_hasta=fecha_hasta, despues_de_id=despues_de_id)
+        with fase('sql'):
+            resultado = obtener_conexion().execute(query, params)
+            columnas = [descripcion[0] for descripcion in resultado.description]
+            filas = resultado.fetchall()
+    
+    with fase('importar_pandas'):
+        # pandas se importa sólo aquí: los comandos de escritura y el resumen no lo necesitan
+        import pandas as pd
+    
+    with fase('pandas'):
+        if instantanea is not None:
+            return pd.DataFrame(datos)
+        df = pd.DataFrame.from_records(filas, columns=columnas)
+        if limite is not None or cursor is not None:
+            df.attrs['cursor'] = pagina['cursor']
+        return df
+
+def iterar_registros(activo=None, operacion=None, fecha_desde=None, fecha_hasta=None, tamano_bloque=TAMANO_BLOQUE_EXPORTACION):
+    """Recorre las transacciones filtradas en bloques, directamente desde el cursor.
+
+    Acepta los mismos filtros que `consultar_registros`, pero nunca materializa el
+    resultado completo: genera listas de como máximo `tamano_bloque` tuplas con
+    las columnas de COLUMNAS_TRANSACCION, en el mismo orden que la consulta.
+    """
+    if tamano_bloque < 1:
+        raise ValueError("El tamaño de bloque debe ser mayor que cero")
+
+    query, params = _consulta_sql(", ".join(COLUMNAS_TRANSACCION), activo=activo, operacion=operacion,
+                                  fecha_desde=fecha_desde, fecha_hasta=fecha_hasta)
+
+    cursor = obtener_conexion().execute(query, params)
+    try:
+        while True:
+            bloque = cursor.fetchmany(tamano_bloque)
+            if not bloque:
+                break
+            yield bloque
+    finally:
+        cursor.close()
+
+def actualizar_transaccion(id_transaccion, estricto=False, **kwargs):
     """Actualiza uno o más campos de una transacción existente.
     
     Parámetros:
     - id_transaccion: ID del registro a actualizar
-    - **kwargs: pares campo=valor a actualizar (activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio, fecha)
+    - estricto: si es True, lanza ErrorInventario (y no guarda nada) cuando el cambio
+      dejaría el inventario de algún activo afectado en negativo en algún momento.
+    - **kwargs: pares campo=valor a actualizar (activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio,
+      fecha, id_externo)
+
+    La huella de contenido se recalcula; si el cambio deja la transacción igual
+    a otra ya registrada se lanza TransaccionDuplicada y no se guarda nada.
     
     Retorna:
     - True si se actualizó exitosamente
@@ -103,83 +656,344 @@ def actualizar_transaccion(id_transaccion, **kwargs):
         return False
     
     # Validar que los campos sean válidos
-    campos_validos = {'activo', 'operacion', 'cantidad', 'precio_unitario', 'costo_total', 'dolar_cambio', 'fecha'}
+    campos_validos = {'activo', 'operacion', 'cantidad', 'precio_unitario', 'costo_total', 'dolar_cambio', 'fecha',
+                      'id_externo'}
     campos = set(kwargs.keys())
     
     campos_invalidos = campos - campos_validos
     if campos_invalidos:
         raise ValueError(f"Campos no válidos: {campos_invalidos}")
     
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    # Guardar activo y fecha en su forma canónica (ver db._migracion_2_indices)
+    if 'activo' in kwargs:
+        kwargs['activo'] = normalizar_activo(kwargs['activo'])
+    if 'fecha' in kwargs:
+        kwargs['fecha'] = normalizar_fecha(kwargs['fecha'])
+        if kwargs['fecha'] is None:
+            raise ValueError("Fecha no válida: no puede quedar vacía")
+    if 'id_externo' in kwargs:
+        kwargs['id_externo'] = leer_id_externo(kwargs)
+    for campo in CAMPOS_MONTOS:
+        if campo in kwargs:
+            kwargs[campo] = a_unidades(kwargs[campo], FACTOR_MONTOS)
     
-    # Construir dinámicamente la sentencia UPDATE
-    set_clause = ", ".join([f"{campo} = ?" for campo in kwargs.keys()])
-    values = list(kwargs.values())
-    values.append(id_transaccion)
-    
-    query = f"UPDATE transacciones SET {set_clause} WHERE id = ?"
-    cursor.execute(query, values)
-    actualizado = cursor.rowcount > 0
+    with transaccion() as conn:
+        anterior = conn.execute("""
+            SELECT activo, fecha, cantidad, operacion, precio_unitario, costo_total, id_externo, huella
+            FROM transacciones WHERE id = ?
+        """, (int(id_transaccion),)).fetchone()
+        if anterior is None:
+            return False
+        cierre = cierre_archivado(conn)
+        _rechazar_archivada(anterior[1], cierre)
+        _rechazar_archivada(kwargs.get('fecha'), cierre)
+        
+        # La cantidad se guarda en la escala del activo que queda en la fila
+        factor_anterior = _factor_activo(conn, anterior[0])
+        factor = _factor_activo(conn, kwargs['activo']) if 'activo' in kwargs else factor_anterior
+        if 'cantidad' in kwargs:
+            kwargs['cantidad'] = a_unidades(kwargs['cantidad'], factor)
+        elif factor != factor_anterior:
+            # Pasa a un activo con otra escala: se reexpresa la misma cantidad
+            kwargs['cantidad'] = (anterior[2] * factor + factor_anterior // 2) // factor_anterior
+
+        # La huella sigue a la fila; las que no tenían (alta sin fecha) la obtienen al recibir una fecha
+        huella = None
+        if anterior[7] is not None or 'fecha' in kwargs:
+            fila = dict(zip(('activo', 'fecha', 'cantidad', 'operacion', 'precio_unitario', 'costo_total', 'id_externo'),
+                            anterior[:7]), **kwargs)
+            if fila['operacion'] != OPERACION_APERTURA:
+                huella = huella_transaccion(fila['fecha'], fila['activo'], fila['operacion'], fila['cantidad'], factor,
+                                            fila['precio_unitario'], fila['costo_total'], fila['id_externo'])
+        if huella != anterior[7]:
+            kwargs['huella'] = huella
+            kwargs['ocurrencia'] = 1
+        
+        # Construir dinámicamente la sentencia UPDATE
+        set_clause = ", ".join([f"{campo} = ?" for campo in kwargs.keys()])
+        values = list(kwargs.values())
+        values.append(int(id_transaccion))
+        
+        query = f"UPDATE transacciones SET {set_clause} WHERE id = ?"
+        try:
+            actualizado = conn.execute(query, values).rowcount > 0
+        except sqlite3.IntegrityError:
+            id_existente, = conn.execute("SELECT id FROM transacciones WHERE huella = ? AND ocurrencia = 1",
+                                         (huella,)).fetchone()
+            raise TransaccionDuplicada(id_existente) from None
+        
+        if estricto and actualizado:
+            nuevo = conn.execute("SELECT activo, fecha FROM transacciones WHERE id = ?", (int(id_transaccion),)).fetchone()
+            # Basta revisar cada activo afectado desde la posición más temprana que ocupó la fila
+            for activo in {anterior[0], nuevo[0]}:
+                fecha_inicio = min(fecha for act, fecha in (anterior[:2], nuevo) if act == activo)
+                _verificar_inventario(conn, activo, fecha_inicio, int(id_transaccion))
     
-    conn.commit()
-    conn.close()
     return actualizado
 
 def borrar_transaccion(id_transaccion):
-    """Borra una transacción por ID."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("DELETE FROM transacciones WHERE id = ?", (id_transaccion,))
-    eliminado = cursor.rowcount > 0
+    """Borra una transacción por ID.
+
+    Los saldos de apertura de años archivados no se borran (ValueError). Sí una
+    transacción atrasada que haya quedado en la base en un año archivado: no
+    forma parte del archivo ni del saldo de apertura (ver `duplicados`).
+    """
+    with transaccion() as conn:
+        fila = conn.execute("SELECT fecha, operacion FROM transacciones WHERE id = ?",
+                            (int(id_transaccion),)).fetchone()
+        if fila is not None and fila[1] == OPERACION_APERTURA:
+            _rechazar_archivada(fila[0], cierre_archivado(conn))
+        eliminado = conn.execute("DELETE FROM transacciones WHERE id = ?", (int(id_transaccion),)).rowcount > 0
     
-    conn.commit()
-    conn.close()
     return eliminado
 
-def calcular_saldos():
-    """Calcula el saldo de cada activo (COMPRA - VENTA) y detecta inventarios negativos.
-    
+def _filtros_masivos(filtros):
+    """Arma el WHERE de un cambio masivo: los filtros de `consulta`, al menos uno, y nunca los saldos de apertura."""
+    desconocidos = set(filtros) - {'activo', 'operacion', 'fecha_desde', 'fecha_hasta'}
+    if desconocidos:
+        raise ValueError(f"Filtros no válidos: {', '.join(sorted(desconocidos))}")
+    if not any(filtros.values()):
+        raise ValueError("Indica al menos un filtro (activo, operación o rango de fechas)")
+    condiciones, params = _construir_filtros(**filtros)
+    return f"{condiciones} AND operacion <> '{OPERACION_APERTURA}'", params
+
+def _describir_cambio(filtros, campos=None):
+    descripcion = ", ".join(f"{clave}={valor}" for clave, valor in filtros.items() if valor)
+    if campos:
+        descripcion += " -> " + ", ".join(f"{clave}={valor}" for clave, valor in campos.items())
+    return descripcion
+
+def _afectadas_por_activo(conn, condiciones, params):
+    return dict(conn.execute(f"""
+        SELECT activo, COUNT(*) FROM transacciones WHERE {condiciones} GROUP BY activo ORDER BY activo
+    """, params))
+
+def _abrir_cambio(conn, tipo, descripcion, condiciones, params):
+    """Registra un cambio masivo en el diario con la imagen previa de las filas que toca; retorna su id."""
+    cambio = conn.execute("""
+        INSERT INTO cambios_masivos (fecha, tipo, descripcion, filas, escrituras_antes, escrituras) VALUES (?, ?, ?, 0, ?, 0)
+    """, (datetime.now().isoformat(sep=' ', timespec='seconds'), tipo, descripcion, contador_escrituras(conn))).lastrowid
+    columnas = ', '.join(_COLUMNAS_IMAGEN)
+    conn.execute(f"""
+        INSERT INTO imagenes_previas (cambio, {columnas}, factor)
+        SELECT ?, {columnas}, (SELECT factor FROM escalas AS e WHERE e.activo = transacciones.activo)
+        FROM transacciones WHERE {condiciones}
+    """, (cambio, *params))
+    return cambio
+
+def _cerrar_cambio(conn, cambio, filas):
+    """Anota las filas y el contador de escrituras al terminar el cambio, y descarta los cambios más viejos."""
+    conn.execute("UPDATE cambios_masivos SET filas = ?, escrituras = ? WHERE id = ?",
+                 (filas, contador_escrituras(conn), cambio))
+    limite = "(SELECT id FROM cambios_masivos ORDER BY id DESC LIMIT 1 OFFSET ?)"
+    conn.execute(f"DELETE FROM imagenes_previas WHERE cambio <= {limite}", (CAMBIOS_CONSERVADOS,))
+    conn.execute(f"DELETE FROM cambios_masivos WHERE id <= {limite}", (CAMBIOS_CONSERVADOS,))
+
+def actualizar_transacciones(filtros, simular=False, estricto=False, **kwargs):
+    """Actualiza de una vez todas las transacciones que cumplen los filtros.
+
+    Es una sola sentencia UPDATE dentro de una transacción (los triggers
+    ajustan `saldos` y los cortes), y la imagen previa de cada fila queda en
+    el diario para `deshacer_cambio`. Al cambiar el activo, la cantidad se
+    reexpresa en la escala del activo nuevo; la huella de cada fila se
+    recalcula en SQL. Los saldos de apertura nunca se modifican, y las
+    transacciones de años archivados no se alcanzan (ni se puede mover una
+    fecha a esos años).
+
+    Parámetros:
+    - filtros: dict con los filtros de `consultar_registros` (activo, operacion,
+      fecha_desde, fecha_hasta); hace falta al menos uno
+    - simular: si es True no cambia nada y sólo cuenta las filas afectadas
+    - estricto: como en `actualizar_transaccion`
+    - **kwargs: campos a cambiar (CAMPOS_MASIVOS)
+
     Retorna:
-    - dict con estructura: {
-        'saldos': {activo: cantidad_neta},
-        'alertas': [lista de alertas sobre saldos negativos]
-      }
+    - dict {'filas': afectadas, 'por_activo': {activo: filas}, 'cambio': id en el diario
+      (None si se simuló o no hubo filas)}
     """
-    conn = get_db_connection()
-    
-    # Consultar todas las transacciones agrupadas por activo y operación
-    query = """
-        SELECT activo, operacion, SUM(cantidad) as total
-        FROM transacciones
-        GROUP BY activo, operacion
-        ORDER BY activo
+    if not kwargs:
+        raise ValueError("No se indicaron campos para actualizar")
+    invalidos = set(kwargs) - set(CAMPOS_MASIVOS)
+    if invalidos:
+        raise ValueError(f"Campos no válidos en un cambio masivo: {', '.join(sorted(invalidos))} "
+                         f"(la cantidad y el id externo se cambian por id)")
+    condiciones, params = _filtros_masivos(filtros)
+
+    descripcion = _describir_cambio(filtros, kwargs)
+    if 'activo' in kwargs:
+        kwargs['activo'] = normalizar_activo(kwargs['activo'])
+    if 'operacion' in kwargs:
+        kwargs['operacion'] = str(kwargs['operacion']).strip().upper()
+    if 'fecha' in kwargs:
+        kwargs['fecha'] = normalizar_fecha(kwargs['fecha'])
+        if kwargs['fecha'] is None:
+            raise ValueError("Fecha no válida: no puede quedar vacía")
+    for campo in CAMPOS_MONTOS:
+        if campo in kwargs:
+            kwargs[campo] = a_unidades(kwargs[campo], FACTOR_MONTOS)
+
+    if simular:
+        por_activo = _afectadas_por_activo(obtener_conexion(), condiciones, params)
+        return {'filas': sum(por_activo.values()), 'por_activo': por_activo, 'cambio': None}
+
+    with transaccion() as conn:
+        _rechazar_archivada(kwargs.get('fecha'), cierre_archivado(conn))
+        por_activo = _afectadas_por_activo(conn, condiciones, params)
+        if not por_activo:
+            return {'filas': 0, 'por_activo': {}, 'cambio': None}
+        cambio = _abrir_cambio(conn, 'ACTUALIZAR', descripcion, condiciones, params)
+
+        # En el SET las columnas valen lo de antes del cambio: cada valor nuevo se pasa explícito
+        def valor(campo):
+            return ("?", [kwargs[campo]]) if campo in kwargs else (campo, [])
+
+        asignaciones = [(f"{campo} = ?", [kwargs[campo]]) for campo in kwargs]
+        factor_anterior = "(SELECT factor FROM escalas AS e WHERE e.activo = transacciones.activo)"
+        cantidad, factor = ("cantidad", []), (factor_anterior, [])
+        if 'activo' in kwargs:
+            # Como en `actualizar_transaccion`: la misma cantidad en la escala del activo nuevo
+            nuevo = _factor_activo(conn, kwargs['activo'])
+            cantidad = (f"CASE WHEN {factor_anterior} = {nuevo} THEN cantidad "
+                        f"ELSE (cantidad * {nuevo} + {factor_anterior} / 2) / {factor_anterior} END", [])
+            factor = (str(nuevo), [])
+            asignaciones.append((f"cantidad = {cantidad[0]}", []))
+        if set(kwargs) - {'dolar_cambio'}:
+            argumentos = [valor('fecha'), valor('activo'), valor('operacion'), cantidad, factor,
+                          valor('precio_unitario'), valor('costo_total'), ("id_externo", [])]
+            huella = f"huella_transaccion({', '.join(expresion for expresion, _ in argumentos)})"
+            if 'fecha' not in kwargs:
+                huella = f"CASE WHEN huella IS NULL THEN NULL ELSE {huella} END"
+            asignaciones.append((f"huella = {huella}", [v for _, valores in argumentos for v in valores]))
+
+        try:
+            filas = conn.execute(f"""
+                UPDATE transacciones SET {', '.join(expresion for expresion, _ in asignaciones)}
+                WHERE id IN (SELECT id FROM imagenes_previas WHERE cambio = ?)
+            """, [v for _, valores in asignaciones for v in valores] + [cambio]).rowcount
+        except sqlite3.IntegrityError:
+            raise ValueError("El cambio dejaría transacciones iguales a otras ya registradas (ver duplicados)") from None
+
+        if estricto:
+            inicio, = conn.execute("SELECT MIN(fecha) FROM imagenes_previas WHERE cambio = ?", (cambio,)).fetchone()
+            inicio = min(inicio, kwargs.get('fecha', inicio))
+            for activo in sorted(set(por_activo) | {kwargs.get('activo')} - {None}):
+                _verificar_inventario(conn, activo, inicio, 0)
+
+        _cerrar_cambio(conn, cambio, filas)
+
+    return {'filas': filas, 'por_activo': por_activo, 'cambio': cambio}
+
+def borrar_transacciones(activo=None, operacion=None, fecha_desde=None, fecha_hasta=None, simular=False):
+    """Borra de una vez todas las transacciones que cumplen los filtros (al menos uno).
+
+    Es una sola sentencia DELETE dentro de una transacción; las filas borradas
+    quedan en el diario para `deshacer_cambio`. Los saldos de apertura nunca se borran.
+
+    Retorna:
+    - dict como `actualizar_transacciones`
     """
-    
-    df = pd.read_sql_query(query, conn)
-    conn.close()
-    
-    # Calcular saldos netos
+    filtros = {'activo': activo, 'operacion': operacion, 'fecha_desde': fecha_desde, 'fecha_hasta': fecha_hasta}
+    condiciones, params = _filtros_masivos(filtros)
+    if simular:
+        por_activo = _afectadas_por_activo(obtener_conexion(), condiciones, params)
+        return {'filas': sum(por_activo.values()), 'por_activo': por_activo, 'cambio': None}
+
+    with transaccion() as conn:
+        por_activo = _afectadas_por_activo(conn, condiciones, params)
+        if not por_activo:
+            return {'filas': 0, 'por_activo': {}, 'cambio': None}
+        cambio = _abrir_cambio(conn, 'BORRAR', _describir_cambio(filtros), condiciones, params)
+        filas = conn.execute("DELETE FROM transacciones WHERE id IN (SELECT id FROM imagenes_previas WHERE cambio = ?)",
+                             (cambio,)).rowcount
+        _cerrar_cambio(conn, cambio, filas)
+
+    return {'filas': filas, 'por_activo': por_activo, 'cambio': cambio}
+
+def listar_cambios():
+    """Retorna el diario de cambios masivos, del más reciente al más viejo.
+
+    Cada elemento: {'id', 'fecha', 'tipo', 'descripcion', 'filas', 'deshecho'}.
+    """
+    cursor = obtener_conexion().execute("""
+        SELECT id, fecha, tipo, descripcion, filas, deshecho FROM cambios_masivos ORDER BY id DESC
+    """)
+    return [dict(zip(('id', 'fecha', 'tipo', 'descripcion', 'filas', 'deshecho'), fila)) for fila in cursor]
+
+def deshacer_cambio(forzar=False):
+    """Deshace el último cambio masivo no deshecho, restaurando las filas desde el diario.
+
+    Las filas actualizadas vuelven a sus valores anteriores y las borradas se
+    vuelven a insertar con su id, todo en una transacción. Llamada varias veces,
+    deshace los cambios en orden inverso. Si hubo otras escrituras después del
+    cambio se lanza ValueError, salvo con `forzar`:
+    entonces las filas que esas escrituras tocaron se pisan con la imagen previa
+    (y las que se borraron después de una actualización no se restauran).
+
+    Retorna:
+    - dict {'cambio', 'tipo', 'descripcion', 'filas': restauradas, 'esperadas': filas del cambio}
+    """
+    with transaccion() as conn:
+        fila = conn.execute("""
+            SELECT id, tipo, descripcion, filas, escrituras_antes, escrituras FROM cambios_masivos
+            WHERE deshecho IS NULL ORDER BY id DESC LIMIT 1
+        """).fetchone()
+        if fila is None:
+            raise ValueError("No hay cambios masivos para deshacer")
+        cambio, tipo, descripcion, esperadas, escrituras_antes, escrituras = fila
+        posteriores = contador_escrituras(conn) - escrituras
+        if posteriores and not forzar:
+            raise ValueError(f"Hubo {posteriores} escrituras después del cambio {cambio} ({descripcion}); "
+                             f"deshacerlo pisaría lo que hayan cambiado. Usa forzar para deshacerlo igual")
+        # Si desde entonces se archivó el año de alguna fila, restaurarla la dejaría fuera de su archivo
+        primera, = conn.execute("SELECT MIN(fecha) FROM imagenes_previas WHERE cambio = ?", (cambio,)).fetchone()
+        _rechazar_archivada(primera, cierre_archivado(conn))
+
+        # La cantidad vuelve en la escala actual de su activo, por si cambió desde entonces
+        valores = ["i.cantidad * (SELECT factor FROM escalas AS e WHERE e.activo = i.activo) / i.factor"
+                   if columna == 'cantidad' else f"i.{columna}" for columna in _COLUMNAS_IMAGEN]
+        try:
+            if tipo == 'BORRAR':
+                filas = conn.execute(f"""
+                    INSERT INTO transacciones ({', '.join(_COLUMNAS_IMAGEN)})
+                    SELECT {', '.join(valores)} FROM imagenes_previas AS i WHERE i.cambio = ? ORDER BY i.id
+                """, (cambio,)).rowcount
+                # Vuelven ids ya usados: la caché columnar no los toma como altas nuevas y debe reconstruirse
+                conn.execute("UPDATE meta SET valor = valor + 1 WHERE clave = 'modificaciones'")
+            else:
+                filas = conn.execute(f"""
+                    UPDATE transacciones SET ({', '.join(_COLUMNAS_IMAGEN[1:])}) = (
+                        SELECT {', '.join(valores[1:])} FROM imagenes_previas AS i
+                        WHERE i.cambio = ? AND i.id = transacciones.id
+                    )
+                    WHERE id IN (SELECT id FROM imagenes_previas WHERE cambio = ?)
+                """, (cambio, cambio)).rowcount
+        except sqlite3.IntegrityError:
+            raise ValueError(f"No se puede deshacer el cambio {cambio}: alguna fila restaurada repetiría "
+                             f"una transacción registrada después") from None
+        conn.execute("UPDATE cambios_masivos SET deshecho = ? WHERE id = ?",
+                     (datetime.now().isoformat(sep=' ', timespec='seconds'), cambio))
+        if not posteriores:
+            # La base volvió a como estaba antes del cambio: si el anterior fue la última
+            # escritura de entonces, también se puede deshacer sin forzar
+            conn.execute("""
+                UPDATE cambios_masivos SET escrituras = ?
+                WHERE id = (SELECT MAX(id) FROM cambios_masivos WHERE id < ? AND deshecho IS NULL) AND escrituras = ?
+            """, (contador_escrituras(conn), cambio, escrituras_antes))
+
+    return {'cambio': cambio, 'tipo': tipo, 'descripcion': descripcion, 'filas': filas, 'esperadas': esperadas}
+
+def _resumir_saldos(filas):
+    """Arma el resultado de `calcular_saldos` a partir de tuplas (activo, compras, ventas, factor)."""
     saldos = {}
     alertas = []
     
-    # Primero, agrupar por activo
-    for activo in df['activo'].unique():
-        df_activo = df[df['activo'] == activo]
-        
-        compras = df_activo[df_activo['operacion'] == 'COMPRA']['total'].sum()
-        ventas = df_activo[df_activo['operacion'] == 'VENTA']['total'].sum()
-        
-        # Si hay NaN (no hay registros de ese tipo), asumir 0
-        compras = compras if pd.notna(compras) else 0
-        ventas = ventas if pd.notna(ventas) else 0
-        
-        saldo_neto = compras - ventas
+    for activo, compras, ventas, factor in filas:
+        saldo_neto = (compras - ventas) / factor
         saldos[activo] = saldo_neto
         
         # Alertar si el saldo es negativo
         if saldo_neto < 0:
+            compras, ventas = compras / factor, ventas / factor
             alertas.append(
                 f"⚠️ ALERTA: {activo} tiene saldo NEGATIVO: {saldo_neto:.8f}. "
                 f"Compras: {compras:.8f}, Ventas: {ventas:.8f}"
@@ -189,3 +1003,261 @@ def calcular_saldos():
         'saldos': saldos,
         'alertas': alertas
     }
+
+def calcular_saldos(al=None, completar_cortes=True):
+    """Calcula el saldo de cada activo (COMPRA - VENTA) y detecta inventarios negativos.
+    
+    Lee la tabla `saldos`, que los triggers de la base mantienen al día con cada
+    alta, modificación o baja, así que el costo es una fila por activo. Compras y
+    ventas se acumulan en enteros, por lo que un activo vendido por completo
+    queda exactamente en cero (sin residuos de redondeo).
+    
+    Parámetros:
+    - al: opcional, fecha (YYYY-MM-DD) para obtener los saldos al final de ese día.
+      Parte del corte mensual más cercano anterior (ver `actualizar_cortes`) y
+      sólo suma las transacciones posteriores a él.
+    - completar_cortes: si es True y faltan cortes, se calculan antes (es una escritura)
+    
+    Lanza ValueError si `al` es anterior al último día archivado (ver `archivo.archivar`).
+    Con la caché en memoria habilitada, el resultado se reutiliza mientras los datos no cambien.
+    
+    Retorna:
+    - dict con estructura: {
+        'saldos': {activo: cantidad_neta},
+        'alertas': [lista de alertas sobre saldos negativos]
+      }
+    """
+    if not memoria.habilitada():
+        return _resumir_saldos(totales_saldos(al=al, completar_cortes=completar_cortes))
+    if al is not None and completar_cortes and cortes_pendientes():
+        # Completar los cortes es una escritura: se hace antes, fuera del cálculo que se guarda
+        actualizar_cortes()
+    clave = ('calcular_saldos', None if al is None else dia_siguiente(al))
+    return memoria.resolver(clave, lambda: _resumir_saldos(totales_saldos(al=al, completar_cortes=False)))
+
+def totales_saldos(al=None, completar_cortes=True):
+    """Compras y ventas acumuladas de cada activo, en enteros, como las usa `calcular_saldos`.
+    
+    Sirve para combinar saldos de varias bases sin redondeos (ver `consolidado`).
+    Acepta los mismos parámetros que `calcular_saldos`. Con `al` y la caché
+    columnar habilitada, los totales se suman sobre ella (`Instantanea.totales_enteros`).
+    
+    Retorna:
+    - lista de tuplas (activo, compras, ventas, factor), ordenada por activo;
+      compras y ventas están en unidades de 1/factor
+    """
+    if al is not None:
+        limite = dia_siguiente(al)
+        cierre = cierre_archivado()
+        if cierre is not None and limite <= cierre:
+            raise ValueError(f"Los saldos hasta el {cierre} están archivados; sólo se calculan desde esa fecha")
+        # Con la caché columnar se suma sobre sus arrays, sin cortes ni lecturas en SQLite
+        instantanea = columnar.obtener_instantanea() if columnar.habilitada() else None
+        if instantanea is not None:
+            with fase('cache'):
+                return instantanea.totales_enteros(fecha_hasta=al)
+        if completar_cortes and cortes_pendientes():
+            actualizar_cortes()
+        with fase('sql'):
+            return _totales_al(obtener_conexion(), limite)
+    
+    with fase('sql'):
+        return obtener_conexion().execute(f"""
+            SELECT s.activo, s.compras, s.ventas, COALESCE(e.factor, {FACTOR_POR_DEFECTO})
+            FROM saldos AS s LEFT JOIN escalas AS e ON e.activo = s.activo
+            ORDER BY s.activo
+        """).fetchall()
+
+def _mes_siguiente(mes):
+    anio, numero = int(mes[:4]), int(mes[5:7])
+    return f"{anio + numero // 12:04d}-{numero % 12 + 1:02d}"
+
+def _ultimo_mes_cerrado():
+    hoy = date.today()
+    return f"{hoy.year - (hoy.month == 1):04d}-{(hoy.month - 2) % 12 + 1:02d}"
+
+def _totales_al(conn, limite):
+    """Tuplas (activo, compras, ventas, factor) acumuladas hasta antes de `limite` (fecha exclusiva).
+    
+    Por activo, toma el último corte que termina antes de `limite` y suma las
+    transacciones desde el mes siguiente al corte, por el índice (activo, fecha).
+    """
+    activos = conn.execute(f"""
+        SELECT s.activo, COALESCE(e.factor, {FACTOR_POR_DEFECTO}), c.mes, c.compras, c.ventas
+        FROM saldos AS s
+        LEFT JOIN escalas AS e ON e.activo = s.activo
+        LEFT JOIN cortes_saldos AS c ON c.activo = s.activo AND c.mes = (
+            SELECT MAX(mes) FROM cortes_saldos AS m WHERE m.activo = s.activo AND m.mes < ?
+        )
+        ORDER BY s.activo
+    """, (limite[:7],)).fetchall()
+    
+    filas = []
+    for activo, factor, mes, compras, ventas in activos:
+        desde = _mes_siguiente(mes) if mes else ''
+        cantidad, compras_resto, ventas_resto = conn.execute(f"""
+            SELECT COUNT(*), {_TOTALES_SQL} FROM transacciones
+            WHERE activo = ? AND fecha >= ? AND fecha < ?
+        """, (activo, desde, limite)).fetchone()
+        if mes or cantidad:
+            filas.append((activo, (compras or 0) + (compras_resto or 0), (ventas or 0) + (ventas_resto or 0), factor))
+    return filas
+
+def cortes_pendientes(hasta_mes=None):
+    """True si a algún activo le faltan cortes hasta `hasta_mes` (por defecto, el último mes cerrado)."""
+    hasta_mes = hasta_mes or _ultimo_mes_cerrado()
+    fila = obtener_conexion().execute("""
+        SELECT 1 FROM saldos AS s LEFT JOIN cortes_estado AS e ON e.activo = s.activo
+        WHERE e.hasta IS NULL OR e.hasta < ?
+        LIMIT 1
+    """, (hasta_mes,)).fetchone()
+    return fila is not None
+
+def actualizar_cortes(hasta_mes=None):
+    """Calcula los cortes mensuales de saldos acumulados que falten.
+    
+    Para cada activo continúa desde su último corte válido (los triggers borran
+    los cortes afectados por cambios en meses ya cortados), de modo que sólo se
+    recorren las transacciones nuevas o las de los meses invalidados.
+    
+    Parámetros:
+    - hasta_mes: último mes a cortar ('YYYY-MM'); por defecto, el último mes cerrado
+      (el mes en curso aún recibe altas y se suma desde las transacciones)
+    
+    Retorna:
+    - cantidad de cortes creados
+    """
+    hasta_mes = hasta_mes or _ultimo_mes_cerrado()
+    limite = _mes_siguiente(hasta_mes) + "-01"
+    creados = 0
+    
+    with transaccion() as conn:
+        pendientes = conn.execute("""
+            SELECT s.activo, e.hasta FROM saldos AS s LEFT JOIN cortes_estado AS e ON e.activo = s.activo
+            WHERE e.hasta IS NULL OR e.hasta < ?
+        """, (hasta_mes,)).fetchall()
+        for activo, hasta in pendientes:
+            mes, compras, ventas = conn.execute("""
+                SELECT mes, compras, ventas FROM cortes_saldos
+                WHERE activo = ? ORDER BY mes DESC LIMIT 1
+            """, (activo,)).fetchone() or (None, 0, 0)
+            
+            cortes = []
+            for mes_corte, compras_mes, ventas_mes in conn.execute(f"""
+                SELECT substr(fecha, 1, 7) AS mes, {_TOTALES_SQL} FROM transacciones
+                WHERE activo = ? AND fecha >= ? AND fecha < ?
+                GROUP BY mes ORDER BY mes
+            """, (activo, _mes_siguiente(mes) if mes else '', limite)):
+                compras += compras_mes
+                ventas += ventas_mes
+                cortes.append((activo, mes_corte, compras, ventas))
+            
+            conn.executemany("INSERT INTO cortes_saldos (activo, mes, compras, ventas) VALUES (?, ?, ?, ?)", cortes)
+            conn.execute("INSERT OR REPLACE INTO cortes_estado (activo, hasta) VALUES (?, ?)", (activo, hasta_mes))
+            creados += len(cortes)
+    
+    return creados
+
+def validar_inventario(activo=None, tolerancia=TOLERANCIA_INVENTARIO):
+    """Recorre cada activo en orden cronológico y detecta la primera sobreventa.
+    
+    A diferencia de `calcular_saldos`, que sólo mira el saldo final, detecta
+    también ventas que dejaron el inventario en negativo aunque una compra
+    posterior lo haya compensado. Se resuelve en una sola pasada con una suma
+    acumulada (ventana) sobre el índice (activo, fecha).
+    
+    Parámetros:
+    - activo: opcional, validar sólo ese activo
+    - tolerancia: margen (en unidades del activo) por debajo de cero que no se considera sobreventa
+    
+    Retorna:
+    - lista de dicts {'activo', 'id', 'fecha', 'saldo', 'faltante'} con la primera
+      transacción que dejó cada activo en negativo (vacía si no hay sobreventas)
+    """
+    where, params = ("activo = ?", [normalizar_activo(activo)]) if activo else ("1=1", [])
+    query = f"""
+        SELECT activo, id, fecha, saldo, factor FROM (
+            SELECT activo, id, fecha, saldo, factor,
+                   ROW_NUMBER() OVER (PARTITION BY activo ORDER BY fecha, id) AS orden
+            FROM (
+                SELECT activo, id, fecha,
+                       SUM({_DELTA_SQL}) OVER (PARTITION BY activo ORDER BY fecha, id) AS saldo,
+                       (SELECT factor FROM escalas AS e WHERE e.activo = t.activo) AS factor
+                FROM transacciones AS t
+                WHERE {where}
+            )
+            WHERE saldo < -? * factor
+        )
+        WHERE orden = 1
+        ORDER BY activo
+    """
+    filas = obtener_conexion().execute(query, params + [tolerancia]).fetchall()
+    return [
+        {'activo': act, 'id': id_transaccion, 'fecha': fecha, 'saldo': saldo / factor, 'faltante': -saldo / factor}
+        for act, id_transaccion, fecha, saldo, factor in filas
+    ]
+
+def _verificar_inventario(conn, activo, fecha, id_transaccion, tolerancia=TOLERANCIA_INVENTARIO):
+    """Lanza ErrorInventario si el activo queda en negativo desde (fecha, id) en adelante.
+    
+    Sólo recorre el sufijo afectado: el saldo previo a ese punto se obtiene
+    restando el sufijo al saldo total que ya mantiene la tabla `saldos`.
+    """
+    factor = _factor_activo(conn, activo)
+    total = conn.execute("SELECT compras - ventas FROM saldos WHERE activo = ?", (activo,)).fetchone()
+    sufijo = conn.execute(f"""
+        SELECT id, fecha, {_DELTA_SQL}
+        FROM transacciones
+        WHERE activo = ? AND (fecha, id) >= (?, ?)
+        ORDER BY fecha, id
+    """, (activo, fecha, id_transaccion)).fetchall()
+    
+    saldo = (total[0] if total else 0) - sum(delta for _, _, delta in sufijo)
+    for id_fila, fecha_fila, delta in sufijo:
+        saldo += delta
+        if saldo < -tolerancia * factor:
+            raise ErrorInventario({'activo': activo, 'id': id_fila, 'fecha': fecha_fila,
+                                   'saldo': saldo / factor, 'faltante': -saldo / factor})
+
+def recalcular_saldos(tolerancia=TOLERANCIA_INVENTARIO):
+    """Reconstruye la tabla `saldos` desde las transacciones y reporta desvíos.
+    
+    Parámetros:
+    - tolerancia: diferencia máxima (en unidades del activo) que no se considera desvío
+    
+    Retorna:
+    - dict con estructura: {
+        'activos': cantidad de activos recalculados,
+        'diferencias': [{'activo', 'guardado', 'recalculado'}] para los activos
+                       cuyo saldo guardado no coincidía con el recalculado
+      }
+    """
+    with transaccion() as conn:
+        factores = dict(conn.execute("SELECT activo, factor FROM escalas"))
+        guardados = {
+            activo: compras - ventas
+            for activo, compras, ventas in conn.execute("SELECT activo, compras, ventas FROM saldos")
+        }
+        conn.execute("DELETE FROM saldos")
+        conn.execute(SQL_RECALCULAR_SALDOS)
+        recalculados = {
+            activo: compras - ventas
+            for activo, compras, ventas in conn.execute("SELECT activo, compras, ventas FROM saldos")
+        }
+    
+    diferencias = []
+    for activo in sorted(set(guardados) | set(recalculados)):
+        guardado = guardados.get(activo)
+        recalculado = recalculados.get(activo)
+        factor = factores.get(activo, FACTOR_POR_DEFECTO)
+        if guardado is None or recalculado is None or abs(guardado - recalculado) > tolerancia * factor:
+            diferencias.append({
+                'activo': activo,
+                'guardado': None if guardado is None else guardado / factor,
+                'recalculado': None if recalculado is None else recalculado / factor,
+            })
+    
+    return {
+        'activos': len(recalculados),
+        'diferencias': diferencias
+    }
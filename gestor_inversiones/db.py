@@ -1,14 +1,64 @@
+import hashlib
 import sqlite3
 import os
+import re
+import threading
+from contextlib import contextmanager
+from decimal import Decimal
 
-def get_db_connection():
-    data_dir = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data")
-    os.makedirs(data_dir, exist_ok=True)
-    db_path = os.path.join(data_dir, "inversiones.db")
-    conn = sqlite3.connect(db_path)
-    
-    # Crear tabla si no existe
-    # Ensure table exists (idempotent)
+from .perfilado import fase
+
+# Ruta por defecto de la base de datos (se puede cambiar con `configurar` o con la variable de entorno)
+RUTA_DB_POR_DEFECTO = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "inversiones.db")
+VARIABLE_ENTORNO_DB = "GESTOR_INVERSIONES_DB"
+
+# Nombres de portafolio admitidos (sin puntos: no se confunden con los archivos por año ni los respaldos)
+PATRON_PORTAFOLIO = r"[A-Za-z0-9_-]+"
+
+_configuracion = {'ruta': None}
+
+# Rutas cuyo esquema ya se creó/migró en este proceso
+_esquemas_listos = set()
+_lock_esquemas = threading.Lock()
+
+# Conexiones reutilizables: una por hilo y por archivo de base de datos
+_local = threading.local()
+
+# Funciones que se aplican a cada conexión nueva (por ejemplo, instrumentación)
+_ganchos_conexion = []
+
+# Funciones que se llaman después de cada COMMIT de `transaccion()` (por ejemplo, respaldos)
+_ganchos_confirmacion = []
+
+
+def configurar(ruta=None):
+    """Define la ruta de la base de datos para el resto del proceso.
+
+    Si `ruta` es None se vuelve al valor de la variable de entorno
+    GESTOR_INVERSIONES_DB o, en su defecto, a `data/inversiones.db`.
+    """
+    _configuracion['ruta'] = os.path.abspath(ruta) if ruta else None
+
+
+def ruta_db():
+    """Retorna la ruta absoluta de la base de datos configurada."""
+    ruta = _configuracion['ruta'] or os.environ.get(VARIABLE_ENTORNO_DB) or RUTA_DB_POR_DEFECTO
+    return os.path.abspath(ruta)
+
+
+def ruta_portafolio(nombre, directorio=None):
+    """Retorna la ruta del archivo de un portafolio: `<nombre>.db` en el directorio de la base configurada.
+
+    Cada portafolio (cuenta, cliente) es una base independiente. El nombre sólo
+    admite letras, números, '-' y '_'; lanza ValueError si no es válido.
+    """
+    if not re.fullmatch(PATRON_PORTAFOLIO, nombre or ''):
+        raise ValueError(f"Nombre de portafolio no válido: {nombre!r} (sólo letras, números, '-' y '_')")
+    return os.path.join(directorio or os.path.dirname(ruta_db()), f"{nombre}.db")
+
+
+def _migracion_1_esquema_base(conn):
+    """Crea la tabla de transacciones y agrega 'operacion' a bases antiguas."""
     conn.execute("""
         CREATE TABLE IF NOT EXISTS transacciones (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -22,20 +72,625 @@ def get_db_connection():
         )
     """)
 
-    # Migration / safety: make sure 'operacion' column exists and has a sensible default
-    # Older DBs might not have 'operacion' (or may have different column names). We'll
-    # detect whether the column is present and, if missing, add it with a default value
-    # so the rest of the code (which expects COMPRA/VENTA) doesn't crash.
-    cur = conn.execute("PRAGMA table_info(transacciones);")
-    cols = [row[1] for row in cur.fetchall()]
+    # Older DBs might not have 'operacion'. Add it with default 'COMPRA' so the rest
+    # of the code (which expects COMPRA/VENTA) doesn't crash; ALTER TABLE fills the
+    # value on existing rows.
+    cols = [row[1] for row in conn.execute("PRAGMA table_info(transacciones);")]
     if 'operacion' not in cols:
-        # Add column with default 'COMPRA' for compatibility (ALTER TABLE adds the value
-        # to existing rows). We avoid adding a CHECK constraint here to keep ALTER simple.
+        conn.execute("ALTER TABLE transacciones ADD COLUMN operacion TEXT DEFAULT 'COMPRA';")
+
+
+def _crear_indices(conn):
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transacciones_activo_fecha ON transacciones (activo, fecha)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transacciones_operacion_fecha ON transacciones (operacion, fecha)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_transacciones_fecha ON transacciones (fecha)")
+
+
+def _migracion_2_indices(conn):
+    """Normaliza activo/fecha y crea los índices usados por los filtros de consulta.
+
+    Los activos se guardan en mayúsculas y las fechas como texto ISO con espacio
+    como separador ('YYYY-MM-DD HH:MM:SS'), de modo que se comparan como strings
+    y los filtros pueden ser rangos sobre columnas indexadas.
+    """
+    conn.execute("UPDATE transacciones SET activo = UPPER(TRIM(activo)) WHERE activo <> UPPER(TRIM(activo))")
+    conn.execute("UPDATE transacciones SET operacion = UPPER(TRIM(operacion)) WHERE operacion <> UPPER(TRIM(operacion))")
+    conn.execute("UPDATE transacciones SET fecha = REPLACE(TRIM(fecha), 'T', ' ') WHERE fecha LIKE '%T%' OR fecha <> TRIM(fecha)")
+    _crear_indices(conn)
+
+
+# Aporte de una fila de transacciones a las columnas compras/ventas de `saldos`.
+# El saldo de apertura que deja `archivar` entra como una compra; las demás
+# operaciones que no son COMPRA ni VENTA no mueven el saldo
+_COMPRA = "CASE WHEN {t}.operacion IN ('COMPRA', 'APERTURA') THEN {t}.cantidad ELSE 0 END"
+_VENTA = "CASE WHEN {t}.operacion = 'VENTA' THEN {t}.cantidad ELSE 0 END"
+
+
+# Recalcula `saldos` desde cero a partir de las transacciones
+SQL_RECALCULAR_SALDOS = """
+    INSERT INTO saldos (activo, compras, ventas, transacciones)
+    SELECT activo, SUM({compra}), SUM({venta}), COUNT(*)
+    FROM transacciones AS t
+    GROUP BY activo
+""".format(compra=_COMPRA.format(t='t'), venta=_VENTA.format(t='t'))
+
+
+def _crear_triggers_saldos(conn):
+    sumar = """
+        INSERT INTO saldos (activo, compras, ventas, transacciones)
+        VALUES (NEW.activo, {compra}, {venta}, 1)
+        ON CONFLICT (activo) DO UPDATE SET
+            compras = compras + excluded.compras,
+            ventas = ventas + excluded.ventas,
+            transacciones = transacciones + 1;
+    """.format(compra=_COMPRA.format(t='NEW'), venta=_VENTA.format(t='NEW'))
+    restar = """
+        UPDATE saldos SET
+            compras = compras - {compra},
+            ventas = ventas - {venta},
+            transacciones = transacciones - 1
+        WHERE activo = OLD.activo;
+        DELETE FROM saldos WHERE activo = OLD.activo AND transacciones <= 0;
+    """.format(compra=_COMPRA.format(t='OLD'), venta=_VENTA.format(t='OLD'))
+
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_saldos_insert AFTER INSERT ON transacciones BEGIN {sumar} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_saldos_delete AFTER DELETE ON transacciones BEGIN {restar} END")
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_saldos_update
+        AFTER UPDATE OF activo, operacion, cantidad ON transacciones
+        BEGIN {restar} {sumar} END
+    """)
+
+
+def _migracion_3_saldos(conn):
+    """Crea la tabla `saldos` (una fila por activo) y los triggers que la mantienen.
+
+    Cada INSERT/UPDATE/DELETE sobre `transacciones` ajusta sólo la fila del activo
+    afectado, por lo que el resumen no necesita recorrer las transacciones.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS saldos (
+            activo TEXT PRIMARY KEY,
+            compras REAL NOT NULL DEFAULT 0,
+            ventas REAL NOT NULL DEFAULT 0,
+            transacciones INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    _crear_triggers_saldos(conn)
+
+    conn.execute("DELETE FROM saldos")
+    conn.execute(SQL_RECALCULAR_SALDOS)
+
+
+def _migracion_4_contador_modificaciones(conn):
+    """Crea la tabla `meta` con un contador de modificaciones de transacciones.
+
+    Los triggers lo incrementan con cada UPDATE o DELETE (no con los INSERT:
+    las altas se detectan por el id máximo, que sólo crece). Así, quien guarde
+    datos derivados fuera de la base, como la caché columnar, puede saber si
+    sólo se agregaron filas nuevas o si cambió alguna existente, incluso si la
+    escritura la hizo otro proceso.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS meta (
+            clave TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    conn.execute("INSERT OR IGNORE INTO meta (clave, valor) VALUES ('modificaciones', 0)")
+
+    _crear_triggers_meta(conn)
+
+
+def _crear_triggers_meta(conn):
+    incrementar = "UPDATE meta SET valor = valor + 1 WHERE clave = 'modificaciones';"
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_meta_update AFTER UPDATE ON transacciones BEGIN {incrementar} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_meta_delete AFTER DELETE ON transacciones BEGIN {incrementar} END")
+
+
+# Los importes (precio_unitario, costo_total, dolar_cambio) se guardan con 8 decimales fijos
+DECIMALES_MONTOS = 8
+FACTOR_MONTOS = 10 ** DECIMALES_MONTOS
+
+# Decimales con que se guarda la cantidad de un activo nuevo (como el satoshi de BTC)
+DECIMALES_POR_DEFECTO = 8
+FACTOR_POR_DEFECTO = 10 ** DECIMALES_POR_DEFECTO
+
+# Máximo de decimales por activo: con más, un int64 no alcanzaría ni para 10^6 unidades
+MAX_DECIMALES = 12
+
+
+def _migracion_5_enteros(conn):
+    """Pasa los importes de REAL a enteros de 64 bits escalados (punto fijo).
+
+    - `cantidad` se guarda en la unidad mínima de cada activo: 10^-decimales,
+      con los decimales definidos por activo en la tabla `escalas` (8 por defecto;
+      un trigger agrega la escala por defecto al aparecer un activo nuevo).
+    - `precio_unitario`, `costo_total` y `dolar_cambio` se guardan en 10^-8.
+    - `saldos` acumula compras y ventas en enteros, así que los saldos son exactos.
+    - La vista `v_transacciones` expone los valores convertidos a REAL para lectura.
+
+    SQLite no permite cambiar el tipo de una columna: se crea la tabla nueva, se
+    copian las filas (conservando ids y la secuencia AUTOINCREMENT) y se reemplaza.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS escalas (
+            activo TEXT PRIMARY KEY,
+            decimales INTEGER NOT NULL,
+            factor INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO escalas (activo, decimales, factor)
+        SELECT DISTINCT activo, ?, ? FROM transacciones
+    """, (DECIMALES_POR_DEFECTO, FACTOR_POR_DEFECTO))
+
+    secuencia = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transacciones'").fetchone()
+    conn.execute("""
+        CREATE TABLE transacciones_enteros (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            activo TEXT NOT NULL,
+            operacion TEXT,
+            cantidad INTEGER NOT NULL,
+            precio_unitario INTEGER NOT NULL,
+            costo_total INTEGER NOT NULL,
+            dolar_cambio INTEGER NOT NULL
+        )
+    """)
+    conn.execute(f"""
+        INSERT INTO transacciones_enteros
+            (id, fecha, activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio)
+        SELECT t.id, t.fecha, t.activo, t.operacion,
+               CAST(ROUND(t.cantidad * e.factor) AS INTEGER),
+               CAST(ROUND(t.precio_unitario * {FACTOR_MONTOS}) AS INTEGER),
+               CAST(ROUND(t.costo_total * {FACTOR_MONTOS}) AS INTEGER),
+               CAST(ROUND(t.dolar_cambio * {FACTOR_MONTOS}) AS INTEGER)
+        FROM transacciones AS t JOIN escalas AS e ON e.activo = t.activo
+    """)
+    # Al borrar la tabla también se borran sus índices y triggers; se recrean abajo
+    conn.execute("DROP TABLE transacciones")
+    conn.execute("ALTER TABLE transacciones_enteros RENAME TO transacciones")
+    if secuencia:
+        conn.execute("UPDATE sqlite_sequence SET seq = MAX(seq, ?) WHERE name = 'transacciones'", secuencia)
+    _crear_indices(conn)
+
+    conn.execute("DROP TABLE saldos")
+    conn.execute("""
+        CREATE TABLE saldos (
+            activo TEXT PRIMARY KEY,
+            compras INTEGER NOT NULL DEFAULT 0,
+            ventas INTEGER NOT NULL DEFAULT 0,
+            transacciones INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    _crear_triggers_saldos(conn)
+    conn.execute(SQL_RECALCULAR_SALDOS)
+    _crear_triggers_meta(conn)
+
+    escala_por_defecto = f"""
+        INSERT OR IGNORE INTO escalas (activo, decimales, factor)
+        VALUES (NEW.activo, {DECIMALES_POR_DEFECTO}, {FACTOR_POR_DEFECTO});
+    """
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_escalas_insert BEFORE INSERT ON transacciones BEGIN {escala_por_defecto} END")
+    conn.execute(f"CREATE TRIGGER IF NOT EXISTS trg_escalas_update BEFORE UPDATE OF activo ON transacciones BEGIN {escala_por_defecto} END")
+    # Cambió la representación de todas las filas: los datos derivados deben reconstruirse
+    conn.execute("UPDATE meta SET valor = valor + 1 WHERE clave = 'modificaciones'")
+
+    conn.execute(f"""
+        CREATE VIEW IF NOT EXISTS v_transacciones AS
+        SELECT id, fecha, activo, operacion,
+               cantidad * 1.0 / (SELECT factor FROM escalas AS e WHERE e.activo = t.activo) AS cantidad,
+               precio_unitario * 1.0 / {FACTOR_MONTOS} AS precio_unitario,
+               costo_total * 1.0 / {FACTOR_MONTOS} AS costo_total,
+               dolar_cambio * 1.0 / {FACTOR_MONTOS} AS dolar_cambio
+        FROM transacciones AS t
+    """)
+
+
+def _migracion_6_cortes_saldos(conn):
+    """Crea los cortes mensuales de saldos acumulados y los triggers que los invalidan.
+
+    - `cortes_saldos` guarda, por activo y mes ('YYYY-MM'), las compras y ventas
+      acumuladas desde el inicio hasta el final de ese mes (sólo meses con movimientos).
+    - `cortes_estado` indica hasta qué mes están calculados los cortes de cada activo.
+
+    Los cortes se calculan a pedido (`crud.actualizar_cortes`). Cuando una alta,
+    modificación o baja toca un mes ya cortado, los triggers borran los cortes
+    del activo desde ese mes y retroceden su estado, así que los que quedan son
+    siempre correctos.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cortes_saldos (
+            activo TEXT NOT NULL,
+            mes TEXT NOT NULL,
+            compras INTEGER NOT NULL,
+            ventas INTEGER NOT NULL,
+            PRIMARY KEY (activo, mes)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cortes_estado (
+            activo TEXT PRIMARY KEY,
+            hasta TEXT NOT NULL
+        )
+    """)
+
+    def invalidar(t):
+        mes = f"substr({t}.fecha, 1, 7)"
+        return f"""
+            DELETE FROM cortes_saldos WHERE activo = {t}.activo AND mes >= {mes};
+            UPDATE cortes_estado SET hasta = strftime('%Y-%m', {mes} || '-01', '-1 month')
+            WHERE activo = {t}.activo AND hasta >= {mes};
+        """
+
+    # La condición evita el trabajo en el caso común: una alta en un mes aún no cortado
+    def cortado(t):
+        return f"EXISTS (SELECT 1 FROM cortes_estado WHERE activo = {t}.activo AND hasta >= substr({t}.fecha, 1, 7))"
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_cortes_insert AFTER INSERT ON transacciones
+        WHEN {cortado('NEW')} BEGIN {invalidar('NEW')} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_cortes_delete AFTER DELETE ON transacciones
+        WHEN {cortado('OLD')} BEGIN {invalidar('OLD')} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_cortes_update
+        AFTER UPDATE OF fecha, activo, operacion, cantidad ON transacciones
+        WHEN {cortado('OLD')} OR {cortado('NEW')} BEGIN {invalidar('OLD')} {invalidar('NEW')} END
+    """)
+
+
+def _migracion_7_tipos_cambio(conn):
+    """Crea la serie de tipos de cambio (moneda local por dólar), una fila por fecha.
+
+    El valor se guarda en punto fijo como los importes (10^-8). La clave primaria
+    por fecha permite buscar el tipo de cambio vigente a una fecha con un rango
+    sobre el índice (`fecha <= ? ORDER BY fecha DESC LIMIT 1`).
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS tipos_cambio (
+            fecha TEXT PRIMARY KEY,
+            valor INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+
+
+def _migracion_8_archivos(conn):
+    """Prepara el archivo por años: registro de archivos y saldos de apertura.
+
+    - `archivos` registra, por año archivado, el archivo SQLite (junto a la base)
+      que guarda sus transacciones y cuántas se movieron.
+    - Los triggers de `saldos` se recrean para contar las filas 'APERTURA' (el
+      saldo de cada activo al cierre de lo archivado) como compras.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS archivos (
+            anio INTEGER PRIMARY KEY,
+            archivo TEXT NOT NULL,
+            transacciones INTEGER NOT NULL,
+            archivado TEXT NOT NULL
+        )
+    """)
+    for trigger in ('trg_saldos_insert', 'trg_saldos_delete', 'trg_saldos_update'):
+        conn.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    _crear_triggers_saldos(conn)
+
+
+def huella_transaccion(fecha, activo, operacion, cantidad, factor, precio_unitario, costo_total, id_externo=None):
+    """Retorna la huella (16 bytes) que identifica una transacción por su contenido.
+
+    Se calcula sobre los valores tal como se guardan (fecha canónica, importes
+    enteros) más el id externo de la operación, si lo hay. La cantidad entra
+    como número decimal y no en unidades de su escala, así que `definir_escala`
+    no cambia la huella. El tipo de cambio no forma parte de la huella: una
+    reimportación con otro tipo de cambio sigue siendo la misma operación.
+    """
+    texto = "\x1f".join((
+        fecha, activo, operacion,
+        format(Decimal(cantidad).scaleb(1 - len(str(factor))).normalize(), 'f'),
+        str(precio_unitario), str(costo_total), id_externo or '',
+    ))
+    return hashlib.blake2b(texto.encode('utf-8'), digest_size=16).digest()
+
+
+def _migracion_9_huellas(conn):
+    """Agrega la huella de contenido de cada transacción y las marcas de agua de importación.
+
+    - `huella` identifica la operación por su contenido (`huella_transaccion`);
+      queda en NULL para los saldos de apertura y para las altas sin fecha
+      (la pone la base al insertar), que no se deduplican.
+    - `id_externo` guarda el id de la operación en el origen (exchange, banco),
+      para distinguir operaciones idénticas el mismo día.
+    - `ocurrencia` numera las filas ya existentes con la misma huella (1, 2...),
+      así el índice único se puede crear sin borrar nada; las altas nuevas usan
+      siempre 1, de modo que `ON CONFLICT DO NOTHING` descarta los duplicados.
+    - `marcas_agua` guarda, por origen de importación, la fecha más reciente
+      importada: las sincronizaciones siguientes descartan lo anterior sin calcular huellas.
+    """
+    conn.execute("ALTER TABLE transacciones ADD COLUMN id_externo TEXT")
+    conn.execute("ALTER TABLE transacciones ADD COLUMN huella BLOB")
+    conn.execute("ALTER TABLE transacciones ADD COLUMN ocurrencia INTEGER NOT NULL DEFAULT 1")
+
+    filas = conn.execute("""
+        SELECT t.id, t.fecha, t.activo, t.operacion, t.cantidad, e.factor, t.precio_unitario, t.costo_total
+        FROM transacciones AS t JOIN escalas AS e ON e.activo = t.activo
+        WHERE t.fecha IS NOT NULL AND t.operacion <> 'APERTURA'
+        ORDER BY t.id
+    """)
+    vistas = {}
+    valores = []
+    for id_transaccion, *campos in filas:
+        huella = huella_transaccion(*campos)
+        vistas[huella] = vistas.get(huella, 0) + 1
+        valores.append((huella, vistas[huella], id_transaccion))
+    # Completar la huella no es una modificación: se evita que el trigger cuente cada fila
+    conn.execute("DROP TRIGGER IF EXISTS trg_meta_update")
+    conn.executemany("UPDATE transacciones SET huella = ?, ocurrencia = ? WHERE id = ?", valores)
+    _crear_triggers_meta(conn)
+
+    conn.execute("""
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_transacciones_huella
+        ON transacciones (huella, ocurrencia) WHERE huella IS NOT NULL
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS marcas_agua (
+            origen TEXT PRIMARY KEY,
+            fecha TEXT NOT NULL,
+            filas INTEGER NOT NULL DEFAULT 0,
+            actualizado TEXT NOT NULL
+        )
+    """)
+
+
+def _migracion_10_cambios_masivos(conn):
+    """Crea el diario de cambios masivos (actualizar/borrar por filtros) para poder deshacerlos.
+
+    - `cambios_masivos` registra cada cambio: tipo ('ACTUALIZAR' o 'BORRAR'),
+      descripción, filas afectadas, el contador de escrituras (`contador_escrituras`)
+      antes y después del cambio, para saber si hubo otras escrituras entre
+      medio, y cuándo se deshizo.
+    - `imagenes_previas` guarda cada fila afectada tal como estaba antes del
+      cambio, con el factor de escala de su cantidad en ese momento.
+    """
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cambios_masivos (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            fecha TEXT NOT NULL,
+            tipo TEXT NOT NULL,
+            descripcion TEXT NOT NULL,
+            filas INTEGER NOT NULL,
+            escrituras_antes INTEGER NOT NULL,
+            escrituras INTEGER NOT NULL,
+            deshecho TEXT
+        )
+    """)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS imagenes_previas (
+            cambio INTEGER NOT NULL,
+            id INTEGER NOT NULL,
+            fecha TEXT,
+            activo TEXT NOT NULL,
+            operacion TEXT,
+            cantidad INTEGER NOT NULL,
+            factor INTEGER NOT NULL,
+            precio_unitario INTEGER NOT NULL,
+            costo_total INTEGER NOT NULL,
+            dolar_cambio INTEGER NOT NULL,
+            id_externo TEXT,
+            huella BLOB,
+            ocurrencia INTEGER NOT NULL,
+            PRIMARY KEY (cambio, id)
+        ) WITHOUT ROWID
+    """)
+
+
+# Migraciones en orden; la posición (empezando en 1) es la versión que dejan
+# registrada en PRAGMA user_version. Sólo se agregan al final, nunca se reordenan.
+MIGRACIONES = [
+    _migracion_1_esquema_base,
+    _migracion_2_indices,
+    _migracion_3_saldos,
+    _migracion_4_contador_modificaciones,
+    _migracion_5_enteros,
+    _migracion_6_cortes_saldos,
+    _migracion_7_tipos_cambio,
+    _migracion_8_archivos,
+    _migracion_9_huellas,
+    _migracion_10_cambios_masivos,
+]
+
+
+def version_esquema(conn):
+    """Retorna la versión de esquema registrada en la base (PRAGMA user_version)."""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def contador_modificaciones(conn):
+    """Retorna cuántas veces se modificaron o borraron transacciones (ver migración 4)."""
+    return conn.execute("SELECT valor FROM meta WHERE clave = 'modificaciones'").fetchone()[0]
+
+
+def contador_escrituras(conn):
+    """Retorna cuántas altas, modificaciones y bajas de transacciones hubo desde que se creó la base.
+
+    Suma el último id asignado (AUTOINCREMENT: nunca se reutiliza, así que cuenta
+    también las altas luego borradas) y el contador de modificaciones. Sólo
+    crece, y ve las escrituras de cualquier proceso.
+    """
+    fila = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'transacciones'").fetchone()
+    return (fila[0] if fila else 0) + contador_modificaciones(conn)
+
+
+def migrar(conn):
+    """Aplica las migraciones pendientes, cada una en su propia transacción.
+
+    La conexión debe estar en modo autocommit (isolation_level=None).
+    Retorna la versión final del esquema.
+    """
+    while True:
+        # BEGIN IMMEDIATE toma el lock de escritura antes de leer la versión, así
+        # dos procesos que arrancan a la vez no aplican la misma migración dos veces
+        conn.execute("BEGIN IMMEDIATE")
         try:
-            conn.execute("ALTER TABLE transacciones ADD COLUMN operacion TEXT DEFAULT 'COMPRA';")
-            conn.commit()
-        except Exception:
-            # If ALTER fails for any reason, just continue — the table exists but may be incompatible.
-            # The rest of the app will raise informative errors later; user can choose to delete/backup DB.
-            pass
+            version = version_esquema(conn)
+            if version >= len(MIGRACIONES):
+                conn.execute("COMMIT")
+                return version
+            MIGRACIONES[version](conn)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+def _preparar_base(ruta):
+    """Crea el directorio y ejecuta el esquema/migración una sola vez por archivo y proceso."""
+    if ruta in _esquemas_listos:
+        return
+    with _lock_esquemas:
+        if ruta in _esquemas_listos:
+            return
+        os.makedirs(os.path.dirname(ruta), exist_ok=True)
+        conn = sqlite3.connect(ruta, isolation_level=None)
+        try:
+            migrar(conn)
+        finally:
+            conn.close()
+        _esquemas_listos.add(ruta)
+
+
+def agregar_gancho_conexion(gancho):
+    """Registra `gancho(conn)` para que se aplique a cada conexión que se abra.
+
+    También se aplica a las conexiones reutilizables ya abiertas por el hilo actual.
+    """
+    _ganchos_conexion.append(gancho)
+    for conn in conexiones_abiertas():
+        gancho(conn)
+
+
+def quitar_gancho_conexion(gancho):
+    """Deja de aplicar un gancho registrado con `agregar_gancho_conexion`."""
+    if gancho in _ganchos_conexion:
+        _ganchos_conexion.remove(gancho)
+
+
+def agregar_gancho_confirmacion(gancho):
+    """Registra `gancho(conn)` para que se llame después de cada COMMIT de `transaccion()`.
+
+    Sólo se llama al confirmar el nivel externo, fuera de la transacción, de modo
+    que el gancho puede leer (o escribir en su propia transacción).
+    """
+    _ganchos_confirmacion.append(gancho)
+
+
+def quitar_gancho_confirmacion(gancho):
+    """Deja de llamar un gancho registrado con `agregar_gancho_confirmacion`."""
+    if gancho in _ganchos_confirmacion:
+        _ganchos_confirmacion.remove(gancho)
+
+
+def _conectar(ruta, **opciones):
+    with fase('conexion'):
+        _preparar_base(ruta)
+        conn = sqlite3.connect(ruta, **opciones)
+    # Permite recalcular huellas en SQL (cambios masivos, ver crud.actualizar_transacciones)
+    conn.create_function('huella_transaccion', 8, huella_transaccion, deterministic=True)
+    for gancho in _ganchos_conexion:
+        gancho(conn)
     return conn
+
+
+def get_db_connection():
+    """Abre una conexión nueva a la base de datos configurada.
+
+    El llamador es responsable de cerrarla. Para uso repetido es preferible
+    `obtener_conexion`, que reutiliza la conexión del hilo actual.
+    """
+    return _conectar(ruta_db())
+
+
+def _estado_hilo():
+    # Tras un fork, las conexiones heredadas del proceso padre no se deben reutilizar
+    if getattr(_local, 'pid', None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.conexiones = {}
+        _local.profundidad = {}
+    return _local
+
+
+def obtener_conexion():
+    """Retorna la conexión reutilizable del hilo actual para la base configurada.
+
+    La conexión trabaja en modo autocommit: las escrituras deben agruparse con
+    `transaccion()`. No se debe cerrar; usar `cerrar_conexiones()` al terminar.
+    """
+    ruta = ruta_db()
+    estado = _estado_hilo()
+    conn = estado.conexiones.get(ruta)
+    if conn is None:
+        conn = _conectar(ruta, isolation_level=None)
+        estado.conexiones[ruta] = conn
+    return conn
+
+
+@contextmanager
+def transaccion():
+    """Agrupa escrituras en una transacción sobre la conexión del hilo.
+
+    Confirma al salir sin errores y deshace todo si ocurre una excepción.
+    Se puede anidar: los niveles internos usan SAVEPOINT, de modo que un error
+    interno sólo deshace su parte si el llamador captura la excepción.
+    """
+    conn = obtener_conexion()
+    ruta = ruta_db()
+    estado = _estado_hilo()
+    nivel = estado.profundidad.get(ruta, 0)
+    punto = f"nivel_{nivel}"
+
+    conn.execute("BEGIN IMMEDIATE" if nivel == 0 else f"SAVEPOINT {punto}")
+    estado.profundidad[ruta] = nivel + 1
+    try:
+        yield conn
+    except BaseException:
+        if nivel == 0:
+            conn.execute("ROLLBACK")
+        else:
+            conn.execute(f"ROLLBACK TO {punto}")
+            conn.execute(f"RELEASE {punto}")
+        raise
+    else:
+        conn.execute("COMMIT" if nivel == 0 else f"RELEASE {punto}")
+    finally:
+        estado.profundidad[ruta] = nivel
+    if nivel == 0:
+        for gancho in list(_ganchos_confirmacion):
+            gancho(conn)
+
+
+def activar_wal():
+    """Pone la base configurada en modo WAL (write-ahead log) y retorna el modo resultante.
+
+    En WAL los lectores leen una instantánea confirmada y nunca bloquean ni son
+    bloqueados por el escritor. El modo queda guardado en el archivo, así que
+    basta con activarlo una vez; las demás conexiones lo adoptan al abrirlo.
+    """
+    return obtener_conexion().execute("PRAGMA journal_mode = WAL").fetchone()[0]
+
+
+def conexiones_abiertas():
+    """Retorna las conexiones reutilizables abiertas por el hilo actual."""
+    return list(_estado_hilo().conexiones.values())
+
+
+def cerrar_conexiones():
+    """Cierra las conexiones reutilizables abiertas por el hilo actual."""
+    estado = _estado_hilo()
+    for conn in estado.conexiones.values():
+        conn.close()
+    estado.conexiones.clear()
+    estado.profundidad.clear()
@@ -0,0 +1,100 @@
+# Exportación de transacciones por bloques (CSV, JSONL, Parquet)
+import csv
+import json
+import sys
+from contextlib import contextmanager
+
+from .crud import iterar_registros, COLUMNAS_TRANSACCION, TAMANO_BLOQUE_EXPORTACION
+
+FORMATOS_EXPORTACION = ('csv', 'jsonl', 'parquet')
+
+
+@contextmanager
+def _abrir_destino(destino):
+    """Abre el archivo de salida en modo texto; None o '-' significa stdout."""
+    if destino in (None, '-'):
+        yield sys.stdout
+    else:
+        with open(destino, 'w', newline='', encoding='utf-8') as archivo:
+            yield archivo
+
+
+def escribir_csv(bloques, salida, columnas=COLUMNAS_TRANSACCION):
+    """Escribe los bloques como CSV con cabecera. Retorna la cantidad de filas."""
+    escritor = csv.writer(salida)
+    escritor.writerow(columnas)
+    total = 0
+    for bloque in bloques:
+        escritor.writerows(bloque)
+        total += len(bloque)
+    return total
+
+
+def escribir_jsonl(bloques, salida, columnas=COLUMNAS_TRANSACCION):
+    """Escribe un objeto JSON por transacción. Retorna la cantidad de filas."""
+    total = 0
+    for bloque in bloques:
+        salida.write(''.join(
+            json.dumps(dict(zip(columnas, fila)), ensure_ascii=False) + '\n' for fila in bloque
+        ))
+        total += len(bloque)
+    return total
+
+
+def escribir_parquet(bloques, ruta, columnas=COLUMNAS_TRANSACCION):
+    """Escribe un archivo Parquet con un row group por bloque. Requiere pyarrow."""
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("La exportación a Parquet requiere pyarrow (pip install pyarrow)") from None
+
+    esquema = pa.schema([
+        ('id', pa.int64()),
+        ('fecha', pa.string()),
+        ('activo', pa.string()),
+        ('operacion', pa.string()),
+        ('cantidad', pa.float64()),
+        ('precio_unitario', pa.float64()),
+        ('costo_total', pa.float64()),
+        ('dolar_cambio', pa.float64()),
+    ])
+    esquema = pa.schema([esquema.field(columna) for columna in columnas])
+
+    total = 0
+    with pq.ParquetWriter(ruta, esquema) as escritor:
+        for bloque in bloques:
+            columnas_bloque = list(zip(*bloque))
+            escritor.write_table(pa.Table.from_arrays(
+                [pa.array(valores, type=campo.type) for valores, campo in zip(columnas_bloque, esquema)],
+                schema=esquema,
+            ))
+            total += len(bloque)
+    return total
+
+
+def exportar_registros(destino=None, formato='csv', tamano_bloque=TAMANO_BLOQUE_EXPORTACION, **filtros):
+    """Exporta las transacciones filtradas sin cargarlas enteras en memoria.
+
+    Parámetros:
+    - destino: ruta del archivo de salida (None o '-' escribe en stdout; no válido para Parquet)
+    - formato: 'csv', 'jsonl' o 'parquet'
+    - tamano_bloque: filas leídas del cursor y escritas por vez
+    - **filtros: activo, operacion, fecha_desde, fecha_hasta (como en `consultar_registros`)
+
+    Retorna:
+    - cantidad de filas exportadas
+    """
+    if formato not in FORMATOS_EXPORTACION:
+        raise ValueError(f"Formato no soportado: {formato!r}")
+
+    bloques = iterar_registros(tamano_bloque=tamano_bloque, **filtros)
+
+    if formato == 'parquet':
+        if destino in (None, '-'):
+            raise ValueError("La exportación a Parquet necesita un archivo de destino (--archivo)")
+        return escribir_parquet(bloques, destino)
+
+    escribir = escribir_csv if formato == 'csv' else escribir_jsonl
+    with _abrir_destino(destino) as salida:
+        return escribir(bloques, salida)
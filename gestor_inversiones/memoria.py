@@ -0,0 +1,179 @@
+# Caché en memoria (LRU) de resultados de consultas, invalidada cuando cambian los datos
+import copy
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+from .db import obtener_conexion, ruta_db, agregar_gancho_confirmacion
+
+VARIABLE_ENTORNO_MEMORIA = "GESTOR_INVERSIONES_MEMORIA"
+
+# Límites por defecto: cantidad de resultados guardados y memoria estimada en total
+ENTRADAS_MAXIMAS = 128
+MEGABYTES_MAXIMOS = 64
+
+_configuracion = {'habilitada': None, 'entradas': ENTRADAS_MAXIMAS, 'bytes': MEGABYTES_MAXIMOS * 1024 * 1024}
+
+# clave -> (resultado, bytes estimados); el primero es el usado hace más tiempo
+_entradas = OrderedDict()
+_estado = {'generacion': 0, 'bytes': 0}
+_contadores = dict.fromkeys(('aciertos', 'fallos', 'desalojos', 'invalidaciones', 'descartados'), 0)
+_lock = threading.Lock()
+
+# Última marca (data_version, total_changes) vista por cada conexión de este hilo, por ruta
+_vistas = threading.local()
+
+
+def habilitar(habilitada=True, entradas=None, megabytes=None):
+    """Activa o desactiva la caché de resultados de `consultar_registros` y `calcular_saldos`.
+
+    Con None se vuelve al valor de la variable de entorno GESTOR_INVERSIONES_MEMORIA
+    (desactivada si no está definida). `entradas` y `megabytes` cambian los límites;
+    si los nuevos son menores se desalojan los resultados usados hace más tiempo.
+    """
+    if entradas is not None and entradas < 1:
+        raise ValueError("entradas debe ser mayor que cero")
+    if megabytes is not None and megabytes <= 0:
+        raise ValueError("megabytes debe ser mayor que cero")
+    _configuracion['habilitada'] = habilitada
+    with _lock:
+        if entradas is not None:
+            _configuracion['entradas'] = entradas
+        if megabytes is not None:
+            _configuracion['bytes'] = int(megabytes * 1024 * 1024)
+        _recortar()
+
+
+def habilitada():
+    if _configuracion['habilitada'] is not None:
+        return _configuracion['habilitada']
+    return os.environ.get(VARIABLE_ENTORNO_MEMORIA, '').lower() in ('1', 'si', 'sí', 'true')
+
+
+def estadisticas():
+    """Contadores de la caché desde el inicio del proceso (o el último `vaciar`).
+
+    Retorna:
+    - dict con 'aciertos', 'fallos', 'desalojos' (por los límites), 'invalidaciones'
+      (resultados descartados porque cambiaron los datos), 'descartados' (resultados
+      que no se guardaron: más grandes que el límite o calculados mientras cambiaban
+      los datos), más 'entradas' y 'bytes' actuales y los límites
+    """
+    with _lock:
+        return {
+            **_contadores,
+            'entradas': len(_entradas),
+            'bytes': _estado['bytes'],
+            'entradas_maximas': _configuracion['entradas'],
+            'bytes_maximos': _configuracion['bytes'],
+        }
+
+
+def vaciar():
+    """Descarta todos los resultados guardados y pone los contadores en cero."""
+    with _lock:
+        _entradas.clear()
+        _estado['bytes'] = 0
+        for nombre in _contadores:
+            _contadores[nombre] = 0
+
+
+def _invalidar():
+    """Descarta todo lo guardado y avanza la generación (con `_lock` tomado)."""
+    _estado['generacion'] += 1
+    _contadores['invalidaciones'] += len(_entradas)
+    _entradas.clear()
+    _estado['bytes'] = 0
+
+
+def _recortar():
+    """Desaloja las entradas usadas hace más tiempo hasta respetar los límites (con `_lock` tomado)."""
+    while _entradas and (len(_entradas) > _configuracion['entradas'] or _estado['bytes'] > _configuracion['bytes']):
+        _, (_, tamano) = _entradas.popitem(last=False)
+        _estado['bytes'] -= tamano
+        _contadores['desalojos'] += 1
+
+
+def _al_confirmar(conn):
+    # Toda escritura confirmada con `db.transaccion` (altas, cambios, bajas, importaciones) invalida
+    with _lock:
+        _invalidar()
+
+
+agregar_gancho_confirmacion(_al_confirmar)
+
+
+def _generacion(conn):
+    """Generación vigente de la caché para lo que ve `conn`.
+
+    PRAGMA data_version cambia cuando otra conexión (de este u otro proceso)
+    confirma cambios, y `total_changes` cuenta los de la propia conexión aunque
+    no pasen por `db.transaccion`. Si alguno difiere de lo visto la última vez
+    (o la conexión es nueva) se invalida todo.
+    """
+    marca = (conn.execute("PRAGMA data_version").fetchone()[0], conn.total_changes)
+    vistas = getattr(_vistas, 'por_ruta', None)
+    if vistas is None:
+        vistas = _vistas.por_ruta = {}
+    ruta = ruta_db()
+    anterior = vistas.get(ruta)
+    with _lock:
+        # Se guarda la conexión misma: otra con el mismo id() sería una conexión nueva
+        if anterior is None or anterior[0] is not conn or anterior[1] != marca:
+            vistas[ruta] = (conn, marca)
+            _invalidar()
+        return _estado['generacion']
+
+
+def _tamano(resultado):
+    """Bytes aproximados que ocupa un resultado en memoria."""
+    if hasattr(resultado, 'memory_usage'):
+        return int(resultado.memory_usage(index=True, deep=True).sum())
+    return len(pickle.dumps(resultado, protocol=pickle.HIGHEST_PROTOCOL))
+
+
+def resolver(clave, calcular):
+    """Retorna una copia del resultado de `calcular()` para `clave`, guardado si sigue vigente.
+
+    La clave se completa con la ruta de la base configurada. Dentro de una
+    transacción abierta se calcula siempre, sin guardar: la conexión ve cambios
+    que todavía no están confirmados. Cada llamada retorna una copia profunda
+    (DataFrame o dict), de modo que modificarla no altera lo guardado.
+
+    Parámetros:
+    - clave: tupla hashable con la consulta y sus filtros normalizados
+    - calcular: función sin argumentos que hace la consulta; no debe escribir
+    """
+    if not habilitada():
+        return calcular()
+    conn = obtener_conexion()
+    if conn.in_transaction:
+        return calcular()
+
+    clave = (ruta_db(),) + tuple(clave)
+    generacion = _generacion(conn)
+    with _lock:
+        entrada = _entradas.get(clave)
+        if entrada is not None:
+            _entradas.move_to_end(clave)
+            _contadores['aciertos'] += 1
+        else:
+            _contadores['fallos'] += 1
+    if entrada is not None:
+        return copy.deepcopy(entrada[0])
+
+    resultado = calcular()
+    tamano = _tamano(resultado)
+    with _lock:
+        # Si los datos cambiaron mientras se calculaba, el resultado puede no corresponder a ninguna versión
+        if generacion != _estado['generacion'] or tamano > _configuracion['bytes']:
+            _contadores['descartados'] += 1
+        else:
+            previa = _entradas.pop(clave, None)
+            if previa is not None:
+                _estado['bytes'] -= previa[1]
+            _entradas[clave] = (resultado, tamano)
+            _estado['bytes'] += tamano
+            _recortar()
+    return copy.deepcopy(resultado)
@@ -0,0 +1,155 @@
+# Perfilado por fases e instrumentación de las sentencias SQL
+import json
+import time
+from contextlib import contextmanager, nullcontext
+
+# Perfil activo en el proceso (None si no se está perfilando)
+_perfil_activo = None
+
+# Cada cuántas instrucciones de la máquina virtual de SQLite se registra actividad
+PASOS_PROGRESO = 100
+
+
+def fase(nombre):
+    """Context manager que acumula el tiempo de una fase en el perfil activo.
+
+    Si no hay un perfil activo no hace nada, así que se puede dejar en el código
+    sin costo apreciable.
+    """
+    if _perfil_activo is None:
+        return nullcontext()
+    return _perfil_activo.fase(nombre)
+
+
+class Perfil:
+    """Tiempos por fase y, opcionalmente, traza de cada sentencia SQL ejecutada.
+
+    Las fases se acumulan por nombre (conexion, sql, pandas, formato...). Las
+    sentencias se capturan con `set_trace_callback`; su duración es aproximada:
+    va desde que SQLite empieza a ejecutarla hasta la última actividad observada
+    (instrucciones de la VM vía `set_progress_handler` o filas entregadas).
+    """
+
+    def __init__(self, trazar_sql=False):
+        self.trazar_sql = trazar_sql
+        self.fases = {}
+        self.sentencias = []
+        self.inicio = time.perf_counter()
+        self.fin = None
+        self._actual = None
+        self._fabricas_previas = {}
+
+    @contextmanager
+    def fase(self, nombre):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.fases[nombre] = self.fases.get(nombre, 0.0) + time.perf_counter() - inicio
+
+    # --- Instrumentación de conexiones sqlite3 ---
+
+    def _traza(self, sql):
+        ahora = time.perf_counter()
+        self._actual = {'sql': ' '.join(sql.split()), 'inicio': ahora, 'ultima': ahora, 'filas': 0, 'pasos_vm': 0}
+        self.sentencias.append(self._actual)
+
+    def _progreso(self):
+        if self._actual is not None:
+            self._actual['ultima'] = time.perf_counter()
+            self._actual['pasos_vm'] += PASOS_PROGRESO
+        return 0
+
+    def instrumentar(self, conn):
+        """Instala los callbacks de traza, progreso y conteo de filas en una conexión."""
+        if not self.trazar_sql:
+            return
+        conn.set_trace_callback(self._traza)
+        conn.set_progress_handler(self._progreso, PASOS_PROGRESO)
+
+        fabrica_previa = conn.row_factory
+        self._fabricas_previas[id(conn)] = fabrica_previa
+
+        def contar_fila(cursor, fila):
+            if self._actual is not None:
+                self._actual['filas'] += 1
+                self._actual['ultima'] = time.perf_counter()
+            return fabrica_previa(cursor, fila) if fabrica_previa else fila
+
+        conn.row_factory = contar_fila
+
+    def desinstrumentar(self, conn):
+        if not self.trazar_sql:
+            return
+        conn.set_trace_callback(None)
+        conn.set_progress_handler(None, 0)
+        if id(conn) in self._fabricas_previas:
+            conn.row_factory = self._fabricas_previas.pop(id(conn))
+
+    # --- Reportes ---
+
+    def reporte(self):
+        """Retorna el perfil como dict serializable a JSON (tiempos en ms)."""
+        total = (self.fin or time.perf_counter()) - self.inicio
+        return {
+            'total_ms': total * 1000,
+            'fases_ms': {nombre: segundos * 1000 for nombre, segundos in self.fases.items()},
+            'sentencias': [
+                {
+                    'sql': sentencia['sql'],
+                    'duracion_ms': (sentencia['ultima'] - sentencia['inicio']) * 1000,
+                    'filas': sentencia['filas'],
+                    'pasos_vm': sentencia['pasos_vm'],
+                }
+                for sentencia in self.sentencias
+            ],
+        }
+
+    def json(self):
+        return json.dumps(self.reporte(), ensure_ascii=False)
+
+    def texto(self, max_sentencias=15, largo_sql=70):
+        """Reporte compacto legible: fases y las sentencias más lentas."""
+        reporte = self.reporte()
+        total = reporte['total_ms']
+        lineas = [f"⏱️ PERFIL: total {total:.1f} ms"]
+        for nombre, ms in sorted(reporte['fases_ms'].items(), key=lambda item: -item[1]):
+            porcentaje = ms / total * 100 if total else 0
+            lineas.append(f"  {nombre:12} {ms:10.1f} ms {porcentaje:5.1f}%")
+
+        sentencias = reporte['sentencias']
+        if self.trazar_sql:
+            sql_ms = sum(s['duracion_ms'] for s in sentencias)
+            lineas.append(f"  SQL: {len(sentencias)} sentencias, {sql_ms:.1f} ms")
+            for sentencia in sorted(sentencias, key=lambda s: -s['duracion_ms'])[:max_sentencias]:
+                sql = sentencia['sql']
+                if len(sql) > largo_sql:
+                    sql = sql[:largo_sql - 1] + '…'
+                lineas.append(f"  {sentencia['duracion_ms']:9.2f} ms {sentencia['filas']:8d} filas  {sql}")
+        return '\n'.join(lineas)
+
+
+@contextmanager
+def perfilar(trazar_sql=False):
+    """Activa un perfil para el bloque y lo retorna.
+
+    Ejemplo:
+        with perfilar(trazar_sql=True) as perfil:
+            consultar_registros(activo='BTC')
+        print(perfil.texto())
+    """
+    from . import db
+
+    global _perfil_activo
+    anterior = _perfil_activo
+    perfil = Perfil(trazar_sql=trazar_sql)
+    _perfil_activo = perfil
+    db.agregar_gancho_conexion(perfil.instrumentar)
+    try:
+        yield perfil
+    finally:
+        perfil.fin = time.perf_counter()
+        db.quitar_gancho_conexion(perfil.instrumentar)
+        for conn in db.conexiones_abiertas():
+            perfil.desinstrumentar(conn)
+        _perfil_activo = anterior
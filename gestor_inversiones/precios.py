@@ -0,0 +1,382 @@
+# Historial local de precios por activo (matrices fecha × activo mapeadas en memoria) y valuación diaria
+import csv
+import json
+import os
+import shutil
+import threading
+import time
+from datetime import date
+
+from .db import obtener_conexion, ruta_db, FACTOR_POR_DEFECTO
+from .perfilado import fase
+from .utils import normalizar_activo, normalizar_fecha
+
+# Cambia si se modifica la forma de los archivos; un historial de otra versión no se lee
+VERSION_FORMATO = 1
+
+# Campos de precio guardados (una matriz por campo) y nombres aceptados en los CSV.
+# El cierre es obligatorio; apertura, máximo y mínimo son opcionales.
+CAMPOS = ('cierre', 'apertura', 'maximo', 'minimo')
+ALIAS_CAMPOS = {
+    'close': 'cierre', 'precio': 'cierre', 'precio_cierre': 'cierre',
+    'open': 'apertura',
+    'high': 'maximo', 'máximo': 'maximo',
+    'low': 'minimo', 'mínimo': 'minimo',
+    'date': 'fecha',
+    'symbol': 'activo', 'simbolo': 'activo',
+}
+
+_lock = threading.Lock()
+
+
+def ruta_precios(ruta=None):
+    """Directorio del historial de precios de una base: junto al archivo, con sufijo '.precios'."""
+    return (ruta or ruta_db()) + '.precios'
+
+
+def _leer_meta(directorio):
+    try:
+        with open(os.path.join(directorio, 'meta.json'), encoding='utf-8') as archivo:
+            meta = json.load(archivo)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get('version') == VERSION_FORMATO else None
+
+
+class HistorialPrecios:
+    """Precios diarios mapeados en memoria: una matriz float64 (días × activos) por campo.
+
+    La fila `i` corresponde al día `inicio + i`; los días sin precio valen NaN.
+    `meta` describe el contenido: fecha de inicio, cantidad de días, activos (en
+    el orden de las columnas) y campos guardados.
+    """
+
+    def __init__(self, directorio, meta):
+        import numpy as np
+
+        self.meta = meta
+        self.activos = meta['activos']
+        self.dias = meta['dias']
+        self.inicio = np.datetime64(meta['inicio'], 'D')
+        self._columnas = {activo: columna for columna, activo in enumerate(self.activos)}
+        generacion = os.path.join(directorio, f"g{meta['generacion']}")
+        self.matrices = {
+            campo: np.memmap(os.path.join(generacion, f"{campo}.bin"), dtype='<f8', mode='r',
+                             shape=(self.dias, len(self.activos)))
+            for campo in meta['campos']
+        }
+
+    @property
+    def fin(self):
+        return self.inicio + (self.dias - 1)
+
+    def fechas(self):
+        import numpy as np
+        return self.inicio + np.arange(self.dias)
+
+    def columna(self, activo):
+        return self._columnas.get(normalizar_activo(activo))
+
+    def cierres(self, fechas, activos, rellenar=True):
+        """Matriz (len(fechas) × len(activos)) con el cierre de cada activo en cada fecha.
+
+        Con `rellenar` se usa el último cierre conocido hasta cada fecha (fines de
+        semana, feriados, huecos en los datos); sin él, NaN donde no hay precio
+        ese día. Los activos sin historial quedan en NaN.
+        """
+        import numpy as np
+
+        fechas = np.asarray(fechas, dtype='datetime64[D]')
+        resultado = np.full((len(fechas), len(activos)), np.nan)
+        columnas = [self.columna(activo) for activo in activos]
+        conocidas = [posicion for posicion, columna in enumerate(columnas) if columna is not None]
+        if not conocidas or not self.dias:
+            return resultado
+
+        cierres = np.asarray(self.matrices['cierre'])[:, [columnas[posicion] for posicion in conocidas]]
+        if rellenar:
+            # Índice de la última fila con precio hasta cada día, acumulado hacia abajo
+            filas = np.where(np.isnan(cierres), 0, np.arange(self.dias)[:, None])
+            np.maximum.accumulate(filas, axis=0, out=filas)
+            cierres = np.take_along_axis(cierres, filas, axis=0)
+
+        indices = (fechas - self.inicio).astype(np.int64)
+        # Después del último día se repite el último cierre (si se rellena); antes del primero no hay precio
+        validas = (indices >= 0) & ((indices < self.dias) | rellenar)
+        indices = np.clip(indices, 0, self.dias - 1)
+        resultado[np.ix_(validas, conocidas)] = cierres[indices[validas]]
+        return resultado
+
+
+def obtener_historial():
+    """Retorna el historial de precios de la base configurada, o None si no hay ninguno cargado."""
+    directorio = ruta_precios()
+    meta = _leer_meta(directorio)
+    return HistorialPrecios(directorio, meta) if meta else None
+
+
+def _normalizar_cabecera(nombre):
+    nombre = (nombre or '').strip().lower()
+    return ALIAS_CAMPOS.get(nombre, nombre)
+
+
+def _leer_csv(ruta, activo=None):
+    """Lee un CSV de precios y retorna {campo: [valores]} más las listas de fechas y activos.
+
+    El CSV lleva 'fecha', 'cierre' (o 'close'/'precio') y opcionalmente 'apertura',
+    'maximo' y 'minimo'. La columna 'activo' puede omitirse si se indica `activo`
+    (un archivo por activo, como los que exportan la mayoría de las fuentes).
+    """
+    with open(ruta, newline='', encoding='utf-8') as archivo:
+        lector = csv.reader(archivo)
+        cabecera = [_normalizar_cabecera(nombre) for nombre in next(lector, [])]
+        if 'fecha' not in cabecera or 'cierre' not in cabecera:
+            raise ValueError(f"{ruta}: el CSV debe tener las columnas 'fecha' y 'cierre' (o 'close')")
+        if 'activo' not in cabecera and activo is None:
+            raise ValueError(f"{ruta}: falta la columna 'activo' (o indica el activo del archivo)")
+
+        posiciones = {campo: cabecera.index(campo) for campo in ('fecha', 'activo', *CAMPOS) if campo in cabecera}
+        datos = {campo: [] for campo in ('fecha', 'activo', *CAMPOS) if campo in posiciones or campo == 'activo'}
+        for fila in lector:
+            if not any(valor.strip() for valor in fila):
+                continue
+            numero = lector.line_num
+            try:
+                datos['fecha'].append(normalizar_fecha(fila[posiciones['fecha']])[:10])
+                datos['activo'].append(normalizar_activo(fila[posiciones['activo']] if 'activo' in posiciones else activo))
+                for campo in CAMPOS:
+                    if campo in posiciones:
+                        texto = fila[posiciones[campo]].strip()
+                        valor = float(texto) if texto else float('nan')
+                        if valor <= 0:
+                            raise ValueError(f"el precio debe ser mayor que cero: {texto!r}")
+                        datos[campo].append(valor)
+            except (ValueError, IndexError) as e:
+                raise ValueError(f"{ruta}, fila {numero}: {e}") from None
+    return datos
+
+
+def importar_precios(rutas, activo=None):
+    """Carga en bloque uno o más CSV de precios diarios en el historial local.
+
+    Los datos se combinan con los ya cargados: se amplía el rango de fechas y
+    la lista de activos si hace falta, y un mismo (fecha, activo) se reemplaza
+    con el valor del archivo. El historial completo se escribe en una
+    generación nueva y se publica al final, así que si algún archivo no es
+    válido no cambia nada.
+
+    Parámetros:
+    - rutas: ruta o lista de rutas de CSV
+    - activo: activo de todas las filas, para archivos sin columna 'activo'
+
+    Retorna:
+    - dict con estructura: {'filas': precios_cargados, 'activos', 'dias', 'bytes', 'segundos'}
+    """
+    import numpy as np
+
+    inicio_reloj = time.perf_counter()
+    if isinstance(rutas, (str, os.PathLike)):
+        rutas = [rutas]
+    lecturas = [_leer_csv(ruta, activo) for ruta in rutas]
+
+    directorio = ruta_precios()
+    with _lock:
+        os.makedirs(directorio, exist_ok=True)
+        anterior = _leer_meta(directorio)
+        historial = HistorialPrecios(directorio, anterior) if anterior else None
+
+        fechas_nuevas = np.array([fecha for datos in lecturas for fecha in datos['fecha']], dtype='datetime64[D]')
+        activos = list(historial.activos) if historial else []
+        for datos in lecturas:
+            for nombre in datos['activo']:
+                if nombre not in activos:
+                    activos.append(nombre)
+        limites = [fechas_nuevas.min(), fechas_nuevas.max()] if len(fechas_nuevas) else []
+        if historial:
+            limites += [historial.inicio, historial.fin]
+        if not limites:
+            raise ValueError("No hay precios para cargar")
+        inicio, fin = min(limites), max(limites)
+        dias = int((fin - inicio).astype(np.int64)) + 1
+        campos = [campo for campo in CAMPOS
+                  if campo == 'cierre' or any(campo in datos for datos in lecturas)
+                  or (historial and campo in historial.matrices)]
+
+        matrices = {campo: np.full((dias, len(activos)), np.nan) for campo in campos}
+        if historial:
+            desplazamiento = int((historial.inicio - inicio).astype(np.int64))
+            for campo, matriz in historial.matrices.items():
+                matrices[campo][desplazamiento:desplazamiento + historial.dias, :len(historial.activos)] = matriz
+        columnas = {nombre: posicion for posicion, nombre in enumerate(activos)}
+        total = 0
+        for datos in lecturas:
+            filas = (np.array(datos['fecha'], dtype='datetime64[D]') - inicio).astype(np.int64)
+            posiciones = np.array([columnas[nombre] for nombre in datos['activo']], dtype=np.int64)
+            for campo in CAMPOS:
+                if campo in datos:
+                    matrices[campo][filas, posiciones] = datos[campo]
+            total += len(filas)
+
+        meta = {
+            'version': VERSION_FORMATO,
+            'generacion': (anterior['generacion'] + 1) if anterior else 1,
+            'inicio': str(inicio),
+            'dias': dias,
+            'activos': activos,
+            'campos': campos,
+        }
+        generacion = os.path.join(directorio, f"g{meta['generacion']}")
+        shutil.rmtree(generacion, ignore_errors=True)
+        os.makedirs(generacion)
+        for campo, matriz in matrices.items():
+            matriz.astype('<f8').tofile(os.path.join(generacion, f"{campo}.bin"))
+
+        # Se escribe aparte y se reemplaza: los lectores ven la versión anterior o la nueva, nunca una a medias
+        temporal = os.path.join(directorio, 'meta.json.tmp')
+        with open(temporal, 'w', encoding='utf-8') as archivo:
+            json.dump(meta, archivo)
+        os.replace(temporal, os.path.join(directorio, 'meta.json'))
+        for nombre in os.listdir(directorio):
+            if nombre.startswith('g') and nombre != f"g{meta['generacion']}":
+                shutil.rmtree(os.path.join(directorio, nombre), ignore_errors=True)
+
+    return {
+        'filas': total,
+        'activos': len(activos),
+        'dias': dias,
+        'bytes': sum(entrada.stat().st_size for entrada in os.scandir(generacion)),
+        'segundos': time.perf_counter() - inicio_reloj,
+    }
+
+
+def _movimientos_diarios():
+    """Variación neta de la cantidad de cada activo por día, en enteros escalados.
+
+    Retorna (dias, activos, codigos, deltas, factores): arrays paralelos con el día
+    (datetime64[D]), el código de activo y la variación de cada (día, activo) (o de
+    cada transacción, si se lee de la caché columnar), más la lista de activos y el
+    factor de escala de cada uno.
+    """
+    import numpy as np
+    from . import columnar
+
+    # Con la caché columnar se parte de sus columnas mapeadas: sin consulta ni agrupación en SQLite
+    instantanea = columnar.obtener_instantanea() if columnar.habilitada() else None
+    if instantanea is not None:
+        dias, codigos, deltas = instantanea.movimientos()
+        return dias, list(instantanea.activos), codigos, deltas, list(instantanea.meta['factores'])
+
+    conn = obtener_conexion()
+    with fase('sql'):
+        filas = conn.execute("""
+            SELECT substr(fecha, 1, 10) AS dia, activo,
+                   SUM(CASE WHEN operacion IN ('COMPRA', 'APERTURA') THEN cantidad
+                            WHEN operacion = 'VENTA' THEN -cantidad ELSE 0 END)
+            FROM transacciones
+            GROUP BY activo, dia
+        """).fetchall()
+        escalas = dict(conn.execute("SELECT activo, factor FROM escalas"))
+    if not filas:
+        return np.empty(0, dtype='datetime64[D]'), [], np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), []
+
+    dias, nombres, deltas = zip(*filas)
+    activos = sorted(set(nombres))
+    codigos_activo = {activo: codigo for codigo, activo in enumerate(activos)}
+    return (
+        np.array(dias, dtype='datetime64[D]'),
+        activos,
+        np.fromiter((codigos_activo[nombre] for nombre in nombres), dtype=np.int64, count=len(nombres)),
+        np.array(deltas, dtype=np.int64),
+        [escalas.get(activo, FACTOR_POR_DEFECTO) for activo in activos],
+    )
+
+
+def valuar_cartera(desde=None, hasta=None, moneda='USD'):
+    """Serie diaria del valor de mercado de la cartera, por activo y total.
+
+    Construye la matriz de tenencias (días × activos) con la suma acumulada de
+    las variaciones diarias y la multiplica por la matriz de cierres del
+    historial local (el último conocido hasta cada día) en una sola operación
+    vectorizada. Las tenencias previas a `desde` se acumulan en el primer día.
+
+    Parámetros:
+    - desde, hasta: rango de fechas (por defecto, de la primera transacción a hoy)
+    - moneda: 'USD' o 'local' (multiplica cada día por el tipo de cambio vigente
+      de la serie de `cambio`)
+
+    Retorna:
+    - dict con estructura: {
+        'fechas': array datetime64[D],
+        'activos': lista de activos en el orden de las columnas,
+        'cantidades': matriz días × activos,
+        'valores': matriz días × activos (0 donde no hay precio),
+        'total': array con el valor total de cada día,
+        'sin_precio': activos con tenencia en algún día del rango y sin precio ese día
+      }
+    """
+    import numpy as np
+
+    moneda = moneda.upper() if moneda.upper() == 'USD' else moneda.lower()
+    if moneda not in ('USD', 'local'):
+        raise ValueError(f"Moneda no válida: {moneda!r} (se espera USD o local)")
+
+    dias, activos, codigos, deltas, factores = _movimientos_diarios()
+    inicio = np.datetime64(normalizar_fecha(desde)[:10], 'D') if desde else (dias.min() if len(dias) else None)
+    fin = np.datetime64(normalizar_fecha(hasta)[:10], 'D') if hasta else np.datetime64(date.today().isoformat(), 'D')
+    if inicio is None or fin < inicio:
+        vacio = np.empty((0, len(activos)))
+        return {'fechas': np.empty(0, dtype='datetime64[D]'), 'activos': activos, 'cantidades': vacio,
+                'valores': vacio, 'total': np.empty(0), 'sin_precio': []}
+
+    fechas = np.arange(inicio, fin + 1, dtype='datetime64[D]')
+    with fase('tenencias'):
+        # Los movimientos anteriores al rango se acumulan en la primera fila; los posteriores se descartan
+        filas = (dias - inicio).astype(np.int64)
+        dentro = filas < len(fechas)
+        movimientos = np.zeros((len(fechas), len(activos)), dtype=np.int64)
+        np.add.at(movimientos, (np.maximum(filas[dentro], 0), codigos[dentro]), deltas[dentro])
+        # Suma acumulada en enteros (exacta) y recién después se pasa a unidades
+        cantidades = np.cumsum(movimientos, axis=0) / np.asarray(factores, dtype=np.int64)
+
+    with fase('valuacion'):
+        historial = obtener_historial()
+        cierres = historial.cierres(fechas, activos) if historial else np.full(cantidades.shape, np.nan)
+        sin_precio_mascara = np.isnan(cierres) & (cantidades != 0)
+        valores = np.where(np.isnan(cierres), 0.0, cantidades * cierres)
+        if moneda == 'local':
+            from .cambio import tipos_cambio_para
+            tipos = tipos_cambio_para(fechas.astype(str))
+            if np.isnan(tipos).any():
+                primera = fechas[np.isnan(tipos)][0]
+                raise ValueError(f"No hay tipo de cambio cargado para {primera} ni para fechas anteriores")
+            valores *= tipos[:, None]
+        total = valores.sum(axis=1)
+
+    return {
+        'fechas': fechas,
+        'activos': activos,
+        'cantidades': cantidades,
+        'valores': valores,
+        'total': total,
+        'sin_precio': [activo for activo, falta in zip(activos, sin_precio_mascara.any(axis=0)) if falta],
+    }
+
+
+def caida_maxima(total):
+    """Mayor caída desde un máximo previo de una serie de valores, como fracción negativa (0 si no cae)."""
+    import numpy as np
+
+    maximos = np.maximum.accumulate(np.asarray(total, dtype=float))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        caidas = np.where(maximos > 0, np.asarray(total) / maximos - 1, 0.0)
+    return float(caidas.min()) if len(caidas) else 0.0
+
+
+def exportar_valuacion(resultado, ruta):
+    """Escribe la serie diaria de `valuar_cartera` en un CSV: fecha, total y el valor de cada activo."""
+    with open(ruta, 'w', newline='', encoding='utf-8') as archivo:
+        escritor = csv.writer(archivo)
+        escritor.writerow(['fecha', 'total', *resultado['activos']])
+        for fecha, total, valores in zip(resultado['fechas'].astype(str), resultado['total'].tolist(),
+                                         resultado['valores'].tolist()):
+            escritor.writerow([fecha, f"{total:.2f}", *(f"{valor:.2f}" for valor in valores)])
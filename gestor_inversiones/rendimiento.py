@@ -0,0 +1,202 @@
+# Cálculo de costo base y ganancias/pérdidas (FIFO, LIFO, promedio ponderado)
+import json
+from collections import deque
+
+from .utils import OPERACION_APERTURA
+
+METODOS = ('FIFO', 'LIFO', 'PROMEDIO')
+
+# Cantidades por debajo de este valor se consideran cero (errores de redondeo)
+_EPSILON = 1e-12
+
+
+class EstadoDesactualizado(ValueError):
+    """El estado guardado ya no corresponde a las transacciones: hay que recalcular desde cero."""
+
+
+class _Cartera:
+    """Lotes abiertos y resultado realizado de un activo.
+
+    Cada lote es una lista [cantidad, costo_unitario_usd, costo_unitario_local].
+    Con el método PROMEDIO hay a lo sumo un lote, con el costo unitario ponderado.
+    `ultima_fecha` es la fecha de la última transacción procesada del activo.
+    """
+    __slots__ = ('lotes', 'realizado_usd', 'realizado_local', 'sin_costo', 'ultima_fecha')
+
+    def __init__(self, lotes=(), realizado_usd=0.0, realizado_local=0.0, sin_costo=0.0, ultima_fecha=None):
+        self.lotes = deque(list(lote) for lote in lotes)
+        self.realizado_usd = realizado_usd
+        self.realizado_local = realizado_local
+        self.sin_costo = sin_costo
+        self.ultima_fecha = ultima_fecha
+
+    def comprar(self, cantidad, costo_usd, costo_local, promedio):
+        if promedio and self.lotes:
+            lote = self.lotes[0]
+            total = lote[0] + cantidad
+            lote[1] = (lote[0] * lote[1] + costo_usd) / total
+            lote[2] = (lote[0] * lote[2] + costo_local) / total
+            lote[0] = total
+        else:
+            self.lotes.append([cantidad, costo_usd / cantidad, costo_local / cantidad])
+
+    def vender(self, cantidad, ingreso_usd, ingreso_local, lifo):
+        costo_usd = 0.0
+        costo_local = 0.0
+        restante = cantidad
+        lotes = self.lotes
+        while restante > _EPSILON and lotes:
+            lote = lotes[-1] if lifo else lotes[0]
+            usado = lote[0] if lote[0] < restante else restante
+            costo_usd += usado * lote[1]
+            costo_local += usado * lote[2]
+            lote[0] -= usado
+            restante -= usado
+            if lote[0] <= _EPSILON:
+                if lifo:
+                    lotes.pop()
+                else:
+                    lotes.popleft()
+
+        # Lo vendido sin lotes que lo respalden se computa con costo cero
+        if restante > _EPSILON:
+            self.sin_costo += restante
+        self.realizado_usd += ingreso_usd - costo_usd
+        self.realizado_local += ingreso_local - costo_local
+
+    def a_dict(self):
+        return {
+            'lotes': [list(lote) for lote in self.lotes],
+            'realizado_usd': self.realizado_usd,
+            'realizado_local': self.realizado_local,
+            'sin_costo': self.sin_costo,
+            'ultima_fecha': self.ultima_fecha,
+        }
+
+
+def calcular_rendimiento(df, metodo='FIFO', estado=None, precios=None, dolar_actual=None,
+                         activo=None, modificaciones=None):
+    """Calcula costo base y ganancias realizadas/no realizadas por activo.
+
+    Parámetros:
+    - df: DataFrame de transacciones como el que retorna `consultar_registros`
+      (en cualquier orden; se procesa por activo en orden de fecha e id)
+    - metodo: 'FIFO', 'LIFO' o 'PROMEDIO' (costo promedio ponderado)
+    - estado: opcional, estado retornado por una ejecución anterior. Sólo se
+      procesan las transacciones con id mayor a `estado['ultimo_id']`, por lo que
+      sirve cuando desde entonces únicamente se agregaron operaciones nuevas.
+    - precios: opcional, {activo: precio_usd} para calcular el resultado no realizado
+    - dolar_actual: opcional, tipo de cambio para el no realizado en moneda local
+    - activo: filtro de activo con que se leyó `df` (None si son todos); se guarda
+      en el estado y sólo se reanuda un estado calculado con el mismo filtro
+    - modificaciones: opcional, `db.contador_modificaciones` leído antes que `df`.
+      Se guarda en el estado; si al reanudar es otro, desde entonces se modificaron,
+      borraron, deshicieron o archivaron transacciones ya procesadas
+
+    Lanza EstadoDesactualizado si `estado` no se puede reanudar: otro filtro de
+    activo, otro contador de modificaciones, o una transacción nueva con fecha
+    anterior a la última procesada de su activo (sus ventas consumirían otros lotes).
+
+    Las ventas se valúan con su `costo_total` (USD) y `costo_total * dolar_cambio`
+    (moneda local); el costo de cada lote usa el tipo de cambio de su compra.
+
+    Retorna:
+    - dict con estructura: {
+        'rendimientos': DataFrame con una fila por activo,
+        'estado': estado para reanudar el cálculo (serializable a JSON)
+      }
+    """
+    import pandas as pd
+
+    metodo = metodo.upper()
+    if metodo not in METODOS:
+        raise ValueError(f"Método no válido: {metodo!r} (se espera {', '.join(METODOS)})")
+    if estado is not None and estado.get('metodo') != metodo:
+        raise ValueError(f"El estado guardado usa el método {estado.get('metodo')}, no {metodo}")
+    if estado is not None and estado.get('activo') != activo:
+        raise EstadoDesactualizado(f"El estado guardado es de {estado.get('activo') or 'todos los activos'}, "
+                                   f"no de {activo or 'todos los activos'}")
+    if estado is not None and modificaciones is not None and estado.get('modificaciones') != modificaciones:
+        raise EstadoDesactualizado("Desde que se guardó el estado se modificaron, borraron o archivaron transacciones")
+
+    ultimo_id = estado['ultimo_id'] if estado else 0
+    carteras = {activo: _Cartera(**datos) for activo, datos in (estado or {}).get('activos', {}).items()}
+
+    df = df[df['operacion'].isin(('COMPRA', 'VENTA', OPERACION_APERTURA)) & (df['id'] > ultimo_id)]
+    if len(df):
+        df = df.sort_values(['activo', 'fecha', 'id'], kind='stable')
+        ultimo_id = max(ultimo_id, int(df['id'].max()))
+
+        activos = df['activo'].to_numpy()
+        fechas = df['fecha'].to_numpy()
+        # El saldo de apertura de lo archivado es un lote con el costo base restante al cierre
+        es_compra = (df['operacion'] != 'VENTA').to_numpy()
+        cantidades = df['cantidad'].to_numpy(dtype=float)
+        costos_usd = df['costo_total'].to_numpy(dtype=float)
+        costos_local = costos_usd * df['dolar_cambio'].to_numpy(dtype=float)
+
+        promedio = metodo == 'PROMEDIO'
+        lifo = metodo == 'LIFO'
+        activo_actual = None
+        cartera = None
+        for activo_fila, fecha, compra, cantidad, costo_usd, costo_local in zip(
+                activos.tolist(), fechas.tolist(), es_compra.tolist(), cantidades.tolist(), costos_usd.tolist(),
+                costos_local.tolist()):
+            if activo_fila != activo_actual:
+                activo_actual = activo_fila
+                cartera = carteras.setdefault(activo_fila, _Cartera())
+                # Las filas de cada activo vienen ordenadas: basta comparar la primera nueva
+                if cartera.ultima_fecha is not None and fecha < cartera.ultima_fecha:
+                    raise EstadoDesactualizado(f"La transacción de {activo_fila} del {fecha} es anterior a la "
+                                               f"última procesada ({cartera.ultima_fecha})")
+            cartera.ultima_fecha = fecha
+            if compra:
+                cartera.comprar(cantidad, costo_usd, costo_local, promedio)
+            else:
+                cartera.vender(cantidad, costo_usd, costo_local, lifo)
+
+    filas = []
+    for activo_fila in sorted(carteras):
+        cartera = carteras[activo_fila]
+        cantidad = sum(lote[0] for lote in cartera.lotes)
+        costo_usd = sum(lote[0] * lote[1] for lote in cartera.lotes)
+        costo_local = sum(lote[0] * lote[2] for lote in cartera.lotes)
+        fila = {
+            'activo': activo_fila,
+            'cantidad': cantidad,
+            'costo_usd': costo_usd,
+            'costo_local': costo_local,
+            'realizado_usd': cartera.realizado_usd,
+            'realizado_local': cartera.realizado_local,
+            'vendido_sin_costo': cartera.sin_costo,
+        }
+        if precios and activo_fila in precios:
+            valor_usd = cantidad * precios[activo_fila]
+            fila['precio'] = precios[activo_fila]
+            fila['no_realizado_usd'] = valor_usd - costo_usd
+            if dolar_actual is not None:
+                fila['no_realizado_local'] = valor_usd * dolar_actual - costo_local
+        filas.append(fila)
+
+    return {
+        'rendimientos': pd.DataFrame(filas),
+        'estado': {
+            'metodo': metodo,
+            'activo': activo,
+            'modificaciones': modificaciones,
+            'ultimo_id': ultimo_id,
+            'activos': {activo: cartera.a_dict() for activo, cartera in carteras.items()},
+        }
+    }
+
+
+def guardar_estado(estado, ruta):
+    """Guarda en un archivo JSON el estado de lotes retornado por `calcular_rendimiento`."""
+    with open(ruta, 'w', encoding='utf-8') as archivo:
+        json.dump(estado, archivo)
+
+
+def cargar_estado(ruta):
+    """Lee un estado de lotes guardado con `guardar_estado`."""
+    with open(ruta, encoding='utf-8') as archivo:
+        return json.load(archivo)
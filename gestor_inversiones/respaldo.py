@@ -0,0 +1,431 @@
+# Respaldo y restauración en caliente con la API de backup de SQLite
+import gzip
+import json
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+from .archivo import ruta_archivo
+from .db import (get_db_connection, obtener_conexion, ruta_db, migrar, version_esquema, contador_escrituras,
+                 agregar_gancho_confirmacion, quitar_gancho_confirmacion, MIGRACIONES)
+
+VARIABLE_ENTORNO_RESPALDO = "GESTOR_INVERSIONES_RESPALDO_CADA"
+
+# Páginas copiadas por paso: entre paso y paso la base queda libre para los escritores
+PAGINAS_POR_PASO = 256
+
+# Generaciones que conserva el respaldo automático
+CONSERVAR_AUTOMATICO = 10
+
+EXTENSIONES = ('.db', '.db.gz')
+
+_automatico = {'cada': None, 'opciones': {}}
+
+
+def ruta_respaldos(ruta=None):
+    """Directorio de respaldos de una base: junto al archivo, con sufijo '.respaldos'."""
+    return (ruta or ruta_db()) + '.respaldos'
+
+
+def _prefijo(ruta=None):
+    return os.path.splitext(os.path.basename(ruta or ruta_db()))[0] + '-'
+
+
+def _ruta_anio(respaldo, anio):
+    """Respaldo del archivo de `anio` que acompaña a `respaldo`: mismo nombre con el año antes de la extensión."""
+    comprimido = respaldo.endswith('.gz')
+    base, extension = os.path.splitext(respaldo[:-3] if comprimido else respaldo)
+    return f"{base}.{int(anio)}{extension or '.db'}" + ('.gz' if comprimido else '')
+
+
+def listar_respaldos(directorio=None):
+    """Lista los respaldos de la base configurada, del más antiguo al más reciente.
+
+    Los respaldos de los años archivados no se listan por separado: van en
+    'archivos' del respaldo de la base con el que se hicieron.
+
+    Retorna:
+    - lista de dicts {'archivo', 'bytes', 'fecha', 'archivos'}
+    """
+    directorio = directorio or ruta_respaldos()
+    prefijo = _prefijo()
+    try:
+        nombres = os.listdir(directorio)
+    except FileNotFoundError:
+        return []
+    respaldos = []
+    # El nombre lleva la fecha y hora con microsegundos, así que el orden alfabético es el cronológico
+    for nombre in sorted(nombres):
+        if not (nombre.startswith(prefijo) and nombre.endswith(EXTENSIONES)):
+            continue
+        extension = '.db.gz' if nombre.endswith('.db.gz') else '.db'
+        base = nombre[:-len(extension)]
+        # Los nombres de portafolio no llevan puntos: uno en la base es el año de un archivo
+        if '.' in base:
+            continue
+        ruta = os.path.join(directorio, nombre)
+        respaldos.append({
+            'archivo': ruta,
+            'bytes': os.path.getsize(ruta),
+            'fecha': datetime.fromtimestamp(os.path.getmtime(ruta)).isoformat(sep=' ', timespec='seconds'),
+            'archivos': [os.path.join(directorio, otro) for otro in sorted(nombres)
+                         if re.fullmatch(rf"{re.escape(base)}\.\d+{re.escape(extension)}", otro)],
+        })
+    return respaldos
+
+
+def _archivados(conn):
+    """Filas de `archivos` (anio, transacciones, archivado): cambian con cada `archivar`.
+
+    Una base anterior al archivo por años no tiene la tabla: no hay nada archivado.
+    """
+    try:
+        return conn.execute("SELECT anio, transacciones, archivado FROM archivos ORDER BY anio").fetchall()
+    except sqlite3.OperationalError:
+        return []
+
+
+def _archivos_en_disco(ruta):
+    """{anio: ruta} de los archivos por año (ver `archivo.ruta_archivo`) que hay junto a la base `ruta`."""
+    directorio = os.path.dirname(ruta)
+    base, extension = os.path.splitext(os.path.basename(ruta))
+    patron = re.compile(rf"{re.escape(base)}\.(\d+){re.escape(extension or '.db')}")
+    encontrados = {}
+    for nombre in os.listdir(directorio):
+        coincidencia = patron.fullmatch(nombre)
+        if coincidencia:
+            encontrados[int(coincidencia.group(1))] = os.path.join(directorio, nombre)
+    return encontrados
+
+
+def _leer_estado(directorio):
+    try:
+        with open(os.path.join(directorio, 'estado.json'), encoding='utf-8') as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return {}
+
+
+def _guardar_estado(directorio, escrituras):
+    temporal = os.path.join(directorio, 'estado.json.tmp')
+    with open(temporal, 'w', encoding='utf-8') as archivo:
+        json.dump({'escrituras': escrituras}, archivo)
+    os.replace(temporal, os.path.join(directorio, 'estado.json'))
+
+
+def _copiar(fuente, destino, paginas_por_paso, progreso, pausa):
+    """Copia `fuente` en `destino` de a `paginas_por_paso` páginas; retorna las páginas copiadas."""
+    inicio = time.perf_counter()
+    copiadas = [0]
+
+    def paso(estado, restantes, total):
+        copiadas[0] = total - restantes
+        if progreso:
+            segundos = time.perf_counter() - inicio
+            progreso({'copiadas': copiadas[0], 'total': total,
+                      'paginas_por_segundo': copiadas[0] / segundos if segundos > 0 else 0.0})
+        if pausa:
+            time.sleep(pausa)
+
+    fuente.backup(destino, pages=paginas_por_paso, progress=paso)
+    return copiadas[0]
+
+
+def _copia_verificada(fuente, directorio, paginas_por_paso, progreso, pausa):
+    """Copia `fuente` en un archivo temporal de `directorio` y la verifica con `PRAGMA quick_check`.
+
+    Retorna (ruta del temporal, páginas copiadas); si algo falla, el temporal se borra.
+    """
+    descriptor, temporal = tempfile.mkstemp(suffix='.tmp', dir=directorio)
+    os.close(descriptor)
+    try:
+        copia = sqlite3.connect(temporal)
+        try:
+            paginas = _copiar(fuente, copia, paginas_por_paso, progreso, pausa)
+            resultado = copia.execute("PRAGMA quick_check").fetchone()[0]
+        finally:
+            copia.close()
+        if resultado != 'ok':
+            raise ValueError(f"La copia no pasó la verificación (quick_check): {resultado}")
+    except BaseException:
+        os.remove(temporal)
+        raise
+    return temporal, paginas
+
+
+def _publicar(temporal, destino, comprimir):
+    """Mueve la copia `temporal` a `destino`, comprimida con gzip si corresponde."""
+    if comprimir:
+        with open(temporal, 'rb') as entrada, gzip.open(temporal + '.gz', 'wb', compresslevel=6) as salida:
+            shutil.copyfileobj(entrada, salida, 1024 * 1024)
+        os.replace(temporal + '.gz', destino)
+        os.remove(temporal)
+    else:
+        os.replace(temporal, destino)
+
+
+def _descomprimir(origen, directorio):
+    """Copia un respaldo (descomprimido si es .gz) en un temporal de `directorio` y verifica que sea una base del gestor.
+
+    Retorna la ruta del temporal; si el respaldo no sirve lanza ValueError y el temporal se borra.
+    """
+    descriptor, temporal = tempfile.mkstemp(suffix='.tmp', dir=directorio)
+    os.close(descriptor)
+    try:
+        try:
+            with (gzip.open(origen, 'rb') if origen.endswith('.gz') else open(origen, 'rb')) as entrada, \
+                    open(temporal, 'wb') as salida:
+                shutil.copyfileobj(entrada, salida, 1024 * 1024)
+        except (gzip.BadGzipFile, EOFError) as e:
+            raise ValueError(f"El respaldo está dañado: {e}")
+        conn = sqlite3.connect(temporal)
+        try:
+            _verificar(conn)
+        except sqlite3.DatabaseError as e:
+            raise ValueError(f"El respaldo está dañado: {e}")
+        finally:
+            conn.close()
+    except BaseException:
+        os.remove(temporal)
+        raise
+    return temporal
+
+
+def _verificar(conn):
+    """Lanza ValueError si `conn` no es una base íntegra del gestor, de una versión que se pueda abrir."""
+    errores = [fila[0] for fila in conn.execute("PRAGMA integrity_check")]
+    if errores != ['ok']:
+        raise ValueError(f"El respaldo está dañado (integrity_check): {'; '.join(errores[:5])}")
+    if not conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transacciones'").fetchone():
+        raise ValueError("El archivo no es una base del gestor de inversiones (no tiene la tabla transacciones)")
+    if version_esquema(conn) > len(MIGRACIONES):
+        raise ValueError(f"El respaldo es de una versión más nueva del esquema ({version_esquema(conn)})")
+
+
+def respaldar(directorio=None, comprimir=False, conservar=None, paginas_por_paso=PAGINAS_POR_PASO,
+              progreso=None, pausa=0):
+    """Respalda la base configurada mientras sigue en uso, con `Connection.backup`.
+
+    La copia avanza de a `paginas_por_paso` páginas y entre un paso y otro no
+    retiene ningún bloqueo, así que las escrituras sólo esperan lo que dura un
+    paso. Si otra conexión escribe durante la copia, SQLite la reinicia para que
+    el resultado sea siempre una instantánea consistente. La copia se verifica
+    con `PRAGMA quick_check` antes de publicarla.
+
+    Los archivos de los años archivados (ver `archivo.archivar`) se respaldan
+    igual, junto al de la base y con el año antes de la extensión: forman un
+    solo respaldo, que se lista, rota y restaura completo. Si se archiva un año
+    mientras se copia, se lanza ValueError y no se publica nada.
+
+    Parámetros:
+    - directorio: dónde guardar el respaldo (por defecto, ver `ruta_respaldos`)
+    - comprimir: guardarlo con gzip (.db.gz)
+    - conservar: opcional, cantidad de respaldos a conservar; se borran los más antiguos
+    - paginas_por_paso: páginas copiadas en cada paso
+    - progreso: opcional, función que recibe {'copiadas', 'total', 'paginas_por_segundo'} tras cada paso
+    - pausa: segundos de espera entre pasos, para ceder más tiempo a los escritores
+
+    Retorna:
+    - dict {'archivo', 'archivos', 'paginas', 'bytes', 'segundos', 'eliminados'}; 'archivos'
+      son los respaldos de los años archivados y 'bytes' suma los de todo el respaldo
+    """
+    if conservar is not None and conservar < 1:
+        raise ValueError("conservar debe ser mayor que cero")
+    if paginas_por_paso < 1:
+        raise ValueError("paginas_por_paso debe ser mayor que cero")
+    directorio = directorio or ruta_respaldos()
+    os.makedirs(directorio, exist_ok=True)
+    nombre = f"{_prefijo()}{datetime.now():%Y%m%d-%H%M%S-%f}.db"
+    destino = os.path.join(directorio, nombre + ('.gz' if comprimir else ''))
+
+    inicio = time.perf_counter()
+    fuente = get_db_connection()
+    temporales = {}
+    try:
+        escrituras = contador_escrituras(fuente)
+        archivados = _archivados(fuente)
+        temporal, paginas = _copia_verificada(fuente, directorio, paginas_por_paso, progreso, pausa)
+        temporales[None] = temporal
+        # Un archivo por año sólo se escribe al archivar, que también actualiza `archivos`
+        for anio, _, _ in archivados:
+            ruta = ruta_archivo(anio)
+            if not os.path.exists(ruta):
+                raise ValueError(f"Falta el archivo del año archivado {anio}: {ruta}")
+            archivo_anio = sqlite3.connect(f"file:{ruta}?mode=ro", uri=True)
+            try:
+                temporales[anio], copiadas = _copia_verificada(archivo_anio, directorio, paginas_por_paso,
+                                                               progreso, pausa)
+            finally:
+                archivo_anio.close()
+            paginas += copiadas
+        if _archivados(fuente) != archivados:
+            raise ValueError("Se archivó un año mientras se respaldaba; vuelve a intentarlo")
+
+        # La base va última: un respaldo listado siempre tiene sus años completos
+        archivos = []
+        for anio, temporal in temporales.items():
+            if anio is not None:
+                archivos.append(_ruta_anio(destino, anio))
+                _publicar(temporal, archivos[-1], comprimir)
+        _publicar(temporales[None], destino, comprimir)
+    finally:
+        fuente.close()
+        for temporal in temporales.values():
+            for resto in (temporal, temporal + '.gz'):
+                if os.path.exists(resto):
+                    os.remove(resto)
+
+    _guardar_estado(directorio, escrituras)
+    eliminados = []
+    if conservar is not None:
+        for viejo in listar_respaldos(directorio)[:-conservar]:
+            for ruta in viejo['archivos'] + [viejo['archivo']]:
+                os.remove(ruta)
+                eliminados.append(ruta)
+
+    return {'archivo': destino, 'archivos': archivos, 'paginas': paginas,
+            'bytes': sum(os.path.getsize(ruta) for ruta in archivos + [destino]),
+            'segundos': time.perf_counter() - inicio, 'eliminados': eliminados}
+
+
+def restaurar(origen=None, respaldo_previo=True, paginas_por_paso=PAGINAS_POR_PASO, progreso=None):
+    """Reemplaza el contenido de la base configurada por el de un respaldo.
+
+    Antes de tocar la base se descomprime el respaldo (si es .gz) en un archivo
+    temporal y se comprueba con `PRAGMA integrity_check` que esté íntegro y sea
+    una base del gestor; si no, se lanza ValueError y la base queda como estaba.
+    Lo mismo con los respaldos de los años archivados que registra: si falta
+    alguno (un respaldo de antes de que se respaldaran) no se restaura nada.
+    La copia sobre la base en uso también se hace con `Connection.backup`, que
+    toma el bloqueo exclusivo, así que las demás conexiones ven el cambio
+    completo o nada. Después se restauran los años archivados, se borran los
+    archivos por año que el respaldo no tiene (son de un `archivar` posterior),
+    se aplican las migraciones pendientes (un respaldo de una versión anterior
+    queda al día) y se descarta la caché columnar.
+
+    Parámetros:
+    - origen: respaldo de la base (por defecto, el más reciente de `ruta_respaldos`)
+    - respaldo_previo: respaldar antes la base actual, por si hay que volver atrás
+    - paginas_por_paso, progreso: como en `respaldar`
+
+    Retorna:
+    - dict {'origen', 'paginas', 'version', 'respaldo_previo', 'anios', 'eliminados'}; 'anios'
+      son los años archivados restaurados y 'eliminados' los archivos por año borrados
+    """
+    from . import columnar
+
+    if origen is None:
+        respaldos = listar_respaldos()
+        if not respaldos:
+            raise ValueError(f"No hay respaldos en {ruta_respaldos()}")
+        origen = respaldos[-1]['archivo']
+    if not os.path.isfile(origen):
+        raise ValueError(f"No existe el respaldo {origen}")
+    conn = obtener_conexion()
+    if conn.in_transaction:
+        raise ValueError("No se puede restaurar dentro de una transacción")
+
+    ruta = ruta_db()
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    temporales = {None: _descomprimir(origen, os.path.dirname(ruta))}
+    try:
+        fuente = sqlite3.connect(temporales[None])
+        try:
+            anios = [anio for anio, _, _ in _archivados(fuente)]
+            for anio in anios:
+                respaldo_anio = _ruta_anio(origen, anio)
+                if not os.path.isfile(respaldo_anio):
+                    raise ValueError(f"El respaldo no incluye el archivo del año archivado {anio} ({respaldo_anio})")
+                temporales[anio] = _descomprimir(respaldo_anio, os.path.dirname(ruta))
+
+            previo = respaldar(paginas_por_paso=paginas_por_paso)['archivo'] if respaldo_previo else None
+            # Los archivos por año adjuntados a la conexión del hilo se reemplazan o se borran
+            for _, esquema, _ in conn.execute("PRAGMA database_list").fetchall():
+                if esquema not in ('main', 'temp'):
+                    conn.execute(f"DETACH DATABASE {esquema}")
+            destino = sqlite3.connect(ruta, isolation_level=None)
+            try:
+                paginas = _copiar(fuente, destino, paginas_por_paso, progreso, 0)
+                version = migrar(destino)
+                escrituras = contador_escrituras(destino)
+            finally:
+                destino.close()
+        finally:
+            fuente.close()
+
+        for anio in anios:
+            fuente = sqlite3.connect(temporales[anio])
+            destino = sqlite3.connect(ruta_archivo(anio, ruta))
+            try:
+                paginas += _copiar(fuente, destino, paginas_por_paso, progreso, 0)
+            finally:
+                destino.close()
+                fuente.close()
+        eliminados = []
+        for anio, archivo_anio in sorted(_archivos_en_disco(ruta).items()):
+            if anio not in anios:
+                for resto in (archivo_anio, archivo_anio + '-journal', archivo_anio + '-wal', archivo_anio + '-shm'):
+                    if os.path.exists(resto):
+                        os.remove(resto)
+                eliminados.append(archivo_anio)
+    finally:
+        for temporal in temporales.values():
+            os.remove(temporal)
+
+    columnar.borrar_cache(ruta)
+    # El conteo de escrituras del respaldo automático sigue desde la base restaurada
+    if os.path.isdir(ruta_respaldos(ruta)):
+        _guardar_estado(ruta_respaldos(ruta), escrituras)
+    return {'origen': origen, 'paginas': paginas, 'version': version, 'respaldo_previo': previo,
+            'anios': anios, 'eliminados': eliminados}
+
+
+def _respaldar_si_corresponde(conn):
+    """Gancho de confirmación: respalda si desde el último respaldo hubo `cada` escrituras o más."""
+    opciones = _automatico['opciones']
+    escrituras = contador_escrituras(conn)
+    ultimo = _leer_estado(opciones.get('directorio') or ruta_respaldos()).get('escrituras', 0)
+    # Un contador menor que el registrado es de una base restaurada o reemplazada: se cuenta desde cero
+    if 0 <= escrituras - ultimo < _automatico['cada']:
+        return
+    try:
+        respaldar(**opciones)
+    except (OSError, ValueError, sqlite3.Error) as e:
+        print(f"⚠️ No se pudo hacer el respaldo automático: {e}", file=sys.stderr)
+
+
+def programar(cada=None, directorio=None, comprimir=True, conservar=CONSERVAR_AUTOMATICO):
+    """Respalda automáticamente la base después de cada `cada` escrituras confirmadas.
+
+    Las escrituras se cuentan con `db.contador_escrituras` (altas, modificaciones
+    y bajas de transacciones), y el valor del último respaldo queda guardado
+    junto a los respaldos, así que el conteo sigue entre una ejecución y otra y
+    suma lo escrito por otros procesos. Se comprueba después de cada COMMIT.
+
+    Parámetros:
+    - cada: escrituras entre respaldos. Con None se usa la variable de entorno
+      GESTOR_INVERSIONES_RESPALDO_CADA; con 0 (o sin variable) se desactiva.
+    - directorio, comprimir, conservar: como en `respaldar`
+
+    Retorna la cantidad de escrituras configurada (0 si quedó desactivado).
+    """
+    if cada is None:
+        valor = os.environ.get(VARIABLE_ENTORNO_RESPALDO, '').strip()
+        try:
+            cada = int(valor) if valor else 0
+        except ValueError:
+            raise ValueError(f"{VARIABLE_ENTORNO_RESPALDO} debe ser un número entero, no {valor!r}")
+    if cada < 0:
+        raise ValueError("La cantidad de escrituras entre respaldos no puede ser negativa")
+
+    quitar_gancho_confirmacion(_respaldar_si_corresponde)
+    _automatico['cada'] = cada or None
+    _automatico['opciones'] = {'directorio': directorio, 'comprimir': comprimir, 'conservar': conservar}
+    if cada:
+        agregar_gancho_confirmacion(_respaldar_si_corresponde)
+    return cada
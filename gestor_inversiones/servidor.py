@@ -0,0 +1,403 @@
+# API HTTP/JSON local sobre las operaciones de crud.py (asyncio, sólo biblioteca estándar)
+import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qsl
+
+from . import memoria
+from .db import activar_wal, transaccion
+from .utils import validar_transaccion, normalizar_fecha, leer_id_externo, ALIAS_CAMPOS, OPERACIONES_VALIDAS
+from .crud import (registrar_transaccion, actualizar_transaccion, borrar_transaccion, consultar_pagina,
+                   calcular_saldos, validar_inventario, ErrorInventario, TransaccionDuplicada,
+                   cortes_pendientes, actualizar_cortes, TAMANO_PAGINA)
+
+HOST_POR_DEFECTO = '127.0.0.1'
+PUERTO_POR_DEFECTO = 8765
+
+# Hilos que atienden lecturas en paralelo (cada uno con su propia conexión)
+HILOS_LECTURA = 4
+
+# Máximo de escrituras confirmadas con un mismo COMMIT
+TAMANO_LOTE_ESCRITURA = 256
+
+# Tamaño máximo aceptado para el cuerpo de una petición
+MAX_CUERPO = 1024 * 1024
+
+# Filas por respuesta de GET /transacciones: sin `limite` se usa TAMANO_PAGINA de crud
+MAX_LIMITE = 10000
+
+_CAMPOS_NUMERICOS = {'cantidad', 'precio_unitario', 'costo_total', 'dolar_cambio'}
+
+
+class ErrorHTTP(Exception):
+    """Error que se responde con un código de estado HTTP concreto."""
+    def __init__(self, estado, mensaje):
+        self.estado = estado
+        super().__init__(mensaje)
+
+
+class EscritorAgrupado:
+    """Serializa todas las escrituras en un único hilo y las confirma en grupo.
+
+    Las peticiones de escritura se encolan; la tarea escritora toma todas las que
+    estén esperando (hasta `tamano_lote`) y las aplica dentro de una sola
+    transacción, de modo que el costo del COMMIT (y del fsync) se reparte entre
+    ellas. Cada escritura corre en su propio SAVEPOINT, así que una que falla no
+    afecta a las demás del grupo. Ninguna se responde antes de su COMMIT.
+    """
+
+    def __init__(self, tamano_lote=TAMANO_LOTE_ESCRITURA):
+        if tamano_lote < 1:
+            raise ValueError("El tamaño de lote debe ser mayor que cero")
+        self.tamano_lote = tamano_lote
+        self.escrituras = 0
+        self.commits = 0
+        self._cola = asyncio.Queue()
+        self._hilo = ThreadPoolExecutor(max_workers=1, thread_name_prefix='escritor')
+        self._tarea = None
+
+    def ejecutar_en_hilo(self, funcion, *args):
+        """Corre `funcion` en el hilo escritor (con su conexión) fuera de los grupos."""
+        return asyncio.get_running_loop().run_in_executor(self._hilo, funcion, *args)
+
+    def iniciar(self):
+        self._tarea = asyncio.create_task(self._procesar())
+
+    async def escribir(self, funcion, **argumentos):
+        """Encola `funcion(**argumentos)` y espera su resultado ya confirmado."""
+        futuro = asyncio.get_running_loop().create_future()
+        await self._cola.put((funcion, argumentos, futuro))
+        return await futuro
+
+    async def _procesar(self):
+        while True:
+            lote = [await self._cola.get()]
+            while len(lote) < self.tamano_lote and not self._cola.empty():
+                lote.append(self._cola.get_nowait())
+
+            try:
+                resultados = await self.ejecutar_en_hilo(_aplicar_lote, [(f, a) for f, a, _ in lote])
+            except Exception as e:
+                # Falló el BEGIN o el COMMIT: no se confirmó ninguna escritura del grupo
+                resultados = [(False, e)] * len(lote)
+            else:
+                self.commits += 1
+                self.escrituras += len(lote)
+
+            for (_, _, futuro), (correcto, valor) in zip(lote, resultados):
+                if futuro.cancelled():
+                    continue
+                if correcto:
+                    futuro.set_result(valor)
+                else:
+                    futuro.set_exception(valor)
+
+    async def cerrar(self):
+        if self._tarea is not None:
+            self._tarea.cancel()
+            try:
+                await self._tarea
+            except asyncio.CancelledError:
+                pass
+        self._hilo.shutdown(wait=True)
+
+
+def _aplicar_lote(lote):
+    resultados = []
+    with transaccion():
+        for funcion, argumentos in lote:
+            try:
+                resultados.append((True, funcion(**argumentos)))
+            except Exception as e:
+                resultados.append((False, e))
+    return resultados
+
+
+def _leer_json(cuerpo):
+    try:
+        datos = json.loads(cuerpo or b'{}')
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ErrorHTTP(HTTPStatus.BAD_REQUEST, f"JSON no válido: {e}")
+    if not isinstance(datos, dict):
+        raise ErrorHTTP(HTTPStatus.BAD_REQUEST, "Se esperaba un objeto JSON")
+    return datos
+
+
+def _id_transaccion(texto):
+    try:
+        return int(texto)
+    except ValueError:
+        raise ErrorHTTP(HTTPStatus.NOT_FOUND, f"Transacción no válida: {texto!r}")
+
+
+def _filtros(parametros):
+    """Traduce los parámetros de la URL a los argumentos de `consultar_pagina`."""
+    desconocidos = set(parametros) - {'activo', 'operacion', 'desde', 'hasta', 'columnas', 'orden', 'cursor', 'limite'}
+    if desconocidos:
+        raise ValueError(f"Parámetros no válidos: {', '.join(sorted(desconocidos))}")
+    try:
+        limite = int(parametros['limite']) if 'limite' in parametros else TAMANO_PAGINA
+    except ValueError:
+        raise ValueError(f"Límite no válido: {parametros['limite']!r}") from None
+    if not 1 <= limite <= MAX_LIMITE:
+        raise ValueError(f"El límite debe estar entre 1 y {MAX_LIMITE}")
+    return {
+        'activo': parametros.get('activo'),
+        'operacion': parametros.get('operacion'),
+        'fecha_desde': normalizar_fecha(parametros.get('desde')),
+        'fecha_hasta': normalizar_fecha(parametros.get('hasta')),
+        'columnas': parametros.get('columnas'),
+        'orden': parametros.get('orden', 'desc'),
+        'cursor': parametros.get('cursor'),
+        'limite': limite,
+    }
+
+
+def _campos_actualizacion(datos):
+    """Valida los campos de un PATCH y los retorna con los nombres de las columnas."""
+    campos = {}
+    for clave, valor in datos.items():
+        campo = ALIAS_CAMPOS.get(clave, clave)
+        if campo in _CAMPOS_NUMERICOS:
+            if isinstance(valor, bool) or not isinstance(valor, (int, float)):
+                raise ValueError(f"Valor no numérico en '{clave}': {valor!r}")
+            valor = float(valor)
+        elif campo == 'fecha':
+            valor = normalizar_fecha(valor)
+            if valor is None:
+                raise ValueError("Fecha no válida: no puede quedar vacía")
+        elif campo == 'operacion':
+            valor = str(valor).strip().upper()
+            if valor not in OPERACIONES_VALIDAS:
+                raise ValueError(f"Operación no válida: {datos[clave]!r} (se espera COMPRA o VENTA)")
+        campos[campo] = valor
+    return campos
+
+
+def _consultar_transacciones(filtros):
+    """Una página desde el cursor (si lo hay); el cursor de la siguiente queda en la respuesta."""
+    pagina = consultar_pagina(**filtros)
+    transacciones = [dict(zip(pagina['columnas'], fila)) for fila in pagina['filas']]
+    return {'transacciones': transacciones, 'total': len(transacciones), 'cursor': pagina['cursor']}
+
+
+def _codificar(datos):
+    return json.dumps(datos, ensure_ascii=False).encode('utf-8')
+
+
+class Servidor:
+    """Servidor HTTP/1.1 con conexiones persistentes que expone el CRUD como JSON.
+
+    Rutas:
+    - GET    /saldos[?al=YYYY-MM-DD] saldo por activo y alertas (`calcular_saldos`), actual o al final de una fecha
+    - GET    /inventario[?activo=]   sobreventas cronológicas (`validar_inventario`)
+    - GET    /transacciones          filtros opcionales: activo, operacion, desde, hasta;
+                                     paginación: limite (por defecto TAMANO_PAGINA, hasta MAX_LIMITE),
+                                     cursor, columnas, orden
+    - POST   /transacciones          registra una transacción; responde 201 con su id
+    - PATCH  /transacciones/<id>     actualiza los campos enviados
+    - DELETE /transacciones/<id>     borra la transacción
+    - GET    /estado                 escrituras y commits realizados por el servidor; contadores de `memoria`
+
+    Las escrituras aceptan "estricto": true para rechazar sobreventas (409).
+    Un POST repetido (misma huella de contenido) responde 409 con el id ya registrado.
+    Las lecturas se atienden en un pool de hilos; las escrituras pasan por un
+    único `EscritorAgrupado`. La base se pone en modo WAL al iniciar.
+    """
+
+    def __init__(self, host=HOST_POR_DEFECTO, puerto=PUERTO_POR_DEFECTO, hilos=HILOS_LECTURA,
+                 tamano_lote=TAMANO_LOTE_ESCRITURA):
+        if hilos < 1:
+            raise ValueError("La cantidad de hilos debe ser mayor que cero")
+        self.host = host
+        self.puerto = puerto
+        self.hilos = hilos
+        self.tamano_lote = tamano_lote
+        self.peticiones = 0
+        self.inicio = None
+        self._lectores = None
+        self._escritor = None
+        self._servidor = None
+
+    async def iniciar(self):
+        """Abre el socket y arranca la tarea escritora. Retorna el puerto en uso."""
+        self._escritor = EscritorAgrupado(self.tamano_lote)
+        modo = await self._escritor.ejecutar_en_hilo(activar_wal)
+        if modo.lower() != 'wal':
+            print(f"⚠️ La base no admite WAL (modo {modo}); las lecturas pueden esperar a las escrituras",
+                  file=sys.stderr)
+        self._escritor.iniciar()
+        self._lectores = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix='lector')
+        self._servidor = await asyncio.start_server(self._atender, self.host, self.puerto)
+        self.puerto = self._servidor.sockets[0].getsockname()[1]
+        self.inicio = time.time()
+        return self.puerto
+
+    async def servir_para_siempre(self):
+        async with self._servidor:
+            await self._servidor.serve_forever()
+
+    async def cerrar(self):
+        if self._servidor is not None:
+            self._servidor.close()
+            await self._servidor.wait_closed()
+        if self._escritor is not None:
+            await self._escritor.cerrar()
+        if self._lectores is not None:
+            self._lectores.shutdown(wait=True)
+
+    # --- HTTP ---
+
+    async def _atender(self, lector, escritor):
+        try:
+            while True:
+                linea = await lector.readline()
+                if not linea:
+                    break
+                try:
+                    metodo, destino, version = linea.decode('latin-1').split()
+                except ValueError:
+                    await self._responder(escritor, HTTPStatus.BAD_REQUEST, _codificar({'error': 'Petición mal formada'}), False)
+                    break
+
+                cabeceras = {}
+                while True:
+                    linea = await lector.readline()
+                    if linea in (b'\r\n', b'\n', b''):
+                        break
+                    nombre, _, valor = linea.decode('latin-1').partition(':')
+                    cabeceras[nombre.strip().lower()] = valor.strip()
+
+                conexion = cabeceras.get('connection', '').lower()
+                mantener = conexion != 'close' if version == 'HTTP/1.1' else conexion == 'keep-alive'
+
+                try:
+                    largo = int(cabeceras.get('content-length', 0))
+                except ValueError:
+                    largo = -1
+                if not 0 <= largo <= MAX_CUERPO:
+                    await self._responder(escritor, HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                                          _codificar({'error': 'Cuerpo demasiado grande o Content-Length no válido'}), False)
+                    break
+                cuerpo = await lector.readexactly(largo) if largo else b''
+
+                estado, datos = await self._despachar(metodo.upper(), destino, cuerpo)
+                self.peticiones += 1
+                await self._responder(escritor, estado, datos, mantener)
+                if not mantener:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            escritor.close()
+
+    async def _responder(self, escritor, estado, cuerpo, mantener):
+        escritor.write(
+            f"HTTP/1.1 {estado.value} {estado.phrase}\r\n"
+            f"Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(cuerpo)}\r\n"
+            f"Connection: {'keep-alive' if mantener else 'close'}\r\n"
+            f"\r\n".encode('latin-1') + cuerpo
+        )
+        await escritor.drain()
+
+    async def _despachar(self, metodo, destino, cuerpo):
+        """Ejecuta la ruta pedida y retorna (estado, cuerpo JSON codificado)."""
+        url = urlsplit(destino)
+        partes = [parte for parte in url.path.split('/') if parte]
+        parametros = dict(parse_qsl(url.query))
+        try:
+            estado, datos = await self._ruta(metodo, partes, parametros, cuerpo)
+        except ErrorHTTP as e:
+            estado, datos = e.estado, {'error': str(e)}
+        except ErrorInventario as e:
+            estado, datos = HTTPStatus.CONFLICT, {'error': str(e), 'sobreventa': e.sobreventa}
+        except TransaccionDuplicada as e:
+            estado, datos = HTTPStatus.CONFLICT, {'error': str(e), 'id_existente': e.id_existente}
+        except ValueError as e:
+            estado, datos = HTTPStatus.BAD_REQUEST, {'error': str(e)}
+        except Exception as e:
+            print(f"❌ {metodo} {destino}: {type(e).__name__}: {e}", file=sys.stderr)
+            estado, datos = HTTPStatus.INTERNAL_SERVER_ERROR, {'error': 'Error interno del servidor'}
+        return estado, datos if isinstance(datos, bytes) else _codificar(datos)
+
+    def _leer(self, funcion, *args):
+        # La consulta y la serialización corren en un hilo lector, fuera del bucle de eventos
+        return asyncio.get_running_loop().run_in_executor(self._lectores, lambda: _codificar(funcion(*args)))
+
+    async def _ruta(self, metodo, partes, parametros, cuerpo):
+        if partes == ['saldos'] and metodo == 'GET':
+            if 'al' not in parametros:
+                return HTTPStatus.OK, await self._leer(calcular_saldos)
+            al = normalizar_fecha(parametros['al'])
+            if al is None:
+                raise ValueError("Falta la fecha en 'al'")
+            # Los cortes que falten los calcula el escritor: los hilos lectores no escriben
+            if await asyncio.get_running_loop().run_in_executor(self._lectores, cortes_pendientes):
+                await self._escritor.escribir(actualizar_cortes)
+            return HTTPStatus.OK, await self._leer(lambda: calcular_saldos(al=al, completar_cortes=False))
+
+        if partes == ['inventario'] and metodo == 'GET':
+            return HTTPStatus.OK, await self._leer(lambda: {'sobreventas': validar_inventario(parametros.get('activo'))})
+
+        if partes == ['estado'] and metodo == 'GET':
+            return HTTPStatus.OK, {
+                'peticiones': self.peticiones,
+                'escrituras': self._escritor.escrituras,
+                'commits': self._escritor.commits,
+                'segundos_activo': time.time() - self.inicio,
+                'memoria': memoria.estadisticas(),
+            }
+
+        if partes == ['transacciones']:
+            if metodo == 'GET':
+                return HTTPStatus.OK, await self._leer(_consultar_transacciones, _filtros(parametros))
+            if metodo == 'POST':
+                datos = _leer_json(cuerpo)
+                estricto = bool(datos.pop('estricto', False))
+                fecha, activo, operacion, cantidad, precio, costo, dolar = validar_transaccion(datos)
+                id_nuevo = await self._escritor.escribir(
+                    registrar_transaccion, activo=activo, operacion=operacion, cantidad=cantidad,
+                    precio_unitario=precio, costo_total=costo, dolar_cambio=dolar, fecha=fecha, estricto=estricto,
+                    id_externo=leer_id_externo(datos))
+                return HTTPStatus.CREATED, {'id': id_nuevo}
+
+        elif len(partes) == 2 and partes[0] == 'transacciones':
+            id_transaccion = _id_transaccion(partes[1])
+            if metodo == 'PATCH':
+                datos = _leer_json(cuerpo)
+                estricto = bool(datos.pop('estricto', False))
+                campos = _campos_actualizacion(datos)
+                if not campos:
+                    raise ValueError("No se indicaron campos para actualizar")
+                actualizado = await self._escritor.escribir(
+                    actualizar_transaccion, id_transaccion=id_transaccion, estricto=estricto, **campos)
+                if not actualizado:
+                    raise ErrorHTTP(HTTPStatus.NOT_FOUND, f"No se encontró la transacción {id_transaccion}")
+                return HTTPStatus.OK, {'id': id_transaccion, 'actualizado': True}
+            if metodo == 'DELETE':
+                if not await self._escritor.escribir(borrar_transaccion, id_transaccion=id_transaccion):
+                    raise ErrorHTTP(HTTPStatus.NOT_FOUND, f"No se encontró la transacción {id_transaccion}")
+                return HTTPStatus.OK, {'id': id_transaccion, 'borrado': True}
+
+        elif partes not in (['saldos'], ['inventario'], ['estado']):
+            raise ErrorHTTP(HTTPStatus.NOT_FOUND, f"Ruta no encontrada: /{'/'.join(partes)}")
+
+        raise ErrorHTTP(HTTPStatus.METHOD_NOT_ALLOWED, f"Método {metodo} no permitido en /{'/'.join(partes)}")
+
+
+def servir(host=HOST_POR_DEFECTO, puerto=PUERTO_POR_DEFECTO, hilos=HILOS_LECTURA, tamano_lote=TAMANO_LOTE_ESCRITURA):
+    """Inicia el servidor y lo mantiene activo hasta que se interrumpe (Ctrl+C)."""
+    async def principal():
+        servidor = Servidor(host, puerto, hilos=hilos, tamano_lote=tamano_lote)
+        await servidor.iniciar()
+        print(f"✅ API escuchando en http://{servidor.host}:{servidor.puerto} (Ctrl+C para detener)", flush=True)
+        try:
+            await servidor.servir_para_siempre()
+        finally:
+            await servidor.cerrar()
+
+    asyncio.run(principal())
@@ -0,0 +1,144 @@
+# Modo shell: muchos comandos en un solo proceso y una sola conexión
+import shlex
+import sys
+import time
+from contextlib import ExitStack
+
+from .db import transaccion
+
+# Comandos que escriben en la base y se pueden agrupar en una transacción
+COMANDOS_ESCRITURA = {'registro', 'actualizar', 'borrar', 'importar', 'recalcular', 'escala', 'cambio'}
+
+# Comandos que no tienen sentido dentro del shell
+COMANDOS_NO_ANIDABLES = {'shell', 'servir'}
+
+TAMANO_GRUPO = 1000
+
+PROMPT = 'gestor> '
+
+
+class _GrupoEscrituras:
+    """Mantiene abierta una transacción mientras lleguen escrituras consecutivas.
+
+    Cada comando corre dentro de su propio SAVEPOINT (las funciones CRUD anidan
+    `transaccion()`), así que un comando que falla sólo deshace su parte.
+    """
+
+    def __init__(self, tamano):
+        self.tamano = tamano
+        self.pendientes = 0
+        self._pila = None
+
+    def preparar(self, escritura):
+        if not escritura or self.pendientes >= self.tamano:
+            self.confirmar()
+        if escritura and self._pila is None:
+            self._pila = ExitStack()
+            self._pila.enter_context(transaccion())
+
+    def registrar(self):
+        if self._pila is not None:
+            self.pendientes += 1
+
+    def confirmar(self):
+        if self._pila is not None:
+            pila, self._pila = self._pila, None
+            self.pendientes = 0
+            pila.close()
+
+    def deshacer(self, error):
+        if self._pila is not None:
+            pila, self._pila = self._pila, None
+            self.pendientes = 0
+            pila.__exit__(type(error), error, error.__traceback__)
+
+
+def ejecutar_linea(parser, ejecutar, linea):
+    """Interpreta y ejecuta una línea con la sintaxis de los subcomandos.
+
+    Retorna (comando, codigo_salida); comando es None si la línea no se pudo interpretar.
+    """
+    try:
+        argumentos = shlex.split(linea, comments=True)
+        args = parser.parse_args(argumentos)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return None, 2
+    except SystemExit as e:
+        # argparse ya mostró el error (o la ayuda) en stderr
+        return None, e.code if isinstance(e.code, int) else 2
+
+    if args.comando in COMANDOS_NO_ANIDABLES:
+        print(f"❌ El comando '{args.comando}' no se puede usar dentro del shell")
+        return args.comando, 2
+    for opcion in ('db', 'portafolio'):
+        if getattr(args, opcion, None):
+            print(f"❌ La opción --{opcion} no se puede usar dentro del shell; indícala al iniciarlo")
+            return args.comando, 2
+
+    try:
+        return args.comando, ejecutar(args) or 0
+    except Exception as e:
+        print(f"❌ {type(e).__name__}: {e}")
+        return args.comando, 1
+
+
+def ejecutar_shell(parser, ejecutar, entrada=None, interactivo=None, tamano_grupo=TAMANO_GRUPO):
+    """Lee comandos línea por línea y los ejecuta en este mismo proceso.
+
+    Parámetros:
+    - parser, ejecutar: el parser del CLI y la función que ejecuta un comando
+    - entrada: archivo de texto a leer (por defecto stdin)
+    - interactivo: mostrar prompt; por defecto, sólo si la entrada es una terminal
+    - tamano_grupo: máximo de escrituras consecutivas por transacción. En modo
+      interactivo cada comando se confirma apenas termina.
+
+    Después de cada comando se informa su línea y código de salida. Retorna 0 si
+    todos los comandos terminaron bien y 1 en caso contrario.
+    """
+    entrada = entrada or sys.stdin
+    if interactivo is None:
+        interactivo = entrada.isatty()
+    grupo = _GrupoEscrituras(1 if interactivo else tamano_grupo)
+
+    inicio = time.perf_counter()
+    ejecutados = 0
+    fallidos = 0
+
+    try:
+        numero = 0
+        while True:
+            if interactivo:
+                print(PROMPT, end='', flush=True)
+            linea = entrada.readline()
+            if not linea:
+                break
+            numero += 1
+            linea = linea.strip()
+            if not linea or linea.startswith('#'):
+                continue
+            if linea in ('salir', 'exit', 'quit'):
+                break
+
+            primera = linea.split(None, 1)[0]
+            grupo.preparar(primera in COMANDOS_ESCRITURA)
+            comando, codigo = ejecutar_linea(parser, ejecutar, linea)
+            grupo.registrar()
+            if interactivo:
+                grupo.confirmar()
+
+            ejecutados += 1
+            if codigo:
+                fallidos += 1
+            estado = "OK" if codigo == 0 else "ERROR"
+            print(f"--- línea {numero}: {estado} ({codigo})", flush=True)
+    except BaseException as error:
+        grupo.deshacer(error)
+        raise
+    else:
+        grupo.confirmar()
+
+    segundos = time.perf_counter() - inicio
+    print(f"{'✅' if not fallidos else '⚠️'} {ejecutados} comandos ({ejecutados - fallidos} OK, {fallidos} con error) "
+          f"en {segundos:.2f} s", file=sys.stderr)
+    return 0 if not fallidos else 1
@@ -1 +1,196 @@
 # Validaciones y helpers
+import csv
+import json
+import math
+import os
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_EVEN
+
+OPERACIONES_VALIDAS = ('COMPRA', 'VENTA')
+
+# Operación del saldo de apertura de cada activo que deja `archivo.archivar` (no se registra a mano)
+OPERACION_APERTURA = 'APERTURA'
+
+# Columnas de una transacción en el orden en que se insertan
+CAMPOS_TRANSACCION = ('fecha', 'activo', 'operacion', 'cantidad', 'precio_unitario', 'costo_total', 'dolar_cambio')
+
+# Nombres alternativos aceptados en archivos importados (los mismos que usan las opciones del CLI)
+ALIAS_CAMPOS = {
+    'precio': 'precio_unitario',
+    'costo': 'costo_total',
+    'dolar': 'dolar_cambio',
+    'trade_id': 'id_externo',
+}
+
+# Largo máximo del id externo de una operación (id del exchange o banco de origen)
+MAX_ID_EXTERNO = 200
+
+
+def normalizar_fecha(fecha):
+    """Normaliza una fecha al formato con que se guarda (YYYY-MM-DD o YYYY-MM-DD HH:MM:SS).
+
+    Acepta un objeto `datetime`/`date` o un string ISO (con 'T' o espacio como
+    separador). Retorna None si la fecha está vacía. Lanza ValueError si el
+    string no es una fecha ISO válida.
+    """
+    if fecha is None:
+        return None
+    if isinstance(fecha, datetime):
+        return fecha.isoformat(sep=' ')
+    if isinstance(fecha, date):
+        return fecha.isoformat()
+
+    fecha_str = str(fecha).strip()
+    if not fecha_str:
+        return None
+    try:
+        return date.fromisoformat(fecha_str).isoformat()
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(fecha_str).isoformat(sep=' ')
+    except ValueError:
+        raise ValueError(f"Fecha no válida: {fecha_str!r} (se espera YYYY-MM-DD o YYYY-MM-DDTHH:MM:SS)")
+
+
+def dia_siguiente(fecha):
+    """Retorna el día posterior a `fecha` como 'YYYY-MM-DD' (límite exclusivo de un rango)."""
+    dia = date.fromisoformat(normalizar_fecha(fecha)[:10])
+    return (dia + timedelta(days=1)).isoformat()
+
+
+# Mayor valor que entra en una columna INTEGER de SQLite (entero de 64 bits con signo)
+MAX_ENTERO = 2 ** 63 - 1
+
+# Hasta este tamaño, redondear el producto en float da el mismo entero que la cuenta decimal exacta
+_MAX_PRODUCTO_EXACTO = 2 ** 50
+
+
+def a_unidades(valor, factor):
+    """Convierte un importe a entero en unidades de 1/factor (punto fijo).
+
+    Redondea al entero más cercano (mitades al par). Acepta números o strings
+    numéricos. Lanza ValueError si el valor no es un número finito o si el
+    resultado no entra en 64 bits.
+    """
+    if isinstance(valor, int) and not isinstance(valor, bool):
+        unidades = valor * factor
+    else:
+        try:
+            numero = float(valor)
+        except (TypeError, ValueError):
+            raise ValueError(f"Valor no numérico: {valor!r}") from None
+        if math.isnan(numero) or math.isinf(numero):
+            raise ValueError(f"Valor no válido: {valor!r}")
+        producto = numero * factor
+        if abs(producto) < _MAX_PRODUCTO_EXACTO:
+            unidades = round(producto)
+        else:
+            unidades = int((Decimal(repr(numero)) * factor).to_integral_value(ROUND_HALF_EVEN))
+    if abs(unidades) > MAX_ENTERO:
+        raise ValueError(f"Valor fuera de rango: {valor!r} (máximo {MAX_ENTERO / factor:.0f})")
+    return unidades
+
+
+def normalizar_activo(activo):
+    """Retorna el símbolo canónico de un activo (sin espacios y en mayúsculas)."""
+    return str(activo).strip().upper()
+
+
+def _numero(fila, campo, positivo=False):
+    valor = fila.get(campo)
+    if valor is None or (isinstance(valor, str) and not valor.strip()):
+        raise ValueError(f"Falta el campo '{campo}'")
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        raise ValueError(f"Valor no numérico en '{campo}': {valor!r}")
+    if math.isnan(numero) or math.isinf(numero):
+        raise ValueError(f"Valor no válido en '{campo}': {valor!r}")
+    if positivo and numero <= 0:
+        raise ValueError(f"'{campo}' debe ser mayor que cero: {valor!r}")
+    if numero < 0:
+        raise ValueError(f"'{campo}' no puede ser negativo: {valor!r}")
+    return numero
+
+
+def validar_transaccion(fila):
+    """Valida un dict con los campos de una transacción.
+
+    Retorna una tupla con los valores en el orden de CAMPOS_TRANSACCION
+    (la fecha puede ser None). Lanza ValueError si algún campo no es válido.
+    """
+    fila = {ALIAS_CAMPOS.get(clave, clave): valor for clave, valor in fila.items()}
+
+    activo = normalizar_activo(fila.get('activo') or '')
+    if not activo:
+        raise ValueError("Falta el campo 'activo'")
+
+    operacion = str(fila.get('operacion') or '').strip().upper()
+    if operacion not in OPERACIONES_VALIDAS:
+        raise ValueError(f"Operación no válida: {fila.get('operacion')!r} (se espera COMPRA o VENTA)")
+
+    return (
+        normalizar_fecha(fila.get('fecha')),
+        activo,
+        operacion,
+        _numero(fila, 'cantidad', positivo=True),
+        _numero(fila, 'precio_unitario'),
+        _numero(fila, 'costo_total'),
+        _numero(fila, 'dolar_cambio'),
+    )
+
+
+def leer_id_externo(fila):
+    """Retorna el id externo de una fila ('id_externo' o 'trade_id') sin espacios, o None si no tiene.
+
+    Lanza ValueError si supera MAX_ID_EXTERNO caracteres.
+    """
+    valor = fila.get('id_externo', fila.get('trade_id'))
+    if valor is None:
+        return None
+    valor = str(valor).strip()
+    if len(valor) > MAX_ID_EXTERNO:
+        raise ValueError(f"'id_externo' no puede superar {MAX_ID_EXTERNO} caracteres")
+    return valor or None
+
+
+def detectar_formato(ruta):
+    """Deduce el formato ('csv' o 'jsonl') a partir de la extensión del archivo."""
+    extension = os.path.splitext(ruta)[1].lower()
+    if extension == '.csv':
+        return 'csv'
+    if extension in ('.jsonl', '.ndjson', '.json'):
+        return 'jsonl'
+    raise ValueError(f"No se puede deducir el formato de {ruta!r}; indica --formato csv o jsonl")
+
+
+def leer_transacciones(ruta, formato=None):
+    """Lee un archivo CSV o JSONL fila por fila sin cargarlo entero en memoria.
+
+    Genera tuplas (numero_linea, dict) donde numero_linea es la línea del
+    archivo en la que empieza la fila (útil para reportar errores).
+    """
+    formato = formato or detectar_formato(ruta)
+
+    with open(ruta, newline='', encoding='utf-8') as archivo:
+        if formato == 'csv':
+            lector = csv.DictReader(archivo)
+            lector.fieldnames  # lee la cabecera para que line_num apunte a la primera fila
+            inicio = lector.line_num + 1
+            for fila in lector:
+                yield inicio, fila
+                inicio = lector.line_num + 1
+        elif formato == 'jsonl':
+            for numero, linea in enumerate(archivo, start=1):
+                if not linea.strip():
+                    continue
+                try:
+                    fila = json.loads(linea)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Fila {numero}: JSON no válido ({e.msg})")
+                if not isinstance(fila, dict):
+                    raise ValueError(f"Fila {numero}: se esperaba un objeto JSON")
+                yield numero, fila
+        else:
+            raise ValueError(f"Formato no soportado: {formato!r}")
@@ -7,6 +7,9 @@ setup(
     install_requires=[
         "pandas",
     ],
+    extras_require={
+        "parquet": ["pyarrow"],
+    },
     entry_points={
         'console_scripts': [
             'gestor_inversiones=gestor_inversiones.cli:main',
@@ -0,0 +1,18 @@
+import os
+import shutil
+import tempfile
+import unittest
+from gestor_inversiones import db
+
+class CasoConBaseTemporal(unittest.TestCase):
+    """Caso de prueba que trabaja sobre una base SQLite temporal en lugar de data/inversiones.db."""
+
+    def setUp(self):
+        self.directorio = tempfile.mkdtemp()
+        self.ruta_db = os.path.join(self.directorio, "inversiones.db")
+        db.configurar(self.ruta_db)
+
+    def tearDown(self):
+        db.cerrar_conexiones()
+        db.configurar(None)
+        shutil.rmtree(self.directorio, ignore_errors=True)
@@ -0,0 +1,192 @@
+import io
+import os
+import sqlite3
+import unittest
+from contextlib import redirect_stdout
+from tests.base import CasoConBaseTemporal
+from gestor_inversiones import columnar, db
+from gestor_inversiones.archivo import archivar, listar_archivos, ruta_archivo
+from gestor_inversiones.cli import main
+from gestor_inversiones.crud import (registrar_transaccion, consultar_registros, consultar_pagina, calcular_saldos,
+                                     validar_inventario, recalcular_saldos, importar_transacciones,
+                                     actualizar_transaccion, borrar_transaccion, actualizar_transacciones,
+                                     importar_archivo, buscar_duplicados, TransaccionDuplicada)
+from gestor_inversiones.rendimiento import calcular_rendimiento
+
+def _con_saldo():
+    # Un activo que ya cerró en cero antes del corte no deja fila de apertura
+    return {activo: saldo for activo, saldo in calcular_saldos()['saldos'].items() if saldo}
+
+class TestArchivar(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 10, fecha="2019-03-01")
+        registrar_transaccion("BTC", "COMPRA", 1, 200, 200, 20, fecha="2019-06-01")
+        registrar_transaccion("BTC", "VENTA", 0.5, 300, 150, 30, fecha="2019-09-01")
+        registrar_transaccion("ETH", "COMPRA", 3, 10, 30, 10, fecha="2019-10-01")
+        registrar_transaccion("ETH", "VENTA", 3, 20, 60, 10, fecha="2020-02-01")
+        registrar_transaccion("BTC", "COMPRA", 0.25, 400, 100, 40, fecha="2020-05-01")
+        registrar_transaccion("BTC", "VENTA", 1, 500, 500, 50, fecha="2021-01-15")
+
+    def test_archivar_conserva_saldos_y_costo_base(self):
+        saldos = _con_saldo()
+        rendimiento = calcular_rendimiento(consultar_registros(), metodo='FIFO')['rendimientos']
+
+        resultados = archivar(2020)
+
+        self.assertEqual([(r['anio'], r['transacciones']) for r in resultados], [(2019, 4), (2020, 2)])
+        self.assertTrue(os.path.exists(ruta_archivo(2019)) and os.path.exists(ruta_archivo(2020)))
+        self.assertEqual([a['anio'] for a in listar_archivos()], [2019, 2020])
+        self.assertEqual(_con_saldo(), saldos)
+        self.assertEqual(recalcular_saldos()['diferencias'], [])
+        self.assertEqual(validar_inventario(), [])
+
+        # En la base queda una fila de apertura por lote FIFO (ETH cerró 2020 en cero)
+        vivas = consultar_registros(orden='asc')
+        self.assertEqual(vivas['operacion'].tolist(), ['APERTURA'] * 3 + ['VENTA'])
+        self.assertEqual(set(vivas['fecha'][:3]), {'2020-12-31 23:59:59'})
+        self.assertEqual(vivas['cantidad'][:3].tolist(), [0.5, 1, 0.25])
+        self.assertEqual(vivas['precio_unitario'][:3].tolist(), [100, 200, 400])
+
+        # El costo base restante (FIFO) se conserva, y con él el resultado de lo posterior
+        despues = calcular_rendimiento(consultar_registros(), metodo='FIFO')['rendimientos']
+        for columna in ('cantidad', 'costo_usd', 'costo_local'):
+            self.assertAlmostEqual(despues[columna][0], rendimiento[rendimiento['activo'] == 'BTC'][columna].iloc[0])
+
+    def test_consulta_alcanza_los_archivos(self):
+        archivar(2020)
+
+        self.assertEqual(len(consultar_registros(fecha_desde='2019-01-01')), 7)
+        self.assertEqual(consultar_registros(fecha_hasta='2019-12-31', orden='asc')['fecha'].tolist(),
+                         ['2019-03-01', '2019-06-01', '2019-09-01', '2019-10-01'])
+        self.assertEqual(consultar_registros(activo='ETH', fecha_desde='2020-01-01', fecha_hasta='2020-12-31')['cantidad'].tolist(), [3])
+
+        # Paginación por clave sobre la vista que une los archivos
+        pagina = consultar_pagina(fecha_desde='2019-01-01', limite=4, orden='asc', columnas='id')
+        siguiente = consultar_pagina(fecha_desde='2019-01-01', limite=4, orden='asc', columnas='id', cursor=pagina['cursor'])
+        self.assertEqual([fila[0] for fila in pagina['filas'] + siguiente['filas']], [1, 2, 3, 4, 5, 6, 7])
+
+        # Con la caché columnar habilitada, un rango archivado también se lee de los archivos
+        columnar.habilitar(True)
+        try:
+            self.assertEqual(len(consultar_registros(fecha_desde='2019-01-01')), 7)
+        finally:
+            columnar.habilitar(None)
+
+    def test_saldos_al_antes_del_cierre_archivado(self):
+        archivar(2019)
+
+        self.assertEqual(calcular_saldos(al='2020-03-01')['saldos'], {'BTC': 1.5, 'ETH': 0})
+        with self.assertRaisesRegex(ValueError, 'archivados'):
+            calcular_saldos(al='2019-06-30')
+
+    def test_archivar_por_partes_y_repetir(self):
+        archivar(2019)
+        # Una transacción tardía de un año ya archivado (de antes de que se rechazaran)
+        # se agrega a su archivo al volver a archivar
+        conn = sqlite3.connect(self.ruta_db)
+        with conn:
+            conn.execute("""
+                INSERT INTO transacciones (fecha, activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio)
+                VALUES ('2019-12-01', 'SOL', 'COMPRA', 500000000, 100000000, 500000000, 1000000000)
+            """)
+        conn.close()
+        saldos = _con_saldo()
+
+        resultados = archivar(2020)
+
+        self.assertEqual([(r['anio'], r['transacciones']) for r in resultados], [(2019, 1), (2020, 2)])
+        self.assertEqual(_con_saldo(), saldos)
+        self.assertEqual(listar_archivos()[0]['transacciones'], 5)
+        self.assertEqual(archivar(2020), [])
+
+    def test_rechaza_escrituras_en_anios_archivados(self):
+        archivar(2019)
+        apertura = int(consultar_registros(operacion='APERTURA')['id'].iloc[0])
+        filas = [(1, {'fecha': '2020-03-01', 'activo': 'SOL', 'operacion': 'COMPRA', 'cantidad': '1',
+                      'precio': '1', 'costo': '1', 'dolar': '10'}),
+                 (2, {'fecha': '2019-12-31', 'activo': 'SOL', 'operacion': 'COMPRA', 'cantidad': '1',
+                      'precio': '1', 'costo': '1', 'dolar': '10'})]
+
+        with self.assertRaisesRegex(ValueError, 'año archivado'):
+            registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 10, fecha="2019-12-31 10:00:00")
+        with self.assertRaisesRegex(ValueError, 'Fila 2: .*año archivado'):
+            importar_transacciones(filas)
+        with self.assertRaisesRegex(ValueError, 'año archivado'):
+            actualizar_transaccion(5, fecha="2019-06-01")
+        with self.assertRaisesRegex(ValueError, 'año archivado'):
+            actualizar_transaccion(apertura, cantidad=10)
+        with self.assertRaisesRegex(ValueError, 'año archivado'):
+            borrar_transaccion(apertura)
+        with self.assertRaisesRegex(ValueError, 'año archivado'):
+            actualizar_transacciones({'activo': 'BTC'}, fecha="2019-01-01")
+
+        # Nada cambió: ni la fila válida de la importación rechazada
+        self.assertEqual(len(consultar_registros(activo='SOL')), 0)
+        self.assertEqual(recalcular_saldos()['diferencias'], [])
+        # El día siguiente al cierre ya se puede registrar
+        saldo = calcular_saldos()['saldos']['BTC']
+        registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 10, fecha="2020-01-01")
+        self.assertEqual(calcular_saldos()['saldos']['BTC'], saldo + 1)
+
+    def test_reimportar_despues_de_archivar(self):
+        ruta_csv = os.path.join(self.directorio, 'extracto.csv')
+        with open(ruta_csv, 'w', encoding='utf-8') as archivo:
+            archivo.write("fecha,activo,operacion,cantidad,precio,costo,dolar,trade_id\n"
+                          "2019-04-01,ADA,COMPRA,1,1,1,10,T1\n"
+                          "2019-05-01,ADA,COMPRA,1,1,1,10,T2\n"
+                          "2021-03-01,ADA,COMPRA,1,1,1,10,T3\n")
+        self.assertEqual(importar_archivo(ruta_csv)['filas'], 3)
+        archivar(2019)
+        saldos = _con_saldo()
+
+        resultado = importar_archivo(ruta_csv)
+
+        self.assertEqual((resultado['filas'], resultado['duplicadas']), (0, 3))
+        self.assertEqual(_con_saldo(), saldos)
+        self.assertEqual(buscar_duplicados(), [])
+        archivado = sqlite3.connect(ruta_archivo(2019))
+        id_t1, = archivado.execute("SELECT id FROM transacciones WHERE id_externo = 'T1'").fetchone()
+        with self.assertRaises(TransaccionDuplicada) as contexto:
+            registrar_transaccion("ADA", "COMPRA", 1, 1, 1, 10, fecha="2019-04-01", id_externo="T1")
+        self.assertEqual(contexto.exception.id_existente, id_t1)
+
+        # Una copia que quedó en la base (de antes de comparar con los archivos) se encuentra y se puede borrar
+        conn = sqlite3.connect(self.ruta_db)
+        with conn:
+            conn.execute("ATTACH DATABASE ? AS a", (ruta_archivo(2019),))
+            id_copia = conn.execute("""
+                INSERT INTO transacciones (fecha, activo, operacion, cantidad, precio_unitario, costo_total,
+                                           dolar_cambio, id_externo, huella)
+                SELECT fecha, activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio, id_externo, huella
+                FROM a.transacciones WHERE id = ?
+            """, (id_t1,)).lastrowid
+        conn.close()
+        archivado.close()
+        self.assertEqual([(grupo['ids'], grupo['archivados']) for grupo in buscar_duplicados()],
+                         [([id_t1, id_copia], [id_t1])])
+        self.assertTrue(borrar_transaccion(id_copia))
+        self.assertEqual(buscar_duplicados(), [])
+
+    def test_no_archiva_saldos_negativos_ni_el_anio_en_curso(self):
+        registrar_transaccion("ADA", "VENTA", 1, 1, 1, 10, fecha="2019-05-01")
+        with self.assertRaisesRegex(ValueError, 'ADA'):
+            archivar(2019)
+        self.assertEqual(listar_archivos(), [])
+        self.assertEqual(len(consultar_registros()), 8)
+
+        with self.assertRaisesRegex(ValueError, 'cerrados'):
+            archivar(2999)
+
+    def test_cli_archivar(self):
+        salida = io.StringIO()
+        with redirect_stdout(salida):
+            codigo = main(['--db', self.ruta_db, 'archivar', '--hasta', '2019'])
+        db.configurar(self.ruta_db)
+
+        self.assertEqual(codigo, 0)
+        self.assertIn('2019: 4 transacciones archivadas', salida.getvalue())
+        self.assertIn('saldos de 1 activos idénticos', salida.getvalue())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import unittest
+from benchmarks.bench_crud import ejecutar_benchmarks
+from benchmarks.bench_enteros import comparar_almacenamiento
+from benchmarks.bench_portafolios import medir_portafolios
+from benchmarks.bench_valuacion import medir_valuacion
+from benchmarks.carga_api import ejecutar_carga
+from benchmarks.sintetico import generar_filas
+from gestor_inversiones import db
+
+class TestBenchmarks(unittest.TestCase):
+    def test_historial_reproducible(self):
+        primeras = [fila for _, fila in generar_filas(50, activos=5, semilla=7)]
+        self.assertEqual(primeras, [fila for _, fila in generar_filas(50, activos=5, semilla=7)])
+        self.assertEqual(sorted(f['fecha'] for f in primeras), [f['fecha'] for f in primeras])
+
+    def test_ejecutar_benchmarks(self):
+        ruta_previa = db.ruta_db()
+        resultado = ejecutar_benchmarks(transacciones=300, activos=5, muestras=5, repeticiones=2, incluir_cli=False)
+
+        self.assertEqual(db.ruta_db(), ruta_previa)
+        self.assertEqual(resultado['resultados']['importar_transacciones']['n'], 300)
+        for nombre in ('registrar_transaccion', 'actualizar_transaccion', 'borrar_transaccion',
+                       'calcular_saldos', 'consultar_registros[activo+operacion+rango]', 'consultar_pagina[profunda]'):
+            self.assertIn('p99_ms', resultado['resultados'][nombre])
+        self.assertGreater(resultado['rss_pico_mb'], 0)
+
+    def test_ejecutar_carga(self):
+        resultado = ejecutar_carga(conexiones=4, peticiones=200, transacciones=300, activos=5)
+
+        self.assertEqual(resultado['errores'], {'total': 0})
+        self.assertEqual(resultado['latencias']['n'], 200)
+        self.assertGreater(resultado['peticiones_por_segundo'], 0)
+        self.assertIn('p99_ms', resultado['por_tipo']['registrar'])
+        self.assertGreater(resultado['servidor']['escrituras'], 0)
+
+    def test_comparar_almacenamiento(self):
+        resultado = comparar_almacenamiento(transacciones=300, activos=5, repeticiones=1)
+
+        for esquema in ('reales', 'enteros'):
+            self.assertGreater(resultado[esquema]['tamano_mb'], 0)
+            self.assertIn('p99_ms', resultado[esquema]['resumen'])
+        self.assertIn('error_maximo', resultado['reales']['error_redondeo_saldos'])
+
+    def test_medir_valuacion(self):
+        ruta_previa = db.ruta_db()
+        resultado = medir_valuacion(transacciones=300, activos=5, dias=60, repeticiones=1)
+
+        self.assertEqual(db.ruta_db(), ruta_previa)
+        self.assertEqual(resultado['carga_precios']['filas'], 300)
+        self.assertEqual((resultado['valuacion']['dias'], resultado['valuacion']['activos']), (60, 5))
+        for variante in ('sqlite', 'columnar'):
+            self.assertIn('p99_ms', resultado['valuacion'][variante])
+
+    def test_medir_portafolios(self):
+        ruta_previa = db.ruta_db()
+        resultado = medir_portafolios(portafolios=3, transacciones=200, activos=5, repeticiones=1, procesos=2)
+
+        self.assertEqual(db.ruta_db(), ruta_previa)
+        for nombre in ('rendimiento', 'saldos'):
+            for variante in ('secuencial', 'paralelo'):
+                self.assertIn('p99_ms', resultado['resultados'][f"{nombre}[{variante}]"])
+            self.assertGreater(resultado['resultados'][f"{nombre}[aceleracion]"], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+import io
+import os
+import unittest
+from contextlib import redirect_stdout
+from tests.base import CasoConBaseTemporal
+from gestor_inversiones.cambio import (importar_tipos_cambio, registrar_tipo_cambio, tipo_cambio_al,
+                                       tipos_cambio_para, asignar_tipos_cambio, resumen_tipos_cambio)
+from gestor_inversiones.cli import main
+from gestor_inversiones.crud import registrar_transaccion, consultar_registros
+
+class TestTiposCambio(CasoConBaseTemporal):
+    def _csv(self, contenido):
+        ruta = os.path.join(self.directorio, 'cambio.csv')
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(contenido)
+        return ruta
+
+    def test_importar_y_consultar_al(self):
+        resultado = importar_tipos_cambio(self._csv("fecha,dolar\n2024-01-10,800\n2024-01-01,700.5\n2024-02-01,900\n"))
+
+        self.assertEqual(resultado['filas'], 3)
+        self.assertIsNone(tipo_cambio_al('2023-12-31'))
+        self.assertEqual(tipo_cambio_al('2024-01-01'), 700.5)
+        self.assertEqual(tipo_cambio_al('2024-01-15 10:30:00'), 800)
+        self.assertEqual(resumen_tipos_cambio(), {'filas': 3, 'desde': '2024-01-01', 'hasta': '2024-02-01', 'ultimo': 900})
+
+        # Reimportar reemplaza los valores de las fechas existentes
+        importar_tipos_cambio(self._csv("fecha,valor\n2024-01-10,810\n"))
+        self.assertEqual(tipo_cambio_al('2024-01-10'), 810)
+
+    def test_importar_fila_invalida_no_guarda_nada(self):
+        with self.assertRaisesRegex(ValueError, 'Fila 3'):
+            importar_tipos_cambio(self._csv("fecha,valor\n2024-01-01,700\n2024-01-02,0\n"))
+        self.assertEqual(resumen_tipos_cambio()['filas'], 0)
+
+    def test_tipos_cambio_para_lote_desordenado(self):
+        registrar_tipo_cambio('2024-01-01', 100)
+        registrar_tipo_cambio('2024-01-05', 105)
+
+        valores = tipos_cambio_para(['2024-01-06', '2023-12-31', '2024-01-05 00:00:00', '2024-01-04 23:59:59'])
+
+        self.assertEqual(valores[[0, 2, 3]].tolist(), [105, 105, 100])
+        self.assertTrue(valores[1] != valores[1])
+
+    def test_asignar_tipos_cambio(self):
+        registrar_tipo_cambio('2024-01-01', 100)
+        registrar_tipo_cambio('2024-02-01', 200)
+        registrar_transaccion("BTC", "COMPRA", 1, 10, 10, 0, fecha="2024-01-15")
+        registrar_transaccion("BTC", "COMPRA", 1, 10, 10, 150, fecha="2024-02-15")
+        df = consultar_registros().sort_values('fecha')
+
+        self.assertEqual(asignar_tipos_cambio(df)['dolar_cambio'].tolist(), [100, 150])
+        self.assertEqual(asignar_tipos_cambio(df, todos=True)['dolar_cambio'].tolist(), [100, 200])
+
+        registrar_transaccion("BTC", "COMPRA", 1, 10, 10, 0, fecha="2023-06-01")
+        with self.assertRaisesRegex(ValueError, '2023-06-01'):
+            asignar_tipos_cambio(consultar_registros())
+
+class TestCliCambio(CasoConBaseTemporal):
+    def _cli(self, *argumentos):
+        salida = io.StringIO()
+        with redirect_stdout(salida):
+            codigo = main(['--db', self.ruta_db, *argumentos])
+        return codigo, salida.getvalue()
+
+    def test_registro_sin_dolar_usa_la_serie(self):
+        self.assertEqual(self._cli('registro', '--activo', 'BTC', '--operacion', 'COMPRA', '--cantidad', '1',
+                                   '--precio', '10', '--costo', '10', '--fecha', '2024-01-01')[0], 1)
+
+        self.assertEqual(self._cli('cambio', '--fecha', '2024-01-01', '--valor', '850')[0], 0)
+        codigo, _ = self._cli('registro', '--activo', 'BTC', '--operacion', 'COMPRA', '--cantidad', '1',
+                              '--precio', '10', '--costo', '10', '--fecha', '2024-01-03')
+        self.assertEqual(codigo, 0)
+        self.assertEqual(consultar_registros()['dolar_cambio'].tolist(), [850])
+
+    def test_rendimiento_con_tipo_de_cambio_de_la_serie(self):
+        registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 10, fecha="2024-01-01")
+        registrar_transaccion("BTC", "VENTA", 1, 150, 150, 10, fecha="2024-02-01")
+        registrar_tipo_cambio('2024-01-01', 1000)
+        registrar_tipo_cambio('2024-02-01', 2000)
+
+        _, registro = self._cli('rendimiento')
+        _, serie = self._cli('rendimiento', '--cambio', 'serie')
+
+        self.assertIn('Realizado local:         500.00', registro)
+        self.assertIn('Realizado local:      200000.00', serie)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,129 @@
+import io
+import os
+import subprocess
+import sys
+import unittest
+from contextlib import redirect_stdout, redirect_stderr
+from tests.base import CasoConBaseTemporal
+from gestor_inversiones import db
+from gestor_inversiones.cli import construir_parser, ejecutar
+from gestor_inversiones.crud import calcular_saldos, consultar_registros
+from gestor_inversiones.shell import ejecutar_shell
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Módulos pesados que los comandos de escritura y el resumen no deben cargar
+MODULOS_PESADOS = ('pandas', 'numpy')
+
+class TestArranque(CasoConBaseTemporal):
+    def _modulos_importados(self, *argumentos):
+        proceso = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-m', 'gestor_inversiones', '--db', self.ruta_db, *argumentos],
+            cwd=RAIZ, capture_output=True, text=True, check=True,
+        )
+        # Formato de cada línea: "import time: propio | acumulado | [sangría]modulo"
+        return {
+            linea.rsplit('|', 1)[1].strip()
+            for linea in proceso.stderr.splitlines()
+            if linea.startswith('import time:') and '|' in linea
+        }
+
+    def test_comandos_de_escritura_no_importan_pandas(self):
+        archivo = os.path.join(self.directorio, 'filas.csv')
+        with open(archivo, 'w', encoding='utf-8') as f:
+            f.write("activo,operacion,cantidad,precio,costo,dolar\nETH,COMPRA,1,10,10,1\n")
+
+        comandos = [
+            ['registro', '--activo', 'BTC', '--operacion', 'COMPRA', '--cantidad', '1',
+             '--precio', '10', '--costo', '10', '--dolar', '1', '--fecha', '2024-01-01'],
+            ['actualizar', '--id', '1', '--cantidad', '2'],
+            ['importar', '--archivo', archivo],
+            ['resumen', '--validar'],
+            ['consulta', '--limit', '5', '--columnas', 'fecha,activo,cantidad'],
+            ['actualizar', '--filtro-activo', 'ETH', '--dolar', '2'],
+            ['deshacer'],
+            ['borrar', '--id', '1'],
+        ]
+        for comando in comandos:
+            modulos = self._modulos_importados(*comando)
+            self.assertIn('gestor_inversiones.crud', modulos)
+            for pesado in MODULOS_PESADOS:
+                self.assertNotIn(pesado, modulos, f"'{comando[0]}' importa {pesado}")
+
+class TestCambiosMasivos(CasoConBaseTemporal):
+    def _ejecutar(self, *argumentos):
+        salida = io.StringIO()
+        with redirect_stdout(salida):
+            codigo = ejecutar(construir_parser().parse_args(argumentos))
+        return codigo, salida.getvalue()
+
+    def test_actualizar_borrar_y_deshacer(self):
+        for dia, activo in ((1, 'BTC'), (2, 'BTC'), (3, 'ETH')):
+            self._ejecutar('registro', '--activo', activo, '--operacion', 'COMPRA', '--cantidad', '1', '--precio', '10',
+                           '--costo', '10', '--dolar', '1', '--fecha', f'2024-01-0{dia}')
+
+        codigo, texto = self._ejecutar('actualizar', '--filtro-activo', 'BTC', '--dolar', '1050', '--dry-run')
+        self.assertEqual(codigo, 0)
+        self.assertIn('Se actualizarían 2 transacciones (BTC: 2). No se cambió nada.', texto)
+        self.assertEqual(consultar_registros()['dolar_cambio'].tolist(), [1, 1, 1])
+
+        self.assertEqual(self._ejecutar('actualizar', '--filtro-activo', 'BTC', '--dolar', '1050')[0], 0)
+        codigo, texto = self._ejecutar('borrar', '--desde', '2024-01-02')
+        self.assertIn('2 transacciones borradas (BTC: 1, ETH: 1). Cambio #2', texto)
+        self.assertEqual(self._ejecutar('borrar', '--id', '1', '--activo', 'BTC')[0], 1)
+        self.assertEqual(self._ejecutar('borrar', '--activo', 'SOL')[0], 1)
+
+        self.assertEqual(self._ejecutar('deshacer')[0], 0)
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 2, 'ETH': 1})
+        self.assertEqual(self._ejecutar('deshacer')[0], 0)
+        self.assertEqual(consultar_registros()['dolar_cambio'].tolist(), [1, 1, 1])
+        codigo, texto = self._ejecutar('deshacer', '--listar')
+        self.assertEqual(texto.count('deshecho el'), 2)
+
+class TestShell(CasoConBaseTemporal):
+    def _shell(self, script, **opciones):
+        salida = io.StringIO()
+        with redirect_stdout(salida), redirect_stderr(io.StringIO()):
+            codigo = ejecutar_shell(construir_parser(), ejecutar, io.StringIO(script), interactivo=False, **opciones)
+        return codigo, salida.getvalue()
+
+    def test_ejecuta_script_e_informa_cada_linea(self):
+        script = (
+            "# compras iniciales\n"
+            "registro --activo BTC --operacion COMPRA --cantidad 1 --precio 10 --costo 10 --dolar 1 --fecha 2024-01-01\n"
+            "\n"
+            "registro --activo BTC --operacion VENTA --cantidad 5 --precio 10 --costo 50 --dolar 1 --fecha 2024-01-02 --estricto\n"
+            "registro --activo 'ETH' --operacion COMPRA --cantidad 2 --precio 5 --costo 10 --dolar 1\n"
+            "comando_inexistente\n"
+            "resumen\n"
+        )
+        codigo, salida = self._shell(script)
+
+        self.assertEqual(codigo, 1)
+        self.assertIn("--- línea 2: OK (0)", salida)
+        self.assertIn("--- línea 4: ERROR (1)", salida)
+        self.assertIn("--- línea 5: OK (0)", salida)
+        self.assertIn("--- línea 6: ERROR (2)", salida)
+        self.assertIn("--- línea 7: OK (0)", salida)
+        # La venta rechazada se deshizo sin afectar al resto del grupo
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 1.0, 'ETH': 2.0})
+
+    def test_agrupa_escrituras_y_confirma(self):
+        lineas = [
+            f"registro --activo BTC --operacion COMPRA --cantidad 1 --precio 1 --costo 1 --dolar 1 --fecha 2024-01-{dia:02d}"
+            for dia in range(1, 11)
+        ]
+        codigo, _ = self._shell('\n'.join(lineas) + '\nsalir\nborrar --id 1\n', tamano_grupo=3)
+
+        self.assertEqual(codigo, 0)
+        self.assertFalse(db.obtener_conexion().in_transaction)
+        # 'salir' termina el shell antes del borrado
+        self.assertEqual(len(consultar_registros()), 10)
+
+    def test_rechaza_shell_anidado(self):
+        codigo, salida = self._shell("shell\n")
+        self.assertEqual(codigo, 1)
+        self.assertIn("--- línea 1: ERROR (2)", salida)
+
+if __name__ == '__main__':
+    unittest.main()
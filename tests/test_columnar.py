@@ -0,0 +1,116 @@
+import io
+import os
+import unittest
+from contextlib import redirect_stdout
+import numpy as np
+import pandas as pd
+from tests.base import CasoConBaseTemporal
+from gestor_inversiones import columnar, db
+from gestor_inversiones.cli import main
+from gestor_inversiones.crud import (registrar_transaccion, consultar_registros, actualizar_transaccion,
+                                     borrar_transaccion, calcular_saldos)
+
+class TestCacheColumnar(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        registrar_transaccion("BTC", "COMPRA", 1.5, 10, 15, 1000, fecha="2025-01-01")
+        registrar_transaccion("ETH", "COMPRA", 4, 5, 20, 1000, fecha="2025-01-01 10:30:00")
+        registrar_transaccion("BTC", "VENTA", 0.5, 12, 6, 1100, fecha="2025-02-15T08:00:00")
+        # Registrada después pero con fecha anterior: el orden no coincide con el id
+        registrar_transaccion("eth", "VENTA", 1, 6, 6, 1050, fecha="2024-12-31")
+
+    def tearDown(self):
+        columnar.habilitar(None)
+        columnar.borrar_cache()
+        super().tearDown()
+
+    def _comparar(self, **filtros):
+        columnar.habilitar(False)
+        esperado = consultar_registros(**filtros)
+        columnar.habilitar(True)
+        obtenido = consultar_registros(**filtros)
+        pd.testing.assert_frame_equal(obtenido, esperado, check_dtype=False)
+
+    def test_consultas_coinciden_con_sqlite(self):
+        for filtros in ({}, {'activo': 'btc'}, {'operacion': 'VENTA'}, {'activo': 'XRP'},
+                        {'fecha_desde': '2025-01-01', 'fecha_hasta': '2025-01-31'},
+                        {'despues_de_id': 2}, {'orden': 'asc', 'columnas': ['fecha', 'activo', 'cantidad']}):
+            self._comparar(**filtros)
+
+    def test_archivos_mapeados_en_memoria(self):
+        self.assertEqual(columnar.actualizar_cache()['accion'], 'reconstruida')
+        instantanea = columnar.obtener_instantanea()
+        self.assertIsInstance(instantanea.columnas['cantidad'], np.memmap)
+        self.assertEqual(instantanea.activos, ['BTC', 'ETH'])
+        self.assertEqual(instantanea.columnas['activo'].dtype, np.dtype('<i4'))
+        self.assertTrue(os.path.isdir(columnar.ruta_cache(self.ruta_db)))
+
+    def test_altas_extienden_y_cambios_reconstruyen(self):
+        columnar.actualizar_cache()
+        self.assertEqual(columnar.actualizar_cache()['accion'], 'vigente')
+
+        registrar_transaccion("SOL", "COMPRA", 10, 1, 10, 1000, fecha="2025-03-01")
+        resultado = columnar.actualizar_cache()
+        self.assertEqual(resultado['accion'], 'extendida')
+        self.assertEqual(resultado['filas'], 5)
+        self._comparar()
+
+        actualizar_transaccion(1, cantidad=2)
+        self.assertEqual(columnar.actualizar_cache()['accion'], 'reconstruida')
+        self._comparar()
+
+        borrar_transaccion(2)
+        self._comparar()
+
+    def test_detecta_escrituras_de_otras_conexiones(self):
+        columnar.habilitar(True)
+        self.assertEqual(len(consultar_registros()), 4)
+
+        # Otra conexión (como lo haría otro proceso) modifica la base
+        conn = db.get_db_connection()
+        try:
+            conn.execute("UPDATE transacciones SET cantidad = 900000000 WHERE id = 1")
+            conn.commit()
+        finally:
+            conn.close()
+        self.assertEqual(consultar_registros(activo="BTC").sort_values('id')['cantidad'].tolist(), [9, 0.5])
+
+    def test_no_guarda_filas_sin_confirmar(self):
+        columnar.habilitar(True)
+        with db.transaccion():
+            registrar_transaccion("ADA", "COMPRA", 1, 1, 1, 1)
+            self.assertIsNone(columnar.obtener_instantanea())
+            self.assertEqual(len(consultar_registros()), 5)
+        self.assertEqual(columnar.obtener_instantanea().filas, 5)
+
+    def test_totales_por_activo(self):
+        totales = columnar.totales_por_activo()
+        saldos = calcular_saldos()['saldos']
+        self.assertEqual({activo: datos['saldo'] for activo, datos in totales.items()}, saldos)
+        self.assertEqual(columnar.totales_por_activo(fecha_hasta="2025-01-31")['BTC']['saldo'], 1.5)
+
+    def test_saldos_a_una_fecha(self):
+        esperados = [calcular_saldos(al=fecha) for fecha in ("2024-12-31", "2025-01-31", "2025-03-01")]
+        columnar.habilitar(True)
+        self.assertEqual([calcular_saldos(al=fecha) for fecha in ("2024-12-31", "2025-01-31", "2025-03-01")],
+                         esperados)
+        self.assertEqual(columnar.obtener_instantanea().totales_enteros(fecha_hasta="2025-01-31"),
+                         [('BTC', 150000000, 0, 100000000), ('ETH', 400000000, 100000000, 100000000)])
+
+    def test_cli_consulta_y_resumen_usan_la_cache(self):
+        salidas = []
+        for opciones in ([], ['--cache']):
+            salida = io.StringIO()
+            with redirect_stdout(salida):
+                main(['--db', self.ruta_db, *opciones, 'consulta', '--activo', 'BTC'])
+                # La consulta sola ya construye la caché
+                self.assertEqual(os.path.isdir(columnar.ruta_cache(self.ruta_db)), bool(opciones))
+                main(['--db', self.ruta_db, *opciones, 'resumen', '--al', '2025-01-31'])
+            salidas.append(salida.getvalue())
+            db.configurar(self.ruta_db)
+
+        self.assertEqual(salidas[0], salidas[1])
+        self.assertIn('SALDOS POR ACTIVO AL 2025-01-31', salidas[1])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import io
+import os
+import sqlite3
+import unittest
+from contextlib import redirect_stdout
+from tests.base import CasoConBaseTemporal
+from gestor_inversiones import db
+from gestor_inversiones.cli import main
+from gestor_inversiones.consolidado import (listar_portafolios, consolidar_saldos, consolidar_registros,
+                                            consolidar_rendimiento)
+from gestor_inversiones.crud import registrar_transaccion, definir_escala
+
+class TestConsolidado(CasoConBaseTemporal):
+    def _en(self, portafolio):
+        db.configurar(db.ruta_portafolio(portafolio, self.directorio))
+
+    def setUp(self):
+        super().setUp()
+        self._en('ana')
+        registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 10, fecha="2024-01-01")
+        registrar_transaccion("BTC", "VENTA", 0.25, 200, 50, 10, fecha="2024-02-01")
+        self._en('bruno')
+        definir_escala("BTC", 10)
+        registrar_transaccion("BTC", "COMPRA", 0.1, 150, 15, 10, fecha="2024-01-15")
+        registrar_transaccion("ETH", "COMPRA", 2, 10, 20, 10, fecha="2024-03-01")
+        db.configurar(self.ruta_db)
+        # Otros archivos del directorio que no son portafolios
+        sqlite3.connect(os.path.join(self.directorio, 'otra.db')).execute("CREATE TABLE x (y)").connection.close()
+        open(os.path.join(self.directorio, 'ana.2023.db'), 'w').close()
+
+    def test_listar_y_seleccionar(self):
+        self.assertEqual(listar_portafolios(), ['ana', 'bruno'])
+        with self.assertRaisesRegex(ValueError, 'no válido'):
+            db.ruta_portafolio('../ana')
+
+    def test_consolidar_saldos(self):
+        for procesos in (1, 2):
+            resultado = consolidar_saldos(procesos=procesos)
+            self.assertEqual(resultado['saldos'], {'BTC': 0.85, 'ETH': 2})
+            self.assertEqual(resultado['por_portafolio'], {'ana': {'BTC': 0.75}, 'bruno': {'BTC': 0.1, 'ETH': 2}})
+        self.assertEqual(consolidar_saldos(['ana'], al='2024-01-31')['saldos'], {'BTC': 1})
+        with self.assertRaisesRegex(ValueError, 'No existe el portafolio carla'):
+            consolidar_saldos(['ana', 'carla'])
+        with self.assertRaisesRegex(ValueError, 'procesos debe ser mayor que cero'):
+            consolidar_saldos(procesos=0)
+        # La consolidación no cambia la base configurada del proceso
+        self.assertEqual(db.ruta_db(), self.ruta_db)
+
+    def test_consolidar_registros(self):
+        df = consolidar_registros(procesos=2, orden='asc')
+        self.assertEqual(list(df.columns[:2]), ['portafolio', 'id'])
+        self.assertEqual(list(zip(df['portafolio'], df['fecha'])), [
+            ('ana', '2024-01-01'), ('bruno', '2024-01-15'), ('ana', '2024-02-01'), ('bruno', '2024-03-01')])
+        self.assertEqual(len(consolidar_registros(activo='ETH')), 1)
+        self.assertEqual(list(consolidar_registros(activo='SOL').columns[:1]), ['portafolio'])
+
+    def test_consolidar_rendimiento(self):
+        resultado = consolidar_rendimiento(precios={'BTC': 300}, procesos=2)
+        btc = resultado['rendimientos'].set_index('activo').loc['BTC']
+
+        # Cada portafolio consume sus propios lotes; el consolidado suma
+        self.assertAlmostEqual(btc['cantidad'], 0.85)
+        self.assertAlmostEqual(btc['costo_usd'], 75 + 15)
+        self.assertAlmostEqual(btc['realizado_usd'], 50 - 25)
+        self.assertAlmostEqual(btc['no_realizado_usd'], 0.85 * 300 - 90)
+        self.assertTrue(resultado['rendimientos'].set_index('activo')['no_realizado_usd'].isna()['ETH'])
+        self.assertEqual(len(resultado['por_portafolio']), 3)
+
+    def test_cli(self):
+        salida = io.StringIO()
+        with redirect_stdout(salida):
+            codigo_registro = main(['--db', self.ruta_db, '--portafolio', 'carla', 'registro', '--activo', 'SOL',
+                                    '--operacion', 'COMPRA', '--cantidad', '3', '--precio', '1', '--costo', '3',
+                                    '--dolar', '10', '--fecha', '2024-04-01'])
+            main(['--db', self.ruta_db, 'portafolios'])
+            codigo_resumen = main(['--db', self.ruta_db, 'consolidado', 'resumen', '--detalle', '--procesos', '2'])
+            codigo_consulta = main(['--db', self.ruta_db, 'consolidado', 'consulta', '--portafolios', 'ana,carla'])
+            codigo_error = main(['--db', self.ruta_db, '--portafolio', 'a.b', 'resumen'])
+        db.configurar(self.ruta_db)
+
+        self.assertEqual((codigo_registro, codigo_resumen, codigo_consulta, codigo_error), (0, 0, 0, 1))
+        texto = salida.getvalue()
+        self.assertTrue(os.path.exists(os.path.join(self.directorio, 'carla.db')))
+        self.assertIn('SALDOS CONSOLIDADOS (3 portafolios)', texto)
+        self.assertIn('📁 CARLA', texto)
+        self.assertIn('SOL      | Saldo:   3.00000000', texto)
+        self.assertIn('3 registros de 2 portafolios', texto)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,7 +1,16 @@
+import os
 import unittest
-from gestor_inversiones.crud import registrar_compra, consultar_registros, borrar_transaccion
+from gestor_inversiones import db
+from gestor_inversiones.crud import (registrar_compra, registrar_transaccion, consultar_registros, borrar_transaccion,
+                                     actualizar_transaccion, calcular_saldos, recalcular_saldos, validar_inventario,
+                                     ErrorInventario, importar_archivo, consultar_pagina, iterar_paginas, _consulta_sql,
+                                     definir_escala, listar_escalas, actualizar_cortes, cortes_pendientes,
+                                     TransaccionDuplicada, buscar_duplicados, listar_marcas_agua,
+                                     actualizar_transacciones, borrar_transacciones, deshacer_cambio, listar_cambios)
+from gestor_inversiones.utils import a_unidades
+from tests.base import CasoConBaseTemporal
 
-class TestCrud(unittest.TestCase):
+class TestCrud(CasoConBaseTemporal):
     def test_registro_consulta(self):
         # Prueba de registro
         registrar_compra("BTC", "CRYPTO", 0.1, 35000, 3500, 1000)
@@ -12,5 +21,451 @@ class TestCrud(unittest.TestCase):
         ultimo_id = df.iloc[-1]['id']
         self.assertTrue(borrar_transaccion(ultimo_id))
 
+class TestFiltros(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        registrar_transaccion("btc", "COMPRA", 1, 10, 10, 1, fecha="2025-11-01")
+        registrar_transaccion("BTC", "VENTA", 0.5, 12, 6, 1, fecha="2025-11-30T23:59:59")
+        registrar_transaccion("ETH", "COMPRA", 2, 5, 10, 1, fecha="2025-12-01")
+
+    def test_filtros_por_activo_y_rango(self):
+        self.assertEqual(len(consultar_registros(activo="Btc")), 2)
+        self.assertEqual(len(consultar_registros(fecha_desde="2025-11-01", fecha_hasta="2025-11-30")), 2)
+        self.assertEqual(len(consultar_registros(operacion="COMPRA", fecha_desde="2025-11-02")), 1)
+
+    def test_filtros_usan_indices(self):
+        combinaciones = [
+            {'activo': 'BTC'},
+            {'operacion': 'VENTA'},
+            {'fecha_desde': '2025-11-01'},
+            {'fecha_hasta': '2025-11-30'},
+            {'activo': 'BTC', 'operacion': 'COMPRA'},
+            {'activo': 'BTC', 'fecha_desde': '2025-11-01', 'fecha_hasta': '2025-11-30'},
+            {'operacion': 'COMPRA', 'fecha_desde': '2025-11-01'},
+        ]
+        conn = db.obtener_conexion()
+        for filtros in combinaciones:
+            query, params = _consulta_sql("*", **filtros)
+            plan = " | ".join(fila[3] for fila in conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+            self.assertNotIn("SCAN", plan, f"{filtros}: {plan}")
+            self.assertIn("USING INDEX", plan, f"{filtros}: {plan}")
+
+class TestPaginacion(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        # Varias transacciones comparten fecha: el id desempata el orden. Las dos de BTC
+        # de cada día son idénticas; el id externo evita que se descarten como duplicadas
+        for dia in range(1, 8):
+            for indice, activo in enumerate(("BTC", "ETH", "BTC")):
+                registrar_transaccion(activo, "COMPRA", dia, 1, dia, 1, fecha=f"2025-01-{dia:02d}",
+                                      id_externo=f"{dia}-{indice}")
+
+    def _recorrer(self, **opciones):
+        filas = []
+        for pagina in iterar_paginas(tamano_pagina=4, **opciones):
+            self.assertLessEqual(len(pagina['filas']), 4)
+            filas.extend(pagina['filas'])
+        return filas
+
+    def test_paginas_cubren_todo_sin_repetir(self):
+        descendente = self._recorrer(columnas=['id', 'fecha'])
+        self.assertEqual(len(descendente), 21)
+        self.assertEqual(descendente, sorted(descendente, key=lambda fila: (fila[1], fila[0]), reverse=True))
+
+        ascendente = self._recorrer(columnas=['id', 'fecha'], orden='asc')
+        self.assertEqual(ascendente, descendente[::-1])
+        self.assertEqual(len(self._recorrer(activo="BTC", fecha_desde="2025-01-03")), 10)
+
+    def test_cursor_y_columnas(self):
+        primera = consultar_pagina(activo="ETH", columnas="cantidad,costo", limite=5, orden='asc')
+        self.assertEqual(primera['columnas'], ['cantidad', 'costo_total'])
+        self.assertEqual([fila[0] for fila in primera['filas']], [1, 2, 3, 4, 5])
+
+        segunda = consultar_pagina(activo="ETH", columnas="cantidad,costo", limite=5, orden='asc', cursor=primera['cursor'])
+        self.assertEqual([fila[0] for fila in segunda['filas']], [6, 7])
+        self.assertIsNone(segunda['cursor'])
+
+        df = consultar_registros(activo="ETH", limite=5, orden='asc', cursor=primera['cursor'])
+        self.assertEqual(list(df['cantidad']), [6, 7])
+        self.assertIsNone(df.attrs['cursor'])
+
+    def test_errores(self):
+        pagina = consultar_pagina(limite=2)
+        with self.assertRaises(ValueError):
+            consultar_pagina(limite=2, orden='asc', cursor=pagina['cursor'])
+        with self.assertRaises(ValueError):
+            consultar_pagina(cursor='no-es-un-cursor')
+        with self.assertRaises(ValueError):
+            consultar_pagina(columnas='id,contraseña')
+        with self.assertRaises(ValueError):
+            consultar_pagina(orden='aleatorio')
+
+    def test_busqueda_por_clave_usa_indices(self):
+        conn = db.obtener_conexion()
+        for orden in ('desc', 'asc'):
+            for filtros in ({}, {'activo': 'BTC'}, {'operacion': 'COMPRA', 'fecha_desde': '2025-01-01'}):
+                query, params = _consulta_sql("*", orden=orden, posicion=('2025-01-04', 10), limite=5, **filtros)
+                plan = " | ".join(fila[3] for fila in conn.execute(f"EXPLAIN QUERY PLAN {query}", params))
+                self.assertIn("USING INDEX", plan, f"{filtros}: {plan}")
+                self.assertNotIn("TEMP B-TREE", plan, f"{filtros}: {plan}")
+
+class TestSaldos(CasoConBaseTemporal):
+    def _ids(self):
+        return list(consultar_registros().sort_values('id')['id'])
+
+    def test_saldos_siguen_altas_cambios_y_bajas(self):
+        registrar_transaccion("BTC", "COMPRA", 1.0, 10, 10, 1)
+        registrar_transaccion("BTC", "VENTA", 0.25, 12, 3, 1)
+        registrar_transaccion("ETH", "COMPRA", 2.0, 5, 10, 1)
+        compra_btc, venta_btc, compra_eth = self._ids()
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 0.75, 'ETH': 2.0})
+
+        # Cambiar activo, operación y cantidad mueve el saldo entre activos
+        actualizar_transaccion(venta_btc, activo="ETH", cantidad=0.5)
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 1.0, 'ETH': 1.5})
+        actualizar_transaccion(compra_eth, operacion="VENTA")
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 1.0, 'ETH': -2.5})
+        self.assertEqual(len(calcular_saldos()['alertas']), 1)
+
+        # Al borrar la última transacción de un activo, desaparece del resumen
+        borrar_transaccion(compra_btc)
+        self.assertEqual(calcular_saldos()['saldos'], {'ETH': -2.5})
+
+    def test_recalcular_detecta_desvios(self):
+        registrar_transaccion("BTC", "COMPRA", 1.0, 10, 10, 1)
+        self.assertEqual(recalcular_saldos()['diferencias'], [])
+
+        db.obtener_conexion().execute("UPDATE saldos SET compras = 500000000 WHERE activo = 'BTC'")
+        resultado = recalcular_saldos()
+        self.assertEqual(resultado['diferencias'], [{'activo': 'BTC', 'guardado': 5.0, 'recalculado': 1.0}])
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 1.0})
+
+class TestSaldosAlFecha(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        self.compra_enero = registrar_transaccion("BTC", "COMPRA", 1.0, 10, 10, 1, fecha="2024-01-10")
+        registrar_transaccion("BTC", "VENTA", 0.25, 10, 2.5, 1, fecha="2024-02-20")
+        registrar_transaccion("ETH", "COMPRA", 3.0, 5, 15, 1, fecha="2024-02-01T12:00:00")
+        self.venta_marzo = registrar_transaccion("BTC", "VENTA", 0.5, 10, 5, 1, fecha="2024-03-31 23:59:59")
+
+    def _cortes(self):
+        return db.obtener_conexion().execute("SELECT activo, mes, compras, ventas FROM cortes_saldos ORDER BY activo, mes").fetchall()
+
+    def test_saldos_a_fin_de_dia(self):
+        self.assertEqual(calcular_saldos(al="2023-12-31")['saldos'], {})
+        self.assertEqual(calcular_saldos(al="2024-01-10")['saldos'], {'BTC': 1.0})
+        self.assertEqual(calcular_saldos(al="2024-02-29")['saldos'], {'BTC': 0.75, 'ETH': 3.0})
+        self.assertEqual(calcular_saldos(al="2024-03-31")['saldos'], calcular_saldos()['saldos'])
+        self.assertFalse(cortes_pendientes())
+        self.assertEqual(self._cortes(), [('BTC', '2024-01', 100000000, 0), ('BTC', '2024-02', 100000000, 25000000),
+                                          ('BTC', '2024-03', 100000000, 75000000), ('ETH', '2024-02', 300000000, 0)])
+
+    def test_cambios_en_meses_cortados_invalidan(self):
+        actualizar_cortes()
+        actualizar_transaccion(self.compra_enero, fecha="2024-02-05", cantidad=2)
+        self.assertEqual(self._cortes(), [('ETH', '2024-02', 300000000, 0)])
+        self.assertEqual(calcular_saldos(al="2024-01-31", completar_cortes=False)['saldos'], {})
+        self.assertEqual(calcular_saldos(al="2024-02-29")['saldos'], {'BTC': 1.75, 'ETH': 3.0})
+
+        # Una baja en marzo sólo invalida los cortes de marzo en adelante
+        borrar_transaccion(self.venta_marzo)
+        self.assertEqual([corte[:2] for corte in self._cortes()], [('BTC', '2024-02'), ('ETH', '2024-02')])
+        self.assertEqual(calcular_saldos(al="2024-12-31")['saldos'], {'BTC': 1.75, 'ETH': 3.0})
+
+        # Un alta con fecha atrasada también
+        registrar_transaccion("ETH", "VENTA", 1, 5, 5, 1, fecha="2024-01-15")
+        self.assertEqual(calcular_saldos(al="2024-01-31")['saldos'], {'ETH': -1.0})
+        self.assertEqual(len(calcular_saldos(al="2024-01-31")['alertas']), 1)
+        self.assertEqual(calcular_saldos(al="2024-03-01")['saldos'], {'BTC': 1.75, 'ETH': 2.0})
+
+class TestPuntoFijo(CasoConBaseTemporal):
+    def test_saldos_exactos(self):
+        for _ in range(3):
+            registrar_transaccion("BTC", "COMPRA", 0.1, 10, 1, 1)
+        registrar_transaccion("BTC", "VENTA", 0.3, 10, 3, 1)
+        # En float, 0.1 + 0.1 + 0.1 - 0.3 deja un residuo de 5.5e-17
+        self.assertEqual(calcular_saldos(), {'saldos': {'BTC': 0.0}, 'alertas': []})
+        self.assertEqual(validar_inventario(tolerancia=0), [])
+
+    def test_conversion_en_el_borde(self):
+        self.assertEqual(a_unidades(0.29, 10 ** 8), 29000000)
+        self.assertEqual(a_unidades("12345678.12345678", 10 ** 8), 1234567812345678)
+        self.assertEqual(a_unidades(1.000000005, 10 ** 8), 100000000)
+        with self.assertRaises(ValueError):
+            a_unidades(1e12, 10 ** 8)
+
+        id_nuevo = registrar_transaccion("BTC", "COMPRA", 0.12345678, 45000.12, 5555.67, 1050.5)
+        fila = consultar_registros().iloc[0]
+        self.assertEqual((fila['id'], fila['cantidad'], fila['precio_unitario'], fila['dolar_cambio']),
+                         (id_nuevo, 0.12345678, 45000.12, 1050.5))
+
+    def test_escala_por_activo(self):
+        registrar_transaccion("ETH", "COMPRA", 1.5, 10, 15, 1)
+        self.assertEqual(listar_escalas(), {'ETH': 8})
+
+        self.assertEqual(definir_escala("eth", 12), 1)
+        registrar_transaccion("ETH", "VENTA", 0.000000000001, 10, 0, 1)
+        self.assertEqual(calcular_saldos()['saldos'], {'ETH': 1.499999999999})
+        self.assertEqual(db.obtener_conexion().execute("SELECT MAX(cantidad) FROM transacciones").fetchone(),
+                         (1500000000000,))
+
+        # Bajar a 8 decimales perdería la venta de 10^-12
+        with self.assertRaises(ValueError):
+            definir_escala("ETH", 8)
+        self.assertEqual(listar_escalas(), {'ETH': 12})
+
+        # Al pasar una transacción a otro activo, la cantidad se reexpresa en su escala
+        id_compra = int(consultar_registros(activo="ETH", operacion="COMPRA")['id'][0])
+        actualizar_transaccion(id_compra, activo="BTC")
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 1.5, 'ETH': -0.000000000001})
+
+class TestInventario(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        registrar_transaccion("BTC", "COMPRA", 1, 10, 10, 1, fecha="2024-01-01")
+        registrar_transaccion("BTC", "VENTA", 1.5, 10, 15, 1, fecha="2024-02-01")
+        registrar_transaccion("BTC", "COMPRA", 2, 10, 20, 1, fecha="2024-03-01")
+        registrar_transaccion("ETH", "COMPRA", 1, 10, 10, 1, fecha="2024-01-01")
+
+    def test_detecta_sobreventa_transitoria(self):
+        # El saldo final es positivo, pero en febrero se vendió más de lo que había
+        self.assertEqual(calcular_saldos()['alertas'], [])
+        sobreventas = validar_inventario()
+        self.assertEqual(len(sobreventas), 1)
+        self.assertEqual(sobreventas[0]['activo'], 'BTC')
+        self.assertEqual(sobreventas[0]['fecha'], '2024-02-01')
+        self.assertAlmostEqual(sobreventas[0]['faltante'], 0.5)
+        self.assertEqual(validar_inventario(activo="eth"), [])
+
+    def test_registro_estricto_rechaza_sobreventa(self):
+        with self.assertRaises(ErrorInventario) as contexto:
+            registrar_transaccion("ETH", "VENTA", 2, 10, 20, 1, fecha="2024-02-01", estricto=True)
+        self.assertAlmostEqual(contexto.exception.sobreventa['faltante'], 1)
+        self.assertEqual(len(consultar_registros(activo="ETH")), 1)
+
+        # Una venta que sí está cubierta se guarda
+        registrar_transaccion("ETH", "VENTA", 0.5, 10, 5, 1, fecha="2024-02-01", estricto=True)
+        self.assertEqual(calcular_saldos()['saldos']['ETH'], 0.5)
+
+    def test_registro_estricto_revisa_operaciones_posteriores(self):
+        registrar_transaccion("ETH", "VENTA", 1, 10, 10, 1, fecha="2024-06-01")
+        # Una venta con fecha anterior deja sin cubrir la venta de junio
+        with self.assertRaises(ErrorInventario) as contexto:
+            registrar_transaccion("ETH", "VENTA", 0.5, 10, 5, 1, fecha="2024-03-01", estricto=True)
+        self.assertEqual(contexto.exception.sobreventa['fecha'], '2024-06-01')
+
+    def test_actualizar_estricto(self):
+        id_eth = int(consultar_registros(activo="ETH")['id'].iloc[0])
+        registrar_transaccion("ETH", "VENTA", 0.5, 10, 5, 1, fecha="2024-05-01")
+
+        # Convertir la única compra de ETH en venta, o moverla a otro activo,
+        # deja descubierta la venta de mayo
+        with self.assertRaises(ErrorInventario):
+            actualizar_transaccion(id_eth, estricto=True, operacion="VENTA")
+        with self.assertRaises(ErrorInventario) as contexto:
+            actualizar_transaccion(id_eth, estricto=True, activo="ADA")
+        self.assertEqual(contexto.exception.sobreventa['activo'], 'ETH')
+        self.assertEqual(calcular_saldos()['saldos']['ETH'], 0.5)
+
+        self.assertTrue(actualizar_transaccion(id_eth, estricto=True, cantidad=3))
+        self.assertEqual(calcular_saldos()['saldos']['ETH'], 2.5)
+
+class TestImportacion(CasoConBaseTemporal):
+    def _archivo(self, nombre, contenido):
+        ruta = os.path.join(self.directorio, nombre)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(contenido)
+        return ruta
+
+    def test_importar_csv(self):
+        ruta = self._archivo("operaciones.csv",
+            "fecha,activo,operacion,cantidad,precio,costo,dolar\n"
+            "2019-01-02,TESTIMP,COMPRA,1.5,100,150,40\n"
+            "2019-01-03,TESTIMP,VENTA,0.5,120,60,41\n"
+            "2019-01-04T10:30:00,TESTIMP,compra,2,110,220,42\n")
+
+        resultado = importar_archivo(ruta, tamano_lote=2)
+        self.assertEqual(resultado['filas'], 3)
+
+        df = consultar_registros(activo="TESTIMP")
+        self.assertEqual(len(df), 3)
+
+    def test_importar_jsonl_fila_invalida_no_guarda_nada(self):
+        ruta = self._archivo("operaciones.jsonl",
+            '{"activo": "TESTIMP", "operacion": "COMPRA", "cantidad": 1, "precio_unitario": 10, "costo_total": 10, "dolar_cambio": 1}\n'
+            '{"activo": "TESTIMP", "operacion": "COMPRA", "cantidad": 2, "precio_unitario": 10, "costo_total": 20, "dolar_cambio": 1}\n'
+            '{"activo": "TESTIMP", "operacion": "REGALO", "cantidad": 3, "precio_unitario": 10, "costo_total": 30, "dolar_cambio": 1}\n')
+
+        with self.assertRaisesRegex(ValueError, "Fila 3"):
+            importar_archivo(ruta, tamano_lote=1)
+
+        self.assertEqual(len(consultar_registros(activo="TESTIMP")), 0)
+
+class TestDeduplicacion(CasoConBaseTemporal):
+    def _archivo(self, contenido):
+        ruta = os.path.join(self.directorio, "sync.csv")
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write("fecha,activo,operacion,cantidad,precio,costo,dolar,trade_id\n" + contenido)
+        return ruta
+
+    def test_registro_repetido(self):
+        id_original = registrar_transaccion("BTC", "COMPRA", 0.5, 100, 50, 10, fecha="2024-01-01")
+        with self.assertRaises(TransaccionDuplicada) as contexto:
+            # Otro tipo de cambio y otra escala no la vuelven una operación distinta
+            definir_escala("BTC", 10)
+            registrar_transaccion("btc", "COMPRA", 0.5, 100, 50, 11, fecha="2024-01-01")
+        self.assertEqual(contexto.exception.id_existente, id_original)
+
+        # Con id externo, dos operaciones idénticas se registran
+        registrar_transaccion("BTC", "COMPRA", 0.5, 100, 50, 10, fecha="2024-01-01", id_externo="A-1")
+        with self.assertRaises(TransaccionDuplicada):
+            registrar_transaccion("BTC", "COMPRA", 0.5, 100, 50, 10, fecha="2024-01-01", id_externo="A-1")
+        # Sin fecha, la pone la base y no se compara
+        registrar_transaccion("BTC", "COMPRA", 0.5, 100, 50, 10)
+        registrar_transaccion("BTC", "COMPRA", 0.5, 100, 50, 10)
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 2})
+
+        # Un cambio que la deja igual a otra se rechaza sin guardar nada
+        id_otra = registrar_transaccion("BTC", "COMPRA", 0.5, 100, 50, 10, fecha="2024-01-02")
+        with self.assertRaises(TransaccionDuplicada):
+            actualizar_transaccion(id_otra, fecha="2024-01-01")
+        self.assertTrue(actualizar_transaccion(id_otra, fecha="2024-01-01", id_externo="A-2"))
+        with self.assertRaises(TransaccionDuplicada):
+            registrar_transaccion("BTC", "COMPRA", 0.5, 100, 50, 10, fecha="2024-01-01", id_externo="A-2")
+        self.assertEqual(buscar_duplicados(), [])
+
+        # La huella necesita fecha: no se puede borrar ni dejar una que no se entiende
+        for fecha in (None, '', 'ayer'):
+            with self.assertRaisesRegex(ValueError, 'Fecha no válida'):
+                actualizar_transaccion(id_otra, fecha=fecha)
+            with self.assertRaisesRegex(ValueError, 'Fecha no válida'):
+                actualizar_transacciones({'activo': 'BTC'}, fecha=fecha)
+
+    def test_reimportar_es_idempotente(self):
+        ruta = self._archivo(
+            "2024-01-01,BTC,COMPRA,1,100,100,10,\n"
+            "2024-01-02,BTC,COMPRA,1,100,100,10,T-1\n"
+            "2024-01-02,BTC,COMPRA,1,100,100,10,T-2\n"
+            "2024-01-02,BTC,COMPRA,1,100,100,10,T-2\n")
+        primera = importar_archivo(ruta, tamano_lote=2)
+        self.assertEqual((primera['filas'], primera['duplicadas']), (3, 1))
+        segunda = importar_archivo(ruta)
+        self.assertEqual((segunda['filas'], segunda['duplicadas']), (0, 4))
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 3})
+
+    def test_marca_de_agua_por_origen(self):
+        ruta = self._archivo(
+            "2024-01-01,BTC,COMPRA,1,100,100,10,T-1\n"
+            "2024-01-03,BTC,COMPRA,1,100,100,10,T-2\n")
+        self.assertEqual(importar_archivo(ruta, origen='binance')['filas'], 2)
+        self.assertEqual([(marca['origen'], marca['fecha'], marca['filas']) for marca in listar_marcas_agua()],
+                         [('binance', '2024-01-03', 2)])
+
+        # La sincronización siguiente trae lo anterior otra vez (hasta con filas que ya no validan)
+        ruta = self._archivo(
+            "2024-01-01,BTC,REGALO,1,100,100,10,T-1\n"
+            "2024-01-03,BTC,COMPRA,1,100,100,10,T-2\n"
+            "2024-01-03,BTC,COMPRA,1,100,100,10,T-3\n"
+            "2024-01-04,BTC,VENTA,1,200,200,10,T-4\n")
+        resultado = importar_archivo(ruta, origen='binance')
+        self.assertEqual((resultado['filas'], resultado['duplicadas'], resultado['omitidas']), (2, 1, 1))
+        self.assertEqual(listar_marcas_agua()[0]['fecha'], '2024-01-04')
+        self.assertEqual(listar_marcas_agua()[0]['filas'], 4)
+
+        # Sin origen (u otro origen) no hay marca: la fila inválida se rechaza
+        with self.assertRaisesRegex(ValueError, "Fila 2"):
+            importar_archivo(ruta, origen='kraken')
+
+    def test_buscar_duplicados_de_bases_anteriores(self):
+        registrar_transaccion("ETH", "COMPRA", 1, 10, 10, 1, fecha="2024-02-01")
+        conn = db.obtener_conexion()
+        # Como quedan las filas repetidas de una base anterior a la huella (ver db._migracion_9_huellas)
+        conn.executemany("INSERT INTO transacciones (fecha, activo, operacion, cantidad, precio_unitario, costo_total, "
+                         "dolar_cambio, huella, ocurrencia) SELECT fecha, activo, operacion, cantidad, precio_unitario, "
+                         "costo_total, dolar_cambio, huella, ? FROM transacciones WHERE id = 1", [(2,), (3,)])
+
+        self.assertEqual(buscar_duplicados(), [{
+            'ids': [1, 2, 3], 'archivados': [], 'fecha': '2024-02-01', 'activo': 'ETH', 'operacion': 'COMPRA', 'cantidad': 1.0,
+            'precio_unitario': 10.0, 'costo_total': 10.0,
+        }])
+        plan = " ".join(fila[-1] for fila in conn.execute(
+            "EXPLAIN QUERY PLAN SELECT huella FROM transacciones WHERE huella IS NOT NULL GROUP BY huella HAVING COUNT(*) > 1"))
+        self.assertIn("COVERING INDEX idx_transacciones_huella", plan)
+
+class TestCambiosMasivos(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        registrar_transaccion("XBT", "COMPRA", 1.5, 100, 150, 10, fecha="2024-01-05")
+        registrar_transaccion("XBT", "COMPRA", 0.5, 100, 50, 10, fecha="2024-01-20")
+        registrar_transaccion("ETH", "COMPRA", 2, 10, 20, 10, fecha="2024-01-10")
+        registrar_transaccion("XBT", "VENTA", 1, 200, 200, 10, fecha="2024-02-01")
+
+    def _tabla(self):
+        return consultar_registros(orden='asc')[['id', 'fecha', 'activo', 'cantidad', 'dolar_cambio']].values.tolist()
+
+    def test_actualizar_por_filtros_y_deshacer(self):
+        antes = self._tabla()
+        filtros = {'fecha_desde': '2024-01-01', 'fecha_hasta': '2024-01-31'}
+        simulado = actualizar_transacciones(filtros, simular=True, dolar_cambio=1000)
+        self.assertEqual((simulado['filas'], simulado['por_activo'], simulado['cambio']), (3, {'ETH': 1, 'XBT': 2}, None))
+        self.assertEqual(self._tabla(), antes)
+
+        resultado = actualizar_transacciones(filtros, dolar_cambio=1000)
+        self.assertEqual(resultado['filas'], 3)
+        self.assertEqual([fila[4] for fila in self._tabla()], [1000, 1000, 1000, 10])
+
+        deshecho = deshacer_cambio()
+        self.assertEqual((deshecho['cambio'], deshecho['filas']), (resultado['cambio'], 3))
+        self.assertEqual(self._tabla(), antes)
+        self.assertIsNotNone(listar_cambios()[0]['deshecho'])
+        with self.assertRaisesRegex(ValueError, "No hay cambios masivos"):
+            deshacer_cambio()
+
+    def test_renombrar_activo_con_otra_escala(self):
+        definir_escala("BTC", 10)
+        actualizar_transacciones({'activo': 'xbt'}, activo='BTC')
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 1, 'ETH': 2})
+        self.assertEqual(db.obtener_conexion().execute(
+            "SELECT cantidad FROM transacciones WHERE id = 1").fetchone(), (15000000000,))
+        # Las huellas siguen al activo nuevo
+        with self.assertRaises(TransaccionDuplicada):
+            registrar_transaccion("BTC", "COMPRA", 1.5, 100, 150, 99, fecha="2024-01-05")
+        registrar_transaccion("XBT", "COMPRA", 1.5, 100, 150, 10, fecha="2024-01-05")
+
+        # Hubo una escritura después: sólo se deshace forzando, y la alta nueva de XBT choca
+        with self.assertRaisesRegex(ValueError, "1 escrituras después"):
+            deshacer_cambio()
+        with self.assertRaisesRegex(ValueError, "repetiría"):
+            deshacer_cambio(forzar=True)
+        borrar_transaccion(5)
+        deshacer_cambio(forzar=True)
+        self.assertEqual(calcular_saldos()['saldos'], {'XBT': 1, 'ETH': 2})
+
+    def test_borrar_por_filtros_y_deshacer(self):
+        antes = self._tabla()
+        modificaciones = db.contador_modificaciones(db.obtener_conexion())
+        self.assertEqual(borrar_transacciones(activo='XBT', operacion='COMPRA', simular=True)['filas'], 2)
+        resultado = borrar_transacciones(activo='XBT', operacion='COMPRA')
+        self.assertEqual(resultado['filas'], 2)
+        self.assertEqual(calcular_saldos()['saldos'], {'XBT': -1, 'ETH': 2})
+
+        self.assertEqual(deshacer_cambio()['filas'], 2)
+        self.assertEqual(self._tabla(), antes)
+        self.assertEqual(calcular_saldos()['saldos'], {'XBT': 1, 'ETH': 2})
+        # Dos bajas y la vuelta de ids viejos: la caché columnar se reconstruye
+        self.assertEqual(db.contador_modificaciones(db.obtener_conexion()), modificaciones + 3)
+
+    def test_cambios_rechazados_no_guardan_nada(self):
+        with self.assertRaisesRegex(ValueError, "al menos un filtro"):
+            borrar_transacciones()
+        with self.assertRaisesRegex(ValueError, "cantidad"):
+            actualizar_transacciones({'activo': 'ETH'}, cantidad=1)
+        # Pasar las compras de enero después de la venta deja XBT en negativo
+        with self.assertRaises(ErrorInventario):
+            actualizar_transacciones({'activo': 'XBT', 'operacion': 'COMPRA'}, estricto=True, fecha='2024-03-01')
+        self.assertEqual(actualizar_transacciones({'activo': 'SOL'}, fecha='2024-03-01')['filas'], 0)
+        self.assertEqual(listar_cambios(), [])
+        self.assertEqual(validar_inventario(), [])
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,114 @@
+import sqlite3
+import threading
+import unittest
+from unittest import mock
+from gestor_inversiones import db
+from gestor_inversiones.crud import registrar_transaccion, consultar_registros, buscar_duplicados
+from tests.base import CasoConBaseTemporal
+
+class TestConexiones(CasoConBaseTemporal):
+    def test_ruta_configurable(self):
+        self.assertEqual(db.ruta_db(), self.ruta_db)
+        registrar_transaccion("BTC", "COMPRA", 1, 10, 10, 1)
+
+        conn = sqlite3.connect(self.ruta_db)
+        self.assertEqual(conn.execute("SELECT COUNT(*) FROM transacciones").fetchone()[0], 1)
+        conn.close()
+
+    def test_esquema_se_inicializa_una_vez(self):
+        with mock.patch.object(db, 'migrar', wraps=db.migrar) as inicializar:
+            for _ in range(5):
+                registrar_transaccion("BTC", "COMPRA", 1, 10, 10, 1)
+            consultar_registros()
+        self.assertEqual(inicializar.call_count, 1)
+
+    def test_conexion_reutilizada_por_hilo(self):
+        self.assertIs(db.obtener_conexion(), db.obtener_conexion())
+
+        otras = []
+        hilo = threading.Thread(target=lambda: otras.append(db.obtener_conexion()))
+        hilo.start()
+        hilo.join()
+        self.assertIsNot(otras[0], db.obtener_conexion())
+
+    def test_transaccion_anidada_deshace_solo_su_parte(self):
+        with db.transaccion() as conn:
+            conn.execute("INSERT INTO transacciones (activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio) "
+                         "VALUES ('BTC', 'COMPRA', 1, 1, 1, 1)")
+            with self.assertRaises(RuntimeError):
+                with db.transaccion():
+                    registrar_transaccion("ETH", "COMPRA", 1, 1, 1, 1)
+                    raise RuntimeError("falla interna")
+
+        self.assertEqual(list(consultar_registros()['activo']), ['BTC'])
+
+    def test_transaccion_con_error_no_confirma(self):
+        with self.assertRaises(RuntimeError):
+            with db.transaccion():
+                registrar_transaccion("BTC", "COMPRA", 1, 1, 1, 1)
+                raise RuntimeError("falla")
+
+        self.assertEqual(len(consultar_registros()), 0)
+
+class TestMigraciones(CasoConBaseTemporal):
+    def test_migra_base_antigua(self):
+        # Esquema anterior a la columna 'operacion', con activos y fechas sin normalizar
+        conn = sqlite3.connect(self.ruta_db)
+        conn.execute("""
+            CREATE TABLE transacciones (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                fecha TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                activo TEXT NOT NULL,
+                cantidad REAL NOT NULL,
+                precio_unitario REAL NOT NULL,
+                costo_total REAL NOT NULL,
+                dolar_cambio REAL NOT NULL
+            )
+        """)
+        conn.execute("INSERT INTO transacciones (fecha, activo, cantidad, precio_unitario, costo_total, dolar_cambio) "
+                     "VALUES ('2024-03-01T10:00:00', 'btc', 1, 10, 10, 1)")
+        conn.commit()
+        conn.close()
+
+        conn = db.obtener_conexion()
+        self.assertEqual(db.version_esquema(conn), len(db.MIGRACIONES))
+        self.assertEqual(conn.execute("SELECT fecha, activo, operacion FROM transacciones").fetchone(),
+                         ('2024-03-01 10:00:00', 'BTC', 'COMPRA'))
+        indices = {fila[1] for fila in conn.execute("PRAGMA index_list(transacciones)")}
+        self.assertIn('idx_transacciones_activo_fecha', indices)
+        self.assertIn('idx_transacciones_operacion_fecha', indices)
+
+    def test_migra_importes_reales_a_enteros(self):
+        # Base en la versión 4, con los importes todavía en columnas REAL
+        conn = sqlite3.connect(self.ruta_db, isolation_level=None)
+        for migracion in db.MIGRACIONES[:4]:
+            migracion(conn)
+        conn.execute("PRAGMA user_version = 4")
+        conn.executemany("INSERT INTO transacciones (fecha, activo, operacion, cantidad, precio_unitario, costo_total, dolar_cambio) "
+                         "VALUES ('2024-01-01', 'BTC', ?, ?, 45000.5, 4500.05, 1050.25)",
+                         [('COMPRA', 0.1)] * 3 + [('VENTA', 0.3), ('COMPRA', 1)])
+        conn.execute("DELETE FROM transacciones WHERE id = 5")
+        conn.close()
+
+        conn = db.obtener_conexion()
+        self.assertEqual(db.version_esquema(conn), len(db.MIGRACIONES))
+        self.assertEqual(conn.execute("SELECT DISTINCT typeof(cantidad), typeof(costo_total) FROM transacciones").fetchall(),
+                         [('integer', 'integer')])
+        self.assertEqual(conn.execute("SELECT cantidad, precio_unitario FROM transacciones WHERE id = 1").fetchone(),
+                         (10000000, 4500050000000))
+        self.assertEqual(conn.execute("SELECT compras - ventas FROM saldos").fetchone(), (0,))
+        self.assertEqual(consultar_registros(orden='asc')['cantidad'].tolist(), [0.1, 0.1, 0.1, 0.3])
+        # Las filas repetidas se numeran para crear el índice único de huellas, sin perder ninguna
+        self.assertEqual(conn.execute("SELECT ocurrencia FROM transacciones ORDER BY id").fetchall(),
+                         [(1,), (2,), (3,), (1,)])
+        self.assertEqual([grupo['ids'] for grupo in buscar_duplicados()], [[1, 2, 3]])
+        # Se conserva la secuencia: el id borrado no se reutiliza
+        self.assertEqual(registrar_transaccion("BTC", "COMPRA", 1, 1, 1, 1), 6)
+
+    def test_migrar_es_idempotente(self):
+        conn = db.obtener_conexion()
+        version = db.version_esquema(conn)
+        self.assertEqual(db.migrar(conn), version)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import csv
+import io
+import json
+import os
+import unittest
+from gestor_inversiones.crud import registrar_transaccion
+from gestor_inversiones.exportacion import exportar_registros
+from tests.base import CasoConBaseTemporal
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+class TestExportacion(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        registrar_transaccion("TESTEXP", "COMPRA", 2, 10, 20, 1, fecha="2020-01-01")
+        registrar_transaccion("TESTEXP", "VENTA", 1, 12, 12, 1, fecha="2020-01-02")
+        registrar_transaccion("TESTEXP", "COMPRA", 3, 11, 33, 1, fecha="2020-01-03")
+
+    def test_exportar_csv_por_bloques(self):
+        salida = os.path.join(self.directorio, "export.csv")
+        total = exportar_registros(salida, formato='csv', tamano_bloque=2, activo="TESTEXP")
+        self.assertEqual(total, 3)
+
+        with open(salida, newline='', encoding='utf-8') as f:
+            filas = list(csv.DictReader(f))
+        self.assertEqual([f['fecha'] for f in filas], ["2020-01-03", "2020-01-02", "2020-01-01"])
+        self.assertEqual(float(filas[1]['cantidad']), 1.0)
+
+    def test_exportar_jsonl_con_filtros(self):
+        salida = os.path.join(self.directorio, "export.jsonl")
+        total = exportar_registros(salida, formato='jsonl', activo="TESTEXP", operacion="COMPRA",
+                                   fecha_desde="2020-01-02")
+        self.assertEqual(total, 1)
+
+        with open(salida, encoding='utf-8') as f:
+            fila = json.loads(f.readline())
+        self.assertEqual(fila['costo_total'], 33)
+
+    @unittest.skipUnless(pq, "pyarrow no está instalado")
+    def test_exportar_parquet(self):
+        salida = os.path.join(self.directorio, "export.parquet")
+        total = exportar_registros(salida, formato='parquet', tamano_bloque=2, activo="TESTEXP")
+        self.assertEqual(total, 3)
+
+        tabla = pq.read_table(salida)
+        self.assertEqual(tabla.num_rows, 3)
+        self.assertEqual(tabla.column('cantidad').to_pylist(), [3.0, 1.0, 2.0])
+
+    def test_parquet_requiere_archivo(self):
+        with self.assertRaises(ValueError):
+            exportar_registros(None, formato='parquet', activo="TESTEXP")
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import sqlite3
+import unittest
+from tests.base import CasoConBaseTemporal
+from gestor_inversiones import db, memoria
+from gestor_inversiones.crud import (registrar_transaccion, consultar_registros, actualizar_transaccion,
+                                     calcular_saldos)
+
+class TestCacheMemoria(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 10, fecha="2024-01-01")
+        registrar_transaccion("ETH", "COMPRA", 2, 10, 20, 10, fecha="2024-01-02")
+        memoria.habilitar(True)
+        memoria.vaciar()
+
+    def tearDown(self):
+        memoria.habilitar(None, entradas=memoria.ENTRADAS_MAXIMAS, megabytes=memoria.MEGABYTES_MAXIMOS)
+        memoria.vaciar()
+        super().tearDown()
+
+    def _contador(self, nombre):
+        return memoria.estadisticas()[nombre]
+
+    def test_aciertos_con_filtros_normalizados_y_copias(self):
+        df = consultar_registros(activo='btc')
+        df.loc[0, 'cantidad'] = 99
+        saldos = calcular_saldos()
+        saldos['saldos']['BTC'] = 99
+
+        # ' BTC ' y 'btc' son la misma consulta; lo modificado por el llamador no se guardó
+        self.assertEqual(consultar_registros(activo=' BTC ')['cantidad'].tolist(), [1])
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 1, 'ETH': 2})
+        self.assertEqual((self._contador('aciertos'), self._contador('fallos')), (2, 2))
+        self.assertEqual(len(consultar_registros(activo='ETH')), 1)
+        self.assertEqual(self._contador('fallos'), 3)
+
+    def test_escrituras_invalidan(self):
+        calcular_saldos()
+        registrar_transaccion("BTC", "VENTA", 0.25, 100, 25, 10, fecha="2024-01-03")
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 0.75, 'ETH': 2})
+
+        actualizar_transaccion(3, cantidad=0.5)
+        self.assertEqual(calcular_saldos(al='2024-01-03')['saldos'], {'BTC': 0.5, 'ETH': 2})
+        self.assertEqual(consultar_registros()['cantidad'].tolist(), [0.5, 2, 1])
+        self.assertEqual(self._contador('aciertos'), 0)
+
+        # Escritura de otra conexión, sin pasar por crud: la detecta PRAGMA data_version
+        otra = sqlite3.connect(self.ruta_db)
+        with otra:
+            otra.execute("UPDATE transacciones SET cantidad = cantidad * 2 WHERE id = 3")
+        otra.close()
+        self.assertEqual(consultar_registros()['cantidad'].tolist(), [1, 2, 1])
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 0, 'ETH': 2})
+        self.assertGreater(self._contador('invalidaciones'), 0)
+
+    def test_dentro_de_una_transaccion_no_se_usa(self):
+        calcular_saldos()
+        with db.transaccion():
+            registrar_transaccion("SOL", "COMPRA", 5, 1, 5, 10, fecha="2024-01-03")
+            self.assertEqual(calcular_saldos()['saldos']['SOL'], 5)
+        self.assertEqual(self._contador('aciertos'), 0)
+        self.assertEqual(calcular_saldos()['saldos']['SOL'], 5)
+
+    def test_limites_desalojan_lo_usado_hace_mas_tiempo(self):
+        memoria.habilitar(True, entradas=2)
+        consultar_registros(activo='BTC')
+        consultar_registros(activo='ETH')
+        consultar_registros(activo='BTC')
+        consultar_registros(activo='SOL')
+        self.assertEqual(self._contador('desalojos'), 1)
+        consultar_registros(activo='BTC')
+        self.assertEqual((self._contador('aciertos'), self._contador('fallos')), (2, 3))
+
+        # Un resultado más grande que el límite de memoria no se guarda
+        memoria.habilitar(True, megabytes=1 / 1024 / 1024)
+        self.assertEqual(self._contador('entradas'), 0)
+        consultar_registros()
+        estadisticas = memoria.estadisticas()
+        self.assertEqual((estadisticas['entradas'], estadisticas['descartados']), (0, 1))
+        with self.assertRaises(ValueError):
+            memoria.habilitar(True, entradas=0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+from gestor_inversiones import db
+from gestor_inversiones.crud import registrar_transaccion, consultar_registros, calcular_saldos
+from gestor_inversiones.perfilado import perfilar
+from tests.base import CasoConBaseTemporal
+
+class TestPerfilado(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        registrar_transaccion("BTC", "COMPRA", 1, 10, 10, 1, fecha="2024-01-01")
+        registrar_transaccion("BTC", "COMPRA", 2, 10, 20, 1, fecha="2024-01-02")
+        registrar_transaccion("ETH", "COMPRA", 1, 10, 10, 1, fecha="2024-01-03")
+
+    def test_fases_y_sentencias(self):
+        with perfilar(trazar_sql=True) as perfil:
+            consultar_registros(activo="BTC")
+            calcular_saldos()
+
+        reporte = perfil.reporte()
+        self.assertIn('sql', reporte['fases_ms'])
+        self.assertIn('pandas', reporte['fases_ms'])
+
+        consultas = [s for s in reporte['sentencias'] if s['sql'].startswith('SELECT * FROM v_transacciones')]
+        self.assertEqual(len(consultas), 1)
+        self.assertEqual(consultas[0]['filas'], 2)
+        saldos = [s for s in reporte['sentencias'] if 'FROM saldos' in s['sql']]
+        self.assertEqual(saldos[0]['filas'], 2)
+        self.assertIn('SQL: ', perfil.texto())
+
+    def test_sin_traza_no_instrumenta(self):
+        with perfilar() as perfil:
+            calcular_saldos()
+        self.assertEqual(perfil.reporte()['sentencias'], [])
+        self.assertIn('sql', perfil.reporte()['fases_ms'])
+
+    def test_al_salir_quita_la_instrumentacion(self):
+        with perfilar(trazar_sql=True) as perfil:
+            calcular_saldos()
+        cantidad = len(perfil.sentencias)
+        calcular_saldos()
+        self.assertEqual(len(perfil.sentencias), cantidad)
+        self.assertIsNone(db.obtener_conexion().row_factory)
+
+if __name__ == '__main__':
+    unittest.main()
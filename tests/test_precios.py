@@ -0,0 +1,83 @@
+import io
+import os
+import unittest
+from contextlib import redirect_stdout
+from tests.base import CasoConBaseTemporal
+from gestor_inversiones import columnar
+from gestor_inversiones.cambio import registrar_tipo_cambio
+from gestor_inversiones.cli import main
+from gestor_inversiones.crud import registrar_transaccion
+from gestor_inversiones.precios import importar_precios, obtener_historial, valuar_cartera, caida_maxima
+
+class TestPrecios(CasoConBaseTemporal):
+    def _csv(self, nombre, contenido):
+        ruta = os.path.join(self.directorio, nombre)
+        with open(ruta, 'w', encoding='utf-8') as f:
+            f.write(contenido)
+        return ruta
+
+    def setUp(self):
+        super().setUp()
+        # Sin precio el 2024-01-03 (se usa el del día anterior); ETH recién desde el 2024-01-02
+        importar_precios(self._csv('precios.csv', "fecha,activo,cierre\n2024-01-01,btc,100\n2024-01-02,BTC,110\n"
+                                                  "2024-01-04,BTC,90\n2024-01-02,ETH,10\n"))
+
+    def test_importar_y_combinar(self):
+        historial = obtener_historial()
+        self.assertEqual((historial.activos, historial.dias), (['BTC', 'ETH'], 4))
+
+        # Un archivo por activo, con OHLC y fechas nuevas: se amplía el rango y se reemplazan las repetidas
+        importar_precios(self._csv('eth.csv', "Date,Open,High,Low,Close\n2023-12-31,8,9,7,8.5\n2024-01-02,10,12,9,11\n"),
+                         activo='eth')
+        historial = obtener_historial()
+        self.assertEqual((str(historial.inicio), historial.dias), ('2023-12-31', 5))
+        self.assertEqual(historial.meta['campos'], ['cierre', 'apertura', 'maximo', 'minimo'])
+        cierres = historial.cierres(['2023-12-31', '2024-01-02', '2024-01-03', '2024-02-01'], ['BTC', 'ETH', 'SOL'])
+        self.assertTrue(cierres[0, 0] != cierres[0, 0])
+        self.assertEqual(cierres[1:, 0].tolist(), [110, 110, 90])
+        self.assertEqual(cierres[:, 1].tolist(), [8.5, 11, 11, 11])
+        self.assertTrue(all(valor != valor for valor in cierres[:, 2]))
+
+    def test_archivo_invalido_no_modifica_el_historial(self):
+        with self.assertRaisesRegex(ValueError, 'fila 3'):
+            importar_precios(self._csv('malo.csv', "fecha,activo,cierre\n2024-02-01,BTC,1\n2024-02-02,BTC,-5\n"))
+        self.assertEqual(obtener_historial().dias, 4)
+
+    def test_valuar_cartera(self):
+        registrar_transaccion("BTC", "COMPRA", 2, 100, 200, 1, fecha="2023-12-20 10:00:00")
+        registrar_transaccion("ETH", "COMPRA", 10, 10, 100, 1, fecha="2024-01-02 15:00:00")
+        registrar_transaccion("BTC", "VENTA", 0.5, 110, 55, 1, fecha="2024-01-03 09:00:00")
+        registrar_tipo_cambio('2024-01-01', 1000)
+
+        for cache in (False, True):
+            columnar.habilitar(cache)
+            try:
+                resultado = valuar_cartera(desde='2024-01-01', hasta='2024-01-04')
+            finally:
+                columnar.habilitar(None)
+            self.assertEqual(resultado['fechas'].astype(str).tolist(), ['2024-01-01', '2024-01-02', '2024-01-03', '2024-01-04'])
+            self.assertEqual(resultado['total'].tolist(), [200, 320, 265, 235])
+            self.assertEqual(resultado['sin_precio'], [])
+
+        local = valuar_cartera(desde='2024-01-01', hasta='2024-01-02', moneda='local')
+        self.assertEqual(local['total'].tolist(), [200000, 320000])
+
+        # Antes del primer precio la tenencia no se puede valuar
+        self.assertEqual(valuar_cartera(desde='2023-12-25', hasta='2023-12-25')['sin_precio'], ['BTC'])
+        self.assertAlmostEqual(caida_maxima([200, 320, 265, 235]), 235 / 320 - 1)
+
+    def test_cli_valuacion(self):
+        registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 1, fecha="2024-01-01")
+        salida_csv = os.path.join(self.directorio, 'curva.csv')
+        salida = io.StringIO()
+        with redirect_stdout(salida):
+            codigo = main(['--db', self.ruta_db, 'valuacion', '--hasta', '2024-01-04', '--salida', salida_csv])
+
+        self.assertEqual(codigo, 0)
+        self.assertIn('Al 2024-01-04: 90.00', salida.getvalue())
+        with open(salida_csv, encoding='utf-8') as f:
+            self.assertEqual(f.read().splitlines(), ['fecha,total,BTC', '2024-01-01,100.00,100.00', '2024-01-02,110.00,110.00',
+                                                     '2024-01-03,110.00,110.00', '2024-01-04,90.00,90.00'])
+
+if __name__ == '__main__':
+    unittest.main()
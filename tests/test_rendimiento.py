@@ -0,0 +1,122 @@
+import io
+import os
+import unittest
+from contextlib import redirect_stdout
+from gestor_inversiones.cli import construir_parser, ejecutar
+from gestor_inversiones.crud import (registrar_transaccion, consultar_registros, actualizar_transaccion,
+                                     borrar_transaccion)
+from gestor_inversiones.db import obtener_conexion, contador_modificaciones
+from gestor_inversiones.rendimiento import calcular_rendimiento, EstadoDesactualizado, cargar_estado
+from tests.base import CasoConBaseTemporal
+
+class TestRendimiento(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        # Dos compras a distinto precio y una venta parcial
+        registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 10, fecha="2024-01-01")
+        registrar_transaccion("BTC", "COMPRA", 1, 200, 200, 20, fecha="2024-02-01")
+        registrar_transaccion("BTC", "VENTA", 1.5, 300, 450, 30, fecha="2024-03-01")
+
+    def _fila(self, resultado, activo="BTC"):
+        df = resultado['rendimientos']
+        return df[df['activo'] == activo].iloc[0]
+
+    def test_fifo(self):
+        fila = self._fila(calcular_rendimiento(consultar_registros(), metodo='FIFO'))
+        self.assertAlmostEqual(fila['cantidad'], 0.5)
+        self.assertAlmostEqual(fila['costo_usd'], 100)
+        self.assertAlmostEqual(fila['realizado_usd'], 450 - (100 + 100))
+        self.assertAlmostEqual(fila['realizado_local'], 450 * 30 - (100 * 10 + 100 * 20))
+
+    def test_lifo(self):
+        fila = self._fila(calcular_rendimiento(consultar_registros(), metodo='LIFO'))
+        self.assertAlmostEqual(fila['costo_usd'], 50)
+        self.assertAlmostEqual(fila['realizado_usd'], 450 - (200 + 50))
+
+    def test_promedio_y_no_realizado(self):
+        resultado = calcular_rendimiento(consultar_registros(), metodo='PROMEDIO', precios={'BTC': 400}, dolar_actual=40)
+        fila = self._fila(resultado)
+        self.assertAlmostEqual(fila['costo_usd'], 75)
+        self.assertAlmostEqual(fila['realizado_usd'], 450 - 225)
+        self.assertAlmostEqual(fila['no_realizado_usd'], 0.5 * 400 - 75)
+        self.assertAlmostEqual(fila['no_realizado_local'], 0.5 * 400 * 40 - 0.5 * (1000 + 4000) / 2)
+
+    def test_reanudar_desde_estado(self):
+        parcial = calcular_rendimiento(consultar_registros(), metodo='FIFO')
+        registrar_transaccion("BTC", "VENTA", 0.5, 400, 200, 40, fecha="2024-04-01")
+        registrar_transaccion("ETH", "COMPRA", 2, 10, 20, 40, fecha="2024-04-02")
+
+        estado = parcial['estado']
+        incremental = calcular_rendimiento(consultar_registros(despues_de_id=estado['ultimo_id']),
+                                           metodo='FIFO', estado=estado)
+        completo = calcular_rendimiento(consultar_registros(), metodo='FIFO')
+
+        self.assertEqual(incremental['rendimientos'].to_dict('records'), completo['rendimientos'].to_dict('records'))
+        self.assertEqual(incremental['estado'], completo['estado'])
+
+    def test_estado_de_otro_metodo(self):
+        estado = calcular_rendimiento(consultar_registros(), metodo='FIFO')['estado']
+        with self.assertRaises(ValueError):
+            calcular_rendimiento(consultar_registros(), metodo='LIFO', estado=estado)
+
+    def _modificaciones(self):
+        return contador_modificaciones(obtener_conexion())
+
+    def test_estado_de_otro_filtro(self):
+        estado = calcular_rendimiento(consultar_registros(activo='BTC'), activo='BTC')['estado']
+        with self.assertRaises(EstadoDesactualizado):
+            calcular_rendimiento(consultar_registros(despues_de_id=estado['ultimo_id']), estado=estado)
+
+    def test_estado_tras_modificar_o_borrar(self):
+        for escribir in (lambda: actualizar_transaccion(1, cantidad=2), lambda: borrar_transaccion(3)):
+            estado = calcular_rendimiento(consultar_registros(), modificaciones=self._modificaciones())['estado']
+            escribir()
+            with self.assertRaises(EstadoDesactualizado):
+                calcular_rendimiento(consultar_registros(despues_de_id=estado['ultimo_id']), estado=estado,
+                                     modificaciones=self._modificaciones())
+
+        # Agregar operaciones no cambia el contador: el estado se reanuda
+        estado = calcular_rendimiento(consultar_registros(), modificaciones=self._modificaciones())['estado']
+        registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 10, fecha="2024-04-01")
+        calcular_rendimiento(consultar_registros(despues_de_id=estado['ultimo_id']), estado=estado,
+                             modificaciones=self._modificaciones())
+
+    def test_estado_con_operacion_anterior(self):
+        estado = calcular_rendimiento(consultar_registros())['estado']
+        # Una compra de otro activo con fecha anterior no altera los lotes de BTC
+        registrar_transaccion("ETH", "COMPRA", 1, 10, 10, 10, fecha="2023-06-01")
+        estado = calcular_rendimiento(consultar_registros(despues_de_id=estado['ultimo_id']), estado=estado)['estado']
+        registrar_transaccion("BTC", "COMPRA", 1, 50, 50, 10, fecha="2024-02-15")
+        with self.assertRaisesRegex(EstadoDesactualizado, 'anterior a la última procesada'):
+            calcular_rendimiento(consultar_registros(despues_de_id=estado['ultimo_id']), estado=estado)
+
+class TestRendimientoCli(CasoConBaseTemporal):
+    def _ejecutar(self, *argumentos):
+        salida = io.StringIO()
+        with redirect_stdout(salida):
+            codigo = ejecutar(construir_parser().parse_args(argumentos))
+        return codigo, salida.getvalue()
+
+    def test_estado_se_recalcula_si_cambiaron_las_transacciones(self):
+        ruta_estado = os.path.join(self.directorio, 'lotes.json')
+        registrar_transaccion("ETH", "COMPRA", 1, 100, 100, 1, fecha="2024-01-01")
+        registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 1, fecha="2024-01-02")
+
+        codigo, texto = self._ejecutar('rendimiento', '--activo', 'BTC', '--estado', ruta_estado, '--dolar', '1')
+        self.assertEqual(codigo, 1)
+        self.assertIn('--activo', texto)
+        self.assertFalse(os.path.exists(ruta_estado))
+
+        self.assertEqual(self._ejecutar('rendimiento', '--estado', ruta_estado, '--dolar', '1')[0], 0)
+        registrar_transaccion("ETH", "VENTA", 1, 200, 200, 1, fecha="2024-01-03")
+        actualizar_transaccion(2, costo_total=150)
+        codigo, texto = self._ejecutar('rendimiento', '--estado', ruta_estado, '--dolar', '1')
+        self.assertEqual(codigo, 0)
+        self.assertIn('se recalcula desde el principio', texto)
+
+        completo = calcular_rendimiento(consultar_registros(), modificaciones=contador_modificaciones(obtener_conexion()))
+        self.assertEqual(cargar_estado(ruta_estado), completo['estado'])
+        self.assertEqual(completo['estado']['activos']['ETH']['realizado_usd'], 100)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import io
+import os
+import unittest
+from contextlib import redirect_stdout
+from tests.base import CasoConBaseTemporal
+from gestor_inversiones import columnar, db
+from gestor_inversiones.archivo import archivar, listar_archivos, ruta_archivo
+from gestor_inversiones.cli import main
+from gestor_inversiones.crud import registrar_transaccion, borrar_transaccion, consultar_registros, calcular_saldos
+from gestor_inversiones.respaldo import respaldar, restaurar, listar_respaldos, programar, ruta_respaldos
+
+class TestRespaldo(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        registrar_transaccion("BTC", "COMPRA", 1, 100, 100, 10, fecha="2024-01-01")
+        registrar_transaccion("ETH", "COMPRA", 2, 10, 20, 10, fecha="2024-01-02")
+
+    def tearDown(self):
+        programar(0)
+        super().tearDown()
+
+    def test_respaldar_y_restaurar(self):
+        avances = []
+        resultado = respaldar(comprimir=True, paginas_por_paso=1, progreso=avances.append)
+
+        self.assertTrue(resultado['archivo'].endswith('.db.gz'))
+        self.assertEqual(os.path.dirname(resultado['archivo']), ruta_respaldos())
+        # Una página por paso: un aviso por página, el último con la copia completa
+        self.assertEqual(len(avances), resultado['paginas'])
+        self.assertEqual(avances[-1]['copiadas'], avances[-1]['total'])
+
+        registrar_transaccion("SOL", "COMPRA", 5, 1, 5, 10, fecha="2024-01-03")
+        borrar_transaccion(1)
+        columnar.actualizar_cache()
+
+        restaurado = restaurar()
+        self.assertEqual(restaurado['origen'], resultado['archivo'])
+        self.assertEqual(restaurado['version'], len(db.MIGRACIONES))
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 1, 'ETH': 2})
+        self.assertFalse(os.path.exists(columnar.ruta_cache()))
+
+        # La base reemplazada quedó respaldada y se puede volver a ella
+        restaurar(restaurado['respaldo_previo'], respaldo_previo=False)
+        self.assertEqual(consultar_registros(orden='asc')['activo'].tolist(), ['ETH', 'SOL'])
+
+    def test_rotacion(self):
+        for _ in range(4):
+            ultimo = respaldar(conservar=2)
+        respaldos = [respaldo['archivo'] for respaldo in listar_respaldos()]
+        self.assertEqual(len(respaldos), 2)
+        self.assertEqual(respaldos[-1], ultimo['archivo'])
+        self.assertEqual(len(ultimo['eliminados']), 1)
+
+    def test_restaurar_rechaza_respaldos_invalidos(self):
+        danado = os.path.join(self.directorio, 'danado.db')
+        with open(respaldar()['archivo'], 'rb') as original, open(danado, 'wb') as copia:
+            contenido = bytearray(original.read())
+            contenido[4096:] = b'\xff' * (len(contenido) - 4096)
+            copia.write(contenido)
+        ajena = os.path.join(self.directorio, 'ajena.db')
+        with open(ajena, 'wb') as archivo:
+            archivo.write(b'')
+
+        for origen, mensaje in ((danado, 'dañado'), (ajena, 'no es una base del gestor'),
+                                (os.path.join(self.directorio, 'falta.db'), 'No existe')):
+            with self.assertRaisesRegex(ValueError, mensaje):
+                restaurar(origen)
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 1, 'ETH': 2})
+        self.assertEqual(len(listar_respaldos()), 1)
+
+    def test_respaldo_automatico(self):
+        programar(3, comprimir=False)
+        registrar_transaccion("SOL", "COMPRA", 1, 1, 1, 10, fecha="2024-01-03")
+        # Las dos altas del setUp también cuentan: van 3 escrituras desde la creación de la base
+        self.assertEqual(len(listar_respaldos()), 1)
+
+        registrar_transaccion("SOL", "COMPRA", 1, 1, 1, 10, fecha="2024-01-04")
+        borrar_transaccion(1)
+        self.assertEqual(len(listar_respaldos()), 1)
+        with db.transaccion():
+            registrar_transaccion("SOL", "VENTA", 1, 1, 1, 10, fecha="2024-01-05")
+            self.assertEqual(len(listar_respaldos()), 1)
+        self.assertEqual(len(listar_respaldos()), 2)
+
+        programar(0)
+        for _ in range(3):
+            registrar_transaccion("SOL", "COMPRA", 1, 1, 1, 10)
+        self.assertEqual(len(listar_respaldos()), 2)
+
+    def test_respaldo_incluye_los_anios_archivados(self):
+        registrar_transaccion("BTC", "COMPRA", 1, 50, 50, 10, fecha="2023-05-01")
+        registrar_transaccion("BTC", "VENTA", 0.5, 80, 40, 10, fecha="2023-08-01")
+        anterior = respaldar()
+        archivar(2023)
+        completo = respaldar(comprimir=True)
+        self.assertEqual(anterior['archivos'], [])
+        self.assertEqual(completo['archivos'], [completo['archivo'][:-len('.db.gz')] + '.2023.db.gz'])
+        self.assertEqual([respaldo['archivos'] for respaldo in listar_respaldos()], [[], completo['archivos']])
+
+        # El año archivado vuelve con la base aunque se haya perdido su archivo
+        os.remove(ruta_archivo(2023))
+        restaurado = restaurar(completo['archivo'], respaldo_previo=False)
+        self.assertEqual((restaurado['anios'], restaurado['eliminados']), ([2023], []))
+        self.assertEqual(len(consultar_registros(fecha_desde='2023-01-01', fecha_hasta='2023-12-31')), 2)
+
+        # Un respaldo de antes de archivar borra el archivo del año, que ya no le corresponde
+        previo = restaurar(anterior['archivo'])['respaldo_previo']
+        self.assertFalse(os.path.exists(ruta_archivo(2023)))
+        self.assertEqual(listar_archivos(), [])
+        self.assertEqual([r['transacciones'] for r in archivar(2023)], [2])
+        restaurar(previo, respaldo_previo=False)
+        self.assertEqual(len(consultar_registros(fecha_desde='2023-01-01', fecha_hasta='2023-12-31')), 2)
+
+        # Sin el respaldo del año no se restaura nada
+        os.remove(completo['archivos'][0])
+        registrar_transaccion("SOL", "COMPRA", 1, 1, 1, 10, fecha="2024-02-01")
+        with self.assertRaisesRegex(ValueError, 'no incluye el archivo del año archivado 2023'):
+            restaurar(completo['archivo'])
+        self.assertEqual(calcular_saldos()['saldos']['SOL'], 1)
+
+        # La rotación borra el respaldo completo
+        eliminados = respaldar(conservar=1)['eliminados']
+        self.assertEqual(len(listar_respaldos()), 1)
+        self.assertEqual(len([ruta for ruta in eliminados if ruta.endswith('.2023.db')]), 1)
+
+    def test_cli_respaldar_y_restaurar(self):
+        salida = io.StringIO()
+        with redirect_stdout(salida):
+            codigo = main(['--db', self.ruta_db, 'respaldar', '--comprimir', '--conservar', '3'])
+            main(['--db', self.ruta_db, 'respaldar', '--listar'])
+            borrar_transaccion(2)
+            codigo_restaurar = main(['--db', self.ruta_db, 'restaurar', '--sin-respaldo-previo'])
+        db.configurar(self.ruta_db)
+
+        self.assertEqual((codigo, codigo_restaurar), (0, 0))
+        self.assertIn('✅ Respaldo creado:', salida.getvalue())
+        self.assertIn('páginas/s', salida.getvalue())
+        self.assertIn('✅ Base restaurada desde', salida.getvalue())
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 1, 'ETH': 2})
+
+if __name__ == '__main__':
+    unittest.main()
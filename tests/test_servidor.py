@@ -0,0 +1,131 @@
+import asyncio
+import json
+import threading
+import unittest
+from unittest import mock
+import urllib.error
+import urllib.request
+from tests.base import CasoConBaseTemporal
+from gestor_inversiones import db, servidor
+from gestor_inversiones.crud import registrar_transaccion, calcular_saldos, borrar_transaccion, ErrorInventario
+from gestor_inversiones.servidor import Servidor, EscritorAgrupado
+
+class TestServidor(CasoConBaseTemporal):
+    def setUp(self):
+        super().setUp()
+        self.bucle = asyncio.new_event_loop()
+        self.hilo = threading.Thread(target=self.bucle.run_forever, daemon=True)
+        self.hilo.start()
+        self.servidor = Servidor(puerto=0, hilos=2)
+        puerto = asyncio.run_coroutine_threadsafe(self.servidor.iniciar(), self.bucle).result(10)
+        self.url = f"http://127.0.0.1:{puerto}"
+
+    def tearDown(self):
+        asyncio.run_coroutine_threadsafe(self.servidor.cerrar(), self.bucle).result(10)
+        self.bucle.call_soon_threadsafe(self.bucle.stop)
+        self.hilo.join()
+        self.bucle.close()
+        super().tearDown()
+
+    def _pedir(self, metodo, ruta, datos=None):
+        cuerpo = json.dumps(datos).encode() if datos is not None else None
+        peticion = urllib.request.Request(self.url + ruta, data=cuerpo, method=metodo)
+        try:
+            with urllib.request.urlopen(peticion, timeout=10) as respuesta:
+                return respuesta.status, json.loads(respuesta.read())
+        except urllib.error.HTTPError as e:
+            return e.code, json.loads(e.read())
+
+    def test_crud_por_http(self):
+        compra = {'activo': 'btc', 'operacion': 'COMPRA', 'cantidad': 1, 'precio': 10, 'costo': 10,
+                  'dolar': 1, 'fecha': '2024-01-01'}
+        estado, datos = self._pedir('POST', '/transacciones', compra)
+        self.assertEqual(estado, 201)
+        id_compra = datos['id']
+
+        estado, datos = self._pedir('POST', '/transacciones', dict(compra, operacion='VENTA', cantidad=5, estricto=True))
+        self.assertEqual(estado, 409)
+        self.assertEqual(datos['sobreventa']['activo'], 'BTC')
+
+        self.assertEqual(self._pedir('PATCH', f'/transacciones/{id_compra}', {'cantidad': 2})[0], 200)
+        estado, datos = self._pedir('GET', '/transacciones?activo=BTC&desde=2024-01-01&hasta=2024-01-01')
+        self.assertEqual(estado, 200)
+        self.assertEqual(datos['total'], 1)
+        self.assertEqual(datos['transacciones'][0]['cantidad'], 2.0)
+
+        self.assertEqual(self._pedir('GET', '/saldos'), (200, {'saldos': {'BTC': 2.0}, 'alertas': []}))
+        self.assertEqual(self._pedir('GET', '/saldos?al=2023-12-31'), (200, {'saldos': {}, 'alertas': []}))
+        self.assertEqual(self._pedir('GET', '/saldos?al=2024-01-01')[1]['saldos'], {'BTC': 2.0})
+        self.assertEqual(self._pedir('DELETE', f'/transacciones/{id_compra}')[0], 200)
+        self.assertEqual(self._pedir('DELETE', f'/transacciones/{id_compra}')[0], 404)
+
+        # Un reintento del mismo POST no duplica la operación; con id externo es otra
+        id_nuevo = self._pedir('POST', '/transacciones', compra)[1]['id']
+        estado, datos = self._pedir('POST', '/transacciones', compra)
+        self.assertEqual((estado, datos['id_existente']), (409, id_nuevo))
+        self.assertEqual(self._pedir('POST', '/transacciones', dict(compra, trade_id='T-1'))[0], 201)
+
+    def test_paginacion(self):
+        for dia in range(1, 6):
+            registrar_transaccion("BTC", "COMPRA", dia, 1, dia, 1, fecha=f"2024-01-0{dia}")
+        estado, datos = self._pedir('GET', '/transacciones?limite=3&columnas=id,cantidad&orden=asc')
+        self.assertEqual(estado, 200)
+        self.assertEqual([fila['cantidad'] for fila in datos['transacciones']], [1, 2, 3])
+        self.assertEqual(set(datos['transacciones'][0]), {'id', 'cantidad'})
+
+        estado, datos = self._pedir('GET', f"/transacciones?columnas=cantidad&orden=asc&cursor={datos['cursor']}")
+        self.assertEqual([fila['cantidad'] for fila in datos['transacciones']], [4, 5])
+        self.assertIsNone(datos['cursor'])
+
+        # Sin limite se responde una sola página de TAMANO_PAGINA filas, con el cursor de la siguiente
+        with mock.patch.object(servidor, 'TAMANO_PAGINA', 2):
+            estado, datos = self._pedir('GET', '/transacciones?orden=asc')
+        self.assertEqual((estado, datos['total']), (200, 2))
+        self.assertIsNotNone(datos['cursor'])
+        self.assertEqual(self._pedir('GET', f'/transacciones?limite={servidor.MAX_LIMITE + 1}')[0], 400)
+
+    def test_errores(self):
+        self.assertEqual(self._pedir('POST', '/transacciones', {'activo': 'BTC'})[0], 400)
+        self.assertEqual(self._pedir('GET', '/transacciones?desde=ayer')[0], 400)
+        self.assertEqual(self._pedir('GET', '/saldos?al=ayer')[0], 400)
+        self.assertEqual(self._pedir('PATCH', '/transacciones/1', {'cantidad': 'mucho'})[0], 400)
+        self.assertEqual(self._pedir('PATCH', '/transacciones/1', {'fecha': None})[0], 400)
+        self.assertEqual(self._pedir('POST', '/saldos', {})[0], 405)
+        self.assertEqual(self._pedir('GET', '/no-existe')[0], 404)
+
+    def test_usa_wal(self):
+        modo = db.obtener_conexion().execute("PRAGMA journal_mode").fetchone()[0]
+        self.assertEqual(modo, 'wal')
+
+class TestEscritorAgrupado(CasoConBaseTemporal):
+    def test_agrupa_commits_y_aisla_errores(self):
+        async def escribir_varias():
+            escritor = EscritorAgrupado(tamano_lote=50)
+            escritor.iniciar()
+            try:
+                tareas = [
+                    escritor.escribir(registrar_transaccion, activo='BTC', operacion='COMPRA', cantidad=1,
+                                      precio_unitario=1, costo_total=1, dolar_cambio=1, fecha='2024-01-02',
+                                      id_externo=f"op-{indice}")
+                    for indice in range(20)
+                ]
+                tareas.append(escritor.escribir(
+                    registrar_transaccion, activo='BTC', operacion='VENTA', cantidad=100, precio_unitario=1,
+                    costo_total=100, dolar_cambio=1, fecha='2024-01-01', estricto=True))
+                tareas.append(escritor.escribir(borrar_transaccion, id_transaccion=999))
+                resultados = await asyncio.gather(*tareas, return_exceptions=True)
+                return resultados, escritor.commits, escritor.escrituras
+            finally:
+                await escritor.cerrar()
+
+        resultados, commits, escrituras = asyncio.run(escribir_varias())
+
+        self.assertEqual(escrituras, 22)
+        self.assertLess(commits, escrituras)
+        self.assertEqual(sorted(resultados[:20]), list(range(1, 21)))
+        self.assertIsInstance(resultados[20], ErrorInventario)
+        self.assertIs(resultados[21], False)
+        self.assertEqual(calcular_saldos()['saldos'], {'BTC': 20.0})
+
+if __name__ == '__main__':
+    unittest.main()